@@ -0,0 +1,328 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+FAISS 近似最近邻索引管理
+根据知识库规模自动选择索引类型（小规模用 Flat，中等规模用 IVF，大规模用 HNSW），
+在规模跨越阈值时自动重新训练，并作为搜索的第一阶段候选生成器。
+所有向量都应预先归一化，索引使用内积作为相似度（等价于余弦相似度）。
+
+索引中的向量可以压缩保存（flat 为 float32 原始向量，fp16 / sq8 为标量量化，pq 为乘积量化），
+压缩索引只负责召回候选，最终分数由调用方用更精确的向量重新计算。
+
+搜索可以在多个线程中并发进行；增量添加和删除向量时独占索引，全量构建在新的索引对象上完成后再替换，
+构建期间搜索继续使用旧索引。
+"""
+
+import logging
+import math
+from typing import Optional, Tuple
+
+import faiss
+import numpy as np
+
+from rwlock import ReadWriteLock
+
+logger = logging.getLogger(__name__)
+
+INDEX_FLAT = 'flat'
+INDEX_IVF = 'ivf'
+INDEX_HNSW = 'hnsw'
+
+CODEC_FLAT = 'flat'
+CODEC_FP16 = 'fp16'
+CODEC_SQ8 = 'sq8'
+CODEC_PQ = 'pq'
+CODECS = (CODEC_FLAT, CODEC_FP16, CODEC_SQ8, CODEC_PQ)
+
+# 每次向索引添加的最大向量数，避免一次性把压缩存储的向量全部解码为 float32
+ADD_BATCH_SIZE = 65536
+
+
+def _codec_of(index: faiss.Index) -> Optional[str]:
+    """识别（已 downcast 的）索引使用的向量编码"""
+    if isinstance(index, (faiss.IndexScalarQuantizer, faiss.IndexIVFScalarQuantizer)):
+        qtype = index.sq.qtype
+        if qtype == faiss.ScalarQuantizer.QT_fp16:
+            return CODEC_FP16
+        if qtype == faiss.ScalarQuantizer.QT_8bit:
+            return CODEC_SQ8
+        return None
+    if isinstance(index, (faiss.IndexPQ, faiss.IndexIVFPQ)):
+        return CODEC_PQ
+    if isinstance(index, (faiss.IndexFlat, faiss.IndexIVFFlat)):
+        return CODEC_FLAT
+    return None
+
+
+class AnnIndex:
+    """带 ID 映射的 FAISS 索引封装
+
+    索引中的 ID 是文本块的永久 ID（FaissVectorStore.chunk_ids），不随删除和压缩变化。
+    Flat 和 HNSW 索引包在 IndexIDMap2 中；IVF 索引的倒排表本身保存 ID，直接使用
+    （IndexIDMap2 删除向量后会压缩 ID 表，而 IVF 不重新编号内部 ID，两者会错位）。
+    """
+
+    def __init__(self, dim: int, flat_threshold: int = 20000, hnsw_threshold: int = 500000,
+                 nprobe: int = 16, hnsw_m: int = 32, retrain_growth: float = 2.0,
+                 compression: str = CODEC_FLAT, pq_m: int = 64, pq_min_train: int = 10000):
+        """
+        初始化索引
+
+        Args:
+            dim: 向量维度
+            flat_threshold: 文本块数量低于该值时使用精确的 Flat 索引
+            hnsw_threshold: 文本块数量达到该值时使用 HNSW 索引，介于两者之间使用 IVF
+            nprobe: IVF 搜索时探测的聚类中心数量
+            hnsw_m: HNSW 图中每个节点的邻居数量
+            retrain_growth: 需要训练的索引（IVF、sq8、pq）规模增长到训练时的多少倍后重新训练
+            compression: 向量编码（flat / fp16 / sq8 / pq）
+            pq_m: 乘积量化的子空间数量（取不超过该值的向量维度约数），每个向量占 pq_m 字节
+            pq_min_train: 文本块数量达到该值才使用乘积量化，之前使用 sq8（训练 256 个中心需要足够的样本）
+        """
+        if compression not in CODECS:
+            raise ValueError(f"不支持的向量编码: {compression}")
+        self.dim = dim
+        self.flat_threshold = flat_threshold
+        self.hnsw_threshold = hnsw_threshold
+        self.nprobe = nprobe
+        self.hnsw_m = hnsw_m
+        self.retrain_growth = retrain_growth
+        self.compression = compression
+        self.pq_m = max(d for d in range(1, min(pq_m, dim) + 1) if dim % d == 0)
+        self.pq_min_train = pq_min_train
+        self.index_type = INDEX_FLAT
+        self.codec = self.choose_codec(0)
+        self.trained_size = 0
+        # 留在索引中但已失效的向量数量（HNSW 不支持删除，删除或替换后旧向量仍在图中）
+        self.stale_count = 0
+        self.index = self._create_index(INDEX_FLAT, self.codec, 0)
+        # 搜索持有读锁，原地修改索引（添加、删除、替换为新索引）持有写锁
+        self._lock = ReadWriteLock()
+
+    @property
+    def ntotal(self) -> int:
+        return self.index.ntotal if self.index is not None else 0
+
+    @property
+    def supports_remove(self) -> bool:
+        """HNSW 索引不支持删除向量，只能重建"""
+        return self.index_type != INDEX_HNSW
+
+    def choose_index_type(self, size: int) -> str:
+        """根据文本块数量选择索引类型"""
+        if size < self.flat_threshold:
+            return INDEX_FLAT
+        if size < self.hnsw_threshold:
+            return INDEX_IVF
+        return INDEX_HNSW
+
+    def choose_codec(self, size: int) -> str:
+        """根据文本块数量选择向量编码（样本不足以训练乘积量化时退回 sq8）"""
+        if self.compression == CODEC_PQ and size < self.pq_min_train:
+            return CODEC_SQ8
+        return self.compression
+
+    @staticmethod
+    def _needs_training(index_type: str, codec: str) -> bool:
+        return index_type == INDEX_IVF or codec in (CODEC_SQ8, CODEC_PQ)
+
+    def _create_index(self, index_type: str, codec: str, size: int) -> faiss.Index:
+        """创建空索引（IVF、sq8、pq 索引尚未训练），IVF 索引不包 IndexIDMap2"""
+        metric = faiss.METRIC_INNER_PRODUCT
+        qtype = faiss.ScalarQuantizer.QT_fp16 if codec == CODEC_FP16 else faiss.ScalarQuantizer.QT_8bit
+        if index_type == INDEX_IVF:
+            nlist = max(1, min(int(4 * math.sqrt(size)), size // 39 or 1))
+            quantizer = faiss.IndexFlatIP(self.dim)
+            if codec == CODEC_PQ:
+                inner = faiss.IndexIVFPQ(quantizer, self.dim, nlist, self.pq_m, 8, metric)
+            elif codec == CODEC_FLAT:
+                inner = faiss.IndexIVFFlat(quantizer, self.dim, nlist, metric)
+            else:
+                inner = faiss.IndexIVFScalarQuantizer(quantizer, self.dim, nlist, qtype, metric)
+            inner.nprobe = min(self.nprobe, nlist)
+            return inner
+        elif index_type == INDEX_HNSW:
+            if codec == CODEC_PQ:
+                inner = faiss.IndexHNSWPQ(self.dim, self.pq_m, self.hnsw_m, 8, metric)
+            elif codec == CODEC_FLAT:
+                inner = faiss.IndexHNSWFlat(self.dim, self.hnsw_m, metric)
+            else:
+                inner = faiss.IndexHNSWSQ(self.dim, qtype, self.hnsw_m, metric)
+        else:
+            if codec == CODEC_PQ:
+                inner = faiss.IndexPQ(self.dim, self.pq_m, 8, metric)
+            elif codec == CODEC_FLAT:
+                inner = faiss.IndexFlatIP(self.dim)
+            else:
+                inner = faiss.IndexScalarQuantizer(self.dim, qtype, metric)
+        return faiss.IndexIDMap2(inner)
+
+    def build(self, vectors, ids: Optional[np.ndarray] = None):
+        """根据当前规模重新选择索引类型和编码并全量构建
+
+        Args:
+            vectors: 全部归一化向量，可以是 np.ndarray，也可以是支持 len() 和按行号数组取行的
+                     对象（例如 EmbeddingMatrix 或其 view()），按批读取，不需要一次性解码全部向量
+            ids: 向量对应的文本块 ID，为 None 时使用行号
+        """
+        size = 0 if vectors is None else len(vectors)
+        index_type = self.choose_index_type(size)
+        codec = self.choose_codec(size)
+        index = self._create_index(index_type, codec, size)
+
+        if size > 0:
+            if ids is None:
+                ids = np.arange(size, dtype=np.int64)
+            ids = np.asarray(ids, dtype=np.int64)
+            if not index.is_trained:
+                logger.info(f"训练 FAISS 索引（{index_type}/{codec}），样本数: {size}")
+                index.train(np.ascontiguousarray(vectors[np.arange(size)], dtype=np.float32))
+            self._add_batches(index, vectors, ids)
+
+        with self._lock.write():
+            self.index = index
+            self.index_type = index_type
+            self.codec = codec
+            self.trained_size = size
+            self.stale_count = 0
+        logger.info(f"FAISS 索引已构建，类型: {index_type}，编码: {codec}，向量数: {size}")
+
+    @staticmethod
+    def _add_batches(index: faiss.Index, vectors, ids: np.ndarray):
+        """分批把向量写入索引（vectors 的要求同 build）"""
+        for start in range(0, len(vectors), ADD_BATCH_SIZE):
+            rows = np.arange(start, min(len(vectors), start + ADD_BATCH_SIZE))
+            index.add_with_ids(np.ascontiguousarray(vectors[rows], dtype=np.float32), ids[rows])
+
+    def should_rebuild(self, size: Optional[int] = None) -> bool:
+        """规模跨越阈值、编码需要切换或需要训练的索引规模增长过多时需要重建"""
+        size = self.ntotal if size is None else size
+        if self.choose_index_type(size) != self.index_type or self.choose_codec(size) != self.codec:
+            return True
+        if (self._needs_training(self.index_type, self.codec) and self.trained_size > 0
+                and size > self.trained_size * self.retrain_growth):
+            return True
+        return False
+
+    def reset_vectors(self, vectors, ids: Optional[np.ndarray] = None):
+        """用新的向量集合替换索引内容（vectors 的要求同 build）
+
+        规模没有跨越阈值时保留已训练的 IVF 聚类中心和量化参数，只重新写入向量
+        （写入复制出的新索引，完成后再替换，期间搜索仍使用旧索引）。
+        """
+        size = 0 if vectors is None else len(vectors)
+        if self.should_rebuild(size) or (size > 0 and not self.index.is_trained):
+            self.build(vectors, ids)
+            return
+        index = faiss.clone_index(self.index)
+        index.reset()
+        if size > 0:
+            ids = np.arange(size, dtype=np.int64) if ids is None else np.asarray(ids, dtype=np.int64)
+            self._add_batches(index, vectors, ids)
+        with self._lock.write():
+            self.index = index
+            self.stale_count = 0
+
+    def add(self, vectors: np.ndarray, ids: np.ndarray):
+        """增量添加向量（空的 sq8 索引用第一批向量训练）"""
+        if len(vectors) == 0:
+            return
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        with self._lock.write():
+            if not self.index.is_trained:
+                self.index.train(vectors)
+                self.trained_size = len(vectors)
+            self.index.add_with_ids(vectors, np.asarray(ids, dtype=np.int64))
+
+    def remove(self, ids) -> bool:
+        """删除指定 ID 的向量
+
+        Returns:
+            bool: 是否删除成功，不支持删除时返回 False（向量计入 stale_count，
+                  调用方需要自行过滤这些 ID，或在 stale_count 过高时重建索引）
+        """
+        ids = np.asarray(list(ids), dtype=np.int64)
+        if not self.supports_remove:
+            self.stale_count += ids.size
+            return False
+        if ids.size:
+            with self._lock.write():
+                self.index.remove_ids(faiss.IDSelectorBatch(ids))
+        return True
+
+    def replace(self, vectors: np.ndarray, ids: np.ndarray):
+        """替换指定 ID 的向量，一次完成删除和添加
+
+        HNSW 索引不支持删除，新向量以相同 ID 加入，旧向量留在图中，搜索结果按 ID 去重。
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        self.remove(ids)
+        self.add(vectors, ids)
+
+    def search(self, query_vector: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """搜索最相似的 k 个向量
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: (文本块 ID, 内积相似度)，按相似度降序排列
+        """
+        query = np.ascontiguousarray(query_vector, dtype=np.float32).reshape(1, -1)
+        with self._lock.read():
+            if self.ntotal == 0 or k <= 0:
+                return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+            index_type = self.index_type
+            params = None
+            if index_type == INDEX_HNSW:
+                # 按次传入搜索参数，不修改共享索引上的 efSearch
+                params = faiss.SearchParametersHNSW()
+                params.efSearch = max(64, k * 2)
+            scores, ids = self.index.search(query, min(k, self.ntotal), params=params)
+        valid = ids[0] >= 0
+        ids, scores = ids[0][valid], scores[0][valid]
+        if index_type == INDEX_HNSW:
+            # 被替换过的文本块可能有多个向量，保留相似度最高的一个
+            _, first = np.unique(ids, return_index=True)
+            first.sort()
+            ids, scores = ids[first], scores[first]
+        return ids, scores
+
+    def adopt(self, index: faiss.Index) -> bool:
+        """接管从磁盘加载的索引
+
+        只有带 ID 映射、使用内积度量的索引才能直接使用，旧的 IndexFlatL2 需要重建；
+        旧版本保存的包在 IndexIDMap2 中的 IVF 索引删除过向量后 ID 可能已经错位，也需要重建。
+
+        Returns:
+            bool: 是否接管成功
+        """
+        try:
+            if index.d != self.dim or index.metric_type != faiss.METRIC_INNER_PRODUCT:
+                return False
+            if isinstance(index, faiss.IndexIVF):
+                index_type = INDEX_IVF
+                index.nprobe = min(self.nprobe, index.nlist)
+                codec = _codec_of(index)
+            else:
+                # read_index 返回的对象本身持有底层索引，不能用 downcast 产生的临时包装替换
+                if not isinstance(index, faiss.IndexIDMap2):
+                    return False
+                inner = faiss.downcast_index(index.index)
+                if isinstance(inner, faiss.IndexIVF):
+                    return False
+                if isinstance(inner, faiss.IndexHNSW):
+                    index_type = INDEX_HNSW
+                    codec = _codec_of(faiss.downcast_index(inner.storage))
+                else:
+                    index_type = INDEX_FLAT
+                    codec = _codec_of(inner)
+            if codec is None:
+                return False
+            with self._lock.write():
+                self.index = index
+                self.index_type = index_type
+                self.codec = codec
+                self.trained_size = index.ntotal
+                self.stale_count = 0
+            return True
+        except Exception as e:
+            logger.warning(f"无法接管已加载的索引: {str(e)}")
+            return False
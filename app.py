@@ -1,11 +1,9 @@
 print('主程序入口:', __file__)
-import document_processor
 from flask import Flask, request, jsonify, render_template, send_from_directory, redirect, url_for, flash
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
 import os
 import logging
-from vector_store import FaissVectorStore
-from document_processor import DocumentProcessor, DocumentChunk
+from columnar_store import vector_store_exists
 from typing import List, Dict, Any
 from werkzeug.utils import secure_filename
 import traceback
@@ -14,22 +12,19 @@ from loguru import logger
 import json
 from models import db, User, SystemConfig
 from datetime import datetime
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.document_loaders import UnstructuredPDFLoader, TextLoader
-import pandas as pd
 from config_loader import config
 import signal
 import sys
-from file_processors.processor_factory import ProcessorFactory
 from knowledge_query_service import get_knowledge_query_service
+from startup import BackgroundLoader
 
 # 配置日志
 logging.basicConfig(level=logging.INFO,
                    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-# 初始化知识库查询服务
-knowledge_query_service = get_knowledge_query_service()
+# 初始化知识库查询服务（向量存储由下面的加载任务设置，这里不再重复加载一次）
+knowledge_query_service = get_knowledge_query_service(initialize=False)
 
 # 初始化知识库目录
 KNOWLEDGE_BASE_DIR = Path("knowledge_base")
@@ -38,27 +33,54 @@ VECTOR_STORE_PATH = KNOWLEDGE_BASE_DIR / "vector_store"
 # 确保知识库目录存在
 KNOWLEDGE_BASE_DIR.mkdir(parents=True, exist_ok=True)
 
-# 初始化向量存储
+# 快速启动：torch、向量模型和知识库在后台线程中加载，HTTP 服务立即开始处理健康检查和登录请求
+LAZY_STARTUP = config.getboolean('server', 'lazy_startup', fallback=False)
+
+# 需要向量存储的接口，快速启动模式下加载完成前返回 503
+VECTOR_STORE_ENDPOINTS = {
+    'delete_document', 'add_document', 'search', 'upload_file', 'get_text_blocks', 'get_text_block',
+    'delete_text_block', 'batch_delete_text_blocks', 'update_text_block', 'batch_update_text_blocks'
+}
+
 vector_store = None
-try:
+
+
+def create_vector_store():
+    """创建向量存储、加载已有数据并预热模型（导入 torch 和 sentence_transformers）"""
+    from vector_store import FaissVectorStore
+
     logger.info("初始化向量存储...")
-    vector_store = FaissVectorStore()
+    store = FaissVectorStore()
     
     # 尝试加载现有的向量存储
-    if VECTOR_STORE_PATH.with_suffix('.index').exists():
+    if vector_store_exists(VECTOR_STORE_PATH):
         logger.info("加载现有向量存储...")
-        vector_store.load(str(VECTOR_STORE_PATH))
+        store.load(str(VECTOR_STORE_PATH))
     else:
         logger.info("未找到现有向量存储，创建新的实例")
-        
-    # 设置向量存储到知识库查询服务
-    knowledge_query_service.set_vector_store(vector_store)
-    logger.info("知识库查询服务已设置向量存储")
     
-except Exception as e:
-    logger.error(f"初始化向量存储失败: {str(e)}")
-    logger.error(traceback.format_exc())
-    raise
+    # 第一次模型前向计算较慢，预热后第一个查询不再承担这部分耗时
+    try:
+        store.encode_text("知识库预热", use_cache=False)
+    except Exception as e:
+        logger.warning(f"模型预热失败: {str(e)}")
+    return store
+
+
+def _set_vector_store(store):
+    """加载完成后设置全局向量存储和知识库查询服务"""
+    global vector_store
+    knowledge_query_service.set_vector_store(store)
+    vector_store = store
+    logger.info("知识库查询服务已设置向量存储")
+
+
+vector_store_loader = BackgroundLoader('vector-store', create_vector_store, on_ready=_set_vector_store)
+if LAZY_STARTUP:
+    vector_store_loader.start()
+else:
+    # 普通启动：导入本模块时同步加载，失败时启动失败
+    vector_store_loader.run()
 
 def save_vector_store():
     """保存向量存储到文件"""
@@ -94,6 +116,23 @@ login_manager.login_message_category = 'info'
 if not os.path.exists(app.config['UPLOAD_FOLDER']):
     os.makedirs(app.config['UPLOAD_FOLDER'])
 
+@app.before_request
+def wait_for_vector_store():
+    """快速启动模式下，知识库加载完成前需要向量存储的接口返回 503 和加载进度"""
+    if vector_store is None and request.endpoint in VECTOR_STORE_ENDPOINTS:
+        status = vector_store_loader.status()
+        message = '知识库加载失败' if status['state'] == 'failed' else '知识库正在加载，请稍后重试'
+        return jsonify({'success': False, 'error': message, 'message': message, 'startup': status}), 503
+
+@app.route('/health')
+def health():
+    """健康检查（不需要登录）：进程存活即返回 200，ready 表示知识库是否已经可以检索"""
+    return jsonify({
+        'status': 'ok',
+        'ready': vector_store is not None,
+        'vector_store': vector_store_loader.status()
+    })
+
 # 允许的文件扩展名
 ALLOWED_EXTENSIONS = {
     # Microsoft Office
@@ -216,14 +255,8 @@ def get_knowledge_base_info():
         total_chunks = len(vector_store.documents) if vector_store and hasattr(vector_store, 'documents') else 0
         
         # 使用向量存储中的文档数量作为总文档数（而不是上传目录的文件数）
-        # 统计向量存储中不同源文件的数量
-        total_documents = 0
-        if vector_store and hasattr(vector_store, 'documents') and vector_store.documents:
-            unique_sources = set()
-            for _, metadata in vector_store.documents:
-                if 'source' in metadata:
-                    unique_sources.add(metadata['source'])
-            total_documents = len(unique_sources)
+        # 不同源文件的数量直接取自向量存储维护的源文件索引
+        total_documents = len(vector_store.source_chunks) if vector_store and hasattr(vector_store, 'source_chunks') else 0
         
         return {
             'total_documents': total_documents,
@@ -353,7 +386,7 @@ def logout():
 def index():
     try:
         if not vector_store:
-            raise Exception("向量存储未初始化")
+            raise Exception("知识库正在后台加载，请稍后刷新" if vector_store_loader.running else "向量存储未初始化")
             
         # 获取知识库信息
         info = get_knowledge_base_info()
@@ -421,13 +454,16 @@ def search():
             return jsonify({'error': '缺少查询参数'}), 400
             
         query = data['query']
+        # 可选的元数据过滤条件，例如 {"source": "...", "sheet": ["Sheet1"], "file_type": ".xlsx"}
+        filters = data.get('filters')
         logger.info("接收到搜索请求")
         logger.info(f"开始搜索查询: {query}")
         
         # 使用知识库查询服务的Web专用搜索方法
         search_result = knowledge_query_service.search_for_web(
             query=query, 
-            include_metadata=True
+            include_metadata=True,
+            filters=filters
         )
         
         if not search_result['success']:
@@ -545,7 +581,8 @@ def upload_file():
             
             # 处理文档
             try:
-                # 使用新的文件处理器系统
+                # 使用新的文件处理器系统（各格式的解析库在第一次上传时才导入）
+                from file_processors.processor_factory import ProcessorFactory
                 processor_factory = ProcessorFactory()
                 processor = processor_factory.get_processor(str(file_path))
                 
@@ -726,14 +763,16 @@ def get_text_blocks():
                 'total_pages': 0
             })
 
-        # 获取所有文本块
+        # 获取所有文本块（ID 为文本块的永久 ID，删除其他文本块后不会变化）
+        # ID 和内容取自同一份快照，遍历期间其他请求的增删不会使两者错位
+        snapshot = vector_store.snapshot()
         all_blocks = []
-        for i, (content, metadata) in enumerate(vector_store.documents):
+        for chunk_id, (content, metadata) in zip(snapshot.live_chunk_ids(), snapshot.documents):
             try:
                 if search and search.lower() not in content.lower():
                     continue
                 all_blocks.append({
-                    'id': i + 1,
+                    'id': chunk_id,
                     'content': content,
                     'source': metadata.get('source', '未知'),
                     'create_time': metadata.get('created_at', '未知')
@@ -768,23 +807,20 @@ def get_text_block(block_id):
         if not vector_store:
             return jsonify({'success': False, 'message': '向量存储未初始化'}), 500
 
-        # 获取所有文本块
-        all_blocks = []
-        for i, (content, metadata) in enumerate(vector_store.documents):
-            all_blocks.append({
-                'id': i + 1,
+        block = vector_store.get_text_block(block_id)
+        if block is None:
+            return jsonify({'success': False, 'message': '文本块不存在'}), 404
+
+        content, metadata = block
+        return jsonify({
+            'success': True,
+            'text_block': {
+                'id': block_id,
                 'content': content,
                 'source': metadata.get('source', '未知'),
                 'create_time': metadata.get('created_at', '未知')
-            })
-
-        if 0 <= block_id - 1 < len(all_blocks):
-            return jsonify({
-                'success': True,
-                'text_block': all_blocks[block_id - 1]
-            })
-        else:
-            return jsonify({'success': False, 'message': '文本块不存在'}), 404
+            }
+        })
     except Exception as e:
         logger.error(f"获取文本块详情失败: {str(e)}")
         logger.error(traceback.format_exc())
@@ -798,13 +834,11 @@ def delete_text_block(block_id):
         if not vector_store:
             return jsonify({'success': False, 'message': '向量存储未初始化'}), 500
 
-        # 验证索引范围（block_id从1开始，需要转换为从0开始的索引）
-        index = block_id - 1
-        if index < 0 or index >= len(vector_store.documents):
+        if vector_store.get_text_block(block_id) is None:
             return jsonify({'success': False, 'message': '文本块不存在'}), 404
 
         # 删除文本块
-        if vector_store.delete_text_blocks([index]):
+        if vector_store.delete_text_blocks([block_id]):
             # 保存向量存储
             save_vector_store()
             return jsonify({'success': True, 'message': '文本块删除成功'})
@@ -828,23 +862,20 @@ def batch_delete_text_blocks():
         if not data or 'ids' not in data:
             return jsonify({'success': False, 'message': '缺少必要参数'}), 400
 
-        # 将ID转换为索引（ID从1开始，索引从0开始）
-        indices = [id - 1 for id in data['ids']]
-        
-        # 验证索引范围
-        max_index = len(vector_store.documents) - 1
-        invalid_indices = [idx for idx in indices if idx < 0 or idx > max_index]
-        if invalid_indices:
-            return jsonify({'success': False, 'message': f'无效的索引: {invalid_indices}'}), 400
+        # 验证文本块是否存在
+        ids = [int(block_id) for block_id in data['ids']]
+        invalid_ids = [block_id for block_id in ids if vector_store.get_text_block(block_id) is None]
+        if invalid_ids:
+            return jsonify({'success': False, 'message': f'文本块不存在: {invalid_ids}'}), 400
 
         # 删除文本块
-        if vector_store.delete_text_blocks(indices):
+        if vector_store.delete_text_blocks(ids):
             # 保存向量存储
             save_vector_store()
             return jsonify({
                 'success': True, 
-                'message': f'成功删除 {len(indices)} 个文本块',
-                'deleted_count': len(indices)
+                'message': f'成功删除 {len(ids)} 个文本块',
+                'deleted_count': len(ids)
             })
         else:
             return jsonify({'success': False, 'message': '批量删除失败'}), 500
@@ -1004,16 +1035,14 @@ def update_text_block(block_id):
     try:
         if not vector_store:
             return jsonify({'success': False, 'message': '向量存储未初始化'}), 500
-        # 验证索引范围（block_id从1开始，需要转换为从0开始的索引）
-        index = block_id - 1
-        if index < 0 or index >= len(vector_store.documents):
+        if vector_store.get_text_block(block_id) is None:
             return jsonify({'success': False, 'message': '文本块不存在'}), 404
         data = request.get_json()
         if not data or 'content' not in data:
             return jsonify({'success': False, 'message': '缺少content参数'}), 400
         new_content = data['content']
         # 更新文本块内容和向量
-        if vector_store.update_text_block(index, new_content):
+        if vector_store.update_text_block(block_id, new_content):
             save_vector_store()
             return jsonify({'success': True, 'message': '文本块内容已更新'})
         else:
@@ -1023,6 +1052,41 @@ def update_text_block(block_id):
         logger.error(traceback.format_exc())
         return jsonify({'success': False, 'message': str(e)}), 500
 
+@app.route('/api/text_blocks/batch', methods=['PUT'])
+@login_required
+def batch_update_text_blocks():
+    """批量更新文本块内容：一次批量编码，只替换索引中这些文本块的向量"""
+    try:
+        if not vector_store:
+            return jsonify({'success': False, 'message': '向量存储未初始化'}), 500
+        data = request.get_json()
+        if not data or not isinstance(data.get('blocks'), list) or not data['blocks']:
+            return jsonify({'success': False, 'message': '缺少blocks参数'}), 400
+
+        updates = {}
+        for block in data['blocks']:
+            if not isinstance(block, dict) or 'id' not in block or not isinstance(block.get('content'), str):
+                return jsonify({'success': False, 'message': '每个文本块都需要id和content'}), 400
+            updates[int(block['id'])] = block['content']
+
+        invalid_ids = [block_id for block_id in updates if vector_store.get_text_block(block_id) is None]
+        if invalid_ids:
+            return jsonify({'success': False, 'message': f'文本块不存在: {invalid_ids}'}), 404
+
+        if vector_store.update_text_blocks(updates):
+            save_vector_store()
+            return jsonify({
+                'success': True,
+                'message': f'成功更新 {len(updates)} 个文本块',
+                'updated_count': len(updates)
+            })
+        else:
+            return jsonify({'success': False, 'message': '批量更新失败'}), 500
+    except Exception as e:
+        logger.error(f"批量更新文本块失败: {str(e)}")
+        logger.error(traceback.format_exc())
+        return jsonify({'success': False, 'message': str(e)}), 500
+
 @app.route('/prompt-management')
 @login_required
 def prompt_management():
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+向量压缩存储基准测试
+对比向量矩阵（float32 / float16 / int8）和 FAISS 索引编码（flat / fp16 / sq8 / pq）的
+内存占用与 recall@k（以 float32 精确打分的 top-k 为标准答案）。
+
+向量取自知识库（列式存储或旧的 .pkl），知识库太小时在这些向量周围加噪声扩充到指定规模，
+查询向量同样由知识库向量加噪声生成，尽量保持与真实数据相同的分布。
+
+用法:
+    python benchmarks/bench_embedding_storage.py
+    python benchmarks/bench_embedding_storage.py --path knowledge_base/vector_store --sizes 10000 100000
+"""
+
+import argparse
+import pickle
+import sys
+import tempfile
+from pathlib import Path
+
+import faiss
+import numpy as np
+
+# 添加项目根目录到Python路径
+project_root = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(project_root))
+
+import columnar_store
+from ann_index import AnnIndex, CODECS
+from embedding_matrix import EmbeddingMatrix, STORAGE_MODES, normalize_rows
+
+
+def load_corpus(path: str) -> np.ndarray:
+    """读取知识库中的全部向量"""
+    if columnar_store.store_exists(path):
+        snapshot = columnar_store.open_store(path)
+        if snapshot is not None and snapshot.embeddings is not None:
+            return np.array(snapshot.embeddings)
+    _, pkl_path = columnar_store.legacy_paths(path)
+    if pkl_path.exists():
+        with open(pkl_path, 'rb') as f:
+            data = pickle.load(f)
+        if data.get('document_embeddings') is not None:
+            return normalize_rows(data['document_embeddings'])
+    raise SystemExit(f"知识库中没有向量: {path}")
+
+
+def expand(corpus: np.ndarray, size: int, noise: float, rng) -> np.ndarray:
+    """在知识库向量周围加噪声生成 size 个向量（前 len(corpus) 个就是原始向量）"""
+    if size <= len(corpus):
+        return corpus[:size]
+    picks = rng.integers(0, len(corpus), size - len(corpus))
+    extra = corpus[picks] + rng.standard_normal((len(picks), corpus.shape[1])).astype(np.float32) * noise
+    return np.concatenate([corpus, normalize_rows(extra)])
+
+
+def recall(found: np.ndarray, truth: np.ndarray) -> float:
+    hits = sum(len(set(f.tolist()) & set(t.tolist())) for f, t in zip(found, truth))
+    return hits / truth.size
+
+
+def run(path: str, sizes, queries: int, k: int, noise: float):
+    rng = np.random.default_rng(42)
+    corpus = load_corpus(path)
+    print(f"知识库向量: {len(corpus)} x {corpus.shape[1]}, 查询数: {queries}, k: {k}")
+
+    for size in sizes:
+        vectors = expand(corpus, size, noise, rng)
+        query_vectors = expand(corpus, len(corpus) + queries, noise, rng)[len(corpus):]
+        truth = np.stack([np.argsort(-(vectors @ q), kind='stable')[:k] for q in query_vectors])
+        print(f"\n文本块数: {len(vectors)}")
+        print(f"{'向量矩阵':>10} | {'内存(MB)':>10} | {'粗排 recall':>12} | {'重排 recall':>12}")
+        print("-" * 54)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            npy_path = Path(tmp) / "embeddings.npy"
+            np.save(npy_path, vectors)
+            source = np.load(npy_path, mmap_mode='r')
+            for storage in STORAGE_MODES:
+                matrix = EmbeddingMatrix(storage=storage)
+                matrix.attach(source)
+                coarse = [np.argsort(-matrix._approximate_scores(q) if matrix.compressed else -(vectors @ q),
+                                     kind='stable')[:k] for q in query_vectors]
+                reranked = [matrix.top_k(q, k)[0] for q in query_vectors]
+                print(f"{storage:>10} | {matrix.nbytes / 2 ** 20:>10.2f} | "
+                      f"{recall(np.stack(coarse), truth):>12.3f} | {recall(np.stack(reranked), truth):>12.3f}")
+                del matrix
+            del source
+
+        print(f"{'索引编码':>10} | {'内存(MB)':>10} | {'索引 recall':>12} | {'重排 recall':>12}")
+        print("-" * 54)
+        exact = EmbeddingMatrix()
+        exact.append(vectors)
+        for codec in CODECS:
+            index = AnnIndex(vectors.shape[1], compression=codec)
+            index.build(vectors)
+            found = [index.search(q, k)[0] for q in query_vectors]
+            # 与搜索流程一致：索引召回 k * 4 个候选，再用精确向量重新打分
+            reranked = [exact.top_k(q, k, rows=index.search(q, 4 * k)[0])[0] for q in query_vectors]
+            size_mb = faiss.serialize_index(index.index).nbytes / 2 ** 20
+            label = f"{index.index_type}/{index.codec}"
+            print(f"{label:>10} | {size_mb:>10.2f} | "
+                  f"{recall(np.stack(found), truth):>12.3f} | {recall(np.stack(reranked), truth):>12.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="向量压缩存储基准测试")
+    parser.add_argument('--path', default="knowledge_base/vector_store", help="知识库向量存储路径（不含扩展名）")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[20000, 100000])
+    parser.add_argument('--queries', type=int, default=100)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--noise', type=float, default=0.02, help="扩充向量时每一维加入的噪声强度")
+    args = parser.parse_args()
+    run(args.path, args.sizes, args.queries, args.k, args.noise)
+
+
+if __name__ == "__main__":
+    main()
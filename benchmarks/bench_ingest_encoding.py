@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+入库编码基准测试
+模拟一次上万行的 Excel 上传（每行一个文本块，长度从几个字到几百字不等），对比：
+- 一次性编码：全部文本块和句子一次提交给编码服务（按提交顺序每 batch_size 条一批）；
+- 流式编码：StreamingEncoder 逐窗口、按长度分桶提交。
+统计吞吐（文本块/秒）和编码过程中 numpy 分配的峰值内存（tracemalloc），并检查两种方式的向量一致。
+
+用法:
+    python benchmarks/bench_ingest_encoding.py
+    python benchmarks/bench_ingest_encoding.py --rows 10000 --window 2048 --backend onnx_int8
+"""
+
+import argparse
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+
+# 添加项目根目录到Python路径
+project_root = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(project_root))
+
+from embedding_service import PRIORITY_INGEST, EmbeddingService
+from onnx_backend import BACKEND_TORCH, load_onnx_encoder
+from sentence_index import encode_with_sentences
+from streaming_encoder import StreamingEncoder
+
+FIELDS = ["产品名称", "型号", "价格", "库存", "供应商", "备注", "适用范围", "售后政策"]
+WORDS = ["标准版", "旗舰款", "支持七天无理由退换", "华东仓库发货", "需要提前预约安装", "含税价", "保修两年",
+         "适用于中小企业", "可开具增值税专用发票", "限时优惠"]
+
+
+def make_rows(rng, count: int):
+    """生成 Excel 行文本：字段数不等，少数行带很长的备注"""
+    rows = []
+    for i in range(count):
+        fields = rng.choice(FIELDS, size=rng.integers(2, len(FIELDS)), replace=False)
+        parts = [f"{field}：{'，'.join(rng.choice(WORDS, size=rng.integers(1, 4)))}" for field in fields]
+        if i % 50 == 0:
+            parts.append("详细说明：" + "。".join(rng.choice(WORDS, size=40)))
+        rows.append(f"第{i + 1}行。" + "。".join(parts))
+    return rows
+
+
+def load_model(model_dir: Path, backend: str):
+    if backend == BACKEND_TORCH:
+        from sentence_transformers import SentenceTransformer
+        return SentenceTransformer(str(model_dir), device='cpu')
+    return load_onnx_encoder(model_dir, backend, min_cosine=-1.0)
+
+
+def measure(label: str, func, rows):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func(rows)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label:>10} | {elapsed:>8.1f} | {len(rows) / elapsed:>12.1f} | {peak / 1024 / 1024:>12.1f}")
+    return result
+
+
+def run(model_dir: Path, backend: str, row_count: int, batch_size: int, window: int, batch_tokens: int):
+    model = load_model(model_dir, backend)
+    rows = make_rows(np.random.default_rng(42), row_count)
+    service = EmbeddingService(lambda texts: model.encode(texts, batch_size=max(1, len(texts)),
+                                                          show_progress_bar=False),
+                               max_batch_size=batch_size)
+    encode = lambda texts: service.encode(texts, PRIORITY_INGEST)
+    streaming = StreamingEncoder(encode, max_batch_size=batch_size, max_batch_tokens=batch_tokens,
+                                 window_size=window, max_length=getattr(model, 'max_seq_length', None) or 512)
+    print(f"模型: {model_dir}（{backend}）, 行数: {row_count}, batch_size: {batch_size}, 窗口: {window}, "
+          f"每批 token 上限: {batch_tokens}")
+    print(f"{'方式':>10} | {'耗时(s)':>8} | {'吞吐(块/秒)':>12} | {'峰值内存(MB)':>12}")
+    print("-" * 55)
+    try:
+        expected, _ = measure("一次性", lambda texts: encode_with_sentences(encode, texts), rows)
+        actual, _ = measure("流式", streaming.encode_chunks, rows)
+    finally:
+        service.close()
+    cosine = np.sum(expected * actual, axis=1) / (np.linalg.norm(expected, axis=1) * np.linalg.norm(actual, axis=1))
+    print(f"填充比例: {streaming.stats()['padding_ratio']:.1%}, 向量最小余弦相似度: {cosine.min():.5f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="入库编码基准测试")
+    parser.add_argument('--model-dir', default=str(project_root / 'models' / 'text2vec-base-chinese'))
+    parser.add_argument('--backend', default=BACKEND_TORCH)
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--window', type=int, default=2048)
+    parser.add_argument('--batch-tokens', type=int, default=8192)
+    args = parser.parse_args()
+    run(Path(args.model_dir), args.backend, args.rows, args.batch_size, args.window, args.batch_tokens)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+向量模型推理后端基准测试
+对比 PyTorch、ONNX Runtime（float32）和 ONNX Runtime 动态 int8 量化三种后端：
+- 查询：逐条编码短问题（batch_size=1），统计每秒查询数和中位延迟；
+- 入库：按 batch_size 批量编码文本块，统计每秒编码的文本块数；
+- 一致性：各后端的文档向量与 PyTorch 向量的最小/平均余弦相似度。
+ONNX 模型第一次运行时导出并缓存到模型目录下的 onnx/ 中，导出耗时不计入结果。
+
+用法:
+    python benchmarks/bench_model_backend.py
+    python benchmarks/bench_model_backend.py --queries 500 --docs 2000 --threads 4
+"""
+
+import argparse
+import os
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+# 添加项目根目录到Python路径
+project_root = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(project_root))
+
+from onnx_backend import BACKEND_ONNX, BACKEND_ONNX_INT8, BACKEND_TORCH, load_onnx_encoder, parity
+
+SUBJECTS = ["公司", "年假", "报销流程", "退款", "会员积分", "快递", "手机价格", "合同", "考勤", "培训"]
+ACTIONS = ["如何申请", "有什么规定", "需要哪些材料", "多久可以完成", "找谁审批", "有哪些注意事项"]
+
+
+def make_texts(rng, count: int, sentences: int):
+    """生成由若干个随机问句组成的中文文本"""
+    texts = []
+    for _ in range(count):
+        parts = [f"{rng.choice(SUBJECTS)}{rng.choice(ACTIONS)}" for _ in range(sentences)]
+        texts.append("，".join(parts) + "？")
+    return texts
+
+
+def load_backend(backend: str, model_dir: Path, threads: int):
+    if backend == BACKEND_TORCH:
+        import torch
+        from sentence_transformers import SentenceTransformer
+        if threads > 0:
+            torch.set_num_threads(threads)
+        return SentenceTransformer(str(model_dir), device='cpu')
+    # 基准测试同时报告一致性，不按阈值拒绝
+    return load_onnx_encoder(model_dir, backend, threads=threads, min_cosine=-1.0)
+
+
+def run(model_dir: Path, query_count: int, doc_count: int, batch_size: int, threads: int, backends):
+    rng = np.random.default_rng(42)
+    queries = make_texts(rng, query_count, 1)
+    documents = make_texts(rng, doc_count, 12)
+    print(f"模型: {model_dir}, 查询数: {query_count}, 文本块数: {doc_count}, batch_size: {batch_size}, "
+          f"线程数: {threads or '自动'}, CPU 核数: {os.cpu_count()}")
+    print(f"{'后端':>10} | {'查询QPS':>8} | {'查询p50(ms)':>11} | {'入库(块/秒)':>11} | {'最小余弦':>8} | {'平均余弦':>8}")
+    print("-" * 75)
+
+    reference = None
+    for backend in backends:
+        model = load_backend(backend, model_dir, threads)
+        if model is None:
+            print(f"{backend:>10} | 加载失败，跳过")
+            continue
+        model.encode(queries[:8], batch_size=8, show_progress_bar=False)  # 预热
+
+        latencies = []
+        start = time.perf_counter()
+        for query in queries:
+            begin = time.perf_counter()
+            model.encode([query], batch_size=1, show_progress_bar=False)
+            latencies.append((time.perf_counter() - begin) * 1000)
+        qps = len(queries) / (time.perf_counter() - start)
+
+        start = time.perf_counter()
+        vectors = np.asarray(model.encode(documents, batch_size=batch_size, show_progress_bar=False),
+                             dtype=np.float32)
+        throughput = len(documents) / (time.perf_counter() - start)
+
+        if reference is None and backend == BACKEND_TORCH:
+            reference = vectors
+        if reference is not None:
+            result = parity(reference, vectors)
+            agreement = f"{result['min_cosine']:>8.5f} | {result['mean_cosine']:>8.5f}"
+        else:
+            agreement = f"{'-':>8} | {'-':>8}"
+        print(f"{backend:>10} | {qps:>8.1f} | {np.median(latencies):>11.2f} | {throughput:>11.1f} | {agreement}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="向量模型推理后端基准测试")
+    parser.add_argument('--model-dir', default=str(project_root / 'models' / 'text2vec-base-chinese'))
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--docs', type=int, default=1000)
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--threads', type=int, default=0)
+    parser.add_argument('--backends', nargs='+', default=[BACKEND_TORCH, BACKEND_ONNX, BACKEND_ONNX_INT8])
+    args = parser.parse_args()
+    run(Path(args.model_dir), args.queries, args.docs, args.batch_size, args.threads, args.backends)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+多进程分片打分基准测试
+对比当前进程内的 EmbeddingMatrix.top_k 与 1 到 N 个工作进程 scatter-gather 打分的延迟，
+并检查并行结果与单进程结果一致。工作进程的 BLAS 为单线程，加速比反映进程数带来的扩展。
+
+用法:
+    python benchmarks/bench_parallel_search.py
+    python benchmarks/bench_parallel_search.py --size 1000000 --workers 1 2 4 8
+"""
+
+import argparse
+import os
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+# 添加项目根目录到Python路径
+project_root = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(project_root))
+
+from embedding_matrix import EmbeddingMatrix, normalize_rows
+from parallel_search import ParallelScorer
+
+
+def time_call(func, repeat: int) -> float:
+    """返回多次调用的中位耗时（毫秒）"""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1000)
+    return float(np.median(timings))
+
+
+def wait_ready(scorer: ParallelScorer, matrix: EmbeddingMatrix, timeout: float = 300.0):
+    """等待工作进程打开导出的矩阵"""
+    deadline = time.time() + timeout
+    while not scorer.ready(matrix):
+        if time.time() > deadline:
+            raise SystemExit("等待工作进程超时")
+        time.sleep(0.05)
+
+
+def run(size: int, dim: int, top_k: int, repeat: int, workers_list):
+    rng = np.random.default_rng(42)
+    print(f"文本块数: {size}, 向量维度: {dim}, top_k: {top_k}, 重复次数: {repeat}, CPU 核数: {os.cpu_count()}")
+    matrix = EmbeddingMatrix(dim)
+    matrix.append(normalize_rows(rng.standard_normal((size, dim)).astype(np.float32)))
+    query = normalize_rows(rng.standard_normal(dim).astype(np.float32))[0]
+    expected_rows, _ = matrix.top_k(query, top_k)
+
+    local_ms = time_call(lambda: matrix.top_k(query, top_k), repeat)
+    print(f"{'工作进程数':>10} | {'延迟(ms)':>10} | {'相对1进程':>10} | {'结果一致':>8}")
+    print("-" * 50)
+    print(f"{'当前进程':>10} | {local_ms:>10.2f} | {'-':>10} | {'-':>8}")
+
+    baseline = None
+    for workers in workers_list:
+        scorer = ParallelScorer(workers)
+        try:
+            wait_ready(scorer, matrix)
+            rows, _ = scorer.top_k(matrix, query, top_k)
+            same = np.array_equal(rows, expected_rows)
+            elapsed = time_call(lambda: scorer.top_k(matrix, query, top_k), repeat)
+        finally:
+            scorer.close()
+        baseline = baseline or elapsed
+        print(f"{workers:>10} | {elapsed:>10.2f} | {baseline / elapsed:>9.2f}x | {'是' if same else '否':>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="多进程分片打分基准测试")
+    parser.add_argument('--size', type=int, default=500000)
+    parser.add_argument('--dim', type=int, default=768)
+    parser.add_argument('--top-k', type=int, default=200)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+    args = parser.parse_args()
+    run(args.size, args.dim, args.top_k, args.repeat, args.workers)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+向量存储加载性能基准测试
+对比旧的 pickle 格式与列式存储在不同知识库规模下的打开耗时（不含 FAISS 索引和关键词索引）。
+
+用法:
+    python benchmarks/bench_store_load.py
+    python benchmarks/bench_store_load.py --sizes 10000 100000 --dim 768
+"""
+
+import argparse
+import pickle
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+# 添加项目根目录到Python路径
+project_root = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(project_root))
+
+from columnar_store import open_store, write_store
+
+
+def make_documents(size: int):
+    return [
+        (f"第{i}个文本块：智能手机的价格、退货政策和系统功能说明。" * 4,
+         {'source': f"uploads/doc_{i // 50}.txt", 'filename': f"doc_{i // 50}.txt", 'file_type': '.txt'})
+        for i in range(size)
+    ]
+
+
+def run(sizes, dim: int):
+    rng = np.random.default_rng(42)
+    print(f"向量维度: {dim}")
+    print(f"{'文本块数':>10} | {'pickle加载(ms)':>15} | {'列式打开(ms)':>14} | {'随机读100行(ms)':>16}")
+    print("-" * 66)
+
+    for size in sizes:
+        documents = make_documents(size)
+        embeddings = rng.standard_normal((size, dim)).astype(np.float32)
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / "vector_store"
+            with open(path.with_suffix('.pkl'), 'wb') as f:
+                pickle.dump({'documents': documents, 'document_embeddings': embeddings}, f)
+            write_store(path, documents, embeddings)
+
+            start = time.perf_counter()
+            with open(path.with_suffix('.pkl'), 'rb') as f:
+                pickle.load(f)
+            pickle_ms = (time.perf_counter() - start) * 1000
+
+            start = time.perf_counter()
+            table = open_store(path).documents
+            open_ms = (time.perf_counter() - start) * 1000
+
+            rows = rng.integers(0, size, 100)
+            start = time.perf_counter()
+            for row in rows:
+                table[int(row)]
+            read_ms = (time.perf_counter() - start) * 1000
+            del table
+
+        print(f"{size:>10} | {pickle_ms:>15.2f} | {open_ms:>14.2f} | {read_ms:>16.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="向量存储加载性能基准测试")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000])
+    parser.add_argument('--dim', type=int, default=768)
+    args = parser.parse_args()
+    run(args.sizes, args.dim)
+
+
+if __name__ == "__main__":
+    main()
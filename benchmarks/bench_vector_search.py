@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+向量打分性能基准测试
+对比逐块 Python 循环打分与 EmbeddingMatrix 矩阵打分在不同知识库规模下的延迟。
+
+用法:
+    python benchmarks/bench_vector_search.py
+    python benchmarks/bench_vector_search.py --sizes 1000 10000 100000 --dim 768
+"""
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+# 添加项目根目录到Python路径
+project_root = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(project_root))
+
+from embedding_matrix import EmbeddingMatrix
+
+
+def legacy_search(query_vector: np.ndarray, embeddings: np.ndarray, top_k: int):
+    """旧实现：逐个文本块归一化并计算余弦相似度"""
+    def normalize(vector):
+        norm = np.linalg.norm(vector)
+        return vector if norm == 0 else vector / norm
+
+    query_vector = normalize(query_vector)
+    results = []
+    for i in range(len(embeddings)):
+        doc_vector = normalize(embeddings[i])
+        similarity = max(0.0, min(1.0, float(np.dot(query_vector, doc_vector))))
+        results.append((i, similarity))
+    results.sort(key=lambda x: x[1], reverse=True)
+    return results[:top_k]
+
+
+def time_call(func, repeat: int) -> float:
+    """返回多次调用的中位耗时（毫秒）"""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1000)
+    return float(np.median(timings))
+
+
+def run(sizes, dim: int, top_k: int, repeat: int, skip_legacy_above: int):
+    rng = np.random.default_rng(42)
+    print(f"向量维度: {dim}, top_k: {top_k}, 重复次数: {repeat}")
+    print(f"{'文本块数':>10} | {'逐块循环(ms)':>14} | {'矩阵打分(ms)':>14} | {'加速比':>8}")
+    print("-" * 58)
+
+    for size in sizes:
+        embeddings = rng.standard_normal((size, dim)).astype(np.float32)
+        query = rng.standard_normal(dim).astype(np.float32)
+
+        matrix = EmbeddingMatrix(dim)
+        matrix.append(embeddings)
+
+        matrix_ms = time_call(lambda: matrix.top_k(query, top_k), repeat)
+
+        if size <= skip_legacy_above:
+            legacy_ms = time_call(lambda: legacy_search(query, embeddings, top_k), max(1, repeat // 5))
+            speedup = f"{legacy_ms / matrix_ms:.1f}x"
+            legacy_str = f"{legacy_ms:.2f}"
+        else:
+            legacy_str, speedup = "跳过", "-"
+
+        print(f"{size:>10} | {legacy_str:>14} | {matrix_ms:>14.2f} | {speedup:>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="向量打分性能基准测试")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--dim', type=int, default=768)
+    parser.add_argument('--top-k', type=int, default=200)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--skip-legacy-above', type=int, default=100000,
+                        help="超过该规模时不再运行逐块循环实现")
+    args = parser.parse_args()
+    run(args.sizes, args.dim, args.top_k, args.repeat, args.skip_legacy_above)
+
+
+if __name__ == "__main__":
+    main()
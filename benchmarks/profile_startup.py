@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+启动耗时分析
+在子进程中用 python -X importtime 导入 app.py（每次都是冷启动），报告：
+- 导入 app 模块的耗时，即 HTTP 服务可以开始监听之前的耗时；
+- 按顶层包汇总的导入耗时（累计），列出最慢的若干个；
+- 使用 --wait 时另外等待知识库加载完成，报告可以开始检索的耗时。
+导入 app 的耗时超过 --budget-ms 时以状态 1 退出，可以放在 CI 中防止冷启动变慢。
+
+importtime 的缩进层级是全局的，后台预热线程同时导入会打乱主线程的记录，
+所以分析时把预热线程推迟到 app 导入完成之后再启动（实际运行时两者同时进行，导入会稍慢一些）。
+
+用法:
+    python benchmarks/profile_startup.py --mode lazy --budget-ms 3000
+    python benchmarks/profile_startup.py --mode eager --top 30 --wait
+"""
+
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+# 项目根目录（子进程在这里导入 app）
+project_root = Path(__file__).resolve().parent.parent
+
+CHILD_SCRIPT = '''
+import json, os, sys, time
+start = time.perf_counter()
+from config_loader import config
+config.config.set('server', 'lazy_startup', {lazy!r})
+import startup
+deferred = []
+start_loader = startup.BackgroundLoader.start
+startup.BackgroundLoader.start = lambda loader: deferred.append(loader) or loader
+import app
+imported = time.perf_counter() - start
+startup.BackgroundLoader.start = start_loader
+for loader in deferred:
+    loader.start()
+ready = None
+if {wait!r}:
+    try:
+        app.vector_store_loader.get()
+        ready = (time.perf_counter() - start) * 1000
+    except Exception:
+        pass
+print("STARTUP_PROFILE " + json.dumps({{"import_ms": imported * 1000, "ready_ms": ready}}), flush=True)
+os._exit(0)
+'''
+
+IMPORT_LINE = re.compile(r'^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|( *)(\S+)')
+
+
+def parse_importtime(stderr: str) -> Tuple[Dict[str, float], int]:
+    """汇总导入 app 过程中的顶层导入耗时
+
+    Returns:
+        Tuple[Dict[str, float], int]: (顶层包 -> 累计耗时毫秒, 导入的模块数)
+    """
+    totals: Dict[str, float] = defaultdict(float)
+    modules = 0
+    for line in stderr.splitlines():
+        match = IMPORT_LINE.match(line)
+        if not match:
+            continue
+        _, cumulative, indent, name = match.groups()
+        modules += 1
+        if len(indent) <= 1:  # 顶层导入（不是被其他模块间接导入的）
+            totals[name.split('.')[0]] += int(cumulative) / 1000
+            if name == 'app':
+                break
+    return dict(totals), modules
+
+
+def profile(mode: str, wait: bool, timeout: float) -> Tuple[Dict[str, float], int, Dict[str, float], str]:
+    script = CHILD_SCRIPT.format(lazy='true' if mode == 'lazy' else 'false', wait=wait)
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', script], cwd=str(project_root),
+                            capture_output=True, text=True, encoding='utf-8', errors='replace', timeout=timeout)
+    timing = None
+    for line in result.stdout.splitlines():
+        if line.startswith('STARTUP_PROFILE '):
+            timing = json.loads(line[len('STARTUP_PROFILE '):])
+    if timing is None:
+        raise SystemExit(f"导入 app 失败（退出码 {result.returncode}）:\n{result.stderr[-3000:]}")
+    totals, modules = parse_importtime(result.stderr)
+    return totals, modules, timing, result.stderr
+
+
+def main():
+    parser = argparse.ArgumentParser(description="启动耗时分析")
+    parser.add_argument('--mode', choices=['lazy', 'eager'], default='lazy')
+    parser.add_argument('--budget-ms', type=float, default=3000.0)
+    parser.add_argument('--top', type=int, default=20)
+    parser.add_argument('--wait', action='store_true', help='等待知识库加载完成')
+    parser.add_argument('--timeout', type=float, default=600.0)
+    parser.add_argument('--raw', help='把 -X importtime 的原始输出写入该文件')
+    args = parser.parse_args()
+
+    totals, modules, timing, stderr = profile(args.mode, args.wait, args.timeout)
+    if args.raw:
+        Path(args.raw).write_text(stderr, encoding='utf-8')
+
+    print(f"模式: {args.mode}, CPU 核数: {os.cpu_count()}, 导入模块数: {modules}")
+    print(f"{'顶层导入':<32} | {'累计耗时(ms)':>12}")
+    print("-" * 49)
+    ranked: List[Tuple[str, float]] = sorted(totals.items(), key=lambda item: item[1], reverse=True)
+    for name, elapsed in ranked[:args.top]:
+        print(f"{name:<32} | {elapsed:>12.1f}")
+    print("-" * 49)
+    print(f"导入 app（服务开始监听前）: {timing['import_ms']:.0f} ms，预算 {args.budget_ms:.0f} ms")
+    if args.wait:
+        ready = timing.get('ready_ms')
+        print(f"知识库可以检索: {ready:.0f} ms" if ready is not None else "知识库加载失败")
+    if timing['import_ms'] > args.budget_ms:
+        print("✗ 超出启动耗时预算")
+        sys.exit(1)
+    print("✓ 启动耗时在预算之内")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,1003 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+列式向量存储文件格式
+取代把整个 documents 列表和向量矩阵 pickle 到 vector_store.pkl 的旧格式。
+向量、文本、元数据按列分别存放，打开时只做内存映射，不需要反序列化全部数据，
+多个进程（网页端和微信端）打开同一份知识库时可以共享操作系统的页缓存。
+
+存储采用类似 LSM 的结构：若干不可变的段 + 一个预写日志（见 segment_log）。
+每次保存只把新增的增、删、改操作追加到日志，日志超过阈值时才把其中的操作落盘成一个新段，
+段数量或已删除比例过高时在后台合并（compaction）并丢弃已删除的文本块。
+
+目录结构（以 knowledge_base/vector_store 为例）:
+    vector_store.store/
+        CURRENT                 当前生效的清单文件名
+        MANIFEST-000007         清单：段列表、删除标记、索引和日志文件名、下一个文本块 ID
+        seg-000003/             不可变的段
+            segment.json        文本块数量、向量维度
+            ids.npy             文本块 ID（int64）
+            embeddings.npy      归一化的 float32 向量矩阵，以 mmap 方式打开
+            texts.bin           UTF-8 编码的文本块依次拼接
+            text_offsets.npy    每个文本块在 texts.bin 中的起始偏移（int64，长度 n+1）
+            metadata.json       去重后的元数据字典列表
+            metadata_codes.npy  每个文本块对应的元数据编号（int32）
+            terms_vocab.json    分词词表
+            terms_offsets.npy   每个文本块的词频在 terms_ids/terms_freqs 中的起始偏移
+            terms_ids.npy       词在词表中的编号（int32）
+            terms_freqs.npy     词频（int32）
+            sentences.npy       每个文本块前几个句子的归一化向量（float16，见 sentence_index）
+            sentences_offsets.npy  每个文本块的句子向量在 sentences.npy 中的起始行
+        deleted-000007.npy      已删除但仍留在段中的文本块 ID
+        index-000007.faiss      与段（不含日志）内容一致的 FAISS 索引，向量 ID 为文本块 ID
+        wal-000007.log          预写日志
+
+同一个 ID 出现在多个段中时以最新的段为准（更新操作），文本块的顺序按 ID 第一次出现的位置排列。
+清单通过原子替换 CURRENT 切换，读者始终看到完整的一版数据。
+只允许一个进程写入（网页端），其他进程（微信端）只读。
+"""
+
+import bisect
+import json
+import logging
+import os
+import re
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import MutableSequence
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import faiss
+import numpy as np
+
+import segment_log
+from embedding_matrix import StackedMatrix, normalize_rows
+
+logger = logging.getLogger(__name__)
+
+FORMAT_NAME = 'wechat_bot.vector_store'
+FORMAT_VERSION = 2
+
+CURRENT_FILE = 'CURRENT'
+SEGMENT_FILE = 'segment.json'
+# 第 1 版格式每次保存写一个完整的版本目录 gNNNNNN/，读取时作为单个段处理
+LEGACY_MANIFEST_FILE = 'manifest.json'
+LEGACY_INDEX_FILE = 'index.faiss'
+
+_NUMBERED = re.compile(r'^(?:MANIFEST-|seg-|deleted-|index-|wal-|g)(\d+)')
+
+
+def store_dir(path) -> Path:
+    """列式存储目录，例如 knowledge_base/vector_store -> knowledge_base/vector_store.store"""
+    return Path(path).with_suffix('.store')
+
+
+def current_file(path) -> Path:
+    """记录当前清单的文件，每次落盘或合并都会被替换"""
+    return store_dir(path) / CURRENT_FILE
+
+
+def legacy_paths(path) -> Tuple[Path, Path]:
+    """旧格式的索引文件和 pickle 数据文件"""
+    return Path(path).with_suffix('.index'), Path(path).with_suffix('.pkl')
+
+
+def store_exists(path) -> bool:
+    """是否存在列式存储"""
+    return SegmentStore(path).read_manifest() is not None
+
+
+def vector_store_exists(path) -> bool:
+    """是否存在可加载的向量存储（列式存储或旧的 .index + .pkl）"""
+    index_path, pkl_path = legacy_paths(path)
+    return store_exists(path) or (index_path.exists() and pkl_path.exists())
+
+
+def store_mtime(path) -> Optional[float]:
+    """存储最近一次变更的时间（清单切换或日志追加），不存在时返回 None"""
+    store = SegmentStore(path)
+    manifest = store.read_manifest()
+    if manifest is None:
+        return None
+    mtimes = [current_file(path).stat().st_mtime]
+    if manifest.get('wal'):
+        wal_path = store.root / manifest['wal']
+        if wal_path.exists():
+            mtimes.append(wal_path.stat().st_mtime)
+    return max(mtimes)
+
+
+def _metadata_key(metadata: Dict[str, Any]) -> str:
+    return json.dumps(metadata, ensure_ascii=False, sort_keys=True, default=str)
+
+
+def _write_array(path: Path, array: np.ndarray):
+    with open(path, 'wb') as f:
+        np.save(f, array)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def _write_json(path: Path, data):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def write_segment(segment_dir: Path, ids, documents: Iterable[Tuple[str, Dict[str, Any]]],
+                  embeddings: Optional[np.ndarray],
+                  keyword_terms: Optional[List[Dict[str, int]]] = None,
+                  dim: Optional[int] = None,
+                  sentence_vectors: Optional[List[np.ndarray]] = None):
+    """写入一个不可变的段
+
+    Args:
+        segment_dir: 段目录（必须不存在或为空）
+        ids: 文本块 ID
+        documents: (text, metadata) 序列
+        embeddings: 与 documents 一一对应的向量矩阵，会被归一化为 float32
+        keyword_terms: 每个文本块的分词词频，为 None 时不保存（加载时重新分词）
+        dim: 没有向量时记录的向量维度
+        sentence_vectors: 每个文本块的句子向量矩阵，为 None 时不保存（加载时重新编码）
+    """
+    segment_dir = Path(segment_dir)
+    segment_dir.mkdir(parents=True, exist_ok=True)
+
+    # 文本与元数据：文本依次写入 texts.bin，元数据按内容去重后只保存编号
+    offsets = [0]
+    metadata_table: List[Dict[str, Any]] = []
+    metadata_lookup: Dict[str, int] = {}
+    codes = []
+    with open(segment_dir / 'texts.bin', 'wb') as f:
+        for text, metadata in documents:
+            encoded = text.encode('utf-8')
+            f.write(encoded)
+            offsets.append(offsets[-1] + len(encoded))
+            key = _metadata_key(metadata)
+            code = metadata_lookup.get(key)
+            if code is None:
+                code = len(metadata_table)
+                metadata_lookup[key] = code
+                metadata_table.append(json.loads(key))
+            codes.append(code)
+        f.flush()
+        os.fsync(f.fileno())
+    count = len(codes)
+
+    ids = np.asarray(ids, dtype=np.int64)
+    if embeddings is None or len(embeddings) == 0:
+        vectors = np.empty((0, dim or 0), dtype=np.float32)
+    else:
+        vectors = normalize_rows(embeddings)
+        dim = int(vectors.shape[1])
+    if len(vectors) != count or len(ids) != count:
+        raise ValueError(f"文本块数量 {count} 与向量数量 {len(vectors)}、ID 数量 {len(ids)} 不一致")
+
+    _write_array(segment_dir / 'ids.npy', ids)
+    _write_array(segment_dir / 'embeddings.npy', vectors)
+    _write_array(segment_dir / 'text_offsets.npy', np.asarray(offsets, dtype=np.int64))
+    _write_array(segment_dir / 'metadata_codes.npy', np.asarray(codes, dtype=np.int32))
+    _write_json(segment_dir / 'metadata.json', metadata_table)
+
+    if keyword_terms is not None and len(keyword_terms) == count:
+        vocab: Dict[str, int] = {}
+        term_offsets = [0]
+        term_ids = []
+        term_freqs = []
+        for terms in keyword_terms:
+            for term, freq in terms.items():
+                term_ids.append(vocab.setdefault(term, len(vocab)))
+                term_freqs.append(freq)
+            term_offsets.append(len(term_ids))
+        _write_json(segment_dir / 'terms_vocab.json', list(vocab))
+        _write_array(segment_dir / 'terms_offsets.npy', np.asarray(term_offsets, dtype=np.int64))
+        _write_array(segment_dir / 'terms_ids.npy', np.asarray(term_ids, dtype=np.int32))
+        _write_array(segment_dir / 'terms_freqs.npy', np.asarray(term_freqs, dtype=np.int32))
+
+    if sentence_vectors is not None and len(sentence_vectors) == count:
+        blocks = [np.asarray(matrix, dtype=np.float16) for matrix in sentence_vectors if len(matrix)]
+        sentence_offsets = np.cumsum([0] + [len(matrix) for matrix in sentence_vectors])
+        matrix = np.concatenate(blocks) if blocks else np.empty((0, dim or 0), dtype=np.float16)
+        _write_array(segment_dir / 'sentences.npy', matrix)
+        _write_array(segment_dir / 'sentences_offsets.npy', sentence_offsets.astype(np.int64))
+
+    _write_json(segment_dir / SEGMENT_FILE, {'count': count, 'dim': dim})
+
+
+class Segment:
+    """只读打开的一个段，所有大块数据都通过 mmap 按需读取"""
+
+    def __init__(self, segment_dir: Path):
+        self.segment_dir = Path(segment_dir)
+        info_path = self.segment_dir / SEGMENT_FILE
+        if not info_path.exists():
+            info_path = self.segment_dir / LEGACY_MANIFEST_FILE
+        with open(info_path, 'r', encoding='utf-8') as f:
+            info = json.load(f)
+        self.count = int(info['count'])
+        self.dim = info.get('dim')
+        if (self.segment_dir / 'ids.npy').exists():
+            self.ids = self._load_array('ids.npy')
+        else:
+            self.ids = np.arange(self.count, dtype=np.int64)
+        self.embeddings = self._load_array('embeddings.npy')
+        self.text_offsets = self._load_array('text_offsets.npy')
+        texts_path = self.segment_dir / 'texts.bin'
+        if texts_path.stat().st_size > 0:
+            self._texts = np.memmap(texts_path, dtype=np.uint8, mode='r')
+        else:
+            self._texts = np.empty(0, dtype=np.uint8)
+        with open(self.segment_dir / 'metadata.json', 'r', encoding='utf-8') as f:
+            self._metadata = json.load(f)
+        self.metadata_codes = self._load_array('metadata_codes.npy')
+
+    def _load_array(self, name: str) -> np.ndarray:
+        return np.load(self.segment_dir / name, mmap_mode='r')
+
+    @property
+    def name(self) -> str:
+        return self.segment_dir.name
+
+    def __len__(self) -> int:
+        return self.count
+
+    def text(self, row: int) -> str:
+        start, end = int(self.text_offsets[row]), int(self.text_offsets[row + 1])
+        return self._texts[start:end].tobytes().decode('utf-8')
+
+    def metadata(self, row: int) -> Dict[str, Any]:
+        # 同一文档的文本块共享一条元数据，返回副本避免调用方修改影响其他文本块
+        return dict(self._metadata[int(self.metadata_codes[row])])
+
+    def row(self, row: int) -> Tuple[str, Dict[str, Any]]:
+        return self.text(row), self.metadata(row)
+
+    def source(self, row: int) -> Optional[str]:
+        """只读取元数据中的 source，不复制元数据"""
+        return self._metadata[int(self.metadata_codes[row])].get('source')
+
+    def metadata_fields(self, row: int, fields: Iterable[str]) -> Dict[str, Any]:
+        """只读取元数据中的指定字段，不复制整条元数据"""
+        metadata = self._metadata[int(self.metadata_codes[row])]
+        return {key: metadata[key] for key in fields if key in metadata}
+
+    def keyword_terms(self) -> Optional[List[Dict[str, int]]]:
+        """读取每个文本块的分词词频，文件缺失时返回 None"""
+        vocab_path = self.segment_dir / 'terms_vocab.json'
+        if not vocab_path.exists():
+            return None
+        with open(vocab_path, 'r', encoding='utf-8') as f:
+            vocab = json.load(f)
+        bounds = np.load(self.segment_dir / 'terms_offsets.npy').tolist()
+        ids = np.load(self.segment_dir / 'terms_ids.npy').tolist()
+        freqs = np.load(self.segment_dir / 'terms_freqs.npy').tolist()
+        return [
+            {vocab[ids[j]]: freqs[j] for j in range(bounds[i], bounds[i + 1])}
+            for i in range(self.count)
+        ]
+
+    def sentence_vectors(self) -> Optional[List[np.ndarray]]:
+        """每个文本块的句子向量（mmap 矩阵的切片，不复制），文件缺失时返回 None"""
+        if not (self.segment_dir / 'sentences_offsets.npy').exists():
+            return None
+        bounds = np.load(self.segment_dir / 'sentences_offsets.npy').tolist()
+        matrix = self._load_array('sentences.npy')
+        return [matrix[bounds[i]:bounds[i + 1]] for i in range(self.count)]
+
+
+class SegmentSet:
+    """把多个段拼接成一个连续的行号空间"""
+
+    def __init__(self, segments: List[Segment]):
+        self.segments = segments
+        self.starts = [0]
+        for segment in segments:
+            self.starts.append(self.starts[-1] + len(segment))
+        if segments:
+            self.ids = np.concatenate([np.asarray(s.ids) for s in segments])
+        else:
+            self.ids = np.empty(0, dtype=np.int64)
+
+    def __len__(self) -> int:
+        return self.starts[-1]
+
+    def _locate(self, row: int) -> Tuple[Segment, int]:
+        k = bisect.bisect_right(self.starts, row) - 1
+        return self.segments[k], row - self.starts[k]
+
+    def text(self, row: int) -> str:
+        segment, local = self._locate(row)
+        return segment.text(local)
+
+    def row(self, row: int) -> Tuple[str, Dict[str, Any]]:
+        segment, local = self._locate(row)
+        return segment.row(local)
+
+    def source(self, row: int) -> Optional[str]:
+        segment, local = self._locate(row)
+        return segment.source(local)
+
+    def metadata_fields(self, row: int, fields: Iterable[str]) -> Dict[str, Any]:
+        segment, local = self._locate(row)
+        return segment.metadata_fields(local, fields)
+
+    def embeddings(self, rows=None) -> Optional[np.ndarray]:
+        """取指定行的向量，不复制：只有一个段且取全部行时直接返回 mmap 矩阵，
+        否则返回按行映射到各段 mmap 矩阵的 StackedMatrix（读取时只复制请求的行）"""
+        if not self.segments:
+            return None
+        whole = rows is None or (isinstance(rows, range) and rows == range(len(self)))
+        if whole and len(self.segments) == 1:
+            return self.segments[0].embeddings
+        return StackedMatrix([s.embeddings for s in self.segments], None if whole else rows)
+
+    def keyword_terms(self, rows=None) -> Optional[List[Dict[str, int]]]:
+        """取指定行的分词词频，任何一个段缺少分词结果时返回 None"""
+        terms = []
+        for segment in self.segments:
+            segment_terms = segment.keyword_terms()
+            if segment_terms is None:
+                return None
+            terms.extend(segment_terms)
+        return terms if rows is None else [terms[row] for row in rows]
+
+    def sentence_vectors(self, rows=None) -> Optional[List[np.ndarray]]:
+        """取指定行的句子向量，任何一个段缺少句子向量时返回 None"""
+        vectors = []
+        for segment in self.segments:
+            segment_vectors = segment.sentence_vectors()
+            if segment_vectors is None:
+                return None
+            vectors.extend(segment_vectors)
+        return vectors if rows is None else [vectors[row] for row in rows]
+
+    def live_rows(self, deleted: Optional[np.ndarray] = None):
+        """每个 ID 取最新段中的行，按 ID 第一次出现的位置排列，并去掉已删除的 ID
+
+        Returns:
+            Tuple[range | np.ndarray, np.ndarray]: (行号, 对应的 ID)
+        """
+        ids = self.ids
+        has_deleted = deleted is not None and len(deleted) > 0
+        unique_ids, first = np.unique(ids, return_index=True)
+        if len(unique_ids) == len(ids) and not has_deleted:
+            return range(len(ids)), ids
+        _, last_reversed = np.unique(ids[::-1], return_index=True)
+        last = len(ids) - 1 - last_reversed
+        order = np.argsort(first, kind='stable')
+        rows, live_ids = last[order], unique_ids[order]
+        if has_deleted:
+            keep = ~np.isin(live_ids, deleted)
+            rows, live_ids = rows[keep], live_ids[keep]
+        return rows, live_ids
+
+
+class ChunkTable(MutableSequence):
+    """文本块表，行为与 (text, metadata) 元组列表一致
+
+    未修改的行直接从段中按需读取；修改或新增的行以元组形式保存在内存中。
+    第一次发生结构性修改（插入、删除、替换）之前不会为每一行创建 Python 对象。
+    """
+
+    def __init__(self, reader=None, rows=None):
+        """
+        Args:
+            reader: 提供 row(i)/text(i) 的只读数据源（SegmentSet）
+            rows: 每一行对应的数据源行号或 (text, metadata) 元组，为 None 时对应数据源的全部行
+        """
+        self.reader = reader
+        # 元素为 int 时表示数据源中的行号，为 tuple 时表示内存中的 (text, metadata)
+        if rows is None:
+            rows = range(len(reader)) if reader is not None else []
+        self._rows = rows
+
+    def _materialize(self):
+        if not isinstance(self._rows, list):
+            self._rows = [entry if isinstance(entry, tuple) else int(entry) for entry in self._rows]
+
+    def _resolve(self, entry):
+        return entry if isinstance(entry, tuple) else self.reader.row(int(entry))
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._resolve(entry) for entry in self._rows[index]]
+        return self._resolve(self._rows[index])
+
+    def __setitem__(self, index, value):
+        self._materialize()
+        if isinstance(index, slice):
+            self._rows[index] = [tuple(item) for item in value]
+        else:
+            self._rows[index] = tuple(value)
+
+    def __delitem__(self, index):
+        self._materialize()
+        del self._rows[index]
+
+    def insert(self, index: int, value):
+        self._materialize()
+        self._rows.insert(index, tuple(value))
+
+    def source(self, row: int) -> Optional[str]:
+        """只读取元数据中的 source"""
+        entry = self._rows[row]
+        return entry[1].get('source') if isinstance(entry, tuple) else self.reader.source(int(entry))
+
+    def metadata_fields(self, row: int, fields: Iterable[str]) -> Dict[str, Any]:
+        """只读取元数据中的指定字段"""
+        entry = self._rows[row]
+        if isinstance(entry, tuple):
+            return {key: entry[1][key] for key in fields if key in entry[1]}
+        return self.reader.metadata_fields(int(entry), fields)
+
+    def copy(self) -> 'ChunkTable':
+        """浅拷贝，之后对任何一方的修改互不影响（段中的数据和内存中的元组是共享的只读对象）"""
+        return ChunkTable(self.reader, list(self._rows) if isinstance(self._rows, list) else self._rows)
+
+    def take(self, rows: Iterable[int]) -> 'ChunkTable':
+        """按行号选出若干行组成新表，未修改的行仍引用段中的数据"""
+        return ChunkTable(self.reader, [self._rows[int(row)] for row in rows])
+
+    def text(self, row: int) -> str:
+        """只读取文本，不解析元数据"""
+        entry = self._rows[row]
+        return entry[0] if isinstance(entry, tuple) else self.reader.text(int(entry))
+
+    def __repr__(self) -> str:
+        return f"ChunkTable({len(self)} rows)"
+
+
+class StoreSnapshot:
+    """打开存储（段 + 日志重放）后得到的完整内容"""
+
+    def __init__(self, documents: ChunkTable, ids: List[int], embeddings: Optional[np.ndarray],
+                 keyword_terms: Optional[List[Dict[str, int]]], index: Optional[faiss.Index],
+                 stale_ids: set, next_id: int, dim: Optional[int],
+                 sentence_vectors: Optional[List[np.ndarray]] = None):
+        self.documents = documents
+        self.ids = ids
+        self.embeddings = embeddings
+        self.keyword_terms = keyword_terms
+        # 与 ids 一一对应的句子向量，存储中没有时为 None；日志记录缺少时对应元素为 None
+        self.sentence_vectors = sentence_vectors
+        # 索引（向量 ID 为文本块 ID）只与段的内容一致；stale_ids 为日志中新增、更新或删除过的文本块，
+        # 调用方需要先从索引中移除这些 ID，再把其中仍然存在的文本块重新加入
+        self.index = index
+        self.stale_ids = stale_ids
+        self.next_id = next_id
+        self.dim = dim
+
+    def __len__(self) -> int:
+        return len(self.documents)
+
+
+class SegmentStore:
+    """段 + 预写日志的存储目录管理
+
+    写入方（FaissVectorStore）每次保存调用 append 追加操作日志；日志超过 wal_flush_bytes 时
+    调用 flush 把日志落盘为新段；needs_compaction 为真时在后台线程中合并段。
+    """
+
+    def __init__(self, path, wal_flush_bytes: int = 64 * 1024 * 1024,
+                 max_segments: int = 8, max_deleted_ratio: float = 0.2):
+        """
+        Args:
+            path: 向量存储路径（不含扩展名）
+            wal_flush_bytes: 日志超过该大小时落盘为新段
+            max_segments: 段数量超过该值时合并
+            max_deleted_ratio: 已删除文本块占段中总行数的比例超过该值时合并
+        """
+        self.path = Path(path)
+        self.root = store_dir(path)
+        self.wal_flush_bytes = wal_flush_bytes
+        self.max_segments = max_segments
+        self.max_deleted_ratio = max_deleted_ratio
+        self._lock = threading.RLock()
+        self._wal_end = None
+        self._compaction_thread = None
+
+    # ------------------------------------------------------------------ 清单
+
+    def read_manifest(self) -> Optional[Dict[str, Any]]:
+        """读取当前清单，不存在时返回 None"""
+        try:
+            name = (self.root / CURRENT_FILE).read_text(encoding='utf-8').strip()
+        except OSError:
+            return None
+        if not name:
+            return None
+        manifest_path = self.root / name
+        if manifest_path.is_dir():
+            return self._read_legacy_generation(manifest_path)
+        if not manifest_path.exists():
+            return None
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        if manifest.get('format') != FORMAT_NAME:
+            raise ValueError(f"不支持的存储格式: {manifest.get('format')}")
+        if manifest.get('version', 0) > FORMAT_VERSION:
+            raise ValueError(f"存储格式版本过新: {manifest.get('version')}，当前支持 {FORMAT_VERSION}")
+        manifest['name'] = name
+        return manifest
+
+    def _read_legacy_generation(self, generation: Path) -> Optional[Dict[str, Any]]:
+        """把第 1 版的版本目录转换为清单"""
+        if not (generation / LEGACY_MANIFEST_FILE).exists():
+            return None
+        with open(generation / LEGACY_MANIFEST_FILE, 'r', encoding='utf-8') as f:
+            info = json.load(f)
+        index_file = f"{generation.name}/{LEGACY_INDEX_FILE}"
+        return {
+            'format': FORMAT_NAME,
+            'version': 1,
+            'name': generation.name,
+            'dim': info.get('dim'),
+            'segments': [{'name': generation.name, 'count': info['count']}],
+            'deleted': None,
+            'deleted_count': 0,
+            'index': index_file if (self.root / index_file).exists() else None,
+            'wal': None,
+            'next_id': info['count']
+        }
+
+    def _next_number(self) -> int:
+        numbers = [int(m.group(1)) for m in (_NUMBERED.match(p.name) for p in self.root.iterdir()) if m]
+        return max(numbers, default=0) + 1
+
+    def _commit_manifest(self, manifest: Dict[str, Any], number: int):
+        """写入清单并原子切换 CURRENT，然后清理不再被引用的文件"""
+        previous = self.read_manifest()
+        manifest = {key: value for key, value in manifest.items() if key != 'name'}
+        manifest.update({
+            'format': FORMAT_NAME,
+            'version': FORMAT_VERSION,
+            'created_at': time.strftime('%Y-%m-%d %H:%M:%S')
+        })
+        name = f"MANIFEST-{number:06d}"
+        _write_json(self.root / name, manifest)
+
+        current_tmp = self.root / f"{CURRENT_FILE}.tmp"
+        with open(current_tmp, 'w', encoding='utf-8') as f:
+            f.write(name)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(current_tmp, self.root / CURRENT_FILE)
+
+        manifest['name'] = name
+        # 保留上一版清单引用的文件，其他进程可能正在打开它
+        self._remove_obsolete([manifest] + ([previous] if previous else []))
+
+    def _remove_obsolete(self, manifests: List[Dict[str, Any]]):
+        keep = set()
+        for manifest in manifests:
+            keep.add(manifest['name'])
+            keep.update(segment['name'] for segment in manifest['segments'])
+            for key in ('deleted', 'index', 'wal'):
+                if manifest.get(key):
+                    keep.add(manifest[key].split('/')[0])
+        compacting = self._compaction_thread is not None and self._compaction_thread.is_alive()
+        for entry in self.root.iterdir():
+            if entry.name in keep or not _NUMBERED.match(entry.name):
+                continue
+            if entry.name.endswith('.tmp') and compacting:
+                continue
+            if entry.is_dir():
+                shutil.rmtree(entry, ignore_errors=True)
+            else:
+                try:
+                    entry.unlink()
+                except OSError:
+                    # Windows 下其他进程仍在映射的文件无法删除，下次清理时重试
+                    pass
+
+    def _load_deleted(self, manifest: Dict[str, Any]) -> np.ndarray:
+        if not manifest.get('deleted'):
+            return np.empty(0, dtype=np.int64)
+        return np.load(self.root / manifest['deleted'])
+
+    def _open_segments(self, manifest: Dict[str, Any]) -> SegmentSet:
+        return SegmentSet([Segment(self.root / segment['name']) for segment in manifest['segments']])
+
+    # ------------------------------------------------------------------ 读写
+
+    @property
+    def wal_path(self) -> Optional[Path]:
+        manifest = self.read_manifest()
+        if manifest is None or not manifest.get('wal'):
+            return None
+        return self.root / manifest['wal']
+
+    @property
+    def wal_size(self) -> int:
+        wal_path = self.wal_path
+        return wal_path.stat().st_size if wal_path is not None and wal_path.exists() else 0
+
+    def create(self, documents: Iterable[Tuple[str, Dict[str, Any]]], embeddings: Optional[np.ndarray],
+               keyword_terms: Optional[List[Dict[str, int]]] = None, ids=None,
+               index: Optional[faiss.Index] = None, next_id: Optional[int] = None,
+               dim: Optional[int] = None, sentence_vectors: Optional[List[np.ndarray]] = None) -> str:
+        """把全部内容写成一个新段并切换到新清单（首次保存或迁移时使用）
+
+        Args:
+            documents: (text, metadata) 序列
+            embeddings: 与 documents 一一对应的向量矩阵
+            keyword_terms: 每个文本块的分词词频
+            ids: 文本块 ID，为 None 时使用 0..n-1
+            index: 以文本块 ID 为向量 ID 的 FAISS 索引，为 None 时加载时重建
+            next_id: 下一个可分配的文本块 ID
+            dim: 没有向量时记录的向量维度
+            sentence_vectors: 每个文本块的句子向量
+
+        Returns:
+            str: 新清单名称
+        """
+        with self._lock:
+            self.root.mkdir(parents=True, exist_ok=True)
+            number = self._next_number()
+            segment_name = f"seg-{number:06d}"
+            tmp_dir = self.root / f"{segment_name}.tmp"
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+            documents = list(documents) if not hasattr(documents, '__len__') else documents
+            if ids is None:
+                ids = np.arange(len(documents), dtype=np.int64)
+            if embeddings is not None and len(embeddings) > 0:
+                dim = int(np.shape(embeddings)[1])
+            elif dim is None and index is not None:
+                dim = index.d
+            write_segment(tmp_dir, ids, documents, embeddings, keyword_terms, dim=dim,
+                          sentence_vectors=sentence_vectors)
+            os.replace(tmp_dir, self.root / segment_name)
+
+            ids = np.asarray(ids, dtype=np.int64)
+            if next_id is None:
+                next_id = int(ids.max()) + 1 if len(ids) else 0
+            manifest = {
+                'dim': dim,
+                'segments': [{'name': segment_name, 'count': len(ids)}],
+                'deleted': None,
+                'deleted_count': 0,
+                'index': self._write_index(index, number),
+                'index_ids': 'chunk',
+                'wal': self._new_wal(number),
+                'next_id': int(next_id)
+            }
+            self._commit_manifest(manifest, number)
+            self._wal_end = 0
+            return f"MANIFEST-{number:06d}"
+
+    def _write_index(self, index: Optional[faiss.Index], number: int) -> Optional[str]:
+        if index is None:
+            return None
+        name = f"index-{number:06d}.faiss"
+        faiss.write_index(index, str(self.root / name))
+        return name
+
+    def _new_wal(self, number: int) -> str:
+        name = f"wal-{number:06d}.log"
+        open(self.root / name, 'wb').close()
+        return name
+
+    def open(self) -> Optional[StoreSnapshot]:
+        """打开当前清单的所有段并重放日志
+
+        Returns:
+            Optional[StoreSnapshot]: 存储内容，存储不存在时返回 None
+        """
+        with self._lock:
+            manifest = self.read_manifest()
+            if manifest is None:
+                return None
+            segments = self._open_segments(manifest)
+            rows, live_ids = segments.live_rows(self._load_deleted(manifest))
+            records = []
+            if manifest.get('wal'):
+                records, self._wal_end = segment_log.read_records(self.root / manifest['wal'])
+            else:
+                self._wal_end = 0
+
+        index = None
+        if manifest.get('index'):
+            try:
+                # 索引在加载后还要增删向量，不能使用 faiss 的 mmap 读取方式（映射的索引不可修改）
+                index = faiss.read_index(str(self.root / manifest['index']))
+            except Exception as e:
+                logger.warning(f"索引文件损坏，需要重建: {e}")
+        # 早期版本的索引以行号为向量 ID，只有文本块 ID 恰好等于行号时才能继续使用
+        if (index is not None and manifest.get('index_ids') != 'chunk'
+                and not np.array_equal(live_ids, np.arange(len(live_ids)))):
+            index = None
+
+        keyword_terms = segments.keyword_terms(rows)
+        sentence_vectors = segments.sentence_vectors(rows)
+        if not records:
+            return StoreSnapshot(
+                documents=ChunkTable(segments, rows),
+                ids=live_ids.tolist(),
+                embeddings=segments.embeddings(rows),
+                keyword_terms=keyword_terms,
+                index=index,
+                stale_ids=set(),
+                next_id=manifest['next_id'],
+                dim=manifest.get('dim'),
+                sentence_vectors=sentence_vectors
+            )
+
+        # 重放日志：每个文本块记录数据源（段中的行号或内存中的元组）、ID、分词结果和向量所在行。
+        # 向量行号指向各段 mmap 矩阵之后接着日志中的向量，段中的向量不复制
+        entries = list(rows)
+        ids = live_ids.tolist()
+        terms = keyword_terms if keyword_terms is not None else [None] * len(entries)
+        sentences = sentence_vectors if sentence_vectors is not None else [None] * len(entries)
+        vector_rows = list(rows)
+        vector_blocks = []
+        vector_count = len(segments)
+        next_id = manifest['next_id']
+        stale_ids = set()
+        # 删除只标记在 keep 中，重放结束后统一过滤一次
+        positions = {chunk_id: i for i, chunk_id in enumerate(ids)}
+        keep = [True] * len(ids)
+
+        for record in records:
+            op = record['op']
+            stale_ids.update(record['ids'])
+            if op == segment_log.OP_DELETE:
+                for chunk_id in record['ids']:
+                    i = positions.pop(chunk_id, None)
+                    if i is not None:
+                        keep[i] = False
+                continue
+
+            vectors = normalize_rows(record['embeddings'])
+            vector_blocks.append(vectors)
+            record_terms = record.get('keyword_terms') or [None] * len(record['ids'])
+            record_sentences = record.get('sentence_vectors') or [None] * len(record['ids'])
+            if op == segment_log.OP_ADD:
+                for k, chunk_id in enumerate(record['ids']):
+                    positions[chunk_id] = len(ids)
+                    keep.append(True)
+                    entries.append(tuple(record['documents'][k]))
+                    ids.append(chunk_id)
+                    terms.append(record_terms[k])
+                    sentences.append(record_sentences[k])
+                    vector_rows.append(vector_count + k)
+                    next_id = max(next_id, chunk_id + 1)
+            elif op == segment_log.OP_UPDATE:
+                for k, chunk_id in enumerate(record['ids']):
+                    i = positions.get(chunk_id)
+                    if i is None:
+                        continue
+                    entries[i] = tuple(record['documents'][k])
+                    terms[i] = record_terms[k]
+                    sentences[i] = record_sentences[k]
+                    vector_rows[i] = vector_count + k
+            vector_count += len(vectors)
+
+        if not all(keep):
+            live = [i for i, alive in enumerate(keep) if alive]
+            entries = [entries[i] for i in live]
+            ids = [ids[i] for i in live]
+            terms = [terms[i] for i in live]
+            sentences = [sentences[i] for i in live]
+            vector_rows = [vector_rows[i] for i in live]
+
+        embeddings = None
+        if vector_rows:
+            # 日志中的向量合成一个小矩阵，与各段 mmap 矩阵一起按行映射
+            blocks = [segment.embeddings for segment in segments.segments]
+            if vector_blocks:
+                blocks.append(np.concatenate(vector_blocks))
+            embeddings = StackedMatrix(blocks, vector_rows)
+        if any(t is None for t in terms):
+            terms = None
+        return StoreSnapshot(
+            documents=ChunkTable(segments, entries),
+            ids=ids,
+            embeddings=embeddings,
+            keyword_terms=terms,
+            index=index,
+            stale_ids=stale_ids,
+            next_id=next_id,
+            dim=manifest.get('dim'),
+            sentence_vectors=sentences
+        )
+
+    def append(self, records: List[Dict[str, Any]]):
+        """把操作追加到当前日志"""
+        if not records:
+            return
+        with self._lock:
+            manifest = self.read_manifest()
+            if manifest is None or not manifest.get('wal'):
+                raise RuntimeError(f"存储不存在或不支持追加日志: {self.root}")
+            wal_path = self.root / manifest['wal']
+            if self._wal_end is None:
+                _, self._wal_end = segment_log.read_records(wal_path)
+            self._wal_end = segment_log.append_records(wal_path, records, self._wal_end)
+
+    def flush(self, index: Optional[faiss.Index] = None):
+        """把日志中的操作落盘为一个新段，并切换到新的空日志
+
+        Args:
+            index: 与落盘后内容一致的 FAISS 索引（即调用方当前的内存索引），为 None 时加载时重建
+        """
+        with self._lock:
+            manifest = self.read_manifest()
+            if manifest is None or not manifest.get('wal'):
+                return
+            records, _ = segment_log.read_records(self.root / manifest['wal'])
+            if not records:
+                return
+
+            # 重放日志得到内存表：ID -> (文本块, 向量, 分词结果, 句子向量)，保持首次写入的顺序
+            memtable = OrderedDict()
+            deleted = set(self._load_deleted(manifest).tolist())
+            next_id = manifest['next_id']
+            for record in records:
+                if record['op'] == segment_log.OP_DELETE:
+                    for chunk_id in record['ids']:
+                        memtable.pop(chunk_id, None)
+                        deleted.add(chunk_id)
+                    continue
+                vectors = normalize_rows(record['embeddings'])
+                record_terms = record.get('keyword_terms') or [None] * len(record['ids'])
+                record_sentences = record.get('sentence_vectors') or [None] * len(record['ids'])
+                for k, chunk_id in enumerate(record['ids']):
+                    memtable[chunk_id] = (tuple(record['documents'][k]), vectors[k], record_terms[k],
+                                          record_sentences[k])
+                    next_id = max(next_id, chunk_id + 1)
+
+            number = self._next_number()
+            segments = list(manifest['segments'])
+            if memtable:
+                segment_name = f"seg-{number:06d}"
+                terms = [entry[2] for entry in memtable.values()]
+                sentences = [entry[3] for entry in memtable.values()]
+                write_segment(
+                    self.root / f"{segment_name}.tmp",
+                    list(memtable.keys()),
+                    [entry[0] for entry in memtable.values()],
+                    np.stack([entry[1] for entry in memtable.values()]),
+                    None if any(t is None for t in terms) else terms,
+                    dim=manifest.get('dim'),
+                    sentence_vectors=None if any(v is None for v in sentences) else sentences
+                )
+                os.replace(self.root / f"{segment_name}.tmp", self.root / segment_name)
+                segments.append({'name': segment_name, 'count': len(memtable)})
+
+            # 只保留仍留在段中的删除标记
+            deleted_ids = np.asarray(sorted(deleted), dtype=np.int64)
+            if len(deleted_ids):
+                segment_ids = self._open_segments({'segments': segments}).ids
+                deleted_ids = deleted_ids[np.isin(deleted_ids, segment_ids)]
+            deleted_name = None
+            if len(deleted_ids):
+                deleted_name = f"deleted-{number:06d}.npy"
+                _write_array(self.root / deleted_name, deleted_ids)
+
+            new_manifest = dict(manifest)
+            new_manifest.update({
+                'segments': segments,
+                'deleted': deleted_name,
+                'deleted_count': int(len(deleted_ids)),
+                'index': self._write_index(index, number),
+                'index_ids': 'chunk',
+                'wal': self._new_wal(number),
+                'next_id': int(next_id)
+            })
+            self._commit_manifest(new_manifest, number)
+            self._wal_end = 0
+            logger.info(f"日志已落盘为新段，当前段数量: {len(segments)}")
+
+    def needs_compaction(self) -> bool:
+        """段数量过多或已删除比例过高时需要合并"""
+        manifest = self.read_manifest()
+        if manifest is None:
+            return False
+        segments = manifest['segments']
+        total = sum(segment['count'] for segment in segments)
+        if len(segments) > self.max_segments:
+            return True
+        return total > 0 and manifest.get('deleted_count', 0) > total * self.max_deleted_ratio
+
+    def compact(self) -> bool:
+        """合并当前所有段并丢弃已删除和被更新覆盖的文本块
+
+        合并期间可以继续追加日志和落盘：合并只替换开始时的那些段，之后新落盘的段保持不变。
+
+        Returns:
+            bool: 是否完成合并
+        """
+        with self._lock:
+            manifest = self.read_manifest()
+            if manifest is None:
+                return False
+            segment_names = [segment['name'] for segment in manifest['segments']]
+            deleted_snapshot = self._load_deleted(manifest)
+            number = self._next_number()
+            segment_name = f"seg-{number:06d}"
+            tmp_dir = self.root / f"{segment_name}.tmp"
+            tmp_dir.mkdir()
+
+        try:
+            segments = self._open_segments(manifest)
+            rows, live_ids = segments.live_rows(deleted_snapshot)
+            write_segment(
+                tmp_dir, live_ids, (segments.row(int(row)) for row in rows),
+                segments.embeddings(rows), segments.keyword_terms(rows), dim=manifest.get('dim'),
+                sentence_vectors=segments.sentence_vectors(rows)
+            )
+        except Exception:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+
+        with self._lock:
+            current = self.read_manifest()
+            current_names = [segment['name'] for segment in current['segments']] if current else []
+            if current_names[:len(segment_names)] != segment_names:
+                logger.warning("合并期间存储被重新创建，放弃本次合并")
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+                return False
+            os.replace(tmp_dir, self.root / segment_name)
+            remaining = current['segments'][len(segment_names):]
+            # 合并期间可能已有新的清单，提交时重新取编号保证清单编号递增
+            number = self._next_number()
+
+            # 合并时已丢弃的 ID 不再需要删除标记；合并开始后才删除的 ID 仍在新段中，需要保留
+            current_deleted = self._load_deleted(current)
+            remaining_ids = self._open_segments({'segments': remaining}).ids
+            dropped = np.isin(current_deleted, deleted_snapshot) & ~np.isin(current_deleted, remaining_ids)
+            deleted_ids = current_deleted[~dropped]
+            deleted_name = None
+            if len(deleted_ids):
+                deleted_name = f"deleted-{number:06d}.npy"
+                _write_array(self.root / deleted_name, deleted_ids)
+
+            new_manifest = dict(current)
+            new_manifest.update({
+                'segments': [{'name': segment_name, 'count': len(live_ids)}] + remaining,
+                'deleted': deleted_name,
+                'deleted_count': int(len(deleted_ids))
+            })
+            self._commit_manifest(new_manifest, number)
+            logger.info(f"段合并完成: {len(segment_names)} 个段 -> 1 个段，保留 {len(live_ids)} 个文本块")
+            return True
+
+    def compact_in_background(self):
+        """需要时在后台线程中合并段，同一时间只运行一个合并任务"""
+        if self._compaction_thread is not None and self._compaction_thread.is_alive():
+            return
+        if not self.needs_compaction():
+            return
+
+        def run():
+            try:
+                self.compact()
+            except Exception as e:
+                logger.error(f"后台合并段失败: {str(e)}")
+
+        self._compaction_thread = threading.Thread(target=run, name='segment-compaction', daemon=True)
+        self._compaction_thread.start()
+
+
+def open_store(path) -> Optional[StoreSnapshot]:
+    """打开列式存储，不存在时返回 None"""
+    return SegmentStore(path).open()
+
+
+def write_store(path, documents: Iterable[Tuple[str, Dict[str, Any]]], embeddings: Optional[np.ndarray],
+                keyword_terms: Optional[List[Dict[str, int]]] = None,
+                index: Optional[faiss.Index] = None, ids=None) -> str:
+    """把全部内容写成一个新的存储版本（单个段、空日志）
+
+    Returns:
+        str: 新清单名称
+    """
+    return SegmentStore(path).create(documents, embeddings, keyword_terms=keyword_terms, ids=ids, index=index)
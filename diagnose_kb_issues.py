@@ -25,6 +25,7 @@ def check_knowledge_base_documents():
     
     try:
         from vector_store import FaissVectorStore
+        from columnar_store import store_exists, vector_store_exists
         
         # 初始化向量存储
         vector_store = FaissVectorStore()
@@ -35,10 +36,11 @@ def check_knowledge_base_documents():
         pkl_file = Path(f"{vector_store_path}.pkl")
         
         print(f"向量存储文件检查:")
-        print(f"  索引文件存在: {index_file.exists()}")
-        print(f"  数据文件存在: {pkl_file.exists()}")
+        print(f"  列式存储存在: {store_exists(vector_store_path)}")
+        print(f"  旧格式索引文件存在: {index_file.exists()}")
+        print(f"  旧格式数据文件存在: {pkl_file.exists()}")
         
-        if index_file.exists() and pkl_file.exists():
+        if vector_store_exists(vector_store_path):
             # 加载向量存储
             vector_store.load(vector_store_path)
             
@@ -177,12 +179,13 @@ def test_vector_store_direct_search():
     
     try:
         from vector_store import FaissVectorStore
+        from columnar_store import vector_store_exists
         
         # 初始化向量存储
         vector_store = FaissVectorStore()
         vector_store_path = "knowledge_base/vector_store"
         
-        if Path(f"{vector_store_path}.index").exists():
+        if vector_store_exists(vector_store_path):
             vector_store.load(vector_store_path)
             
             # 直接搜索
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+持久化向量缓存（按内容寻址）
+重新上传同一个文档、修改文本块后又改回去、从旧格式的存储迁移时，原来都要把模型见过的文本重新编码一遍。
+EmbeddingCache 把入库时模型输出的原始向量保存在磁盘上的 SQLite 数据库中：
+
+- 缓存键为 sha256(模型标识 + 规范化文本)，换模型（或换推理后端）后旧向量不会被命中；
+- 文本规范化只合并连续空白、去掉首尾空白（分词器本来就忽略空白，向量不变），不改大小写和全半角；
+- 每条记录保存最近一次使用的序号（每次查找或写入递增），总大小超过 max_mb 时按最近最少使用淘汰到上限的 90%；
+- 查找和写入都按批进行，一次上传只需要几次数据库事务。
+"""
+
+import hashlib
+import logging
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# 单条 SQL 语句中的参数个数上限（旧版本 SQLite 为 999）
+_SQL_BATCH = 500
+
+
+def normalize_text(text: str) -> str:
+    """合并连续空白并去掉首尾空白"""
+    return ' '.join((text or '').split())
+
+
+class EmbeddingCache:
+    """以 (模型标识, 规范化文本) 的哈希为键、按大小淘汰的持久化向量缓存（线程安全）"""
+
+    def __init__(self, path: str, max_mb: float = 1024, model_id: str = ''):
+        """
+        Args:
+            path: SQLite 数据库文件路径
+            max_mb: 缓存向量的总大小上限（MB）
+            model_id: 模型标识，换模型后旧的向量不会被命中
+        """
+        self.path = Path(path)
+        self.max_bytes = int(max(0.0, max_mb) * 1024 * 1024)
+        self.model_id = model_id
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS embeddings ("
+                           "key BLOB PRIMARY KEY, dim INTEGER NOT NULL, vector BLOB NOT NULL, "
+                           "last_used INTEGER NOT NULL)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+        self._conn.commit()
+        self._bytes, self._clock = self._conn.execute(
+            "SELECT COALESCE(SUM(LENGTH(vector)), 0), COALESCE(MAX(last_used), 0) FROM embeddings"
+        ).fetchone()
+
+    def key(self, text: str) -> bytes:
+        return hashlib.sha256(f"{self.model_id}\0{normalize_text(text)}".encode('utf-8')).digest()
+
+    def get_many(self, texts: List[str]) -> List[Optional[np.ndarray]]:
+        """批量查找缓存的向量，未命中的位置为 None"""
+        keys = [self.key(text) for text in texts]
+        found: Dict[bytes, np.ndarray] = {}
+        with self._lock:
+            self._clock += 1
+            now = self._clock
+            for start in range(0, len(keys), _SQL_BATCH):
+                batch = list(set(keys[start:start + _SQL_BATCH]))
+                marks = ','.join('?' * len(batch))
+                for key, dim, blob in self._conn.execute(
+                        f"SELECT key, dim, vector FROM embeddings WHERE key IN ({marks})", batch):
+                    found[key] = np.frombuffer(blob, dtype=np.float32, count=dim)
+                self._conn.execute(f"UPDATE embeddings SET last_used = ? WHERE key IN ({marks})", [now] + batch)
+            self._conn.commit()
+            vectors = [found.get(key) for key in keys]
+            hits = sum(vector is not None for vector in vectors)
+            self.hits += hits
+            self.misses += len(keys) - hits
+        return vectors
+
+    def put_many(self, texts: List[str], vectors: np.ndarray):
+        """写入向量（与 texts 一一对应），总大小超过上限时淘汰最久没有使用的记录"""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if self.max_bytes == 0 or not len(texts):
+            return
+        rows = {self.key(text): (vectors.shape[1], vector.tobytes()) for text, vector in zip(texts, vectors)}
+        with self._lock:
+            self._clock += 1
+            keys = list(rows)
+            for start in range(0, len(keys), _SQL_BATCH):
+                # 覆盖已有记录时先扣除旧记录的大小
+                batch = keys[start:start + _SQL_BATCH]
+                marks = ','.join('?' * len(batch))
+                self._bytes -= self._conn.execute(
+                    f"SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings WHERE key IN ({marks})", batch
+                ).fetchone()[0]
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, dim, vector, last_used) VALUES (?, ?, ?, ?)",
+                [(key, dim, blob, self._clock) for key, (dim, blob) in rows.items()]
+            )
+            self._bytes += sum(len(blob) for _, blob in rows.values())
+            if self._bytes > self.max_bytes:
+                self._evict(int(self.max_bytes * 0.9))
+            self._conn.commit()
+
+    def _evict(self, target: int):
+        """按最近最少使用删除记录，直到总大小不超过 target（调用方持有锁）"""
+        removed = []
+        freed = 0
+        for key, size in self._conn.execute("SELECT key, LENGTH(vector) FROM embeddings ORDER BY last_used"):
+            if self._bytes - freed <= target:
+                break
+            removed.append((key,))
+            freed += size
+        self._conn.executemany("DELETE FROM embeddings WHERE key = ?", removed)
+        self._bytes -= freed
+        self.evictions += len(removed)
+        logger.info(f"向量缓存超过 {self.max_bytes / 1024 / 1024:.0f}MB，淘汰了 {len(removed)} 条最久未使用的记录")
+
+    def encode(self, texts: List[str], encode: Callable[[List[str]], np.ndarray]) -> np.ndarray:
+        """命中的文本直接返回缓存的向量，其余文本调用 encode 批量编码并写入缓存"""
+        texts = list(texts)
+        cached = self.get_many(texts)
+        missing = [i for i, vector in enumerate(cached) if vector is None]
+        if not missing:
+            return np.stack(cached) if cached else np.asarray(encode([]), dtype=np.float32)
+        encoded = np.asarray(encode([texts[i] for i in missing]), dtype=np.float32)
+        self.put_many([texts[i] for i in missing], encoded)
+        if len(missing) == len(texts):
+            return encoded
+        vectors = np.empty((len(texts), encoded.shape[1]), dtype=np.float32)
+        vectors[missing] = encoded
+        for i, vector in enumerate(cached):
+            if vector is not None:
+                vectors[i] = vector
+        return vectors
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM embeddings")
+            self._conn.commit()
+            self._bytes = 0
+            self.hits = self.misses = self.evictions = 0
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def stats(self) -> Dict[str, Any]:
+        """命中统计和磁盘占用"""
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            total = self.hits + self.misses
+            return {
+                "entries": entries,
+                "size_mb": self._bytes / 1024 / 1024,
+                "max_mb": self.max_bytes / 1024 / 1024,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "evictions": self.evictions
+            }
@@ -0,0 +1,498 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+文档向量打分矩阵
+维护一份预先归一化的文档向量矩阵，通过一次矩阵-向量乘法完成全量打分，
+并使用 argpartition 选出 top-k，避免在 Python 循环中逐个文本块计算相似度。
+
+矩阵可以压缩保存在内存中（float16 每维 2 字节；int8 每维 1 字节，另加每行一个缩放系数），
+压缩模式下先用压缩向量粗排，再对前 k * rerank_factor 个候选用精确的 float32 向量重新打分。
+精确向量取自接管的 mmap 矩阵（磁盘上的 embeddings.npy，不常驻内存），
+之后新增或修改的行在下次落盘前只能使用解码后的近似向量。
+
+copy() 得到与原矩阵共享缓冲区的副本：副本追加的行写在原矩阵长度之后（原矩阵读不到），
+修改已有行之前才复制整个缓冲区，因此搜索可以一直读取原矩阵而不需要加锁。
+"""
+
+import copy
+
+import logging
+from typing import Iterable, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+STORAGE_FLOAT32 = 'float32'
+STORAGE_FLOAT16 = 'float16'
+STORAGE_INT8 = 'int8'
+STORAGE_MODES = (STORAGE_FLOAT32, STORAGE_FLOAT16, STORAGE_INT8)
+
+# 压缩模式下按块解码打分，每块的行数（避免一次性把整个矩阵转换为 float32）
+SCORE_BLOCK_ROWS = 65536
+
+
+def normalize_rows(vectors) -> np.ndarray:
+    """将向量（或向量矩阵）按行归一化为 float32
+
+    Args:
+        vectors: 一维向量或二维向量矩阵
+
+    Returns:
+        np.ndarray: 归一化后的二维 float32 矩阵，零向量保持不变
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if vectors.ndim == 1:
+        vectors = vectors.reshape(1, -1)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def select_top_k(scores: np.ndarray, positions: np.ndarray, k: int,
+                 min_score: float = 0.0) -> Tuple[np.ndarray, np.ndarray]:
+    """从已算好的相似度中选出最高的 k 个
+
+    Args:
+        scores: 相似度数组
+        positions: 与 scores 一一对应的行号
+        k: 返回数量
+        min_score: 最低相似度，低于该值的行直接丢弃
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: (行号, 相似度)，按相似度降序排列，相似度相同时按行号升序排列
+    """
+    if scores.size == 0 or k <= 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+    positions = np.asarray(positions, dtype=np.int64)
+    if k < scores.size:
+        # 只对不低于第 k 大分数的行排序；与第 k 个分数相同的行全部参与排序，按行号取舍
+        kth = np.partition(scores, scores.size - k)[scores.size - k]
+        top = np.flatnonzero(scores >= kth)
+    else:
+        top = np.arange(scores.size)
+    top = top[np.lexsort((positions[top], -scores[top]))][:k]
+
+    if min_score > 0:
+        top = top[scores[top] >= min_score]
+    return positions[top], scores[top]
+
+
+class StackedMatrix:
+    """首尾相接的多个只读 float32 矩阵块中部分行组成的矩阵（不复制向量）
+
+    块通常是各段 mmap 打开的 embeddings.npy 和日志中的少量新向量，rows 是结果中
+    每一行在拼接后的块中的行号（为 None 时取全部行）。按行号读取时只复制请求的行，
+    与矩阵相乘时逐块计算；只有 np.asarray() 才会复制出一个完整的连续矩阵。
+    """
+
+    dtype = np.dtype(np.float32)
+    ndim = 2
+
+    def __init__(self, blocks: List[np.ndarray], rows=None):
+        """
+        Args:
+            blocks: 二维 float32 矩阵块（维度相同）
+            rows: 结果行在拼接后的块中的行号，为 None 时取全部行
+        """
+        self.blocks = [block for block in blocks if len(block)]
+        self.starts = np.cumsum([0] + [len(block) for block in self.blocks]).astype(np.int64)
+        self.rows = None if rows is None else np.asarray(rows, dtype=np.int64)
+        size = int(self.starts[-1]) if self.rows is None else len(self.rows)
+        self.shape = (size, self.blocks[0].shape[1] if self.blocks else 0)
+
+    def __len__(self) -> int:
+        return self.shape[0]
+
+    @property
+    def nbytes(self) -> int:
+        return self.shape[0] * self.shape[1] * self.dtype.itemsize
+
+    def __getitem__(self, rows) -> np.ndarray:
+        """按行号数组、切片或单个行号读取，返回请求行的 float32 副本"""
+        if isinstance(rows, (int, np.integer)):
+            return self[np.array([rows])][0]
+        if isinstance(rows, slice):
+            rows = np.arange(len(self))[rows]
+        rows = np.asarray(rows, dtype=np.int64)
+        if self.rows is not None:
+            rows = self.rows[rows]
+        if len(self.blocks) == 1:
+            return np.asarray(self.blocks[0][rows], dtype=np.float32)
+        vectors = np.empty((len(rows), self.shape[1]), dtype=np.float32)
+        owners = np.searchsorted(self.starts, rows, side='right') - 1
+        for k in np.unique(owners):
+            picked = np.flatnonzero(owners == k)
+            vectors[picked] = self.blocks[k][rows[picked] - self.starts[k]]
+        return vectors
+
+    def __matmul__(self, other: np.ndarray) -> np.ndarray:
+        if self.rows is None:
+            parts = [block @ other for block in self.blocks]
+        else:
+            parts = [self[start:start + SCORE_BLOCK_ROWS] @ other
+                     for start in range(0, len(self), SCORE_BLOCK_ROWS)]
+        if not parts:
+            return np.empty((0,) + np.shape(other)[1:], dtype=np.float32)
+        return np.concatenate(parts)
+
+    def __array__(self, dtype=None, copy=None) -> np.ndarray:
+        if self.rows is None and self.blocks:
+            vectors = np.concatenate([np.asarray(block) for block in self.blocks])
+        else:
+            vectors = self[np.arange(len(self))]
+        return vectors if dtype is None else vectors.astype(dtype, copy=False)
+
+
+class EmbeddingMatrix:
+    """预归一化的文档向量矩阵
+
+    行号与 FaissVectorStore.chunks 中的位置一一对应。底层使用按倍数扩容的
+    预分配缓冲区，追加向量时不需要复制整个矩阵。float32 模式下可以直接接管只读的 mmap 矩阵，
+    第一次写入时才复制到可写缓冲区；压缩模式下接管时把向量编码到内存，mmap 只用于精确重排。
+    """
+
+    def __init__(self, dim: Optional[int] = None, initial_capacity: int = 1024,
+                 storage: str = STORAGE_FLOAT32, rerank_factor: int = 4):
+        """
+        初始化向量矩阵
+
+        Args:
+            dim: 向量维度，为 None 时在第一次写入时确定
+            initial_capacity: 初始预分配的行数
+            storage: 内存中的向量格式（float32 / float16 / int8）
+            rerank_factor: 压缩模式下粗排保留 k 的多少倍候选做精确重排
+        """
+        if storage not in STORAGE_MODES:
+            raise ValueError(f"不支持的向量存储格式: {storage}")
+        self.dim = dim
+        self.initial_capacity = max(1, initial_capacity)
+        self.storage = storage
+        self.rerank_factor = max(1, rerank_factor)
+        self._buffer = None
+        self._scales = None  # int8 模式下每行的缩放系数
+        self._source = None  # 压缩模式下接管的精确 float32 矩阵（mmap）
+        self._source_rows = None  # 每行在 _source 中的行号，-1 表示没有精确向量
+        self._size = 0
+        self._shared = False  # 缓冲区是否与其他副本共享（修改已有行前需要先复制）
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def compressed(self) -> bool:
+        return self.storage != STORAGE_FLOAT32
+
+    @property
+    def nbytes(self) -> int:
+        """打分时需要访问的向量数据字节数（float32 模式下包括接管的 mmap 矩阵，
+        不含压缩模式下只用于精确重排的 mmap 向量）"""
+        total = 0
+        for array in (self._buffer, self._scales, self._source_rows):
+            if array is not None:
+                total += (array if isinstance(array, StackedMatrix) else array[:self._size]).nbytes
+        return total
+
+    @property
+    def vectors(self) -> Optional[np.ndarray]:
+        """当前有效的向量矩阵视图（只读使用），为空时返回 None
+
+        压缩模式下返回全部行解码后的 float32 副本，大规模知识库应改用按行读取（matrix[rows]）；
+        float32 模式下接管的是 StackedMatrix 时直接返回它（同样支持按行读取和矩阵乘法）。
+        """
+        if self._buffer is None or self._size == 0:
+            return None
+        if self.compressed:
+            return self[np.arange(self._size)]
+        if isinstance(self._buffer, StackedMatrix):
+            return self._buffer
+        return self._buffer[:self._size]
+
+    def __getitem__(self, rows) -> np.ndarray:
+        """按行号数组（或切片）读取 float32 向量，压缩模式下有精确向量的行返回精确值"""
+        if isinstance(rows, slice):
+            rows = np.arange(self._size)[rows]
+        rows = np.asarray(rows, dtype=np.int64)
+        if not self.compressed:
+            return np.asarray(self._buffer[rows], dtype=np.float32)
+        vectors = self._decode(rows)
+        if self._source is not None:
+            source_rows = self._source_rows[rows]
+            exact = source_rows >= 0
+            if exact.any():
+                vectors[exact] = self._source[source_rows[exact]]
+        return vectors
+
+    def copy(self) -> 'EmbeddingMatrix':
+        """写时复制的副本（与原矩阵共享缓冲区，见模块说明）"""
+        clone = copy.copy(self)
+        clone._shared = True
+        return clone
+
+    def view(self, rows: np.ndarray) -> '_RowView':
+        """只包含指定行的只读视图（按需读取，可直接传给 AnnIndex.build）"""
+        return _RowView(self, np.asarray(rows, dtype=np.int64))
+
+    def _encode(self, vectors: np.ndarray) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+        """把归一化的 float32 向量编码为内存格式
+
+        Returns:
+            Tuple[np.ndarray, Optional[np.ndarray]]: (编码后的向量, int8 模式下每行的缩放系数)
+        """
+        if self.storage == STORAGE_FLOAT16:
+            return vectors.astype(np.float16), None
+        if self.storage == STORAGE_INT8:
+            scales = np.abs(vectors).max(axis=1) / 127.0
+            safe = np.where(scales > 0, scales, 1.0)
+            codes = np.rint(vectors / safe[:, None]).astype(np.int8)
+            return codes, scales.astype(np.float32)
+        return vectors, None
+
+    def _decode(self, rows) -> np.ndarray:
+        """解码指定行（行号数组或切片）的压缩向量为 float32"""
+        vectors = self._buffer[rows].astype(np.float32)
+        if self.storage == STORAGE_INT8:
+            vectors *= self._scales[rows][:, None]
+        return vectors
+
+    def _ensure_capacity(self, required: int, private: bool = False):
+        """确保缓冲区至少能容纳 required 行
+
+        Args:
+            required: 需要的行数
+            private: 是否需要独占缓冲区（修改已有行时为 True，与其他副本共享时先复制）
+        """
+        if (isinstance(self._buffer, np.ndarray) and self._buffer.shape[0] >= required
+                and self._buffer.flags.writeable and not (private and self._shared)):
+            return
+        capacity = self.initial_capacity if self._buffer is None else self._buffer.shape[0]
+        while capacity < required:
+            capacity *= 2
+        dtype = {STORAGE_FLOAT32: np.float32, STORAGE_FLOAT16: np.float16, STORAGE_INT8: np.int8}[self.storage]
+        new_buffer = np.empty((capacity, self.dim), dtype=dtype)
+        if self._buffer is not None and self._size > 0:
+            for block in self._blocks(None):
+                new_buffer[block] = self._buffer[block]
+        self._buffer = new_buffer
+        if self.storage == STORAGE_INT8:
+            self._scales = self._grow(self._scales, capacity, np.float32)
+        if self._source is not None:
+            self._source_rows = self._grow(self._source_rows, capacity, np.int64)
+        self._shared = False
+
+    def _grow(self, array: Optional[np.ndarray], capacity: int, dtype) -> np.ndarray:
+        grown = np.empty(capacity, dtype=dtype)
+        if array is not None and self._size > 0:
+            grown[:self._size] = array[:self._size]
+        return grown
+
+    def _write_rows(self, rows, vectors: np.ndarray):
+        """写入已归一化的向量（rows 为行号数组或切片），这些行不再有精确向量"""
+        codes, scales = self._encode(vectors)
+        self._buffer[rows] = codes
+        if scales is not None:
+            self._scales[rows] = scales
+        if self._source is not None:
+            self._source_rows[rows] = -1
+
+    def reset(self, embeddings=None):
+        """用给定的向量重建矩阵
+
+        Args:
+            embeddings: 新的向量矩阵，为 None 或空时清空矩阵
+        """
+        self._buffer = None
+        self._scales = None
+        self._source = None
+        self._source_rows = None
+        self._size = 0
+        self._shared = False
+        if embeddings is None or len(embeddings) == 0:
+            return
+        self.append(embeddings)
+
+    def attach(self, vectors: np.ndarray):
+        """接管已归一化的 float32 矩阵（例如以 mmap_mode='r' 打开的 .npy 文件或由多个段拼接的 StackedMatrix）
+
+        float32 模式下不复制数据；压缩模式下按块编码到内存，mmap 矩阵保留为精确重排的来源
+        （内存中的普通矩阵不保留，避免同时占用两份内存）。
+
+        Args:
+            vectors: 已按行归一化的二维 float32 矩阵
+        """
+        if vectors.dtype != np.float32 or vectors.ndim != 2:
+            raise ValueError(f"只能接管二维 float32 矩阵: {vectors.dtype}, ndim={vectors.ndim}")
+        if self.dim is not None and len(vectors) and vectors.shape[1] != self.dim:
+            raise ValueError(f"向量维度不匹配: 期望 {self.dim}, 实际 {vectors.shape[1]}")
+        self.reset()
+        if len(vectors) == 0:
+            return
+        self.dim = vectors.shape[1]
+        if not self.compressed:
+            self._buffer = vectors
+            self._size = len(vectors)
+            return
+
+        if isinstance(vectors, (np.memmap, StackedMatrix)):
+            self._source = vectors
+        self._ensure_capacity(len(vectors))
+        for start in range(0, len(vectors), SCORE_BLOCK_ROWS):
+            block = slice(start, min(len(vectors), start + SCORE_BLOCK_ROWS))
+            self._write_rows(block, np.asarray(vectors[block]))
+        self._size = len(vectors)
+        if self._source is not None:
+            self._source_rows[:self._size] = np.arange(self._size)
+
+    def append(self, embeddings) -> range:
+        """追加向量（会先做归一化）
+
+        Args:
+            embeddings: 待追加的向量矩阵
+
+        Returns:
+            range: 新向量所在的行号范围
+        """
+        vectors = normalize_rows(embeddings)
+        if self.dim is None:
+            self.dim = vectors.shape[1]
+        elif vectors.shape[1] != self.dim:
+            raise ValueError(f"向量维度不匹配: 期望 {self.dim}, 实际 {vectors.shape[1]}")
+
+        start = self._size
+        self._ensure_capacity(start + len(vectors))
+        self._write_rows(slice(start, start + len(vectors)), vectors)
+        self._size += len(vectors)
+        return range(start, self._size)
+
+    def set_row(self, row: int, vector):
+        """替换指定行的向量"""
+        self.set_rows([row], normalize_rows(vector))
+
+    def set_rows(self, rows, vectors):
+        """批量替换多行向量（会先做归一化）"""
+        rows = np.asarray(rows, dtype=np.int64)
+        if rows.size == 0:
+            return
+        if rows.min() < 0 or rows.max() >= self._size:
+            raise IndexError(f"向量行号超出范围: {rows.tolist()}")
+        self._ensure_capacity(self._size, private=True)
+        self._write_rows(rows, normalize_rows(vectors))
+
+    def delete_rows(self, rows: Iterable[int]):
+        """删除指定行，剩余行保持原有顺序"""
+        if self._size == 0:
+            return
+        keep = np.ones(self._size, dtype=bool)
+        keep[np.fromiter(rows, dtype=np.int64)] = False
+        self._buffer = self._buffer[np.flatnonzero(keep)]
+        if self._scales is not None:
+            self._scales = self._scales[:self._size][keep]
+        if self._source_rows is not None:
+            self._source_rows = self._source_rows[:self._size][keep]
+        self._size = int(np.count_nonzero(keep))
+        self._shared = False  # 布尔索引得到的是新数组
+        if self._size == 0:
+            self.reset()
+
+    def _blocks(self, rows: Optional[np.ndarray]):
+        """按块遍历全部行（切片）或指定行（行号数组）"""
+        if rows is None:
+            for start in range(0, self._size, SCORE_BLOCK_ROWS):
+                yield slice(start, min(self._size, start + SCORE_BLOCK_ROWS))
+        else:
+            for start in range(0, len(rows), SCORE_BLOCK_ROWS):
+                yield rows[start:start + SCORE_BLOCK_ROWS]
+
+    def _approximate_scores(self, query: np.ndarray, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        """用内存中的压缩向量粗略打分（query 已归一化）"""
+        parts = [self._decode(block) @ query for block in self._blocks(rows)]
+        return np.concatenate(parts) if parts else np.empty(0, dtype=np.float32)
+
+    def score(self, query_vector: np.ndarray, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        """计算查询向量与文档向量的余弦相似度（压缩模式下尽量使用精确向量）
+
+        Args:
+            query_vector: 查询向量（无需提前归一化）
+            rows: 只对这些行打分，为 None 时对全部行打分
+
+        Returns:
+            np.ndarray: 相似度数组，范围裁剪到 [0, 1]
+        """
+        if self._buffer is None or self._size == 0:
+            return np.empty(0, dtype=np.float32)
+        query = normalize_rows(query_vector)[0]
+        if self.compressed:
+            parts = [self[block] @ query for block in self._blocks(rows)]
+            scores = np.concatenate(parts) if parts else np.empty(0, dtype=np.float32)
+        else:
+            matrix = self.vectors
+            if rows is not None:
+                matrix = matrix[rows]
+            scores = matrix @ query
+        return np.clip(scores, 0.0, 1.0, out=scores)
+
+    def score_many(self, query_vectors: np.ndarray, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        """一次矩阵-矩阵乘法计算多个查询与文档向量的余弦相似度（压缩模式下尽量使用精确向量）
+
+        Args:
+            query_vectors: 查询向量矩阵（每行一个查询，无需提前归一化）
+            rows: 只对这些行打分，为 None 时对全部行打分
+
+        Returns:
+            np.ndarray: 形状为 (行数, 查询数) 的相似度矩阵，范围裁剪到 [0, 1]
+        """
+        queries = normalize_rows(query_vectors)
+        if self._buffer is None or self._size == 0:
+            return np.empty((0, len(queries)), dtype=np.float32)
+        if self.compressed:
+            parts = [self[block] @ queries.T for block in self._blocks(rows)]
+            scores = np.concatenate(parts) if parts else np.empty((0, len(queries)), dtype=np.float32)
+        else:
+            matrix = self.vectors
+            if rows is not None:
+                matrix = matrix[rows]
+            scores = matrix @ queries.T
+        return np.clip(scores, 0.0, 1.0, out=scores)
+
+    def top_k(self, query_vector: np.ndarray, k: int,
+              min_score: float = 0.0,
+              rows: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """选出相似度最高的 k 个文本块
+
+        压缩模式下先用压缩向量粗排，保留 k * rerank_factor 个候选后再精确打分。
+
+        Args:
+            query_vector: 查询向量
+            k: 返回数量
+            min_score: 最低相似度，低于该值的行直接丢弃
+            rows: 候选行号，为 None 时在全部行中选择
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: (行号, 相似度)，按相似度降序排列
+        """
+        if k > 0 and self.compressed and self._size > 0:
+            size = self._size if rows is None else len(rows)
+            pool = k * self.rerank_factor
+            if size > pool:
+                query = normalize_rows(query_vector)[0]
+                coarse = self._approximate_scores(query, None if rows is None else np.asarray(rows, dtype=np.int64))
+                top = np.argpartition(-coarse, pool - 1)[:pool]
+                rows = top if rows is None else np.asarray(rows, dtype=np.int64)[top]
+
+        scores = self.score(query_vector, rows)
+        positions = np.arange(scores.size) if rows is None else rows
+        return select_top_k(scores, positions, k, min_score)
+
+
+class _RowView:
+    """EmbeddingMatrix 中部分行的只读视图，按位置读取时映射回矩阵行号"""
+
+    def __init__(self, matrix: EmbeddingMatrix, rows: np.ndarray):
+        self.matrix = matrix
+        self.rows = rows
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def __getitem__(self, positions) -> np.ndarray:
+        return self.matrix[self.rows[positions]]
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+微批量编码服务
+网页搜索、微信查询和文档上传原来各自在调用线程上运行模型，查询每次只编码一条文本。
+EmbeddingService 把所有编码请求放入队列，由一个专用线程合并成批量调用模型：
+
+- 模型正在计算时到达的请求在下一批中一起编码，空闲时到达的单条查询立即编码，不增加延迟；
+- 已经有多个请求在排队（并发负载）时，最多再等待 max_wait_ms 凑满一批；
+- 查询请求优先于入库请求：每一批先放入排队的查询，剩余位置再放入库文本，
+  大批量入库按 max_batch_size 拆开，查询最多等待一批入库文本编码完成；
+- 同一批中重复的文本只编码一次。
+"""
+
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import Any, Callable, Deque, Dict, List, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_QUERY = 0
+PRIORITY_INGEST = 1
+
+
+class _Request:
+    """一次编码请求，可能分几批完成"""
+
+    __slots__ = ('texts', 'future', 'offset', 'parts')
+
+    def __init__(self, texts: List[str]):
+        self.texts = texts
+        self.future: Future = Future()
+        self.offset = 0    # 已经放入批次的文本数量
+        self.parts: List[np.ndarray] = []
+
+
+class EmbeddingService:
+    """按优先级合并编码请求的微批量服务（线程安全）"""
+
+    def __init__(self, encode: Callable[[List[str]], np.ndarray], max_batch_size: int = 32,
+                 max_wait_ms: float = 5.0):
+        """
+        Args:
+            encode: 批量编码函数，输入文本列表，返回向量矩阵（只在服务线程中调用）
+            max_batch_size: 每次模型调用最多编码的文本数量
+            max_wait_ms: 并发负载下为凑满一批最多等待的时间（毫秒），为 0 时不等待
+        """
+        self.encode_batch = encode
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000
+        self._queues: Tuple[Deque[_Request], Deque[_Request]] = (deque(), deque())  # 查询、入库
+        self._pending = 0           # 排队中尚未放入批次的文本数量
+        self._last_requests = 0     # 上一批合并的请求数量
+        self._closed = False
+        self._cond = threading.Condition()
+        self._stats = {"batches": 0, "texts": 0, "requests": 0, "encode_seconds": 0.0}
+        self._thread = threading.Thread(target=self._run, name='embedding-service', daemon=True)
+        self._thread.start()
+
+    def submit(self, texts: List[str], priority: int = PRIORITY_QUERY) -> Future:
+        """提交编码请求，返回结果为向量矩阵（行与 texts 一一对应）的 Future"""
+        request = _Request(list(texts))
+        if not request.texts:
+            request.future.set_result(np.asarray(self.encode_batch([]), dtype=np.float32))
+            return request.future
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("编码服务已关闭")
+            self._queues[PRIORITY_INGEST if priority == PRIORITY_INGEST else PRIORITY_QUERY].append(request)
+            self._pending += len(request.texts)
+            self._cond.notify()
+        return request.future
+
+    def encode(self, texts: List[str], priority: int = PRIORITY_QUERY) -> np.ndarray:
+        """编码并等待结果；在服务线程中调用时直接编码（避免自己等待自己）"""
+        if threading.current_thread() is self._thread:
+            return np.asarray(self.encode_batch(list(texts)), dtype=np.float32)
+        return self.submit(texts, priority).result()
+
+    def _take_batch(self) -> List[Tuple[_Request, int, int]]:
+        """取出下一批：先取查询，再用入库文本补满（调用方持有锁）"""
+        items = []
+        room = self.max_batch_size
+        for queue in self._queues:
+            while queue and room > 0:
+                request = queue[0]
+                take = min(room, len(request.texts) - request.offset)
+                items.append((request, request.offset, request.offset + take))
+                request.offset += take
+                room -= take
+                if request.offset == len(request.texts):
+                    queue.popleft()
+        self._pending -= self.max_batch_size - room
+        return items
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._closed:
+                    self._cond.wait()
+                if not self._pending:
+                    return
+                queued = len(self._queues[0]) + len(self._queues[1])
+                if self.max_wait > 0 and (queued > 1 or self._last_requests > 1):
+                    # 并发负载下等待更多请求凑满一批，空闲时单条查询不等待
+                    deadline = time.monotonic() + self.max_wait
+                    while self._pending < self.max_batch_size and not self._closed:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            break
+                        self._cond.wait(remaining)
+                items = self._take_batch()
+            self._encode_items(items)
+
+    def _encode_items(self, items: List[Tuple[_Request, int, int]]):
+        """编码一批文本并把结果分发给各个请求"""
+        texts = [text for request, start, stop in items for text in request.texts[start:stop]]
+        unique = list(dict.fromkeys(texts))
+        start_time = time.perf_counter()
+        try:
+            vectors = np.asarray(self.encode_batch(unique), dtype=np.float32)
+        except BaseException as e:
+            logger.error(f"批量编码失败: {str(e)}")
+            failed = {id(request): request for request, _, _ in items}
+            with self._cond:
+                for queue in self._queues:
+                    for request in [r for r in queue if id(r) in failed]:
+                        queue.remove(request)
+                        self._pending -= len(request.texts) - request.offset
+            for request in failed.values():
+                if not request.future.done():
+                    request.future.set_exception(e)
+            return
+        elapsed = time.perf_counter() - start_time
+        if len(unique) != len(texts):
+            positions = {text: i for i, text in enumerate(unique)}
+            vectors = vectors[[positions[text] for text in texts]]
+
+        offset = 0
+        for request, start, stop in items:
+            request.parts.append(vectors[offset:offset + stop - start])
+            offset += stop - start
+            if stop == len(request.texts) and not request.future.done():
+                parts = request.parts
+                request.parts = []
+                request.future.set_result(parts[0] if len(parts) == 1 else np.concatenate(parts))
+        with self._cond:
+            self._last_requests = len(items)
+            self._stats["batches"] += 1
+            self._stats["texts"] += len(texts)
+            self._stats["requests"] += sum(1 for request, _, stop in items if stop == len(request.texts))
+            self._stats["encode_seconds"] += elapsed
+
+    def close(self):
+        """处理完已排队的请求后停止服务线程"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join(timeout=30)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            batches = self._stats["batches"]
+            return {
+                "batches": batches,
+                "texts": self._stats["texts"],
+                "requests": self._stats["requests"],
+                "avg_batch_size": self._stats["texts"] / batches if batches else 0.0,
+                "avg_encode_ms": self._stats["encode_seconds"] / batches * 1000 if batches else 0.0,
+                "queued_texts": self._pending,
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait * 1000
+            }
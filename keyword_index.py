@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+倒排关键词索引
+文本块的分词结果在入库时计算一次并保存，同时维护 关键词 -> 文本块行号 的倒排表。
+查询时只需合并查询关键词的倒排表，就能得到包含这些关键词的文本块及其匹配数量，
+不再需要在每次查询时对每个文本块重新分词。
+倒排表同时维护 BM25 所需的文档频率和文档长度，增删文本块时增量更新，
+BM25 打分只遍历查询关键词的倒排表。
+copy() 得到写时复制的副本：倒排表中每个关键词的行号集合在副本第一次修改它时才复制。
+"""
+
+import heapq
+import logging
+import math
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import jieba
+
+logger = logging.getLogger(__name__)
+
+
+def tokenize(text: str) -> List[str]:
+    """搜索引擎模式分词，过滤单字词"""
+    return [w for w in jieba.lcut_for_search(text) if len(w) > 1]
+
+
+class KeywordIndex:
+    """关键词倒排索引，行号与 FaissVectorStore.chunks 的位置一致"""
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        """
+        初始化索引
+
+        Args:
+            k1: BM25 词频饱和参数
+            b: BM25 文档长度归一化参数
+        """
+        self.k1 = k1
+        self.b = b
+        self.row_terms: List[Dict[str, int]] = []  # 每个文本块的词频
+        self.postings: Dict[str, set] = {}         # 关键词 -> 包含该词的行号集合
+        self.row_lengths: List[int] = []           # 每个文本块的词数
+        self.total_length = 0                      # 所有文本块的词数之和
+        self.cleared_rows: set = set()             # 已删除（保留行号但不再参与检索）的行
+        self._owned_terms: Optional[set] = None    # 副本中已复制过行号集合的关键词，为 None 时全部可写
+
+    def __len__(self) -> int:
+        return len(self.row_terms)
+
+    @property
+    def document_count(self) -> int:
+        """参与 BM25 统计的文本块数量（不含已清除的行）"""
+        return len(self.row_terms) - len(self.cleared_rows)
+
+    @property
+    def avg_length(self) -> float:
+        return self.total_length / self.document_count if self.document_count else 0.0
+
+    def copy(self) -> 'KeywordIndex':
+        """写时复制的副本：修改副本不影响原索引，原索引可以继续被并发读取"""
+        clone = KeywordIndex(self.k1, self.b)
+        clone.row_terms = list(self.row_terms)  # 每行的词频字典只会被整体替换，不会原地修改
+        clone.postings = dict(self.postings)
+        clone.row_lengths = list(self.row_lengths)
+        clone.total_length = self.total_length
+        clone.cleared_rows = set(self.cleared_rows)
+        clone._owned_terms = set()
+        return clone
+
+    def _writable_rows(self, term: str) -> set:
+        """可以原地修改的行号集合（与原索引共享的集合先复制）"""
+        rows = self.postings.get(term)
+        if rows is None:
+            rows = self.postings[term] = set()
+        elif self._owned_terms is not None and term not in self._owned_terms:
+            rows = self.postings[term] = set(rows)
+        if self._owned_terms is not None:
+            self._owned_terms.add(term)
+        return rows
+
+    def _index_row(self, row: int, terms: Dict[str, int]):
+        for term in terms:
+            self._writable_rows(term).add(row)
+        length = sum(terms.values())
+        if row == len(self.row_lengths):
+            self.row_lengths.append(length)
+        else:
+            self.row_lengths[row] = length
+        self.total_length += length
+
+    def _unindex_row(self, row: int, terms: Dict[str, int]):
+        for term in terms:
+            if term not in self.postings:
+                continue
+            rows = self._writable_rows(term)
+            rows.discard(row)
+            if not rows:
+                del self.postings[term]
+        self.total_length -= self.row_lengths[row]
+
+    def _rebuild_postings(self):
+        self.postings = {}
+        self._owned_terms = None
+        self.row_lengths = []
+        self.total_length = 0
+        for row, terms in enumerate(self.row_terms):
+            self._index_row(row, terms)
+
+    def add_texts(self, texts: Iterable[str]):
+        """对新文本分词并追加到索引末尾"""
+        for text in texts:
+            terms = dict(Counter(tokenize(text)))
+            self.row_terms.append(terms)
+            self._index_row(len(self.row_terms) - 1, terms)
+
+    def update_row(self, row: int, text: str):
+        """重新索引指定行"""
+        self._unindex_row(row, self.row_terms[row])
+        terms = dict(Counter(tokenize(text)))
+        self.row_terms[row] = terms
+        self._index_row(row, terms)
+
+    def clear_rows(self, rows: Iterable[int]):
+        """从倒排表中移除指定行，行号保持不变（用于标记删除，之后由 delete_rows 统一压缩）"""
+        for row in rows:
+            if row in self.cleared_rows:
+                continue
+            self._unindex_row(row, self.row_terms[row])
+            self.row_terms[row] = {}
+            self.row_lengths[row] = 0
+            self.cleared_rows.add(row)
+
+    def delete_rows(self, rows: Iterable[int]):
+        """删除指定行，后续行号前移，倒排表使用已保存的分词结果重建（不重新分词）"""
+        removed = set(rows)
+        if not removed:
+            return
+        kept = [i for i in range(len(self.row_terms)) if i not in removed]
+        self.row_terms = [self.row_terms[i] for i in kept]
+        self.cleared_rows = {new for new, old in enumerate(kept) if old in self.cleared_rows}
+        self._rebuild_postings()
+
+    def reset(self, texts: Optional[Iterable[str]] = None, row_terms: Optional[List[Dict[str, int]]] = None):
+        """重建索引
+
+        Args:
+            texts: 原始文本，需要重新分词
+            row_terms: 已保存的分词结果，优先使用
+        """
+        self.row_terms = []
+        self.postings = {}
+        self._owned_terms = None
+        self.row_lengths = []
+        self.total_length = 0
+        self.cleared_rows = set()
+        if row_terms is not None:
+            self.row_terms = [dict(terms) for terms in row_terms]
+            self._rebuild_postings()
+        elif texts is not None:
+            self.add_texts(texts)
+
+    def match(self, query_terms: Iterable[str]) -> Dict[int, int]:
+        """合并查询关键词的倒排表
+
+        Returns:
+            Dict[int, int]: 行号 -> 命中的不同查询关键词数量
+        """
+        counts: Dict[int, int] = {}
+        for term in set(query_terms):
+            for row in self.postings.get(term, ()):
+                counts[row] = counts.get(row, 0) + 1
+        return counts
+
+    def idf(self, term: str) -> float:
+        """BM25 逆文档频率，文档频率直接取倒排表长度"""
+        df = len(self.postings.get(term, ()))
+        n = self.document_count
+        return math.log(1 + (n - df + 0.5) / (df + 0.5))
+
+    def normalized_idf(self, term: str) -> float:
+        """归一化到 [0, 1] 的逆文档频率（只出现在一个文本块中的词为 1）"""
+        n = self.document_count
+        max_idf = math.log(1 + (n - 0.5) / 1.5) if n else 0.0
+        if max_idf <= 0:
+            return 0.0
+        return min(1.0, self.idf(term) / max_idf)
+
+    def bm25_scores(self, query_terms: Iterable[str]) -> Dict[int, float]:
+        """计算包含查询关键词的文本块的 BM25 分数
+
+        Returns:
+            Dict[int, float]: 行号 -> BM25 分数，只包含至少命中一个关键词的行
+        """
+        scores: Dict[int, float] = {}
+        avg_length = self.avg_length or 1.0
+        for term in set(query_terms):
+            rows = self.postings.get(term)
+            if not rows:
+                continue
+            idf = self.idf(term)
+            for row in rows:
+                tf = self.row_terms[row][term]
+                norm = self.k1 * (1 - self.b + self.b * self.row_lengths[row] / avg_length)
+                scores[row] = scores.get(row, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+        return scores
+
+    def bm25_top_n(self, query_terms: Iterable[str], n: int,
+                   rows: Optional[Iterable[int]] = None) -> List[Tuple[int, float]]:
+        """BM25 排名前 n 的文本块
+
+        Args:
+            query_terms: 查询关键词
+            n: 返回数量
+            rows: 只在这些行中排名，为 None 时不限制
+
+        Returns:
+            List[Tuple[int, float]]: (行号, BM25 分数)，按分数降序排列
+        """
+        scores = self.bm25_scores(query_terms)
+        if rows is not None:
+            allowed = set(rows)
+            scores = {row: score for row, score in scores.items() if row in allowed}
+        return heapq.nlargest(n, scores.items(), key=lambda item: (item[1], -item[0]))
@@ -359,9 +359,9 @@ class KnowledgeBot:
             
             for threshold in thresholds:
                 print(f"\n尝试相似度阈值: {threshold}")
-                self.kb.vector_store.similarity_threshold = threshold
                 try:
-                    current_context = self.kb.query(question)
+                    # 阈值随本次查询传入，不修改共享的向量存储（其他线程的搜索不受影响）
+                    current_context = self.kb.query(question, min_score=threshold)
                     if current_context:
                         print(f"在阈值 {threshold} 下找到相关内容")
                         # 如果是第一次找到内容，或者当前内容更相关（基于长度），则更新
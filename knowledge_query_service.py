@@ -11,6 +11,8 @@ from datetime import datetime
 import traceback
 from config_loader import config
 from pathlib import Path
+from metadata_index import filter_key
+from query_cache import SearchResultCache
 
 logger = logging.getLogger(__name__)
 
@@ -66,15 +68,22 @@ class KnowledgeQueryService:
         """
         self.vector_store = vector_store
         self.search_config = search_config
+        # 搜索结果缓存，按向量存储的版本号（generation）失效
+        self.result_cache = SearchResultCache(
+            max_size=config.getint('vector_store', 'result_cache_size', fallback=1000)
+        )
         
     def set_vector_store(self, vector_store):
-        """设置向量存储实例"""
+        """设置向量存储实例（换成另一个实例时清空结果缓存，版本号不能跨实例比较）"""
+        if vector_store is not self.vector_store:
+            self.result_cache.clear()
         self.vector_store = vector_store
         
     def search_knowledge_base(self, query: str, top_k: int = None, 
                             min_score: float = None, 
                             include_metadata: bool = True,
-                            search_type: str = 'default') -> Dict[str, Any]:
+                            search_type: str = 'default',
+                            filters: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
         """
         搜索知识库
         
@@ -84,6 +93,7 @@ class KnowledgeQueryService:
             min_score: 最小分数阈值
             include_metadata: 是否包含元数据
             search_type: 搜索类型 ('wechat', 'web', 'default')
+            filters: 元数据过滤条件（source、filename、file_type、sheet、type -> 值或值列表）
             
         Returns:
             Dict[str, Any]: 搜索结果
@@ -97,51 +107,154 @@ class KnowledgeQueryService:
                 logger.warning("查询内容过短")
                 return self._create_error_response("查询内容过短")
             
-            # 根据搜索类型获取默认配置
-            if search_type == 'wechat':
-                default_top_k, default_min_score = self.search_config.get_wechat_config()
-            elif search_type == 'web':
-                default_top_k, default_min_score = self.search_config.get_web_config()
-            else:
-                default_top_k, default_min_score = self.search_config.get_default_config()
+            top_k, min_score = self._resolve_search_params(search_type, top_k, min_score)
+            try:
+                filters_key = filter_key(filters)
+            except ValueError as e:
+                logger.warning(f"过滤条件无效: {str(e)}")
+                return self._create_error_response(str(e))
             
-            # 使用参数或默认值
-            top_k = top_k or default_top_k
-            min_score = min_score or default_min_score
+            # 知识库版本号没有变化时直接返回缓存的结果（向量存储没有版本号时不缓存）
+            generation = getattr(self.vector_store, 'generation', None)
+            cache_key = SearchResultCache.make_key(query, top_k, min_score, search_type, include_metadata,
+                                                   filters_key)
+            cached = self._get_cached(cache_key, generation)
+            if cached is not None:
+                logger.info(f"命中搜索结果缓存: '{query}' (type={search_type}, generation={generation})")
+                return cached
             
-            logger.info(f"开始搜索知识库: '{query}' (top_k={top_k}, min_score={min_score}, type={search_type})")
+            logger.info(f"开始搜索知识库: '{query}' (top_k={top_k}, min_score={min_score}, type={search_type}"
+                        f"{f', filters={filters}' if filters_key else ''})")
             
-            # 执行搜索
-            results = self.vector_store.search(query, top_k=top_k)
+            # 执行搜索（过滤条件在向量存储中先于向量打分应用）
+            results = self.vector_store.search(query, top_k=top_k, **self._filter_kwargs(filters_key, filters))
+            response = self._build_response(results, min_score, include_metadata)
+            # 搜索期间知识库如果发生变化，这里记录的仍是旧版本号，结果不会被命中
+            self._put_cached(cache_key, generation, response)
+            return response
             
-            if not results:
-                logger.info("未找到相关结果")
-                return self._create_success_response([], "未找到相关内容")
+        except Exception as e:
+            logger.error(f"搜索知识库失败: {str(e)}")
+            logger.error(traceback.format_exc())
+            return self._create_error_response(f"搜索失败: {str(e)}")
+    
+    def search_many(self, queries: List[str], top_k: int = None, min_score: float = None,
+                    include_metadata: bool = True, search_type: str = 'default',
+                    filters: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """
+        批量搜索知识库：未命中结果缓存的查询交给向量存储的 search_many，
+        在一次模型调用中编码，并用一次矩阵乘法打分
+        
+        Args:
+            queries: 查询字符串列表
+            top_k: 返回结果数量
+            min_score: 最小分数阈值
+            include_metadata: 是否包含元数据
+            search_type: 搜索类型 ('wechat', 'web', 'default')
+            filters: 元数据过滤条件，对全部查询生效
             
-            # 过滤和格式化结果
-            formatted_results = []
-            for text, score, metadata in results:
-                if score >= min_score:
-                    result_item = {
-                        'content': text,
-                        'score': float(score),
-                        'source': metadata.get('source', '未知'),
-                        'filename': metadata.get('filename', '未知'),
-                        'created_at': metadata.get('created_at', '未知')
-                    }
-                    
-                    if include_metadata:
-                        result_item['metadata'] = metadata
-                        
-                    formatted_results.append(result_item)
+        Returns:
+            List[Dict[str, Any]]: 与 queries 一一对应的搜索结果
+        """
+        try:
+            if not self.vector_store:
+                logger.error("向量存储未初始化")
+                return [self._create_error_response("向量存储未初始化") for _ in queries]
+            
+            top_k, min_score = self._resolve_search_params(search_type, top_k, min_score)
+            try:
+                filters_key = filter_key(filters)
+            except ValueError as e:
+                logger.warning(f"过滤条件无效: {str(e)}")
+                return [self._create_error_response(str(e)) for _ in queries]
+            generation = getattr(self.vector_store, 'generation', None)
+            
+            responses: List[Optional[Dict[str, Any]]] = [None] * len(queries)
+            pending = []
+            for i, query in enumerate(queries):
+                if not query or len(query.strip()) < 2:
+                    responses[i] = self._create_error_response("查询内容过短")
+                    continue
+                cache_key = SearchResultCache.make_key(query, top_k, min_score, search_type, include_metadata,
+                                                       filters_key)
+                responses[i] = self._get_cached(cache_key, generation)
+                if responses[i] is None:
+                    pending.append((i, cache_key))
             
-            logger.info(f"找到 {len(formatted_results)} 个相关结果")
-            return self._create_success_response(formatted_results, "搜索成功")
+            logger.info(f"批量搜索知识库: {len(queries)} 个查询，{len(pending)} 个未命中缓存 "
+                        f"(top_k={top_k}, min_score={min_score}, type={search_type})")
+            if pending:
+                pending_queries = [queries[i] for i, _ in pending]
+                search_kwargs = self._filter_kwargs(filters_key, filters)
+                if hasattr(self.vector_store, 'search_many'):
+                    batch_results = self.vector_store.search_many(pending_queries, top_k=top_k, **search_kwargs)
+                else:
+                    batch_results = [self.vector_store.search(query, top_k=top_k, **search_kwargs)
+                                     for query in pending_queries]
+                for (i, cache_key), results in zip(pending, batch_results):
+                    responses[i] = self._build_response(results, min_score, include_metadata)
+                    self._put_cached(cache_key, generation, responses[i])
+            return responses
             
         except Exception as e:
-            logger.error(f"搜索知识库失败: {str(e)}")
+            logger.error(f"批量搜索知识库失败: {str(e)}")
             logger.error(traceback.format_exc())
-            return self._create_error_response(f"搜索失败: {str(e)}")
+            return [self._create_error_response(f"搜索失败: {str(e)}") for _ in queries]
+    
+    def _resolve_search_params(self, search_type: str, top_k: int = None,
+                               min_score: float = None) -> Tuple[int, float]:
+        """根据搜索类型补全默认的返回数量和最小分数"""
+        if search_type == 'wechat':
+            default_top_k, default_min_score = self.search_config.get_wechat_config()
+        elif search_type == 'web':
+            default_top_k, default_min_score = self.search_config.get_web_config()
+        else:
+            default_top_k, default_min_score = self.search_config.get_default_config()
+        return top_k or default_top_k, min_score or default_min_score
+    
+    @staticmethod
+    def _filter_kwargs(filters_key: tuple, filters: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        """有过滤条件时才传给向量存储（兼容不支持过滤的向量存储实现）"""
+        return {'filters': filters} if filters_key else {}
+    
+    def _get_cached(self, cache_key: tuple, generation: Optional[int]) -> Optional[Dict[str, Any]]:
+        """读取当前知识库版本的缓存结果，更新时间戳"""
+        if generation is None:
+            return None
+        cached = self.result_cache.get(cache_key, generation)
+        if cached is not None:
+            cached['timestamp'] = datetime.now().isoformat()
+        return cached
+    
+    def _put_cached(self, cache_key: tuple, generation: Optional[int], response: Dict[str, Any]):
+        if generation is not None and response.get('success'):
+            self.result_cache.put(cache_key, generation, response)
+    
+    def _build_response(self, results: List[Tuple[str, float, Dict]], min_score: float,
+                        include_metadata: bool) -> Dict[str, Any]:
+        """过滤低分结果并格式化为响应"""
+        if not results:
+            logger.info("未找到相关结果")
+            return self._create_success_response([], "未找到相关内容")
+        
+        formatted_results = []
+        for text, score, metadata in results:
+            if score >= min_score:
+                result_item = {
+                    'content': text,
+                    'score': float(score),
+                    'source': metadata.get('source', '未知'),
+                    'filename': metadata.get('filename', '未知'),
+                    'created_at': metadata.get('created_at', '未知')
+                }
+                
+                if include_metadata:
+                    result_item['metadata'] = metadata
+                    
+                formatted_results.append(result_item)
+        
+        logger.info(f"找到 {len(formatted_results)} 个相关结果")
+        return self._create_success_response(formatted_results, "搜索成功")
     
     def search_for_wechat(self, query: str, top_k: int = None, min_score: float = None, include_metadata: bool = True) -> Dict[str, Any]:
         """
@@ -158,7 +271,8 @@ class KnowledgeQueryService:
         """
         return self.search_knowledge_base(query, top_k, min_score, include_metadata, search_type='wechat')
     
-    def search_for_web(self, query: str, top_k: int = None, min_score: float = None, include_metadata: bool = True) -> Dict[str, Any]:
+    def search_for_web(self, query: str, top_k: int = None, min_score: float = None, include_metadata: bool = True,
+                       filters: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
         """
         Web界面专用搜索方法
         
@@ -167,11 +281,13 @@ class KnowledgeQueryService:
             top_k: 返回结果数量
             min_score: 最小分数阈值
             include_metadata: 是否包含元数据
+            filters: 元数据过滤条件
             
         Returns:
             Dict[str, Any]: 搜索结果
         """
-        return self.search_knowledge_base(query, top_k, min_score, include_metadata, search_type='web')
+        return self.search_knowledge_base(query, top_k, min_score, include_metadata, search_type='web',
+                                          filters=filters)
     
     def search_with_context(self, query: str, user_id: str = None, 
                           conversation_history: List[Dict] = None,
@@ -262,7 +378,8 @@ class KnowledgeQueryService:
             stats = self.vector_store.get_statistics()
             return {
                 'success': True,
-                'statistics': stats
+                'statistics': stats,
+                'result_cache': self.result_cache.stats()
             }
         except Exception as e:
             logger.error(f"获取搜索统计信息失败: {str(e)}")
@@ -310,20 +427,22 @@ class KnowledgeQueryService:
 # 全局实例
 knowledge_query_service = KnowledgeQueryService()
 
-def get_knowledge_query_service() -> KnowledgeQueryService:
-    """获取知识库查询服务实例"""
+def get_knowledge_query_service(initialize: bool = True) -> KnowledgeQueryService:
+    """获取知识库查询服务实例
+
+    Args:
+        initialize: 全局实例没有向量存储时是否立即创建并加载（调用方自己设置向量存储时传 False）
+    """
     # 如果全局实例没有向量存储，尝试初始化
-    if not knowledge_query_service.vector_store:
+    if initialize and not knowledge_query_service.vector_store:
         try:
             from vector_store import FaissVectorStore
+            from columnar_store import vector_store_exists
             vector_store = FaissVectorStore()
             vector_store_path = "knowledge_base/vector_store"
             
-            # 检查向量存储文件是否存在
-            index_file = Path(f"{vector_store_path}.index")
-            pkl_file = Path(f"{vector_store_path}.pkl")
-            
-            if index_file.exists() and pkl_file.exists():
+            # 检查向量存储文件是否存在（列式存储或旧的 .index + .pkl）
+            if vector_store_exists(vector_store_path):
                 vector_store.load(vector_store_path)
                 knowledge_query_service.set_vector_store(vector_store)
                 logger.info("全局知识库查询服务向量存储已初始化")
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+元数据过滤索引
+文件处理器给每个文本块写入 source、filename、file_type、sheet、type 等元数据。
+入库时为这些字段维护 字段 -> 值 -> 文本块 ID 集合 的索引，搜索时先由过滤条件得到允许的文本块，
+再与关键词筛选结果取交集，向量打分只在过滤后的文本块中进行。
+
+索引按文本块 ID（而不是行号）记录，压缩删除标记后不需要更新。
+copy() 得到写时复制的副本：某个值的 ID 集合在副本第一次修改它时才复制。
+"""
+
+from typing import Any, Dict, FrozenSet, Iterable, List, Optional, Set, Tuple
+
+FILTER_FIELDS = ('source', 'filename', 'file_type', 'sheet', 'type')
+
+
+def _normalize_value(field: str, value: Any) -> str:
+    value = str(value).strip()
+    if field == 'file_type':
+        # 扩展名统一为小写并带点，"XLSX" 和 ".xlsx" 等价
+        value = value.lower()
+        if value and not value.startswith('.'):
+            value = '.' + value
+    return value
+
+
+def normalize_filters(filters: Optional[Dict[str, Any]]) -> Optional[Dict[str, FrozenSet[str]]]:
+    """检查并规范化过滤条件
+
+    Args:
+        filters: 字段 -> 值或值列表，同一字段的多个值任一匹配即可，不同字段需要同时满足
+
+    Returns:
+        Optional[Dict[str, FrozenSet[str]]]: 规范化后的过滤条件，没有条件时返回 None
+
+    Raises:
+        ValueError: 不支持的字段或空的值列表
+    """
+    if not filters:
+        return None
+    if not isinstance(filters, dict):
+        raise ValueError("过滤条件必须是 字段 -> 值 的字典")
+    normalized = {}
+    for field, values in filters.items():
+        if field not in FILTER_FIELDS:
+            raise ValueError(f"不支持的过滤字段: {field}，可用字段: {', '.join(FILTER_FIELDS)}")
+        if isinstance(values, (list, tuple, set, frozenset)):
+            values = frozenset(_normalize_value(field, value) for value in values)
+        else:
+            values = frozenset([_normalize_value(field, values)])
+        if not values:
+            raise ValueError(f"过滤字段 {field} 没有指定值")
+        normalized[field] = values
+    return normalized
+
+
+def filter_key(filters: Optional[Dict[str, Any]]) -> Tuple:
+    """过滤条件的可哈希表示（用作搜索结果缓存键的一部分）"""
+    normalized = normalize_filters(filters)
+    if normalized is None:
+        return ()
+    return tuple(sorted((field, tuple(sorted(values))) for field, values in normalized.items()))
+
+
+class MetadataIndex:
+    """字段 -> 值 -> 文本块 ID 集合"""
+
+    def __init__(self, fields: Iterable[str] = FILTER_FIELDS):
+        self.fields = tuple(fields)
+        self.postings: Dict[str, Dict[str, Set[int]]] = {field: {} for field in self.fields}
+        self._owned: Optional[Set[Tuple[str, str]]] = None  # 副本中已复制过的 (字段, 值)，为 None 时全部可写
+
+    def copy(self) -> 'MetadataIndex':
+        """写时复制的副本：修改副本不影响原索引，原索引可以继续被并发读取"""
+        clone = MetadataIndex(self.fields)
+        clone.postings = {field: dict(values) for field, values in self.postings.items()}
+        clone._owned = set()
+        return clone
+
+    def _writable_ids(self, field: str, value: str) -> Set[int]:
+        ids = self.postings[field].get(value)
+        if ids is None:
+            ids = self.postings[field][value] = set()
+        elif self._owned is not None and (field, value) not in self._owned:
+            ids = self.postings[field][value] = set(ids)
+        if self._owned is not None:
+            self._owned.add((field, value))
+        return ids
+
+    def _values(self, metadata: Dict[str, Any]):
+        for field in self.fields:
+            value = metadata.get(field)
+            if value is not None:
+                yield field, _normalize_value(field, value)
+
+    def add(self, chunk_id: int, metadata: Dict[str, Any]):
+        for field, value in self._values(metadata):
+            self._writable_ids(field, value).add(chunk_id)
+
+    def remove(self, chunk_id: int, metadata: Dict[str, Any]):
+        for field, value in self._values(metadata):
+            if value not in self.postings[field]:
+                continue
+            ids = self._writable_ids(field, value)
+            ids.discard(chunk_id)
+            if not ids:
+                del self.postings[field][value]
+
+    def reset(self, entries: Iterable[Tuple[int, Dict[str, Any]]] = ()):
+        """按 (文本块 ID, 元数据) 重建索引"""
+        self.postings = {field: {} for field in self.fields}
+        self._owned = None
+        for chunk_id, metadata in entries:
+            self.add(chunk_id, metadata)
+
+    def match(self, filters: Dict[str, FrozenSet[str]]) -> Set[int]:
+        """满足规范化过滤条件（见 normalize_filters）的文本块 ID"""
+        result: Optional[Set[int]] = None
+        # 从最小的集合开始取交集
+        groups = []
+        for field, values in filters.items():
+            postings = self.postings.get(field, {})
+            ids = [postings[value] for value in values if value in postings]
+            groups.append(ids[0] if len(ids) == 1 else set().union(*ids))
+        for ids in sorted(groups, key=len):
+            result = set(ids) if result is None else result & ids
+            if not result:
+                return set()
+        return result if result is not None else set()
+
+    def values(self, field: str) -> List[Tuple[str, int]]:
+        """某个字段的全部取值及其文本块数量（用于展示可选的过滤条件）"""
+        return sorted((value, len(ids)) for value, ids in self.postings.get(field, {}).items())
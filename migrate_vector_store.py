@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+向量存储迁移脚本：把旧的 vector_store.index + vector_store.pkl 转换为列式存储（vector_store.store/）
+不需要加载嵌入模型，向量直接取自 pickle 中保存的 document_embeddings。
+
+用法:
+    python migrate_vector_store.py
+    python migrate_vector_store.py --path knowledge_base/vector_store --keep-legacy
+"""
+
+import argparse
+import pickle
+from collections import Counter
+
+import faiss
+import numpy as np
+
+import columnar_store
+from ann_index import AnnIndex
+from keyword_index import tokenize
+
+
+def migrate_vector_store(path: str = "knowledge_base/vector_store", keep_legacy: bool = False,
+                         force: bool = False) -> bool:
+    """迁移旧格式向量存储
+
+    Args:
+        path: 向量存储路径（不含扩展名）
+        keep_legacy: 是否保留旧文件，默认重命名为 .bak
+        force: 已存在列式存储时是否覆盖
+
+    Returns:
+        bool: 是否迁移成功
+    """
+    index_path, pkl_path = columnar_store.legacy_paths(path)
+
+    if columnar_store.store_exists(path) and not force:
+        print(f"列式存储已存在: {columnar_store.store_dir(path)}，跳过迁移（使用 --force 覆盖）")
+        return True
+    if not pkl_path.exists():
+        print(f"数据文件不存在，跳过迁移: {pkl_path}")
+        return False
+
+    try:
+        with open(pkl_path, 'rb') as f:
+            data = pickle.load(f)
+
+        if 'documents' not in data or 'document_embeddings' not in data:
+            # 更早的 texts/metadata 格式没有保存向量，需要由 FaissVectorStore.load 重新编码
+            print("数据文件中没有保存向量，请先用应用加载一次再保存，或直接运行应用自动转换")
+            return False
+
+        documents = data['documents']
+        embeddings = data['document_embeddings']
+        keyword_terms = data.get('keyword_terms')
+        if keyword_terms is None or len(keyword_terms) != len(documents):
+            print("数据中没有分词结果，重新分词...")
+            keyword_terms = [dict(Counter(tokenize(text))) for text, _ in documents]
+
+        # 只有 AnnIndex 能直接接管的索引才迁移，旧的 IndexFlatL2 等在加载时重建
+        index = None
+        if index_path.exists():
+            loaded = faiss.read_index(str(index_path))
+            dim = np.asarray(embeddings).shape[-1]
+            if loaded.ntotal == len(documents) and AnnIndex(dim).adopt(loaded):
+                index = loaded
+            else:
+                print("旧索引格式不兼容，加载时将重新构建 FAISS 索引")
+
+        manifest = columnar_store.write_store(path, documents, embeddings,
+                                              keyword_terms=keyword_terms, index=index)
+        print(f"已迁移 {len(documents)} 个文本块到: {columnar_store.store_dir(path) / manifest}")
+
+        if not keep_legacy:
+            for legacy in (index_path, pkl_path):
+                if legacy.exists():
+                    backup = legacy.with_name(legacy.name + '.bak')
+                    legacy.replace(backup)
+                    print(f"旧文件已重命名为: {backup}")
+        return True
+
+    except Exception as e:
+        print(f"迁移失败: {str(e)}")
+        return False
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="把旧的 pickle 向量存储迁移为列式存储")
+    parser.add_argument('--path', default="knowledge_base/vector_store", help="向量存储路径（不含扩展名）")
+    parser.add_argument('--keep-legacy', action='store_true', help="保留旧的 .index 和 .pkl 文件")
+    parser.add_argument('--force', action='store_true', help="覆盖已存在的列式存储")
+    args = parser.parse_args()
+    migrate_vector_store(args.path, keep_legacy=args.keep_legacy, force=args.force)
@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+ONNX Runtime 向量模型后端
+在只有 CPU 的机器上用 ONNX Runtime 代替 PyTorch 运行 text2vec-base-chinese：
+
+- 第一次使用时把 SentenceTransformer（Transformer + 池化 + 归一化）整体导出为一个 ONNX 模型，
+  输出直接是句向量；可选再做动态 int8 量化（权重 int8，激活在运行时量化）；
+- 导出结果缓存在模型目录下的 onnx/ 中，export.json 记录源模型文件的指纹，
+  模型文件变化后自动重新导出；
+- 导出时用一组固定文本对比 ONNX 与 PyTorch 的句向量，最小余弦相似度记录在 export.json 中，
+  低于阈值时不使用 ONNX 后端（调用方退回 PyTorch）。
+
+OnnxSentenceEncoder 实现了向量存储用到的 SentenceTransformer 接口（encode /
+get_sentence_embedding_dimension / to），运行时只需要 onnxruntime 和分词器，不加载 PyTorch 模型。
+"""
+
+import hashlib
+import inspect
+import json
+import logging
+import os
+import traceback
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Union
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+BACKEND_TORCH = 'torch'
+BACKEND_ONNX = 'onnx'
+BACKEND_ONNX_INT8 = 'onnx_int8'
+BACKENDS = (BACKEND_TORCH, BACKEND_ONNX, BACKEND_ONNX_INT8)
+
+EXPORT_DIR = 'onnx'
+EXPORT_MANIFEST = 'export.json'
+EXPORT_VERSION = 1
+MODEL_FILES = {BACKEND_ONNX: 'model.onnx', BACKEND_ONNX_INT8: 'model.int8.onnx'}
+INPUT_NAMES = ('input_ids', 'attention_mask', 'token_type_ids')
+
+# 一致性检查用的文本，覆盖短查询、长段落和中英混排
+PARITY_TEXTS = [
+    "你好",
+    "如何申请退款？",
+    "公司的年假制度是怎样规定的",
+    "iPhone 15 Pro 的价格是多少",
+    "请问周末是否提供送货上门服务，运费怎么计算？",
+    "第一章 总则 第一条 为规范公司员工的日常行为，提高工作效率，根据国家有关法律法规，结合公司实际情况，制定本制度。",
+    "知识库支持上传 Word、Excel、PDF 和 TXT 文档，上传后自动分块并建立向量索引，微信群中的提问会先在知识库中检索相关内容。",
+    "The quick brown fox jumps over the lazy dog 与中文混合的句子",
+]
+
+
+def model_fingerprint(model_dir: Union[str, Path]) -> str:
+    """源模型文件（不含导出目录）的路径、大小和修改时间的摘要"""
+    model_dir = Path(model_dir)
+    digest = hashlib.sha1()
+    for path in sorted(model_dir.rglob('*')):
+        relative = path.relative_to(model_dir)
+        if relative.parts[0] == EXPORT_DIR or not path.is_file():
+            continue
+        stat = path.stat()
+        digest.update(f"{relative.as_posix()}:{stat.st_size}:{stat.st_mtime_ns}\n".encode('utf-8'))
+    return digest.hexdigest()
+
+
+def parity(expected: np.ndarray, actual: np.ndarray) -> Dict[str, float]:
+    """两组句向量逐行的余弦相似度统计"""
+    expected = np.asarray(expected, dtype=np.float32)
+    actual = np.asarray(actual, dtype=np.float32)
+    norms = np.linalg.norm(expected, axis=1) * np.linalg.norm(actual, axis=1)
+    cosine = np.sum(expected * actual, axis=1) / np.maximum(norms, 1e-12)
+    return {
+        "min_cosine": float(cosine.min()),
+        "mean_cosine": float(cosine.mean()),
+        "max_abs_diff": float(np.abs(expected - actual).max())
+    }
+
+
+class OnnxSentenceEncoder:
+    """用 ONNX Runtime 运行导出的句向量模型，接口与 SentenceTransformer 相同"""
+
+    def __init__(self, model_path: Union[str, Path], tokenizer_dir: Union[str, Path], dim: int,
+                 max_length: int = 512, threads: int = 0):
+        """
+        Args:
+            model_path: 导出的 ONNX 模型文件
+            tokenizer_dir: 分词器目录
+            dim: 句向量维度
+            max_length: 最大 token 数，超出部分截断（与 SentenceTransformer 的 max_seq_length 相同）
+            threads: ONNX Runtime 算子内线程数，为 0 时由 ONNX Runtime 决定
+        """
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads > 0:
+            options.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(str(model_path), options, providers=['CPUExecutionProvider'])
+        self.input_names = [node.name for node in self.session.get_inputs()]
+        self.tokenizer = AutoTokenizer.from_pretrained(str(tokenizer_dir))
+        self.model_path = Path(model_path)
+        self.dim = dim
+        self.max_seq_length = max_length
+
+    def _run(self, texts: List[str]) -> np.ndarray:
+        encoded = self.tokenizer(texts, padding=True, truncation=True, max_length=self.max_seq_length,
+                                 return_tensors='np')
+        feed = {name: np.asarray(encoded[name], dtype=np.int64) for name in self.input_names}
+        return self.session.run(None, feed)[0]
+
+    def encode(self, sentences: Union[str, List[str]], batch_size: int = 32, convert_to_tensor: bool = False,
+               **kwargs) -> Any:
+        """编码文本，参数含义同 SentenceTransformer.encode（其余参数忽略）"""
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        vectors = np.empty((len(texts), self.dim), dtype=np.float32)
+        # 按长度排序后分批，减少同一批内的填充
+        order = np.argsort([-len(text) for text in texts], kind='stable')
+        for start in range(0, len(texts), max(1, batch_size)):
+            positions = order[start:start + max(1, batch_size)]
+            vectors[positions] = self._run([texts[i] for i in positions])
+        if single:
+            vectors = vectors[0]
+        if convert_to_tensor:
+            import torch
+            return torch.from_numpy(vectors)
+        return vectors
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.dim
+
+    def to(self, device):
+        """ONNX 后端只在 CPU 上运行"""
+        return self
+
+
+def _read_manifest(path: Path) -> Dict[str, Any]:
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_manifest(path: Path, manifest: Dict[str, Any]):
+    tmp_path = path.with_name(path.name + '.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def _export_onnx(model, export_dir: Path) -> Path:
+    """把 SentenceTransformer 整体导出为 ONNX（输入为分词结果，输出为句向量）"""
+    import torch
+
+    class SentenceEmbedding(torch.nn.Module):
+        def __init__(self, inner, names):
+            super().__init__()
+            self.inner = inner
+            self.names = names
+
+        def forward(self, *inputs):
+            return self.inner(dict(zip(self.names, inputs)))['sentence_embedding']
+
+    sample = model.tokenizer(["示例文本", "用于导出的较长一些的示例文本"], padding=True, return_tensors='pt')
+    names = [name for name in INPUT_NAMES if name in sample]
+    wrapper = SentenceEmbedding(model, names).eval()
+    path = export_dir / MODEL_FILES[BACKEND_ONNX]
+    tmp_path = path.with_name(path.name + '.tmp')
+    dynamic_axes = {name: {0: 'batch', 1: 'sequence'} for name in names}
+    dynamic_axes['sentence_embedding'] = {0: 'batch'}
+    options = {}
+    if 'dynamo' in inspect.signature(torch.onnx.export).parameters:
+        options['dynamo'] = False  # 使用 TorchScript 导出器，动态维度按 dynamic_axes 指定
+    with torch.no_grad():
+        torch.onnx.export(wrapper, tuple(sample[name] for name in names), str(tmp_path),
+                          input_names=names, output_names=['sentence_embedding'],
+                          dynamic_axes=dynamic_axes, opset_version=14, do_constant_folding=True, **options)
+    os.replace(tmp_path, path)
+    return path
+
+
+def _quantize(source: Path, export_dir: Path) -> Path:
+    """动态 int8 量化：权重离线量化为 int8，激活在推理时按批量化"""
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    path = export_dir / MODEL_FILES[BACKEND_ONNX_INT8]
+    tmp_path = path.with_name(path.name + '.tmp')
+    quantize_dynamic(str(source), str(tmp_path), weight_type=QuantType.QInt8)
+    os.replace(tmp_path, path)
+    return path
+
+
+def export_model(model_dir: Union[str, Path], backend: str) -> Dict[str, Any]:
+    """导出（并按需量化）模型，返回更新后的导出记录
+
+    已导出且源模型文件没有变化的格式直接复用；每个导出的格式都与 PyTorch 句向量做一次一致性检查。
+    """
+    from sentence_transformers import SentenceTransformer
+
+    model_dir = Path(model_dir)
+    export_dir = model_dir / EXPORT_DIR
+    export_dir.mkdir(parents=True, exist_ok=True)
+    manifest_path = export_dir / EXPORT_MANIFEST
+    fingerprint = model_fingerprint(model_dir)
+    manifest = _read_manifest(manifest_path)
+    if manifest.get('fingerprint') != fingerprint or manifest.get('version') != EXPORT_VERSION:
+        manifest = {"version": EXPORT_VERSION, "fingerprint": fingerprint, "models": {}}
+
+    logger.info(f"正在导出 ONNX 模型（{backend}）: {model_dir}")
+    model = SentenceTransformer(str(model_dir), device='cpu')
+    model.eval()
+    model.tokenizer.save_pretrained(str(export_dir))
+    manifest['dim'] = model.get_sentence_embedding_dimension()
+    manifest['max_length'] = model.max_seq_length
+    expected = model.encode(PARITY_TEXTS, convert_to_numpy=True, show_progress_bar=False)
+
+    required = [BACKEND_ONNX] if backend == BACKEND_ONNX else [BACKEND_ONNX, BACKEND_ONNX_INT8]
+    for name in required:
+        path = export_dir / MODEL_FILES[name]
+        if name in manifest['models'] and path.exists():
+            continue
+        if name == BACKEND_ONNX:
+            _export_onnx(model, export_dir)
+        else:
+            _quantize(export_dir / MODEL_FILES[BACKEND_ONNX], export_dir)
+        encoder = OnnxSentenceEncoder(path, export_dir, manifest['dim'], manifest['max_length'])
+        result = parity(expected, encoder.encode(PARITY_TEXTS))
+        result['size_mb'] = round(path.stat().st_size / 1024 / 1024, 1)
+        manifest['models'][name] = result
+        logger.info(f"ONNX 模型导出完成: {path.name}，与 PyTorch 的最小余弦相似度 {result['min_cosine']:.5f}")
+        _write_manifest(manifest_path, manifest)
+    return manifest
+
+
+def load_onnx_encoder(model_dir: Union[str, Path], backend: str = BACKEND_ONNX, threads: int = 0,
+                      min_cosine: float = 0.99) -> Optional[OnnxSentenceEncoder]:
+    """加载 ONNX 后端，必要时先导出
+
+    Args:
+        model_dir: SentenceTransformer 模型目录
+        backend: BACKEND_ONNX（float32）或 BACKEND_ONNX_INT8（动态 int8 量化）
+        threads: ONNX Runtime 算子内线程数，为 0 时由 ONNX Runtime 决定
+        min_cosine: 一致性检查要求的最小余弦相似度
+
+    Returns:
+        OnnxSentenceEncoder；缺少 onnxruntime、导出失败或一致性检查不通过时返回 None
+    """
+    try:
+        import onnxruntime  # noqa: F401
+    except ImportError:
+        logger.warning("未安装 onnxruntime，使用 PyTorch 后端")
+        return None
+
+    try:
+        model_dir = Path(model_dir)
+        export_dir = model_dir / EXPORT_DIR
+        path = export_dir / MODEL_FILES[backend]
+        manifest = _read_manifest(export_dir / EXPORT_MANIFEST)
+        if (manifest.get('version') != EXPORT_VERSION or backend not in manifest.get('models', {})
+                or not path.exists() or manifest.get('fingerprint') != model_fingerprint(model_dir)):
+            manifest = export_model(model_dir, backend)
+
+        result = manifest['models'][backend]
+        if result['min_cosine'] < min_cosine:
+            logger.error(f"ONNX 模型 {path.name} 与 PyTorch 句向量不一致（最小余弦相似度 "
+                         f"{result['min_cosine']:.5f} < {min_cosine}），使用 PyTorch 后端")
+            return None
+        encoder = OnnxSentenceEncoder(path, export_dir, manifest['dim'], manifest['max_length'], threads)
+        logger.info(f"使用 ONNX Runtime 后端: {path.name}（最小余弦相似度 {result['min_cosine']:.5f}）")
+        return encoder
+    except Exception as e:
+        logger.error(f"加载 ONNX 模型失败，使用 PyTorch 后端: {str(e)}")
+        logger.error(traceback.format_exc())
+        return None
@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+多进程分片打分（scatter-gather）
+向量矩阵按行均分给 N 个工作进程。矩阵导出为一个 float32 的 .npy 文件（优先放在 /dev/shm），
+各工作进程以 mmap 只读打开其中属于自己的行范围，多个进程共享同一份物理内存，不复制向量。
+
+工作进程以独立的 Python 进程运行本文件（不经过 multiprocessing 的 spawn，不会重新导入主程序、加载模型），
+通过标准输入输出传递 pickle 消息；每个进程的 BLAS 限制为单线程，并行度由进程数决定。
+
+查询时把查询向量发给全部工作进程（scatter），每个进程在自己的行范围内打分并返回本地 top-k，
+协调方合并各进程的结果再选出全局 top-k（gather），结果与单进程的精确打分相同。
+
+工作进程绑定某一个已发布快照的向量矩阵。知识库修改后第一次搜索时在后台线程导出新矩阵，
+导出完成前搜索在请求线程内打分，不等待导出。
+"""
+
+import logging
+import os
+import pickle
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import traceback
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from embedding_matrix import SCORE_BLOCK_ROWS, normalize_rows, select_top_k
+
+logger = logging.getLogger(__name__)
+
+
+def _worker_main():
+    """工作进程：从标准输入接收 attach / search / stop 消息，在自己的行范围内打分"""
+    reader = sys.stdin.buffer
+    writer = os.fdopen(os.dup(sys.stdout.fileno()), 'wb')
+    # 其他输出改到标准错误，不混入消息管道
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+
+    def reply(message):
+        pickle.dump(message, writer, protocol=pickle.HIGHEST_PROTOCOL)
+        writer.flush()
+
+    block, start = None, 0
+    while True:
+        try:
+            message = pickle.load(reader)
+        except EOFError:
+            break  # 主进程已退出
+        op = message[0]
+        if op == 'stop':
+            break
+        try:
+            if op == 'attach':
+                _, path, start, stop = message
+                block = np.load(path, mmap_mode='r')[start:stop]
+                reply(('ok', None))
+            elif op == 'search':
+                _, queries, k, min_score, rows = message
+                if rows is None:
+                    positions = np.arange(start, start + len(block), dtype=np.int64)
+                    scores = block @ queries.T
+                else:
+                    positions = rows
+                    scores = block[rows - start] @ queries.T
+                np.clip(scores, 0.0, 1.0, out=scores)
+                reply(('ok', [select_top_k(scores[:, q], positions, k, min_score) for q in range(len(queries))]))
+        except Exception as e:
+            reply(('error', f"{e}\n{traceback.format_exc()}"))
+
+
+class _Worker:
+    """一个工作进程及其消息管道"""
+
+    def __init__(self):
+        env = dict(os.environ, OMP_NUM_THREADS='1', OPENBLAS_NUM_THREADS='1', MKL_NUM_THREADS='1')
+        self.process = subprocess.Popen([sys.executable, str(Path(__file__).resolve())],
+                                        stdin=subprocess.PIPE, stdout=subprocess.PIPE, env=env)
+
+    def send(self, *message):
+        pickle.dump(message, self.process.stdin, protocol=pickle.HIGHEST_PROTOCOL)
+        self.process.stdin.flush()
+
+    def recv(self):
+        """读取一条回复，工作进程已退出时抛出 EOFError"""
+        return pickle.load(self.process.stdout)
+
+    def stop(self):
+        try:
+            self.send('stop')
+            self.process.stdin.close()
+            self.process.wait(timeout=5)
+        except (OSError, ValueError, subprocess.TimeoutExpired):
+            self.process.kill()
+
+
+class ParallelScorer:
+    """把向量矩阵分给多个工作进程并行精确打分"""
+
+    def __init__(self, workers: int):
+        """
+        Args:
+            workers: 工作进程数量
+        """
+        self.workers = max(1, workers)
+        self.searches = 0
+        self.exports = 0
+        self._workers: List[_Worker] = []
+        self._matrix = None        # 工作进程当前打开的向量矩阵（EmbeddingMatrix 对象）
+        self._ranges: List[Tuple[int, int]] = []
+        self._path: Optional[Path] = None
+        self._exporting = False
+        self._tmp_dir: Optional[str] = None
+        self._lock = threading.Lock()         # 串行化 scatter-gather（各进程一次只处理一个请求）
+        self._state_lock = threading.Lock()   # 保护 _matrix / _exporting
+
+    def _start(self):
+        """第一次导出时（或工作进程异常退出后）启动工作进程"""
+        if not self._workers:
+            self._workers = [_Worker() for _ in range(self.workers)]
+            logger.info(f"已启动 {self.workers} 个向量打分进程")
+
+    def ready(self, matrix) -> bool:
+        """工作进程是否已经打开了这个向量矩阵；没有时在后台导出（导出完成前返回 False）"""
+        with self._state_lock:
+            if self._matrix is matrix:
+                return True
+            if self._exporting or len(matrix) == 0:
+                return False
+            self._exporting = True
+        threading.Thread(target=self._export, args=(matrix,), daemon=True).start()
+        return False
+
+    def _export(self, matrix):
+        """把向量矩阵写入共享目录，通知全部工作进程打开新矩阵后删除旧文件"""
+        try:
+            if self._tmp_dir is None:
+                shm = Path('/dev/shm')
+                self._tmp_dir = tempfile.mkdtemp(prefix='vector_shards_', dir=str(shm) if shm.is_dir() else None)
+            size = len(matrix)
+            path = Path(self._tmp_dir) / f"embeddings-{self.exports:06d}.npy"
+            exported = np.lib.format.open_memmap(path, mode='w+', dtype=np.float32, shape=(size, matrix.dim))
+            for start in range(0, size, SCORE_BLOCK_ROWS):
+                stop = min(size, start + SCORE_BLOCK_ROWS)
+                exported[start:stop] = matrix[start:stop]
+            exported.flush()
+            del exported
+
+            bounds = np.linspace(0, size, self.workers + 1).astype(int)
+            ranges = list(zip(bounds[:-1].tolist(), bounds[1:].tolist()))
+            with self._lock:
+                self._start()
+                try:
+                    for worker, (start, stop) in zip(self._workers, ranges):
+                        worker.send('attach', str(path), start, stop)
+                    replies = [worker.recv() for worker in self._workers]
+                except (EOFError, OSError):
+                    self._stop_workers()
+                    raise
+                errors = [error for status, error in replies if status != 'ok']
+                if errors:
+                    # 部分工作进程打开新文件失败，不能再用旧矩阵打分，下次搜索重新导出
+                    with self._state_lock:
+                        self._matrix = None
+                    raise RuntimeError(errors[0])
+                previous, self._path, self._ranges = self._path, path, ranges
+                with self._state_lock:
+                    self._matrix = matrix
+            self.exports += 1
+            if previous is not None:
+                # 工作进程都已改为打开新文件
+                previous.unlink(missing_ok=True)
+            logger.info(f"已导出 {size} 行向量供 {self.workers} 个打分进程使用")
+        except Exception as e:
+            logger.error(f"导出向量矩阵到打分进程失败: {str(e)}")
+            logger.error(traceback.format_exc())
+        finally:
+            with self._state_lock:
+                self._exporting = False
+
+    def top_k_many(self, matrix, query_vectors: np.ndarray, k: int, min_score: float = 0.0,
+                   rows: Optional[np.ndarray] = None) -> Optional[List[Tuple[np.ndarray, np.ndarray]]]:
+        """多个查询的精确 top-k（语义同 EmbeddingMatrix.top_k）
+
+        Args:
+            matrix: 本次搜索快照中的向量矩阵，工作进程没有打开这个矩阵时返回 None
+            query_vectors: 查询向量矩阵（每行一个查询，无需提前归一化）
+            rows: 候选行号，为 None 时在全部行中选择
+
+        Returns:
+            每个查询的 (行号, 相似度)，按相似度降序排列；无法并行打分时返回 None
+        """
+        queries = np.ascontiguousarray(normalize_rows(query_vectors))
+        if rows is not None:
+            rows = np.asarray(rows, dtype=np.int64)
+        with self._lock:
+            if self._matrix is not matrix:
+                return None
+            sent = []
+            try:
+                for worker, (start, stop) in zip(self._workers, self._ranges):
+                    local = None if rows is None else rows[(rows >= start) & (rows < stop)]
+                    if local is not None and local.size == 0:
+                        continue
+                    worker.send('search', queries, k, min_score, local)
+                    sent.append(worker)
+                replies = [worker.recv() for worker in sent]
+            except (EOFError, OSError):
+                # 工作进程异常退出，管道中可能留有未读的回复；全部停止，下次搜索时重新启动并导出
+                self._stop_workers()
+                raise
+            self.searches += 1
+        errors = [payload for status, payload in replies if status != 'ok']
+        if errors:
+            raise RuntimeError(errors[0])
+
+        merged = []
+        for q in range(len(queries)):
+            parts = [payload[q] for _, payload in replies]
+            if not parts:
+                merged.append((np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)))
+                continue
+            merged.append(select_top_k(np.concatenate([scores for _, scores in parts]),
+                                       np.concatenate([positions for positions, _ in parts]), k))
+        return merged
+
+    def top_k(self, matrix, query_vector: np.ndarray, k: int, min_score: float = 0.0,
+              rows: Optional[np.ndarray] = None) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """单个查询的精确 top-k，无法并行打分时返回 None"""
+        results = self.top_k_many(matrix, query_vector, k, min_score, rows)
+        return None if results is None else results[0]
+
+    def _stop_workers(self):
+        for worker in self._workers:
+            worker.stop()
+        self._workers = []
+        with self._state_lock:
+            self._matrix = None
+
+    def close(self):
+        """停止工作进程并删除导出的矩阵文件"""
+        with self._lock:
+            self._stop_workers()
+            if self._tmp_dir is not None:
+                shutil.rmtree(self._tmp_dir, ignore_errors=True)
+                self._tmp_dir = None
+            self._path = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "workers": self.workers,
+            "running": sum(worker.process.poll() is None for worker in self._workers),
+            "searches": self.searches,
+            "exports": self.exports,
+            "ready": self._matrix is not None
+        }
+
+
+if __name__ == "__main__":
+    _worker_main()
@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+查询缓存
+微信群里同样的问题会被反复提问：
+- QueryEmbeddingCache 缓存归一化后的查询向量，命中时不再经过模型前向计算。
+  缓存键为（模型标识, 规范化后的查询文本），按最近最少使用（LRU）淘汰，可以保存到磁盘，重启后继续命中。
+- SearchResultCache 缓存完整的搜索结果，每条结果记录计算时的知识库版本号，
+  知识库增删改或重新加载后版本号递增，旧结果自然失效，不需要全局清空。
+"""
+
+import copy
+import logging
+import os
+import pickle
+import re
+import threading
+import unicodedata
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+_WHITESPACE = re.compile(r'\s+')
+
+
+def normalize_query(text: str) -> str:
+    """规范化查询文本：全角转半角、英文转小写、合并连续空白"""
+    text = unicodedata.normalize('NFKC', text or '')
+    return _WHITESPACE.sub(' ', text).strip().lower()
+
+
+class QueryEmbeddingCache:
+    """线程安全的查询向量 LRU 缓存"""
+
+    def __init__(self, max_size: int = 10000, model_id: str = '', path: Optional[str] = None):
+        """
+        初始化缓存
+
+        Args:
+            max_size: 最多缓存的查询数量，为 0 时不缓存
+            model_id: 模型标识，换模型后旧的向量不会被命中
+            path: 持久化文件路径，为 None 或空时只缓存在内存中
+        """
+        self.max_size = max(0, max_size)
+        self.model_id = model_id
+        self.path = Path(path) if path else None
+        self.hits = 0
+        self.misses = 0
+        self._entries: 'OrderedDict[tuple, np.ndarray]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _key(self, text: str) -> tuple:
+        return (self.model_id, normalize_query(text))
+
+    def get(self, text: str) -> Optional[np.ndarray]:
+        """查找缓存的向量（返回副本），未命中时返回 None"""
+        key = self._key(text)
+        with self._lock:
+            vector = self._entries.get(key)
+            if vector is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return vector.copy()
+
+    def put(self, text: str, vector: np.ndarray) -> np.ndarray:
+        """缓存查询向量
+
+        Returns:
+            np.ndarray: 归一化后的 float32 向量（副本，调用方可以随意修改）
+        """
+        vector = np.array(vector, dtype=np.float32).reshape(-1)
+        norm = np.linalg.norm(vector)
+        if norm > 0:
+            vector /= norm
+        if self.max_size == 0:
+            return vector
+        key = self._key(text)
+        with self._lock:
+            self._entries[key] = vector
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return vector.copy()
+
+    def get_or_compute(self, text: str, compute: Callable[[str], np.ndarray]) -> np.ndarray:
+        """命中时直接返回缓存的向量，否则调用 compute 计算并缓存
+
+        模型计算在锁外进行，同一查询并发未命中时可能重复计算一次，结果相同。
+        """
+        vector = self.get(text)
+        if vector is None:
+            vector = self.put(text, compute(text))
+        return vector
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """命中统计"""
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0
+        }
+
+    def save(self) -> bool:
+        """保存到 path（先写临时文件再替换，避免写入中途退出留下损坏的文件）"""
+        if self.path is None:
+            return False
+        try:
+            with self._lock:
+                entries = list(self._entries.items())
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.path.with_name(self.path.name + '.tmp')
+            with open(tmp_path, 'wb') as f:
+                pickle.dump({'version': 1, 'entries': entries}, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self.path)
+            logger.info(f"查询向量缓存已保存: {self.path}，共 {len(entries)} 条")
+            return True
+        except Exception as e:
+            logger.error(f"保存查询向量缓存失败: {str(e)}")
+            return False
+
+    def load(self) -> bool:
+        """从 path 加载，只保留当前模型的向量"""
+        if self.path is None or not self.path.exists():
+            return False
+        try:
+            with open(self.path, 'rb') as f:
+                data = pickle.load(f)
+            entries = [(key, vector) for key, vector in data.get('entries', []) if key[0] == self.model_id]
+            with self._lock:
+                for key, vector in entries[-self.max_size:] if self.max_size else []:
+                    self._entries[key] = vector
+                    self._entries.move_to_end(key)
+                while len(self._entries) > self.max_size:
+                    self._entries.popitem(last=False)
+            logger.info(f"已加载查询向量缓存: {self.path}，共 {len(self._entries)} 条")
+            return True
+        except Exception as e:
+            logger.error(f"加载查询向量缓存失败: {str(e)}")
+            return False
+
+
+class SearchResultCache:
+    """按知识库版本号失效的搜索结果 LRU 缓存（线程安全）"""
+
+    def __init__(self, max_size: int = 1000):
+        """
+        Args:
+            max_size: 最多缓存的结果数量，为 0 时不缓存
+        """
+        self.max_size = max(0, max_size)
+        self.hits = 0
+        self.misses = 0
+        self._entries: 'OrderedDict[tuple, tuple]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @staticmethod
+    def make_key(query: str, *params) -> tuple:
+        """缓存键：规范化后的查询文本加上影响结果的搜索参数"""
+        return (normalize_query(query),) + params
+
+    def get(self, key: tuple, generation: int) -> Optional[Any]:
+        """查找当前版本的缓存结果（返回深拷贝），不存在或已过期时返回 None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != generation:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            value = entry[1]
+        return copy.deepcopy(value)
+
+    def put(self, key: tuple, generation: int, value: Any):
+        """缓存结果（保存深拷贝，调用方之后修改返回值不影响缓存）"""
+        if self.max_size == 0:
+            return
+        value = copy.deepcopy(value)
+        with self._lock:
+            self._entries[key] = (generation, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """命中统计"""
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0
+        }
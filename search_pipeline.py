@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+两阶段检索流水线
+第一阶段（召回）是现有的便宜步骤：关键词筛选、向量候选生成和排名融合，只输出 N 个候选；
+第二阶段（重排）只对这 N 个候选批量打分，N 由 rerank_budget 配置，重排开销不随知识库规模增长。
+
+重排器:
+    relevance       FaissVectorStore.calculate_relevance_score（关键词重要性 + 句子向量语义连贯性）
+    cross_encoder   本地 CPU 上运行的交叉编码器模型（sentence_transformers.CrossEncoder）
+
+每次搜索记录各阶段耗时，累计统计见 SearchPipeline.stats()。
+"""
+
+import logging
+import threading
+import time
+import traceback
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+RERANK_NONE = 'none'
+RERANK_RELEVANCE = 'relevance'
+RERANK_CROSS_ENCODER = 'cross_encoder'
+
+
+class Candidate:
+    """第一阶段输出的一个候选文本块"""
+
+    __slots__ = ('row', 'chunk_id', 'text', 'score', 'metadata', 'vector')
+
+    def __init__(self, row: int, chunk_id: int, text: str, score: float, metadata: Dict[str, Any]):
+        self.row = row
+        self.chunk_id = chunk_id
+        self.text = text
+        self.score = score
+        self.metadata = metadata
+        self.vector: Optional[np.ndarray] = None  # 文档向量，重排器需要时由向量存储填入
+
+    def result(self) -> Tuple[str, float, Dict]:
+        return self.text, self.score, self.metadata
+
+
+class StageTimer:
+    """记录一次搜索中各阶段的耗时（秒）"""
+
+    def __init__(self):
+        self.timings: Dict[str, float] = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = self.timings.get(name, 0.0) + time.perf_counter() - start
+
+    def summary(self) -> str:
+        return ", ".join(f"{name} {seconds * 1000:.1f}ms" for name, seconds in self.timings.items())
+
+
+class Reranker:
+    """重排器基类"""
+
+    name = RERANK_NONE
+    needs_vectors = False  # 是否需要候选的文档向量
+
+    def score(self, query: str, candidates: List[Candidate]) -> np.ndarray:
+        """给一个查询的候选打分，分数越高越相关"""
+        raise NotImplementedError
+
+    def score_many(self, queries: List[str], candidate_lists: List[List[Candidate]]) -> List[np.ndarray]:
+        """批量打分，默认逐个查询调用 score"""
+        return [self.score(query, candidates) for query, candidates in zip(queries, candidate_lists)]
+
+
+class RelevanceReranker(Reranker):
+    """用向量存储的综合相关性得分重排（查询向量走缓存，语义连贯性查句子向量索引，不调用模型）"""
+
+    name = RERANK_RELEVANCE
+    needs_vectors = True
+
+    def __init__(self, store):
+        self.store = store
+
+    def score(self, query: str, candidates: List[Candidate]) -> np.ndarray:
+        query_vector = self.store.normalize_vector(self.store.encode_text(query))
+        return np.array([
+            self.store.calculate_relevance_score(query_vector, c.vector, query, c.text, c.chunk_id)[0]
+            for c in candidates
+        ], dtype=np.float32)
+
+
+class CrossEncoderReranker(Reranker):
+    """本地交叉编码器重排，全部 (查询, 文本块) 对一次批量推理；模型在第一次使用时加载"""
+
+    name = RERANK_CROSS_ENCODER
+
+    def __init__(self, model_path: str, batch_size: int = 32, max_length: int = 512, device: str = 'cpu'):
+        self.model_path = model_path
+        self.batch_size = batch_size
+        self.max_length = max_length
+        self.device = device
+        self._model = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        with self._lock:
+            if self._model is None:
+                from sentence_transformers import CrossEncoder
+                logger.info(f"加载交叉编码器: {self.model_path}（设备: {self.device}）")
+                self._model = CrossEncoder(self.model_path, max_length=self.max_length, device=self.device)
+        return self._model
+
+    def score(self, query: str, candidates: List[Candidate]) -> np.ndarray:
+        return self.score_many([query], [candidates])[0]
+
+    def score_many(self, queries: List[str], candidate_lists: List[List[Candidate]]) -> List[np.ndarray]:
+        pairs = [(query, c.text) for query, candidates in zip(queries, candidate_lists) for c in candidates]
+        if not pairs:
+            return [np.empty(0, dtype=np.float32) for _ in queries]
+        scores = np.asarray(self._load().predict(pairs, batch_size=self.batch_size, show_progress_bar=False),
+                            dtype=np.float32).reshape(-1)
+        bounds = np.cumsum([0] + [len(candidates) for candidates in candidate_lists])
+        return [scores[bounds[i]:bounds[i + 1]] for i in range(len(queries))]
+
+
+class SearchPipeline:
+    """召回 → 重排两阶段流水线
+
+    第一阶段由向量存储完成并返回 candidate_count(top_k) 个候选，本类负责第二阶段和耗时统计。
+    重排只改变前 rerank_budget 个候选的顺序，返回结果中的分数仍是第一阶段的分数
+    （调用方按该分数做阈值过滤），重排分数记录在 _debug_info['rerank_score'] 中。
+    """
+
+    def __init__(self, reranker: Optional[Reranker] = None, rerank_budget: int = 50):
+        """
+        Args:
+            reranker: 第二阶段的重排器，为 None 时只有第一阶段
+            rerank_budget: 进入重排阶段的候选数量 N
+        """
+        self.reranker = reranker
+        self.rerank_budget = max(1, rerank_budget)
+        self._stats: Dict[str, List[float]] = {}  # 阶段 -> [次数, 总耗时, 最大耗时]
+        self._runs = 0
+        self._lock = threading.Lock()
+
+    @property
+    def reranks(self) -> bool:
+        return self.reranker is not None
+
+    def candidate_count(self, top_k: int) -> int:
+        """第一阶段需要输出的候选数量"""
+        return max(top_k, self.rerank_budget) if self.reranker is not None else top_k
+
+    def rerank(self, queries: List[str], candidate_lists: List[List[Candidate]],
+               timer: StageTimer) -> List[List[Candidate]]:
+        """第二阶段：每个查询只重排前 rerank_budget 个候选，所有查询一次批量打分
+
+        重排失败时记录错误并保留第一阶段的顺序。
+        """
+        if self.reranker is None:
+            return candidate_lists
+        heads = [candidates[:self.rerank_budget] for candidates in candidate_lists]
+        if not any(len(head) > 1 for head in heads):
+            return candidate_lists
+        try:
+            with timer.stage('rerank'):
+                score_lists = self.reranker.score_many(queries, heads)
+        except Exception as e:
+            logger.error(f"重排失败，使用第一阶段的排序: {str(e)}")
+            logger.error(traceback.format_exc())
+            return candidate_lists
+
+        reranked = []
+        for candidates, head, scores in zip(candidate_lists, heads, score_lists):
+            # 稳定排序：重排分数相同时保持第一阶段的顺序
+            order = np.argsort(-np.asarray(scores, dtype=np.float64), kind='stable')
+            for c, score in zip(head, scores):
+                debug_info = c.metadata.get('_debug_info')
+                if debug_info is not None:
+                    debug_info['rerank_score'] = f"{float(score):.4f}"
+            reranked.append([head[i] for i in order] + candidates[len(head):])
+        return reranked
+
+    def record(self, timer: StageTimer):
+        """累计一次搜索的各阶段耗时"""
+        logger.info(f"搜索各阶段耗时: {timer.summary()}")
+        with self._lock:
+            self._runs += 1
+            for name, seconds in timer.timings.items():
+                entry = self._stats.setdefault(name, [0, 0.0, 0.0])
+                entry[0] += 1
+                entry[1] += seconds
+                entry[2] = max(entry[2], seconds)
+
+    def stats(self) -> Dict[str, Any]:
+        """各阶段的平均和最大耗时（毫秒）"""
+        with self._lock:
+            return {
+                "runs": self._runs,
+                "reranker": self.reranker.name if self.reranker is not None else RERANK_NONE,
+                "rerank_budget": self.rerank_budget,
+                "stages": {
+                    name: {
+                        "count": count,
+                        "avg_ms": total / count * 1000,
+                        "max_ms": peak * 1000
+                    }
+                    for name, (count, total, peak) in self._stats.items()
+                }
+            }
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+向量存储预写日志（WAL）
+记录自上次落盘以来的增、删、改操作，每次保存只需在日志末尾追加本次变更。
+
+记录格式: [4 字节长度][4 字节 CRC32][pickle 编码的操作字典]
+进程在写入中途退出会留下不完整的记录，读取时在第一条不完整或校验失败的记录处停止，
+写入方在下次追加前把这部分截掉。
+
+操作字典:
+    {'op': 'add',    'ids': [...], 'documents': [(text, metadata), ...],
+     'embeddings': float32 矩阵, 'keyword_terms': [{词: 词频}, ...],
+     'sentence_vectors': [每个文本块的 float16 句子向量矩阵, ...]}
+    {'op': 'update', 与 add 相同的字段，ids 为已存在的文本块}
+    {'op': 'delete', 'ids': [...]}
+"""
+
+import logging
+import os
+import pickle
+import struct
+import zlib
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+OP_ADD = 'add'
+OP_UPDATE = 'update'
+OP_DELETE = 'delete'
+
+_HEADER = struct.Struct('<II')
+
+
+def read_records(path) -> Tuple[List[Dict[str, Any]], int]:
+    """读取日志中的全部完整记录
+
+    Returns:
+        Tuple[List[Dict[str, Any]], int]: (操作记录列表, 最后一条完整记录的结束偏移)
+    """
+    records = []
+    end = 0
+    path = Path(path)
+    if not path.exists():
+        return records, end
+    with open(path, 'rb') as f:
+        data = f.read()
+    while end + _HEADER.size <= len(data):
+        length, crc = _HEADER.unpack_from(data, end)
+        start = end + _HEADER.size
+        payload = data[start:start + length]
+        if len(payload) < length or zlib.crc32(payload) != crc:
+            logger.warning(f"日志 {path} 在偏移 {end} 处存在不完整的记录，忽略之后的内容")
+            break
+        records.append(pickle.loads(payload))
+        end = start + length
+    return records, end
+
+
+def append_records(path, records: Iterable[Dict[str, Any]], valid_end: int) -> int:
+    """在日志末尾追加记录并同步到磁盘
+
+    Args:
+        path: 日志文件
+        records: 操作记录
+        valid_end: 已知最后一条完整记录的结束偏移，之后的残留内容会被截掉
+
+    Returns:
+        int: 追加后的日志长度
+    """
+    path = Path(path)
+    with open(path, 'ab') as f:
+        if f.tell() > valid_end:
+            f.truncate(valid_end)
+            f.seek(valid_end)
+        for record in records:
+            payload = pickle.dumps(record, protocol=pickle.HIGHEST_PROTOCOL)
+            f.write(_HEADER.pack(len(payload), zlib.crc32(payload)))
+            f.write(payload)
+        f.flush()
+        os.fsync(f.fileno())
+        return f.tell()
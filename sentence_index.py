@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+句子向量索引（多向量旁路索引）
+语义相关度和语义连贯性按句子打分：原来在查询时对每个候选文本块的前几个句子逐句调用模型，
+排序循环中包含模型前向计算。现在入库时把全部文本块的句子一次批量编码，
+按文本块 ID 保存归一化的句子向量（float16），查询时只需查表和做点积。
+"""
+
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+# 每个文本块只取前几个句子参与打分
+MAX_SENTENCES = 3
+
+
+def split_sentences(text: str, limit: int = MAX_SENTENCES) -> List[str]:
+    """按句号切分文本，去掉空句，只保留前 limit 句"""
+    return [s.strip() for s in text.split('。') if s.strip()][:limit]
+
+
+def _encode_batch(encode: Callable[[List[str]], np.ndarray], texts: List[str], limit: int,
+                  with_texts: bool) -> Tuple[Optional[np.ndarray], List[np.ndarray]]:
+    sentences = [split_sentences(text, limit) for text in texts]
+    # 相同的字符串只编码一次（只有一个句子的文本块，句子就是整段文本）
+    positions: Dict[str, int] = {}
+    for text in texts if with_texts else ():
+        positions.setdefault(text, len(positions))
+    for group in sentences:
+        for sentence in group:
+            positions.setdefault(sentence, len(positions))
+    if not positions:
+        return None, [np.empty((0, 0), dtype=np.float16) for _ in texts]
+    vectors = np.asarray(encode(list(positions)), dtype=np.float32).reshape(len(positions), -1)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    normalized = (vectors / np.maximum(norms, 1e-12)).astype(np.float16)
+    sentence_vectors = [normalized[[positions[sentence] for sentence in group]] for group in sentences]
+    text_vectors = vectors[[positions[text] for text in texts]] if with_texts else None
+    return text_vectors, sentence_vectors
+
+
+def encode_sentences(encode: Callable[[List[str]], np.ndarray], texts: Iterable[str],
+                     limit: int = MAX_SENTENCES) -> List[np.ndarray]:
+    """把所有文本的句子合并成一批编码
+
+    Args:
+        encode: 批量编码函数，输入句子列表，返回向量矩阵
+        texts: 文本块内容
+        limit: 每个文本块最多取的句子数
+
+    Returns:
+        List[np.ndarray]: 每个文本块的归一化句子向量（float16，没有句子时为 0 行）
+    """
+    return _encode_batch(encode, list(texts), limit, with_texts=False)[1]
+
+
+def encode_with_sentences(encode: Callable[[List[str]], np.ndarray], texts: List[str],
+                          limit: int = MAX_SENTENCES) -> Tuple[np.ndarray, List[np.ndarray]]:
+    """文本块和它们的句子放在同一批中编码（入库时只调用一次模型）
+
+    Returns:
+        Tuple[np.ndarray, List[np.ndarray]]: (文本块的原始向量, 每个文本块的归一化句子向量)
+    """
+    return _encode_batch(encode, list(texts), limit, with_texts=True)
+
+
+def _similarities(vectors: np.ndarray, query_vector: np.ndarray) -> np.ndarray:
+    """查询与每个句子的余弦相似度，截断到 [0, 1]（向量均已归一化）"""
+    return np.clip(vectors @ np.asarray(query_vector, dtype=np.float32), 0.0, 1.0)
+
+
+def semantic_similarity(query_vector: np.ndarray, sentence_vectors: np.ndarray) -> float:
+    """查询与各句子相似度的最大值"""
+    if len(sentence_vectors) == 0:
+        return 0.0
+    return float(np.max(_similarities(np.asarray(sentence_vectors, dtype=np.float32), query_vector)))
+
+
+def semantic_coherence(query_vector: np.ndarray, sentence_vectors: np.ndarray) -> float:
+    """语义连贯性：查询与句子的平均相似度，结合相邻句子之间的相似度
+
+    只有一个句子时，平均相似度超过 0.5 才计分；平均相似度低于 0.4 时为 0，
+    否则为 0.7 * 平均查询相似度 + 0.3 * 平均相邻句子相似度。
+    """
+    if len(sentence_vectors) == 0:
+        return 0.0
+    vectors = np.asarray(sentence_vectors, dtype=np.float32)
+    avg_query_sim = float(np.mean(_similarities(vectors, query_vector)))
+    if len(vectors) == 1:
+        return avg_query_sim if avg_query_sim > 0.5 else 0.0
+    if avg_query_sim < 0.4:
+        return 0.0
+    avg_coherence = float(np.mean(np.clip(np.einsum('ij,ij->i', vectors[:-1], vectors[1:]), 0.0, 1.0)))
+    return 0.7 * avg_query_sim + 0.3 * avg_coherence
+
+
+class SentenceIndex:
+    """文本块 ID -> 句子向量矩阵
+
+    写入方修改 copy() 得到的副本：字典浅拷贝，向量矩阵本身只读共享（可以是段文件的 mmap 视图）。
+    """
+
+    def __init__(self, entries: Optional[Iterable[Tuple[int, np.ndarray]]] = None):
+        self._vectors: Dict[int, np.ndarray] = dict(entries or ())
+
+    def __len__(self) -> int:
+        return len(self._vectors)
+
+    def __contains__(self, chunk_id: int) -> bool:
+        return chunk_id in self._vectors
+
+    def get(self, chunk_id: int) -> Optional[np.ndarray]:
+        """指定文本块的句子向量，没有记录时返回 None"""
+        return self._vectors.get(chunk_id)
+
+    def set_many(self, chunk_ids: Iterable[int], vectors: Iterable[np.ndarray]):
+        for chunk_id, matrix in zip(chunk_ids, vectors):
+            self._vectors[int(chunk_id)] = matrix
+
+    def remove(self, chunk_ids: Iterable[int]):
+        for chunk_id in chunk_ids:
+            self._vectors.pop(chunk_id, None)
+
+    def reset(self, entries: Optional[Iterable[Tuple[int, np.ndarray]]] = None):
+        self._vectors = dict(entries or ())
+
+    def copy(self) -> 'SentenceIndex':
+        clone = SentenceIndex()
+        clone._vectors = dict(self._vectors)
+        return clone
+
+    @property
+    def nbytes(self) -> int:
+        return sum(matrix.nbytes for matrix in self._vectors.values())
@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+按源文件分片的路由索引与常驻缓存
+知识库按源文件划分为分片。ShardRouter 为每个分片维护一个质心向量（分片内归一化向量之和），
+查询先与全部质心打分（粗路由），只在最接近的若干个分片中精确打分。
+
+ShardCache 按 LRU 在内存预算（MB）内保留最近访问的分片向量（连续的 float32 矩阵）：
+热门文档的分片一直留在内存中，冷门分片的向量留在磁盘上（列式存储以 mmap 打开的 embeddings.npy），
+被路由到时才按需读取，超出预算时淘汰最久未访问的分片。
+
+每次分片的成员或向量发生变化（增删改、压缩删除标记）都会分配新的版本号，
+缓存以 (源文件, 版本号) 为键，旧版本的缓存自然不再命中。
+
+同一份质心也用作文档级粗路由（document_route_top）：搜索先选出质心最接近的前 M 个文档，
+只对这些文档的文本块打分；路由把握不大时退回全量打分。质心随列式存储一起保存（ROUTER_FILE），
+加载时不需要读取全部向量重新计算。
+"""
+
+import itertools
+import logging
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+ROUTER_FILE = 'document_router.npz'
+
+_versions = itertools.count(1)
+
+
+class ShardRouter:
+    """源文件分片的质心路由索引
+
+    copy() 得到的副本与原索引共享质心向量（向量只会被整体替换），修改副本不影响原索引。
+    """
+
+    def __init__(self):
+        self._sums: Dict[str, np.ndarray] = {}     # 源文件 -> 分片内归一化向量之和
+        self._counts: Dict[str, int] = {}          # 源文件 -> 分片内文本块数量
+        self._versions: Dict[str, int] = {}        # 源文件 -> 分片版本号
+        self.loose_ids: Set[int] = set()           # 没有源文件的文本块，不参与路由，每次都要搜索
+        self._centroids: Optional[Tuple[List[str], np.ndarray]] = None
+
+    def __len__(self) -> int:
+        return len(self._sums)
+
+    def copy(self) -> 'ShardRouter':
+        clone = ShardRouter()
+        clone._sums = dict(self._sums)
+        clone._counts = dict(self._counts)
+        clone._versions = dict(self._versions)
+        clone.loose_ids = set(self.loose_ids)
+        clone._centroids = self._centroids
+        return clone
+
+    def version(self, source: str) -> int:
+        return self._versions.get(source, 0)
+
+    def add(self, source: Optional[str], chunk_ids: Iterable[int], vectors: np.ndarray):
+        """把归一化向量加入分片（source 为 None 的文本块记为不参与路由）"""
+        if source is None:
+            self.loose_ids.update(chunk_ids)
+            return
+        if len(vectors) == 0:
+            return
+        total = np.asarray(vectors, dtype=np.float32).sum(axis=0)
+        previous = self._sums.get(source)
+        self._sums[source] = total if previous is None else previous + total
+        self._counts[source] = self._counts.get(source, 0) + len(vectors)
+        self._touch(source)
+
+    def remove(self, source: Optional[str], chunk_ids: Iterable[int], vectors: np.ndarray):
+        """把归一化向量移出分片，分片为空时删除"""
+        if source is None:
+            self.loose_ids.difference_update(chunk_ids)
+            return
+        if source not in self._sums or len(vectors) == 0:
+            return
+        count = self._counts[source] - len(vectors)
+        if count <= 0:
+            del self._sums[source], self._counts[source], self._versions[source]
+            self._centroids = None
+            return
+        self._sums[source] = self._sums[source] - np.asarray(vectors, dtype=np.float32).sum(axis=0)
+        self._counts[source] = count
+        self._touch(source)
+
+    def _touch(self, source: str):
+        self._versions[source] = next(_versions)
+        self._centroids = None
+
+    def touch_all(self):
+        """全部分片的行号发生变化（压缩删除标记）时使已缓存的分片失效"""
+        for source in self._versions:
+            self._versions[source] = next(_versions)
+
+    def reset(self, groups: Iterable[Tuple[Optional[str], List[int], np.ndarray]] = ()):
+        """按 (源文件, 文本块 ID, 归一化向量) 分组重建"""
+        self._sums, self._counts, self._versions = {}, {}, {}
+        self.loose_ids = set()
+        self._centroids = None
+        for source, chunk_ids, vectors in groups:
+            self.add(source, chunk_ids, vectors)
+
+    def route(self, query_vector: np.ndarray, n: int) -> List[str]:
+        """质心与查询最接近的 n 个分片"""
+        return [name for name, _ in self.rank(query_vector, n)]
+
+    def rank(self, query_vector: np.ndarray, n: int) -> List[Tuple[str, float]]:
+        """质心与查询最接近的 n 个分片及其余弦相似度，按相似度降序排列"""
+        centroids = self._centroids
+        if centroids is None:
+            names = list(self._sums)
+            matrix = (np.stack([self._sums[name] for name in names]) if names
+                      else np.empty((0, len(query_vector)), dtype=np.float32))
+            norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            centroids = self._centroids = (names, (matrix / norms).astype(np.float32))
+        names, matrix = centroids
+        if not names:
+            return []
+        scores = matrix @ np.asarray(query_vector, dtype=np.float32)
+        if n < len(names):
+            top = np.argpartition(-scores, n - 1)[:n]
+            top = top[np.argsort(-scores[top], kind='stable')]
+        else:
+            top = np.argsort(-scores, kind='stable')
+        return [(names[i], float(scores[i])) for i in top]
+
+    def save(self, path, key: str) -> bool:
+        """保存质心（key 标识保存时存储的内容，加载时不一致则不使用）"""
+        try:
+            path = Path(path)
+            names = list(self._sums)
+            sums = (np.stack([self._sums[name] for name in names]) if names
+                    else np.empty((0, 0), dtype=np.float32))
+            tmp_path = path.with_name(path.name + '.tmp')
+            with open(tmp_path, 'wb') as f:
+                np.savez(f, key=np.array(key), sources=np.array(names, dtype=str), sums=sums,
+                         counts=np.array([self._counts[name] for name in names], dtype=np.int64),
+                         loose_ids=np.array(sorted(self.loose_ids), dtype=np.int64))
+            os.replace(tmp_path, path)
+            return True
+        except Exception as e:
+            logger.error(f"保存文档路由质心失败: {str(e)}")
+            return False
+
+    def load(self, path, key: str) -> bool:
+        """加载 save 保存的质心，文件不存在或 key 不一致时返回 False 并保持原状"""
+        path = Path(path)
+        if not path.exists():
+            return False
+        try:
+            with np.load(path) as data:
+                if str(data['key']) != key:
+                    return False
+                sources = data['sources'].tolist()
+                sums, counts, loose_ids = data['sums'], data['counts'], data['loose_ids']
+        except Exception as e:
+            logger.error(f"加载文档路由质心失败: {str(e)}")
+            return False
+        self.reset()
+        self._sums = {source: sums[i] for i, source in enumerate(sources)}
+        self._counts = {source: int(counts[i]) for i, source in enumerate(sources)}
+        for source in sources:
+            self._touch(source)
+        self.loose_ids = set(loose_ids.tolist())
+        return True
+
+    def counts(self) -> Dict[str, int]:
+        """源文件 -> 分片内文本块数量"""
+        return dict(self._counts)
+
+
+class RouteStats:
+    """文档级路由的统计：路由和退回全量打分的次数，每次查询打分的文本块占全部文本块的比例（线程安全）"""
+
+    def __init__(self):
+        self.routed = 0
+        self.fallback = 0
+        self._ratio_sum = 0.0
+        self._ratio_max = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, routed: bool, touched: int, total: int) -> float:
+        """记录一次查询，返回打分比例"""
+        ratio = touched / total if total else 0.0
+        with self._lock:
+            if routed:
+                self.routed += 1
+            else:
+                self.fallback += 1
+            self._ratio_sum += ratio
+            self._ratio_max = max(self._ratio_max, ratio)
+        return ratio
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            queries = self.routed + self.fallback
+            return {
+                "queries": queries,
+                "routed": self.routed,
+                "fallback": self.fallback,
+                "avg_touched_ratio": self._ratio_sum / queries if queries else 0.0,
+                "max_touched_ratio": self._ratio_max
+            }
+
+
+class ShardCache:
+    """分片向量的 LRU 常驻缓存（线程安全）"""
+
+    def __init__(self, budget_mb: float = 512):
+        """
+        Args:
+            budget_mb: 常驻分片向量的内存预算（MB），为 0 时不缓存，每次都从向量矩阵读取
+        """
+        self.budget_bytes = int(max(0.0, budget_mb) * 1024 * 1024)
+        self.hits = 0
+        self.misses = 0
+        self._entries: 'OrderedDict[tuple, Tuple[np.ndarray, np.ndarray]]' = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: tuple, loader: Callable[[], Tuple[np.ndarray, np.ndarray]]) -> Tuple[np.ndarray, np.ndarray]:
+        """取分片的 (行号, 向量)，不在缓存中时调用 loader 读取（在锁外读取）"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            self.misses += 1
+        entry = loader()
+        size = entry[0].nbytes + entry[1].nbytes
+        if size > self.budget_bytes:
+            return entry
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = entry
+                self._bytes += size
+            while self._bytes > self.budget_bytes:
+                _, (rows, vectors) = self._entries.popitem(last=False)
+                self._bytes -= rows.nbytes + vectors.nbytes
+        return entry
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "resident_shards": len(self._entries),
+            "resident_mb": self._bytes / 2 ** 20,
+            "budget_mb": self.budget_bytes / 2 ** 20,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0
+        }
@@ -403,29 +403,10 @@ class SmartKnowledgeBase:
             if not self.document_manager.remove_document(file_path):
                 return False
             
-            # 从向量存储中删除
-            if hasattr(self.vector_store, 'documents'):
-                # 找到所有属于该文档的文本块
-                file_path = str(Path(file_path))
-                new_documents = []
-                new_embeddings = []
-                
-                # 遍历所有文本块，保留不属于被删除文档的块
-                for i, (text, metadata) in enumerate(self.vector_store.documents):
-                    if metadata.get('source') != file_path:
-                        new_documents.append((text, metadata))
-                        if self.vector_store.document_embeddings is not None:
-                            new_embeddings.append(self.vector_store.document_embeddings[i])
-                
-                # 更新文档列表和向量
-                self.vector_store.documents = new_documents
-                if new_embeddings:
-                    self.vector_store.document_embeddings = np.array(new_embeddings)
-                    
-                    # 重建索引
-                    self.vector_store.index.reset()
-                    if len(new_embeddings) > 0:
-                        self.vector_store.index.add(self.vector_store.document_embeddings)
+            # 从向量存储中删除：按文本块 ID 标记删除，不再重建文档列表、向量矩阵和整个索引
+            if hasattr(self.vector_store, 'delete_document'):
+                if not self.vector_store.delete_document(str(Path(file_path))):
+                    return False
                 
                 # 保存更新后的向量存储
                 self.vector_store.save(self.vector_store_path)
@@ -468,13 +449,14 @@ class SmartKnowledgeBase:
                 "vector_dimension": 0
             }
             
-    def query(self, question: str, top_k: int = 3) -> str:
+    def query(self, question: str, top_k: int = 3, min_score: float = 0.01) -> str:
         """
         查询知识库
         
         Args:
             question: 问题
             top_k: 返回的相关文档数量
+            min_score: 本次查询的相似度阈值（随搜索请求传入，不修改向量存储共享的阈值）
             
         Returns:
             str: 答案
@@ -483,21 +465,17 @@ class SmartKnowledgeBase:
             # 搜索相关文档
             print(f"\n=== 开始查询知识库 ===")
             print(f"问题: {question}")
-            print(f"当前相似度阈值: {self.vector_store.similarity_threshold}")
+            print(f"当前相似度阈值: {min_score}")
             
-            # 调整相似度阈值为更小的值
-            original_threshold = self.vector_store.similarity_threshold
-            self.vector_store.similarity_threshold = 0.01  # 设置一个较小的阈值
-            
-            results = self.vector_store.search(question, top_k=top_k)
+            results = self.vector_store.search(question, top_k=top_k, min_score=min_score)
             print(f"\n找到 {len(results)} 个结果:")
             
             # 提取相关内容
             relevant_docs = []
-            for text, score in results:
+            for text, score, _ in results:
                 print(f"\n相似度得分: {score:.4f}")
                 print(f"文本内容: {text[:200]}...")
-                if score > self.vector_store.similarity_threshold:
+                if score > min_score:
                     relevant_docs.append(text)
                     
             if not relevant_docs:
@@ -508,9 +486,6 @@ class SmartKnowledgeBase:
             context = "\n".join(relevant_docs)
             print(f"\n最终返回内容长度: {len(context)} 字符")
             
-            # 恢复原始阈值
-            self.vector_store.similarity_threshold = original_threshold
-            
             return context
             
         except Exception as e:
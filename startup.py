@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+后台预热
+导入 torch / sentence_transformers、加载向量模型和知识库需要几十秒（模型加载失败时还有重试等待）。
+快速启动模式下这些工作放到后台线程中完成，HTTP 服务立即开始处理健康检查和登录请求，
+需要知识库的接口在加载完成前返回 503 和加载进度。
+
+BackgroundLoader 包装一个耗时的初始化函数：
+- start() 在后台线程中执行，run() 在当前线程中执行（普通启动模式），两种方式只执行一次；
+- 成功后调用 on_ready 回调（例如设置全局变量），失败时记录异常，status() 中可以看到错误信息；
+- get(timeout) 等待加载完成并返回结果。
+"""
+
+import logging
+import threading
+import time
+import traceback
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+STATE_PENDING = 'pending'
+STATE_LOADING = 'loading'
+STATE_READY = 'ready'
+STATE_FAILED = 'failed'
+
+
+class BackgroundLoader:
+    """只执行一次的（后台）初始化任务"""
+
+    def __init__(self, name: str, load: Callable[[], Any], on_ready: Optional[Callable[[Any], None]] = None):
+        """
+        Args:
+            name: 任务名称，用于日志和线程名
+            load: 初始化函数，返回初始化好的对象
+            on_ready: 初始化成功后以结果调用的回调
+        """
+        self.name = name
+        self.load = load
+        self.on_ready = on_ready
+        self.state = STATE_PENDING
+        self.value = None
+        self.error: Optional[BaseException] = None
+        self._started_at: Optional[float] = None
+        self._finished_at: Optional[float] = None
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+
+    @property
+    def ready(self) -> bool:
+        return self.state == STATE_READY
+
+    @property
+    def running(self) -> bool:
+        return self.state in (STATE_PENDING, STATE_LOADING) and self._started_at is not None
+
+    def _claim(self) -> bool:
+        """标记为开始执行，已经开始过时返回 False"""
+        with self._lock:
+            if self._started_at is not None:
+                return False
+            self._started_at = time.time()
+            self.state = STATE_LOADING
+            return True
+
+    def _execute(self):
+        logger.info(f"开始加载 {self.name}")
+        try:
+            value = self.load()
+            if self.on_ready is not None:
+                self.on_ready(value)
+            self.value = value
+            self.state = STATE_READY
+            logger.info(f"{self.name} 加载完成，耗时 {time.time() - self._started_at:.1f} 秒")
+        except BaseException as e:
+            self.error = e
+            self.state = STATE_FAILED
+            logger.error(f"{self.name} 加载失败: {str(e)}")
+            logger.error(traceback.format_exc())
+        finally:
+            self._finished_at = time.time()
+            self._done.set()
+
+    def start(self) -> 'BackgroundLoader':
+        """在后台线程中执行（只执行一次）"""
+        if self._claim():
+            threading.Thread(target=self._execute, name=f"warmup-{self.name}", daemon=True).start()
+        return self
+
+    def run(self) -> Any:
+        """在当前线程中执行并返回结果，失败时抛出原来的异常"""
+        if self._claim():
+            self._execute()
+        return self.get()
+
+    def get(self, timeout: Optional[float] = None) -> Any:
+        """等待执行完成并返回结果；超时返回 None，执行失败时抛出原来的异常"""
+        if not self._done.wait(timeout):
+            return None
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+    def status(self) -> Dict[str, Any]:
+        """加载状态：state、已耗时（秒）和失败原因"""
+        seconds = 0.0
+        if self._started_at is not None:
+            seconds = (self._finished_at or time.time()) - self._started_at
+        return {
+            "name": self.name,
+            "state": self.state,
+            "seconds": round(seconds, 1),
+            "error": str(self.error) if self.error is not None else None
+        }
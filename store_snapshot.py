@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+知识库只读快照
+FaissVectorStore 只有一个写入方：上传、删除、更新文本块和重新加载都在写锁内进行，
+先把当前快照中的各个结构复制一份（写时复制，大块数据在真正修改时才复制），修改副本，
+完成后一次赋值发布新的快照；中途出错时丢弃副本，已发布的快照不受影响。
+搜索只读取开始时拿到的快照，不需要加锁，也不会看到写了一半的状态。
+
+FAISS 索引体积太大不做复制，由 AnnIndex 内部的读写锁保护；快照中的行号映射决定哪些索引结果有效，
+搜索期间新加入的文本块会被跳过，刚删除的文本块也不会再出现。
+"""
+
+from typing import Dict, List, Optional, Tuple
+
+from tombstones import LiveView
+
+
+class KnowledgeSnapshot:
+    """某一时刻知识库的完整只读状态（属性含义同 FaissVectorStore 中的同名属性）"""
+
+    __slots__ = ('chunks', 'chunk_ids', 'chunk_rows', 'source_chunks', 'metadata_index', 'tombstones',
+                 'embedding_matrix', 'keyword_index', 'ann_index', 'sentence_index', 'shard_router', 'generation')
+
+    def __init__(self, chunks, chunk_ids: List[int], chunk_rows: Dict[int, int],
+                 source_chunks: Dict[str, Dict[int, None]], metadata_index, tombstones, embedding_matrix,
+                 keyword_index, ann_index, sentence_index, shard_router, generation: int):
+        self.chunks = chunks
+        self.chunk_ids = chunk_ids
+        self.chunk_rows = chunk_rows
+        self.source_chunks = source_chunks
+        self.metadata_index = metadata_index
+        self.tombstones = tombstones
+        self.embedding_matrix = embedding_matrix
+        self.keyword_index = keyword_index
+        self.ann_index = ann_index
+        self.sentence_index = sentence_index
+        self.shard_router = shard_router
+        self.generation = generation
+
+    @property
+    def documents(self) -> LiveView:
+        """未删除的文本块 (text, metadata) 序列"""
+        return LiveView(self.chunks, self.tombstones)
+
+    def live_chunk_ids(self) -> List[int]:
+        """未删除文本块的 ID，顺序与 documents 一致"""
+        if self.tombstones.count == 0:
+            return list(self.chunk_ids)
+        return [self.chunk_ids[row] for row in self.tombstones.live_rows()]
+
+    def get_text_block(self, chunk_id: int) -> Optional[Tuple[str, Dict]]:
+        """按 ID 获取文本块，不存在或已删除时返回 None"""
+        row = self.chunk_rows.get(chunk_id)
+        return None if row is None else self.chunks[row]
+
+    def chunk_ids_for_source(self, source: str) -> List[int]:
+        """指定源文件的全部未删除文本块 ID"""
+        return list(self.source_chunks.get(str(source), ()))
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+流式入库编码
+上传大文件（例如上万行的 Excel）时，原来把全部文本块和句子一次提交给编码服务：
+编码服务按提交顺序每 32 条切一批，长短不一的文本在同一批中按最长的一条填充；
+全部向量编好之后才拼接成一个大矩阵，峰值内存随上传规模线性增长。
+
+StreamingEncoder 改为：
+- 按窗口（window_size 个文本块）依次编码，每个窗口的文本块和句子向量编好后写入
+  预先分配的结果矩阵，中间结果只占一个窗口的内存；
+- 窗口内的文本按长度排序后切分批次，每批最多 max_batch_size 条，且
+  条数 × 最长文本长度不超过 max_batch_tokens，同一批中的文本长度接近，填充最少；
+- 每一批作为一个独立的入库请求提交给编码服务，查询仍然可以插在两批之间优先编码。
+- 配置了持久化向量缓存（embedding_cache.EmbeddingCache）时先查缓存，只有未命中的文本参与分桶编码。
+
+文本长度按字符数估算 token 数（text2vec-base-chinese 的中文分词基本是一字一个 token），
+超过 max_length 的部分会被模型截断，不计入批次的 token 数。
+"""
+
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from sentence_index import MAX_SENTENCES, encode_sentences, encode_with_sentences
+
+
+class StreamingEncoder:
+    """按长度分桶、按窗口流式编码入库文本（线程安全）"""
+
+    def __init__(self, encode: Callable[[List[str]], np.ndarray], max_batch_size: int = 32,
+                 max_batch_tokens: int = 8192, window_size: int = 2048, max_length: int = 512,
+                 cache=None):
+        """
+        Args:
+            encode: 批量编码函数，输入文本列表，返回向量矩阵
+            max_batch_size: 每批最多的文本数量
+            max_batch_tokens: 每批按最长文本填充后的 token 数上限
+            window_size: 每个窗口的文本块数量
+            max_length: 模型的最大 token 数，更长的文本按该长度计算
+            cache: 持久化向量缓存（EmbeddingCache），为 None 时每次都调用模型
+        """
+        self.encode_batch = encode
+        self.cache = cache
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_batch_tokens = max(1, max_batch_tokens)
+        self.window_size = max(1, window_size)
+        self.max_length = max(1, max_length)
+        self._lock = threading.Lock()
+        self._stats = {"texts": 0, "batches": 0, "tokens": 0, "padded_tokens": 0}
+
+    def batches(self, texts: List[str]) -> List[np.ndarray]:
+        """按长度排序后切分批次，返回每批文本在 texts 中的下标"""
+        lengths = np.minimum([len(text) for text in texts], self.max_length)
+        order = np.argsort(lengths, kind='stable')
+        batches = []
+        start = 0
+        while start < len(order):
+            stop = start + 1
+            # 升序排列，批内最长的是最后一条
+            while (stop < len(order) and stop - start < self.max_batch_size
+                   and (stop - start + 1) * max(1, lengths[order[stop]]) <= self.max_batch_tokens):
+                stop += 1
+            batches.append(order[start:stop])
+            start = stop
+        return batches
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        """按长度分桶编码，结果按 texts 的顺序写入预先分配的矩阵（缓存命中的文本不再编码）"""
+        if self.cache is not None:
+            return self.cache.encode(list(texts), self._encode_buckets)
+        return self._encode_buckets(list(texts))
+
+    def _encode_buckets(self, texts: List[str]) -> np.ndarray:
+        if not texts:
+            return np.asarray(self.encode_batch([]), dtype=np.float32)
+        vectors: Optional[np.ndarray] = None
+        tokens = padded = 0
+        batches = self.batches(texts)
+        for batch in batches:
+            batch_texts = [texts[i] for i in batch]
+            encoded = np.asarray(self.encode_batch(batch_texts), dtype=np.float32)
+            if vectors is None:
+                vectors = np.empty((len(texts), encoded.shape[1]), dtype=np.float32)
+            vectors[batch] = encoded
+            lengths = [min(len(text), self.max_length) for text in batch_texts]
+            tokens += sum(lengths)
+            padded += max(lengths) * len(lengths)
+        with self._lock:
+            self._stats["texts"] += len(texts)
+            self._stats["batches"] += len(batches)
+            self._stats["tokens"] += tokens
+            self._stats["padded_tokens"] += padded
+        return vectors
+
+    def encode_chunks(self, texts: List[str], limit: int = MAX_SENTENCES) -> Tuple[np.ndarray, List[np.ndarray]]:
+        """逐窗口编码文本块和它们的前几个句子（语义同 sentence_index.encode_with_sentences）
+
+        Returns:
+            Tuple[np.ndarray, List[np.ndarray]]: (文本块的原始向量, 每个文本块的归一化句子向量)
+        """
+        texts = list(texts)
+        if not texts:
+            return encode_with_sentences(self.encode, texts, limit)
+        embeddings: Optional[np.ndarray] = None
+        sentence_vectors: List[np.ndarray] = []
+        for start in range(0, len(texts), self.window_size):
+            window = texts[start:start + self.window_size]
+            vectors, sentences = encode_with_sentences(self.encode, window, limit)
+            if embeddings is None:
+                embeddings = np.empty((len(texts), vectors.shape[1]), dtype=np.float32)
+            embeddings[start:start + len(window)] = vectors
+            sentence_vectors.extend(sentences)
+        return embeddings, sentence_vectors
+
+    def encode_sentences(self, texts: List[str], limit: int = MAX_SENTENCES) -> List[np.ndarray]:
+        """逐窗口编码文本块的前几个句子（语义同 sentence_index.encode_sentences）"""
+        texts = list(texts)
+        sentence_vectors: List[np.ndarray] = []
+        for start in range(0, len(texts), self.window_size):
+            sentence_vectors.extend(encode_sentences(self.encode, texts[start:start + self.window_size], limit))
+        return sentence_vectors
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            padded = self._stats["padded_tokens"]
+            return {
+                "texts": self._stats["texts"],
+                "batches": self._stats["batches"],
+                "avg_batch_size": self._stats["texts"] / self._stats["batches"] if self._stats["batches"] else 0.0,
+                "padding_ratio": 1 - self._stats["tokens"] / padded if padded else 0.0,
+                "window_size": self.window_size,
+                "max_batch_tokens": self.max_batch_tokens
+            }
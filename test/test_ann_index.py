@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试FAISS索引管理
+"""
+
+import sys
+import threading
+from pathlib import Path
+
+import faiss
+import numpy as np
+
+# 添加项目根目录到Python路径
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from ann_index import AnnIndex, CODEC_PQ, CODEC_SQ8, INDEX_FLAT, INDEX_IVF, INDEX_HNSW
+from embedding_matrix import normalize_rows
+
+
+def _vectors(n, dim=16, seed=0):
+    return normalize_rows(np.random.default_rng(seed).standard_normal((n, dim)))
+
+
+def test_index_type_follows_corpus_size():
+    """索引类型随规模切换"""
+    print("=== 测试索引类型选择 ===")
+    index = AnnIndex(16, flat_threshold=100, hnsw_threshold=1000)
+    assert index.choose_index_type(10) == INDEX_FLAT
+    assert index.choose_index_type(500) == INDEX_IVF
+    assert index.choose_index_type(5000) == INDEX_HNSW
+
+    index.build(_vectors(50))
+    assert index.index_type == INDEX_FLAT and index.ntotal == 50
+    assert index.should_rebuild(150)
+
+    index.build(_vectors(400))
+    assert index.index_type == INDEX_IVF
+    assert not index.should_rebuild(500)
+    assert index.should_rebuild(900)
+    print("✓ 索引类型选择正确")
+
+
+def test_search_remove_and_reset():
+    """搜索、删除与重置"""
+    print("=== 测试搜索与删除 ===")
+    vectors = _vectors(200)
+    index = AnnIndex(16, flat_threshold=100, hnsw_threshold=1000)
+    index.build(vectors)
+
+    ids, scores = index.search(vectors[7], 5)
+    assert ids[0] == 7 and abs(scores[0] - 1.0) < 1e-4
+
+    assert index.remove([7])
+    assert index.ntotal == 199
+    ids, _ = index.search(vectors[7], 5)
+    assert 7 not in ids
+
+    # 规模不变时重置保留 IVF 训练结果
+    index.reset_vectors(vectors[:150])
+    assert index.index_type == INDEX_IVF and index.ntotal == 150
+    print("✓ 搜索与删除正确")
+
+
+def test_remove_twice_from_ivf_index():
+    """IVF 索引多次删除向量后搜索返回正确的文本块 ID"""
+    print("=== 测试 IVF 多次删除 ===")
+    vectors = _vectors(400)
+    index = AnnIndex(16, flat_threshold=100, hnsw_threshold=1000)
+    index.build(vectors)
+    assert index.index_type == INDEX_IVF
+
+    assert index.remove(range(50))
+    assert index.ntotal == 350
+    for chunk_id in (100, 250, 399):
+        ids, scores = index.search(vectors[chunk_id], 1)
+        assert ids[0] == chunk_id and abs(scores[0] - 1.0) < 1e-4
+    ids, _ = index.search(vectors[10], 400)
+    assert ids.min() >= 50
+
+    assert index.remove(range(50, 60))
+    assert index.ntotal == 340
+    for chunk_id in (100, 250, 399):
+        ids, _ = index.search(vectors[chunk_id], 1)
+        assert ids[0] == chunk_id
+    ids, _ = index.search(vectors[55], 400)
+    assert ids.min() >= 60
+    print("✓ IVF 多次删除正确")
+
+
+def test_adopt_saved_index(tmp_path=None):
+    """接管保存到磁盘的索引，拒绝旧的 IndexFlatL2"""
+    print("=== 测试加载已保存索引 ===")
+    import tempfile
+    tmp_dir = Path(tmp_path or tempfile.mkdtemp())
+    index = AnnIndex(16)
+    index.build(_vectors(20))
+    path = str(tmp_dir / "ann.index")
+    faiss.write_index(index.index, path)
+
+    loaded = AnnIndex(16)
+    assert loaded.adopt(faiss.read_index(path))
+    assert loaded.ntotal == 20 and loaded.index_type == INDEX_FLAT
+
+    legacy = faiss.IndexFlatL2(16)
+    assert not AnnIndex(16).adopt(legacy)
+    print("✓ 索引加载正确")
+
+
+def test_replace_vectors():
+    """替换向量：支持删除的索引原地替换，HNSW 追加新向量并按 ID 去重"""
+    print("=== 测试替换向量 ===")
+    vectors = _vectors(50)
+    new_vector = _vectors(1, seed=1)
+
+    index = AnnIndex(16)
+    index.build(vectors)
+    index.replace(new_vector, [3])
+    assert index.ntotal == 50 and index.stale_count == 0
+    ids, scores = index.search(new_vector[0], 1)
+    assert ids[0] == 3 and abs(scores[0] - 1.0) < 1e-4
+
+    hnsw = AnnIndex(16, flat_threshold=1, hnsw_threshold=1)
+    hnsw.build(vectors)
+    assert hnsw.index_type == INDEX_HNSW
+    hnsw.replace(new_vector, [3])
+    assert hnsw.ntotal == 51 and hnsw.stale_count == 1
+    ids, _ = hnsw.search(new_vector[0], 51)
+    assert ids[0] == 3 and len(set(ids.tolist())) == len(ids)
+    print("✓ 替换向量正确")
+
+
+def test_replace_in_ivf_index():
+    """IVF 索引多次替换向量后搜索仍返回正确的 ID，旧版本包在 IndexIDMap2 中的 IVF 索引需要重建"""
+    print("=== 测试 IVF 替换向量 ===")
+    vectors = _vectors(400)
+    index = AnnIndex(16, flat_threshold=100, hnsw_threshold=1000)
+    index.build(vectors)
+    assert index.index_type == INDEX_IVF and not isinstance(index.index, faiss.IndexIDMap2)
+    for seed, chunk_id in ((1, 3), (2, 3), (3, 250)):
+        new_vector = _vectors(1, seed=seed)
+        index.replace(new_vector, [chunk_id])
+        assert index.ntotal == 400
+        ids, scores = index.search(new_vector[0], 1)
+        assert ids[0] == chunk_id and abs(scores[0] - 1.0) < 1e-4
+        ids, _ = index.search(vectors[100], 1)
+        assert ids[0] == 100
+
+    loaded = AnnIndex(16, flat_threshold=100, hnsw_threshold=1000)
+    assert loaded.adopt(faiss.deserialize_index(faiss.serialize_index(index.index)))
+    assert loaded.index_type == INDEX_IVF and loaded.ntotal == 400
+    inner = faiss.clone_index(index.index)
+    inner.reset()
+    legacy = faiss.IndexIDMap2(inner)
+    legacy.add_with_ids(vectors, np.arange(400))
+    assert not AnnIndex(16, flat_threshold=100, hnsw_threshold=1000).adopt(legacy)
+    print("✓ IVF 替换向量正确")
+
+
+def test_compressed_codecs():
+    """压缩编码：样本不足时 pq 退回 sq8，空索引用第一批向量训练，保存后能识别编码"""
+    print("=== 测试压缩编码 ===")
+    vectors = _vectors(300)
+    index = AnnIndex(16, flat_threshold=100, hnsw_threshold=1000, compression=CODEC_PQ, pq_m=8, pq_min_train=250)
+    assert index.codec == CODEC_SQ8 and index.choose_codec(300) == CODEC_PQ
+
+    index.add(vectors[:50], np.arange(50))
+    assert index.ntotal == 50 and index.trained_size == 50
+    ids, _ = index.search(vectors[7], 5)
+    assert 7 in ids
+    assert index.should_rebuild(300)
+
+    index.build(vectors)
+    assert index.index_type == INDEX_IVF and index.codec == CODEC_PQ
+    index.remove([7])
+    assert index.ntotal == 299
+
+    loaded = AnnIndex(16, flat_threshold=100, hnsw_threshold=1000, compression=CODEC_PQ, pq_m=8, pq_min_train=250)
+    assert loaded.adopt(faiss.deserialize_index(faiss.serialize_index(index.index)))
+    assert loaded.index_type == INDEX_IVF and loaded.codec == CODEC_PQ
+    assert not loaded.should_rebuild(300)
+    print("✓ 压缩编码正确")
+
+
+def test_concurrent_search_during_updates():
+    """其他线程增删向量、重建索引时搜索不出错，结果中只有有效的 ID"""
+    print("=== 测试并发搜索 ===")
+    vectors = _vectors(2000)
+    index = AnnIndex(16, flat_threshold=500, hnsw_threshold=100000)
+    index.build(vectors[:1000], np.arange(1000))
+    errors = []
+    stop = threading.Event()
+
+    def searcher():
+        while not stop.is_set():
+            try:
+                ids, _ = index.search(vectors[0], 10)
+                assert ((ids >= 0) & (ids < 2000)).all()
+            except Exception as e:
+                errors.append(e)
+
+    threads = [threading.Thread(target=searcher) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for start in range(1000, 2000, 100):
+        index.add(vectors[start:start + 100], np.arange(start, start + 100))
+        index.remove(range(start - 1000, start - 950))
+    index.reset_vectors(vectors[:1500], np.arange(1500))
+    stop.set()
+    for t in threads:
+        t.join()
+    assert not errors and index.ntotal == 1500
+    print("✓ 并发搜索正确")
+
+
+if __name__ == "__main__":
+    test_index_type_follows_corpus_size()
+    test_search_remove_and_reset()
+    test_remove_twice_from_ivf_index()
+    test_adopt_saved_index()
+    test_replace_vectors()
+    test_replace_in_ivf_index()
+    test_compressed_codecs()
+    test_concurrent_search_during_updates()
+    print("所有测试完成")
@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试列式向量存储格式
+"""
+
+import sys
+import tempfile
+from pathlib import Path
+
+import numpy as np
+
+# 添加项目根目录到Python路径
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+import columnar_store
+import segment_log
+from columnar_store import SegmentStore, open_store, write_store
+from embedding_matrix import EmbeddingMatrix
+
+
+DOCUMENTS = [
+    ("智能手机的价格是三千元", {'source': 'a.txt', 'filename': 'a.txt'}),
+    ("系统支持文档上传和搜索功能", {'source': 'a.txt', 'filename': 'a.txt'}),
+    ("第 3 行：退货政策", {'source': 'b.xlsx', 'sheet': 'Sheet1', 'row': 3}),
+]
+TERMS = [{"智能": 1, "手机": 1}, {"文档": 1}, {"退货": 2}]
+
+
+def _embeddings(n, seed=0):
+    return np.random.default_rng(seed).standard_normal((n, 4)).astype(np.float32)
+
+
+def _normalized(vectors):
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def _add_record(ids, texts, seed):
+    return {
+        'op': segment_log.OP_ADD,
+        'ids': ids,
+        'documents': [(text, {'source': 'log.txt'}) for text in texts],
+        'embeddings': _embeddings(len(ids), seed),
+        'keyword_terms': [{text: 1} for text in texts]
+    }
+
+
+def test_round_trip():
+    """写入后以 mmap 方式读回，内容保持一致"""
+    print("=== 测试写入与读取 ===")
+    with tempfile.TemporaryDirectory() as tmp:
+        path = str(Path(tmp) / "vector_store")
+        assert not columnar_store.vector_store_exists(path)
+        embeddings = _embeddings(3)
+        write_store(path, DOCUMENTS, embeddings, keyword_terms=TERMS)
+        assert columnar_store.vector_store_exists(path)
+
+        snapshot = open_store(path)
+        assert len(snapshot) == 3
+        assert snapshot.ids == [0, 1, 2] and snapshot.next_id == 3
+        assert isinstance(snapshot.embeddings, np.memmap)
+        assert np.allclose(snapshot.embeddings, _normalized(embeddings))
+        assert list(snapshot.documents) == DOCUMENTS
+        assert snapshot.keyword_terms == TERMS
+        assert snapshot.index is None
+
+        # 同一文档的元数据只保存一份，返回的是副本
+        segment = snapshot.documents.reader.segments[0]
+        assert len(segment._metadata) == 2
+        segment.metadata(0)['source'] = 'changed'
+        assert segment.metadata(1)['source'] == 'a.txt'
+        del snapshot, segment
+    print("✓ 读写一致")
+
+
+def test_chunk_table_behaves_like_list():
+    """ChunkTable 的增删改与普通列表一致"""
+    print("=== 测试文本块表 ===")
+    with tempfile.TemporaryDirectory() as tmp:
+        path = str(Path(tmp) / "vector_store")
+        write_store(path, DOCUMENTS, _embeddings(3), keyword_terms=TERMS)
+        table = open_store(path).documents
+        expected = list(DOCUMENTS)
+
+        assert table[:2] == expected[:2]
+        assert table.text(2) == expected[2][0]
+        assert [table.source(i) for i in range(3)] == ['a.txt', 'a.txt', 'b.xlsx']
+
+        table.append(("新文本", {'source': 'c.txt'}))
+        expected.append(("新文本", {'source': 'c.txt'}))
+        table[0] = ("更新后的文本", {'source': 'a.txt'})
+        expected[0] = ("更新后的文本", {'source': 'a.txt'})
+        del table[1]
+        del expected[1]
+        assert list(table) == expected
+        assert len(table) == 3
+        assert table.source(0) == 'a.txt' and table.source(2) == 'c.txt'
+        del table
+    print("✓ 行为与列表一致")
+
+
+def test_log_replay_flush_and_compaction():
+    """日志重放、落盘为新段、合并之后内容保持一致"""
+    print("=== 测试日志重放、落盘与合并 ===")
+    with tempfile.TemporaryDirectory() as tmp:
+        path = str(Path(tmp) / "vector_store")
+        store = SegmentStore(path, max_deleted_ratio=0.1)
+        store.create(DOCUMENTS, _embeddings(3), keyword_terms=TERMS)
+        update = _add_record([0], ["更新后的手机"], seed=2)
+        update['op'] = segment_log.OP_UPDATE
+        store.append([
+            _add_record([3, 4], ["新增一", "新增二"], seed=1),
+            update,
+            {'op': segment_log.OP_DELETE, 'ids': [1, 3]},
+        ])
+
+        def contents(snapshot):
+            return ([text for text, _ in snapshot.documents], snapshot.ids,
+                    np.asarray(snapshot.embeddings), snapshot.keyword_terms)
+
+        replayed = open_store(path)
+        texts, ids, vectors, terms = contents(replayed)
+        assert texts == ["更新后的手机", "第 3 行：退货政策", "新增二"]
+        assert ids == [0, 2, 4] and replayed.next_id == 5
+        assert terms == [{"更新后的手机": 1}, {"退货": 2}, {"新增二": 1}]
+        assert np.allclose(vectors[0], _normalized(_embeddings(1, 2))[0])
+        # 段中的向量保持 mmap，日志中的向量单独放在一个小矩阵中
+        blocks = replayed.embeddings.blocks
+        assert isinstance(blocks[0], np.memmap) and len(blocks) == 2 and len(blocks[1]) == 3
+        # 日志中出现过的文本块需要在索引中重新同步
+        assert replayed.stale_ids == {0, 1, 3, 4}
+
+        store.flush()
+        flushed = open_store(path)
+        assert contents(flushed)[:2] == (texts, ids)
+        assert np.allclose(contents(flushed)[2], vectors)
+        assert store.wal_size == 0
+        manifest = store.read_manifest()
+        assert len(manifest['segments']) == 2 and manifest['deleted_count'] == 1
+
+        assert store.needs_compaction()
+        assert store.compact()
+        compacted = open_store(path)
+        assert contents(compacted)[:2] == (texts, ids)
+        assert contents(compacted)[3] == terms
+        manifest = store.read_manifest()
+        assert len(manifest['segments']) == 1 and manifest['deleted_count'] == 0
+        assert not store.needs_compaction()
+        del replayed, flushed, compacted
+    print("✓ 重放、落盘与合并正确")
+
+
+def test_multiple_segments_stay_mapped():
+    """多个段的向量不拼接复制：按行读取只复制请求的行，打分逐段进行"""
+    print("=== 测试多段向量不复制 ===")
+    with tempfile.TemporaryDirectory() as tmp:
+        path = str(Path(tmp) / "vector_store")
+        store = SegmentStore(path)
+        store.create(DOCUMENTS, _embeddings(3), keyword_terms=TERMS)
+        store.append([_add_record([3, 4], ["新增一", "新增二"], seed=1)])
+        store.flush()
+        expected = _normalized(np.concatenate([_embeddings(3), _embeddings(2, 1)]))
+
+        snapshot = open_store(path)
+        vectors = snapshot.embeddings
+        assert len(vectors.blocks) == 2 and all(isinstance(b, np.memmap) for b in vectors.blocks)
+        assert vectors.shape == (5, 4) and np.allclose(vectors[[4, 0]], expected[[4, 0]])
+        assert np.allclose(np.asarray(vectors), expected)
+
+        matrix = EmbeddingMatrix()
+        matrix.attach(vectors)
+        assert matrix.vectors is vectors
+        query = np.array([1.0, 0, 0, 0])
+        assert np.allclose(matrix.score(query), np.clip(expected @ query, 0, 1))
+        matrix.set_row(0, np.array([0, 0, 0, 1.0]))
+        assert matrix.vectors.flags.writeable and np.allclose(matrix.vectors[1:], expected[1:])
+
+        # 删除后的行号映射到各段，仍然不复制
+        store.append([{'op': segment_log.OP_DELETE, 'ids': [1]}])
+        store.flush()
+        vectors = open_store(path).embeddings
+        assert all(isinstance(b, np.memmap) for b in vectors.blocks)
+        assert np.allclose(vectors[[0, 1, 3]], expected[[0, 2, 4]])
+        del snapshot, matrix, vectors
+    print("✓ 多段向量按需读取")
+
+
+def test_torn_log_tail_is_ignored_and_truncated():
+    """日志末尾不完整的记录在读取时被忽略，下次追加时被截掉"""
+    print("=== 测试不完整的日志记录 ===")
+    with tempfile.TemporaryDirectory() as tmp:
+        path = str(Path(tmp) / "vector_store")
+        store = SegmentStore(path)
+        store.create(DOCUMENTS, _embeddings(3), keyword_terms=TERMS)
+        store.append([_add_record([3], ["新增一"], seed=1)])
+        with open(store.wal_path, 'ab') as f:
+            f.write(b'\x40\x00\x00\x00\x00\x00\x00\x00partial')
+
+        reader = SegmentStore(path)
+        assert len(reader.open()) == 4
+
+        store.append([_add_record([4], ["新增二"], seed=2)])
+        records, end = segment_log.read_records(store.wal_path)
+        assert [r['ids'] for r in records] == [[3], [4]]
+        assert end == store.wal_size
+    print("✓ 不完整的记录被正确处理")
+
+
+def test_obsolete_files_and_copy_on_write():
+    """只保留当前和上一版清单引用的文件；mmap 向量在写入时才复制"""
+    print("=== 测试旧文件清理与写时复制 ===")
+    with tempfile.TemporaryDirectory() as tmp:
+        path = str(Path(tmp) / "vector_store")
+        for _ in range(3):
+            write_store(path, DOCUMENTS, _embeddings(3))
+        names = sorted(p.name for p in columnar_store.store_dir(path).iterdir())
+        assert names == ['CURRENT', 'MANIFEST-000002', 'MANIFEST-000003',
+                         'seg-000002', 'seg-000003', 'wal-000002.log', 'wal-000003.log']
+
+        snapshot = open_store(path)
+        matrix = EmbeddingMatrix()
+        matrix.attach(snapshot.embeddings)
+        assert not matrix.vectors.flags.writeable
+        matrix.set_row(0, np.array([0, 0, 0, 1.0]))
+        assert matrix.vectors.flags.writeable
+        assert np.allclose(matrix.vectors[0], [0, 0, 0, 1])
+        assert not np.allclose(snapshot.embeddings[0], [0, 0, 0, 1])
+        del matrix, snapshot
+    print("✓ 清理与写时复制正确")
+
+
+if __name__ == "__main__":
+    test_round_trip()
+    test_chunk_table_behaves_like_list()
+    test_log_replay_flush_and_compaction()
+    test_multiple_segments_stay_mapped()
+    test_torn_log_tail_is_ignored_and_truncated()
+    test_obsolete_files_and_copy_on_write()
+    print("所有测试完成")
@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试文档级粗路由
+"""
+
+import sys
+from pathlib import Path
+
+# 添加项目根目录到Python路径
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+sys.path.insert(0, str(Path(__file__).parent))
+
+from shard_router import ShardRouter
+from test_search_threshold import create_hash_store
+
+
+def test_document_route_without_shard_probe():
+    """只开启文档路由（shard_probe = 0）时，路由后仍超过精确打分上限的幸存行由向量召回，不只剩 BM25 排名"""
+    print("=== 测试只开启文档路由 ===")
+    store = create_hash_store()
+    store.document_route_top = 2
+    store.document_route_min_score = 0.0
+    store.document_route_margin = 0.0
+    store.shard_router = ShardRouter()
+    store.lexical_exact_limit = 3
+    assert store.shard_probe == 0
+    texts = [f"{brand}手机退货说明第{i}条" for brand in ("苹果", "华为", "小米", "三星") for i in range(4)]
+    store.add(texts, [{'source': f"{text[:2]}.txt"} for text in texts])
+
+    results = store.search("苹果手机退货", top_k=3)
+    assert results and store.route_stats.stats()['routed'] == 1
+    # 文本块同时出现在向量排名和 BM25 排名中时，融合分数超过只出现在一个排名中的上限 0.5
+    assert all(float(metadata['_debug_info']['rrf_score']) > 0.5 for _, _, metadata in results)
+    assert store.get_statistics()['shards'] is None
+    print("✓ 只开启文档路由正确")
+
+
+if __name__ == "__main__":
+    test_document_route_without_shard_probe()
+    print("所有测试完成")
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试持久化向量缓存
+"""
+
+import sys
+import tempfile
+from pathlib import Path
+
+import numpy as np
+
+# 添加项目根目录到Python路径
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from embedding_cache import EmbeddingCache
+from streaming_encoder import StreamingEncoder
+
+
+class CountingEncoder:
+    """记录编码过的文本的假模型"""
+
+    def __init__(self):
+        self.texts = []
+
+    def __call__(self, texts):
+        self.texts.extend(texts)
+        return np.array([[len(text), ord(text[0]), 1.0, 0.0] for text in texts], dtype=np.float32).reshape(-1, 4)
+
+
+def test_hits_survive_restart_and_model_change():
+    """重新打开缓存后仍然命中；空白不同的文本共用向量；换模型后不命中"""
+    print("=== 测试缓存命中 ===")
+    path = Path(tempfile.mkdtemp()) / 'embedding_cache.db'
+    model = CountingEncoder()
+    cache = EmbeddingCache(str(path), model_id='text2vec:768')
+    texts = ["第一行 内容", "第二行", "第三行"]
+    first = cache.encode(texts, model)
+    assert model.texts == texts
+    cache.close()
+
+    cache = EmbeddingCache(str(path), model_id='text2vec:768')
+    again = cache.encode(["第二行", "  第一行   内容 ", "第四行"], model)
+    assert model.texts == texts + ["第四行"]
+    assert np.array_equal(again[:2], first[[1, 0]])
+    stats = cache.stats()
+    assert stats['hits'] == 2 and stats['misses'] == 1 and stats['entries'] == 4
+
+    cache.model_id = 'text2vec:768:onnx_int8'
+    cache.encode(["第二行"], model)
+    assert model.texts[-1] == "第二行"
+    cache.close()
+    print("✓ 缓存命中正确")
+
+
+def test_size_bound_evicts_least_recently_used():
+    """超过大小上限时淘汰最久没有使用的向量"""
+    print("=== 测试按大小淘汰 ===")
+    path = Path(tempfile.mkdtemp()) / 'embedding_cache.db'
+    cache = EmbeddingCache(str(path), max_mb=1000 * 16 / 1024 / 1024)  # 最多 1000 条 4 维向量
+    model = CountingEncoder()
+    cache.encode([f"旧{i}" for i in range(600)], model)
+    cache.encode([f"旧{i}" for i in range(300)], model)  # 前 300 条最近使用过
+    cache.encode([f"新{i}" for i in range(600)], model)
+    stats = cache.stats()
+    assert stats['size_mb'] <= cache.max_bytes / 1024 / 1024 and stats['evictions'] > 0
+    kept = cache.get_many([f"旧{i}" for i in range(600)])
+    assert all(vector is not None for vector in kept[:300]) and all(vector is None for vector in kept[300:])
+    cache.close()
+    print("✓ 按大小淘汰正确")
+
+
+def test_streaming_encoder_skips_cached_texts():
+    """流式编码器只把未命中的文本交给模型"""
+    print("=== 测试入库编码使用缓存 ===")
+    cache = EmbeddingCache(str(Path(tempfile.mkdtemp()) / 'embedding_cache.db'))
+    model = CountingEncoder()
+    encoder = StreamingEncoder(model, max_batch_size=4, cache=cache)
+    texts = [f"文本块{i}。第二句{i}" for i in range(10)]
+    embeddings, _ = encoder.encode_chunks(texts)
+    encoded = len(model.texts)
+    again, _ = encoder.encode_chunks(texts[:5] + ["新的文本块"])
+    assert len(model.texts) == encoded + 1 and np.array_equal(again[:5], embeddings[:5])
+    assert encoder.stats()['texts'] == encoded + 1
+    cache.close()
+    print("✓ 入库编码使用缓存正确")
+
+
+if __name__ == "__main__":
+    test_hits_survive_restart_and_model_change()
+    test_size_bound_evicts_least_recently_used()
+    test_streaming_encoder_skips_cached_texts()
+    print("所有测试完成")
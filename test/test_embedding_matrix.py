@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试向量打分矩阵
+"""
+
+import sys
+import tempfile
+from pathlib import Path
+
+import numpy as np
+
+# 添加项目根目录到Python路径
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from embedding_matrix import EmbeddingMatrix, STORAGE_FLOAT16, STORAGE_INT8, normalize_rows, select_top_k
+
+
+def _legacy_scores(query, embeddings):
+    """旧实现的逐块余弦相似度"""
+    q = query / np.linalg.norm(query)
+    scores = []
+    for vec in embeddings:
+        v = vec / np.linalg.norm(vec)
+        scores.append(max(0.0, min(1.0, float(np.dot(q, v)))))
+    return np.array(scores)
+
+
+def test_top_k_matches_legacy_loop():
+    """矩阵打分结果应与逐块循环一致"""
+    print("=== 测试矩阵打分与逐块循环一致 ===")
+    rng = np.random.default_rng(0)
+    embeddings = rng.standard_normal((500, 32)).astype(np.float32)
+    query = rng.standard_normal(32).astype(np.float32)
+
+    matrix = EmbeddingMatrix()
+    matrix.append(embeddings)
+
+    rows, scores = matrix.top_k(query, 10)
+    expected = _legacy_scores(query, embeddings)
+    expected_rows = np.argsort(-expected, kind='stable')[:10]
+
+    assert list(rows) == list(expected_rows)
+    assert np.allclose(scores, expected[expected_rows], atol=1e-5)
+
+    # 多个查询一次矩阵乘法打分，与逐个查询一致
+    queries = rng.standard_normal((3, 32)).astype(np.float32)
+    subset = np.array([3, 40, 41, 499])
+    many = matrix.score_many(queries, subset)
+    assert many.shape == (4, 3)
+    for column, q in enumerate(queries):
+        assert np.allclose(many[:, column], matrix.score(q, subset), atol=1e-6)
+    print("✓ top-k 结果一致")
+
+
+def test_min_score_and_candidate_rows():
+    """最低分过滤和候选行限制"""
+    print("=== 测试最低分过滤和候选行 ===")
+    matrix = EmbeddingMatrix()
+    matrix.append(np.eye(4, dtype=np.float32))
+    query = np.array([1.0, 0.5, 0.0, 0.0], dtype=np.float32)
+
+    rows, scores = matrix.top_k(query, 4, min_score=0.3)
+    assert list(rows) == [0, 1]
+
+    rows, _ = matrix.top_k(query, 4, rows=np.array([1, 2, 3]))
+    assert rows[0] == 1
+    print("✓ 过滤结果正确")
+
+
+def test_append_grows_and_delete_keeps_order():
+    """追加扩容与删除后的行顺序"""
+    print("=== 测试追加与删除 ===")
+    matrix = EmbeddingMatrix(initial_capacity=2)
+    for i in range(5):
+        vec = np.zeros((1, 5), dtype=np.float32)
+        vec[0, i] = 2.0
+        matrix.append(vec)
+
+    assert len(matrix) == 5
+    assert np.allclose(matrix.vectors, np.eye(5))
+
+    matrix.delete_rows([1, 3])
+    assert len(matrix) == 3
+    assert np.allclose(matrix.vectors, np.eye(5)[[0, 2, 4]])
+
+    matrix.set_row(0, np.array([0, 3.0, 0, 0, 0]))
+    assert np.allclose(matrix.vectors[0], [0, 1, 0, 0, 0])
+    matrix.set_rows([1, 2], np.array([[0, 0, 0, 0, 5.0], [4.0, 0, 0, 0, 0]]))
+    assert np.allclose(matrix.vectors[1:], np.eye(5)[[4, 0]])
+    assert np.allclose(normalize_rows(np.zeros(5)), 0)
+    print("✓ 追加与删除正确")
+
+
+def test_compressed_storage_reranks_with_exact_vectors():
+    """压缩模式：内存占用减少，有 mmap 精确向量时 top-k 与 float32 一致"""
+    print("=== 测试压缩存储与精确重排 ===")
+    rng = np.random.default_rng(1)
+    embeddings = normalize_rows(rng.standard_normal((2000, 64)))
+    queries = rng.standard_normal((20, 64)).astype(np.float32)
+
+    exact = EmbeddingMatrix()
+    exact.append(embeddings)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "embeddings.npy"
+        np.save(path, embeddings)
+        source = np.load(path, mmap_mode='r')
+        for storage, ratio in ((STORAGE_FLOAT16, 1.8), (STORAGE_INT8, 3)):
+            matrix = EmbeddingMatrix(storage=storage)
+            matrix.attach(source)
+            assert matrix.nbytes * ratio <= exact.nbytes
+            assert np.array_equal(matrix[[5, 9]], embeddings[[5, 9]])
+            for query in queries:
+                rows, scores = matrix.top_k(query, 10)
+                expected_rows, expected_scores = exact.top_k(query, 10)
+                assert list(rows) == list(expected_rows)
+                assert np.allclose(scores, expected_scores, atol=1e-6)
+
+            # 新增和修改的行没有精确向量，使用解码后的近似向量
+            matrix.set_rows([0], embeddings[[1]])
+            rows = matrix.append(embeddings[:2])
+            assert np.allclose(matrix[[0, rows[1]]], embeddings[[1, 1]], atol=1e-2)
+            matrix.delete_rows([0])
+            assert len(matrix) == 2001
+            assert np.array_equal(matrix[[0]], embeddings[[1]])
+            del matrix
+        del source
+    print("✓ 压缩存储与精确重排正确")
+
+
+def test_copy_shares_buffer_until_rows_change():
+    """副本共享缓冲区：追加的行原矩阵看不到，修改已有行前先复制缓冲区"""
+    print("=== 测试写时复制 ===")
+    rng = np.random.default_rng(2)
+    embeddings = normalize_rows(rng.standard_normal((10, 8)))
+    for storage in (None, STORAGE_INT8):
+        matrix = EmbeddingMatrix() if storage is None else EmbeddingMatrix(storage=storage)
+        matrix.append(embeddings)
+        before = matrix[np.arange(10)]
+
+        clone = matrix.copy()
+        clone.append(embeddings[:3])
+        assert clone._buffer is matrix._buffer and len(matrix) == 10 and len(clone) == 13
+        clone.set_rows([0, 1], embeddings[[5, 6]])
+        assert clone._buffer is not matrix._buffer
+        assert np.array_equal(matrix[np.arange(10)], before)
+        assert np.allclose(clone[[0, 1]], embeddings[[5, 6]], atol=1e-2)
+
+        clone.delete_rows([2])
+        clone.set_row(0, embeddings[9])
+        assert np.array_equal(matrix[np.arange(10)], before)
+    print("✓ 写时复制正确")
+
+
+def test_ties_ordered_by_row():
+    """相似度相同的行按行号排序，与输入顺序无关，截断在相同分数中间时保留行号小的"""
+    print("=== 测试相同分数的顺序 ===")
+    scores = np.array([0.5, 0.9, 0.7, 0.9, 0.7, 0.9, 0.1], dtype=np.float32)
+    positions = np.array([30, 12, 8, 40, 3, 7, 1])
+    for k in (2, 4, 7):
+        expected = [7, 12, 40, 3, 8, 30, 1][:k]
+        for seed in range(5):
+            order = np.random.default_rng(seed).permutation(len(scores))
+            rows, top_scores = select_top_k(scores[order], positions[order], k)
+            assert rows.tolist() == expected
+            assert np.array_equal(top_scores, np.sort(scores)[::-1][:k])
+    print("✓ 相同分数的顺序正确")
+
+
+if __name__ == "__main__":
+    test_top_k_matches_legacy_loop()
+    test_min_score_and_candidate_rows()
+    test_append_grows_and_delete_keeps_order()
+    test_compressed_storage_reranks_with_exact_vectors()
+    test_copy_shares_buffer_until_rows_change()
+    test_ties_ordered_by_row()
+    print("所有测试完成")
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试微批量编码服务
+"""
+
+import sys
+import threading
+from pathlib import Path
+
+import numpy as np
+
+# 添加项目根目录到Python路径
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from embedding_service import PRIORITY_INGEST, PRIORITY_QUERY, EmbeddingService
+
+
+class SlowEncoder:
+    """记录每批文本的假模型；第一批在 release 之前阻塞，用来让后续请求排队"""
+
+    def __init__(self):
+        self.batches = []
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def __call__(self, texts):
+        self.batches.append(list(texts))
+        self.started.set()
+        self.release.wait(5)
+        return np.array([[len(text), ord(text[0])] for text in texts], dtype=np.float32)
+
+
+def test_batches_with_query_priority():
+    """模型计算期间到达的请求合并成一批，查询排在入库之前，大批量入库被拆开"""
+    print("=== 测试微批量与优先级 ===")
+    encoder = SlowEncoder()
+    service = EmbeddingService(encoder, max_batch_size=4, max_wait_ms=0)
+    try:
+        first = service.submit(["先到"], PRIORITY_QUERY)
+        assert encoder.started.wait(5)
+        ingest = service.submit([f"入库{i}" for i in range(6)], PRIORITY_INGEST)
+        queries = [service.submit([text], PRIORITY_QUERY) for text in ["问题一", "问题二", "问题一"]]
+        encoder.release.set()
+
+        assert first.result(5).shape == (1, 2)
+        for future, text in zip(queries, ["问题一", "问题二", "问题一"]):
+            assert np.array_equal(future.result(5)[0], [len(text), ord(text[0])])
+        vectors = ingest.result(5)
+        assert vectors.shape == (6, 2) and vectors[:, 0].tolist() == [3] * 6
+        # 第二批：三个查询（重复的只编码一次）+ 一条入库文本；之后每批最多 4 条入库文本
+        assert encoder.batches[1:] == [["问题一", "问题二", "入库0"], ["入库1", "入库2", "入库3", "入库4"], ["入库5"]]
+        stats = service.stats()
+        assert stats['batches'] == 4 and stats['requests'] == 5 and stats['queued_texts'] == 0
+    finally:
+        encoder.release.set()
+        service.close()
+    print("✓ 微批量与优先级正确")
+
+
+def test_errors_reach_every_request():
+    """模型出错时同一批的所有请求都收到异常，服务继续处理之后的请求"""
+    print("=== 测试编码失败 ===")
+    calls = []
+
+    def encode(texts):
+        calls.append(list(texts))
+        if len(calls) == 1:
+            raise RuntimeError("模型不可用")
+        return np.ones((len(texts), 3), dtype=np.float32)
+
+    service = EmbeddingService(encode, max_batch_size=8, max_wait_ms=0)
+    try:
+        try:
+            service.encode(["失败"])
+        except RuntimeError:
+            pass
+        else:
+            raise AssertionError("应当抛出异常")
+        assert service.encode(["成功"]).shape == (1, 3)
+    finally:
+        service.close()
+    print("✓ 编码失败处理正确")
+
+
+if __name__ == "__main__":
+    test_batches_with_query_priority()
+    test_errors_reach_every_request()
+    print("所有测试完成")
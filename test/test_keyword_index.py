@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试关键词倒排索引
+"""
+
+import math
+import sys
+from collections import Counter
+from pathlib import Path
+
+# 添加项目根目录到Python路径
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from keyword_index import KeywordIndex, tokenize
+
+
+TEXTS = [
+    "智能手机的价格是三千元",
+    "系统支持文档上传和搜索功能",
+    "退货政策说明：七天无理由退货",
+    "智能系统的知识管理平台",
+]
+
+
+def _legacy_match(query, text):
+    """旧实现：每次查询都对文本重新分词"""
+    query_words = set(tokenize(query))
+    text_words = set(tokenize(text))
+    if not query_words or not text_words:
+        return 0.0
+    return len(query_words & text_words) / len(query_words)
+
+
+def _reference_bm25(query_words, texts, k1=1.5, b=0.75):
+    """从头计算 BM25，用于校验增量维护的统计"""
+    docs = [Counter(tokenize(text)) for text in texts]
+    avg_length = sum(sum(d.values()) for d in docs) / len(docs)
+    scores = {}
+    for row, doc in enumerate(docs):
+        length = sum(doc.values())
+        score = 0.0
+        for word in set(query_words):
+            if word not in doc:
+                continue
+            df = sum(1 for d in docs if word in d)
+            idf = math.log(1 + (len(docs) - df + 0.5) / (df + 0.5))
+            tf = doc[word]
+            score += idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * length / avg_length))
+        if score:
+            scores[row] = score
+    return scores
+
+
+def test_match_equals_legacy_ratio():
+    """倒排表命中数得到的匹配率与逐块分词一致"""
+    print("=== 测试倒排索引匹配率 ===")
+    index = KeywordIndex()
+    index.add_texts(TEXTS)
+
+    for query in ["智能手机价格", "文档搜索", "退货政策", "知识管理"]:
+        query_words = set(tokenize(query))
+        hits = index.match(query_words)
+        for row, text in enumerate(TEXTS):
+            expected = _legacy_match(query, text)
+            actual = hits.get(row, 0) / len(query_words)
+            assert abs(expected - actual) < 1e-9, (query, row)
+    print("✓ 匹配率一致")
+
+
+def test_update_and_delete_rows():
+    """更新与删除后行号和倒排表保持一致"""
+    print("=== 测试更新与删除 ===")
+    index = KeywordIndex()
+    index.add_texts(TEXTS)
+
+    index.update_row(0, "全新的退货说明")
+    assert 0 in index.match(["退货"])
+    assert 0 not in index.match(["手机"])
+
+    index.delete_rows([1])
+    assert len(index) == 3
+    # 原来的第3行（退货政策）前移到第2行
+    assert set(index.match(["退货"])) == {0, 1}
+    assert set(index.match(["知识"])) == {2}
+
+    restored = KeywordIndex()
+    restored.reset(row_terms=index.row_terms)
+    assert restored.postings == index.postings
+    print("✓ 更新与删除正确")
+
+
+
+def test_bm25_after_incremental_updates():
+    """增删改之后的 BM25 分数与从头计算一致"""
+    print("=== 测试 BM25 增量统计 ===")
+    texts = list(TEXTS)
+    index = KeywordIndex()
+    index.add_texts(texts)
+
+    index.update_row(2, "智能退货系统的退货流程")
+    texts[2] = "智能退货系统的退货流程"
+    index.delete_rows([0])
+    del texts[0]
+    index.add_texts(["文档搜索与智能问答"])
+    texts.append("文档搜索与智能问答")
+
+    query_words = set(tokenize("智能系统退货"))
+    expected = _reference_bm25(query_words, texts)
+    actual = index.bm25_scores(query_words)
+    assert set(actual) == set(expected)
+    for row, score in expected.items():
+        assert abs(actual[row] - score) < 1e-9
+
+    ranked = index.bm25_top_n(query_words, 2, rows=[0, 1, 2])
+    assert len(ranked) == 2
+    assert ranked[0][0] == 1  # 退货出现两次的文本块排第一
+    assert 0.0 < index.normalized_idf("退货") <= 1.0
+    print("✓ BM25 分数正确")
+
+
+
+def test_cleared_rows_keep_row_numbers():
+    """标记删除的行不再命中，BM25 统计与删除后的文本集合一致，压缩后行号前移"""
+    print("=== 测试标记删除 ===")
+    index = KeywordIndex()
+    index.add_texts(TEXTS)
+    index.clear_rows([0])
+    assert len(index) == 4 and index.document_count == 3
+    assert 0 not in index.match(["智能"])
+
+    query_words = tokenize("智能系统")
+    expected = _reference_bm25(query_words, TEXTS[1:])
+    actual = index.bm25_scores(query_words)
+    assert {row - 1 for row in actual} == set(expected)
+    for row, score in expected.items():
+        assert abs(actual[row + 1] - score) < 1e-9
+
+    index.delete_rows([0])
+    assert index.cleared_rows == set()
+    assert index.match(["智能"]) == {2: 1}
+    print("✓ 标记删除正确")
+
+
+def test_copy_on_write():
+    """修改副本不影响原索引（原索引仍可被并发读取）"""
+    print("=== 测试写时复制 ===")
+    index = KeywordIndex()
+    index.add_texts(TEXTS)
+    before = (index.match(["智能", "系统"]), index.bm25_scores(["智能"]), list(index.row_lengths))
+
+    clone = index.copy()
+    clone.update_row(0, "退货政策说明")
+    clone.clear_rows([2])
+    clone.add_texts(["新的智能手机"])
+    assert (index.match(["智能", "系统"]), index.bm25_scores(["智能"]), list(index.row_lengths)) == before
+    assert clone.match(["智能"]) == {3: 1, 4: 1} and 0 in clone.match(["退货"])
+
+    clone.delete_rows([1])
+    assert len(index) == 4 and len(clone) == 4
+    assert index.match(["智能", "系统"]) == before[0]
+    print("✓ 写时复制正确")
+
+
+if __name__ == "__main__":
+    test_match_equals_legacy_ratio()
+    test_update_and_delete_rows()
+    test_bm25_after_incremental_updates()
+    test_cleared_rows_keep_row_numbers()
+    test_copy_on_write()
+    print("所有测试完成")
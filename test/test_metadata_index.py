@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试元数据过滤索引
+"""
+
+import sys
+from pathlib import Path
+
+# 添加项目根目录到Python路径
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from knowledge_query_service import KnowledgeQueryService
+from metadata_index import MetadataIndex, filter_key, normalize_filters
+
+METADATA = [
+    {'source': 'a.xlsx', 'filename': 'a.xlsx', 'file_type': '.xlsx', 'sheet': 'Sheet1', 'type': 'header'},
+    {'source': 'a.xlsx', 'filename': 'a.xlsx', 'file_type': '.xlsx', 'sheet': 'Sheet1', 'type': 'row', 'row': 2},
+    {'source': 'a.xlsx', 'filename': 'a.xlsx', 'file_type': '.xlsx', 'sheet': 'Sheet2', 'type': 'row', 'row': 2},
+    {'source': 'b.docx', 'filename': 'b.docx', 'file_type': '.docx', 'type': 'table'},
+    {'source': 'c.txt', 'filename': 'c.txt', 'file_type': '.txt'},
+]
+
+
+def _index():
+    index = MetadataIndex()
+    index.reset((10 + i, metadata) for i, metadata in enumerate(METADATA))
+    return index
+
+
+def test_normalize_and_match():
+    """同一字段的多个值取并集，不同字段取交集；扩展名大小写和点号等价"""
+    print("=== 测试过滤条件 ===")
+    assert normalize_filters(None) is None and normalize_filters({}) is None
+    assert normalize_filters({'file_type': 'XLSX'}) == {'file_type': frozenset(['.xlsx'])}
+    assert filter_key({'sheet': ['Sheet2', 'Sheet1']}) == filter_key({'sheet': ('Sheet1', 'Sheet2')})
+    for invalid in ({'author': 'x'}, {'sheet': []}, ['source']):
+        try:
+            normalize_filters(invalid)
+        except ValueError:
+            continue
+        raise AssertionError(f"应当拒绝: {invalid}")
+
+    index = _index()
+    assert index.match(normalize_filters({'source': 'a.xlsx'})) == {10, 11, 12}
+    assert index.match(normalize_filters({'source': 'a.xlsx', 'type': 'row'})) == {11, 12}
+    assert index.match(normalize_filters({'sheet': ['Sheet2', 'Sheet9'], 'file_type': 'xlsx'})) == {12}
+    assert index.match(normalize_filters({'file_type': ['.docx', '.txt']})) == {13, 14}
+    assert index.match(normalize_filters({'source': 'a.xlsx', 'type': 'table'})) == set()
+    assert index.match(normalize_filters({'source': 'missing'})) == set()
+    assert index.values('sheet') == [('Sheet1', 2), ('Sheet2', 1)]
+    print("✓ 过滤条件正确")
+
+
+def test_copy_on_write():
+    """修改副本不影响原索引，删除最后一个文本块后取值消失"""
+    print("=== 测试写时复制 ===")
+    index = _index()
+    clone = index.copy()
+    clone.remove(12, METADATA[2])
+    clone.add(20, {'source': 'd.pdf', 'type': 'pdf_ai'})
+    assert index.match(normalize_filters({'sheet': 'Sheet2'})) == {12}
+    assert clone.match(normalize_filters({'sheet': 'Sheet2'})) == set()
+    assert ('Sheet2', 1) not in clone.values('sheet')
+    assert clone.match(normalize_filters({'type': 'pdf_ai'})) == {20}
+    assert index.match(normalize_filters({'type': 'pdf_ai'})) == set()
+    assert index.match(normalize_filters({'source': 'a.xlsx'})) == {10, 11, 12}
+    print("✓ 写时复制正确")
+
+
+class FilteringVectorStore:
+    """记录收到的过滤条件的假向量存储"""
+
+    def __init__(self):
+        self.generation = 0
+        self.calls = []
+
+    def search(self, query, top_k=5, filters=None):
+        self.calls.append(filters)
+        return [(f"{query} 的答案", 0.9, {'source': 'a.xlsx'})]
+
+
+def test_query_service_filters():
+    """查询服务传递过滤条件，过滤条件不同的结果分别缓存，无效条件返回错误"""
+    print("=== 测试查询服务过滤 ===")
+    store = FilteringVectorStore()
+    service = KnowledgeQueryService(store)
+    service.search_for_web("手机价格")
+    service.search_for_web("手机价格", filters={'sheet': 'Sheet1'})
+    service.search_for_web("手机价格", filters={'sheet': ['Sheet1']})
+    assert store.calls == [None, {'sheet': 'Sheet1'}]
+
+    response = service.search_for_web("手机价格", filters={'author': 'x'})
+    assert not response['success'] and len(store.calls) == 2
+    print("✓ 查询服务过滤正确")
+
+
+if __name__ == "__main__":
+    test_normalize_and_match()
+    test_copy_on_write()
+    test_query_service_filters()
+    print("所有测试完成")
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试 ONNX Runtime 向量模型后端
+用一个随机初始化的小型 BERT 句向量模型代替 text2vec-base-chinese，不需要下载模型文件
+"""
+
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+import numpy as np
+
+# 添加项目根目录到Python路径
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+import onnx_backend
+from onnx_backend import BACKEND_ONNX, BACKEND_ONNX_INT8, EXPORT_DIR, MODEL_FILES, load_onnx_encoder, parity
+
+
+def _build_model(root: Path) -> Path:
+    """保存一个小型的 Transformer + 平均池化 + 归一化句向量模型"""
+    import torch
+    from sentence_transformers import SentenceTransformer, models
+    from transformers import BertConfig, BertModel, BertTokenizerFast
+
+    chars = sorted({c for text in onnx_backend.PARITY_TEXTS + ["示例文本用于导出的较长一些"] for c in text if c.strip()})
+    bert_dir = root / 'bert'
+    bert_dir.mkdir()
+    (bert_dir / 'vocab.txt').write_text("\n".join(["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"] + chars),
+                                        encoding='utf-8')
+    torch.manual_seed(0)
+    BertModel(BertConfig(vocab_size=len(chars) + 5, hidden_size=64, num_hidden_layers=2, num_attention_heads=4,
+                         intermediate_size=128, max_position_embeddings=256)).save_pretrained(bert_dir)
+    BertTokenizerFast(str(bert_dir / 'vocab.txt')).save_pretrained(bert_dir)
+    model = SentenceTransformer(modules=[models.Transformer(str(bert_dir), max_seq_length=128),
+                                         models.Pooling(64, 'mean'), models.Normalize()])
+    model.save(str(root / 'model'))
+    return root / 'model'
+
+
+def test_export_parity_and_cache():
+    """导出的 float32 / int8 模型与 PyTorch 句向量一致，导出结果被缓存，模型文件变化后重新导出"""
+    print("=== 测试 ONNX 导出与一致性 ===")
+    try:
+        import onnxruntime  # noqa: F401
+    except ImportError:
+        print("✗ onnxruntime 未安装，跳过")
+        return
+    from sentence_transformers import SentenceTransformer
+
+    model_dir = _build_model(Path(tempfile.mkdtemp()))
+    texts = ["你好", "如何申请退款？", "公司的年假制度是怎样规定的", "你好"]
+    expected = SentenceTransformer(str(model_dir), device='cpu').encode(texts)
+
+    encoder = load_onnx_encoder(model_dir, BACKEND_ONNX)
+    assert encoder is not None and encoder.get_sentence_embedding_dimension() == 64
+    vectors = encoder.encode(texts, batch_size=3)
+    assert vectors.shape == (4, 64) and parity(expected, vectors)['min_cosine'] > 0.9999
+    assert encoder.encode("你好").shape == (64,)
+
+    quantized = load_onnx_encoder(model_dir, BACKEND_ONNX_INT8)
+    assert quantized is not None and parity(expected, quantized.encode(texts))['min_cosine'] > 0.99
+    export_dir = model_dir / EXPORT_DIR
+    assert (export_dir / MODEL_FILES[BACKEND_ONNX_INT8]).stat().st_size < (export_dir / MODEL_FILES[BACKEND_ONNX]).stat().st_size
+
+    # 再次加载直接使用缓存；一致性要求过高时返回 None，由调用方退回 PyTorch
+    exported_at = (export_dir / MODEL_FILES[BACKEND_ONNX]).stat().st_mtime_ns
+    assert load_onnx_encoder(model_dir, BACKEND_ONNX) is not None
+    assert load_onnx_encoder(model_dir, BACKEND_ONNX, min_cosine=1.01) is None
+    assert (export_dir / MODEL_FILES[BACKEND_ONNX]).stat().st_mtime_ns == exported_at
+
+    # 源模型文件变化后重新导出
+    config_file = model_dir / 'config_sentence_transformers.json'
+    os.utime(config_file, ns=(exported_at + 10 ** 9, exported_at + 10 ** 9))
+    assert load_onnx_encoder(model_dir, BACKEND_ONNX) is not None
+    assert (export_dir / MODEL_FILES[BACKEND_ONNX]).stat().st_mtime_ns != exported_at
+    print("✓ ONNX 导出、一致性检查与缓存正确")
+
+
+if __name__ == "__main__":
+    test_export_parity_and_cache()
+    print("所有测试完成")
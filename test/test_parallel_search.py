@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试多进程分片打分
+"""
+
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+# 添加项目根目录到Python路径
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from embedding_matrix import EmbeddingMatrix
+from parallel_search import ParallelScorer
+
+
+def _wait_ready(scorer, matrix):
+    for _ in range(300):
+        if scorer.ready(matrix):
+            return
+        time.sleep(0.1)
+    raise AssertionError("工作进程没有打开向量矩阵")
+
+
+def test_scatter_gather_matches_single_process():
+    """并行打分结果与单进程 top_k 相同；矩阵换成新快照后重新导出"""
+    print("=== 测试多进程打分 ===")
+    rng = np.random.default_rng(0)
+    matrix = EmbeddingMatrix()
+    matrix.append(rng.standard_normal((1000, 32)).astype(np.float32))
+    queries = rng.standard_normal((2, 32)).astype(np.float32)
+    rows = np.sort(rng.choice(1000, 300, replace=False))
+
+    scorer = ParallelScorer(3)
+    try:
+        assert scorer.top_k(matrix, queries[0], 10) is None  # 尚未导出
+        _wait_ready(scorer, matrix)
+        for query in queries:
+            for subset in (None, rows, rows[:2]):
+                expected = matrix.top_k(query, 10, min_score=0.1, rows=subset)
+                actual = scorer.top_k(matrix, query, 10, min_score=0.1, rows=subset)
+                assert np.array_equal(actual[0], expected[0])
+                assert np.allclose(actual[1], expected[1], atol=1e-5)
+        many = scorer.top_k_many(matrix, queries, 5)
+        assert [list(r) for r, _ in many] == [list(matrix.top_k(q, 5)[0]) for q in queries]
+
+        updated = matrix.copy()
+        updated.append(rng.standard_normal((10, 32)).astype(np.float32))
+        assert not scorer.ready(updated)  # 在后台导出新矩阵
+        _wait_ready(scorer, updated)
+        assert np.array_equal(scorer.top_k(updated, queries[0], 5)[0], updated.top_k(queries[0], 5)[0])
+        assert scorer.stats()['exports'] == 2
+    finally:
+        scorer.close()
+    assert scorer.stats()['running'] == 0
+    print("✓ 多进程打分结果正确")
+
+
+if __name__ == "__main__":
+    test_scatter_gather_matches_single_process()
+    print("所有测试完成")
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试查询向量缓存
+"""
+
+import sys
+import tempfile
+import threading
+from pathlib import Path
+
+import numpy as np
+
+# 添加项目根目录到Python路径
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from knowledge_query_service import KnowledgeQueryService
+from query_cache import QueryEmbeddingCache, SearchResultCache, normalize_query
+
+
+class CountingEncoder:
+    """记录调用次数的假模型"""
+
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, text):
+        self.calls += 1
+        return np.full(8, float(len(text)), dtype=np.float32)
+
+
+def test_hits_skip_model_and_lru_eviction():
+    """相同问题（忽略空白、大小写、全角）只计算一次，超过容量时淘汰最久未使用的"""
+    print("=== 测试缓存命中与淘汰 ===")
+    assert normalize_query("  手机  价格ABC ") == normalize_query("手机 价格ａｂｃ")
+
+    encoder = CountingEncoder()
+    cache = QueryEmbeddingCache(max_size=2, model_id='m')
+    first = cache.get_or_compute("手机 价格", encoder)
+    again = cache.get_or_compute(" 手机   价格 ", encoder)
+    assert encoder.calls == 1
+    assert np.allclose(first, again) and abs(np.linalg.norm(first) - 1.0) < 1e-6
+    again[:] = 0
+    assert np.allclose(cache.get_or_compute("手机 价格", encoder), first)
+
+    cache.get_or_compute("退货", encoder)
+    cache.get_or_compute("手机 价格", encoder)
+    cache.get_or_compute("天气", encoder)  # 淘汰最久未使用的“退货”
+    assert len(cache) == 2 and cache.get("退货") is None
+    stats = cache.stats()
+    assert stats['hits'] == 3 and stats['misses'] == 4 and encoder.calls == 3
+    print("✓ 命中与淘汰正确")
+
+
+def test_persistence_and_model_id():
+    """保存后重新加载仍然命中；换模型后不命中"""
+    print("=== 测试缓存持久化 ===")
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "query_cache.pkl"
+        cache = QueryEmbeddingCache(model_id='m', path=str(path))
+        cache.put("手机价格", np.ones(8))
+        assert cache.save()
+
+        warm = QueryEmbeddingCache(model_id='m', path=str(path))
+        assert warm.load() and warm.get("手机价格") is not None
+
+        other = QueryEmbeddingCache(model_id='other', path=str(path))
+        assert other.load() and other.get("手机价格") is None
+    print("✓ 持久化正确")
+
+
+def test_concurrent_access():
+    """多线程并发读写时容量限制保持正确"""
+    print("=== 测试并发访问 ===")
+    cache = QueryEmbeddingCache(max_size=50)
+    encoder = CountingEncoder()
+
+    def worker(offset):
+        for i in range(200):
+            cache.get_or_compute(f"问题{(i + offset) % 80}", encoder)
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(cache) == 50
+    assert cache.hits + cache.misses == 1600
+    print("✓ 并发访问正确")
+
+
+class FakeVectorStore:
+    """记录搜索次数、带版本号的假向量存储"""
+
+    def __init__(self):
+        self.generation = 0
+        self.searches = 0
+        self.batches = 0
+
+    def search(self, query, top_k=5):
+        self.searches += 1
+        return [(f"{query} 的答案", 0.9, {'source': 'a.txt'})]
+
+    def search_many(self, queries, top_k=5):
+        self.batches += 1
+        return [[(f"{query} 的答案", 0.9, {'source': 'a.txt'})] for query in queries]
+
+
+def test_search_results_invalidated_by_generation():
+    """知识库版本号不变时命中缓存，版本号变化后旧结果失效"""
+    print("=== 测试搜索结果缓存 ===")
+    cache = SearchResultCache(max_size=10)
+    key = SearchResultCache.make_key("手机 价格", 5, 0.3, 'web')
+    cache.put(key, 1, {'results': [1]})
+    assert cache.get(SearchResultCache.make_key(" 手机价格", 5, 0.3, 'web'), 1) is None
+    assert cache.get(key, 1) == {'results': [1]}
+    assert cache.get(key, 2) is None and len(cache) == 0
+
+    store = FakeVectorStore()
+    service = KnowledgeQueryService(store)
+    first = service.search_for_wechat("手机价格")
+    first['results'].clear()
+    second = service.search_for_wechat(" 手机价格 ")
+    assert store.searches == 1 and len(second['results']) == 1
+    service.search_for_web("手机价格")
+    assert store.searches == 2  # 搜索类型不同，分别缓存
+
+    store.generation += 1
+    service.search_for_wechat("手机价格")
+    assert store.searches == 3
+    assert service.result_cache.stats()['hits'] == 1
+    print("✓ 搜索结果缓存正确")
+
+
+def test_search_many_batches_cache_misses():
+    """批量搜索：未命中缓存的查询一次交给向量存储，结果与单条搜索共用缓存"""
+    print("=== 测试批量搜索 ===")
+    store = FakeVectorStore()
+    service = KnowledgeQueryService(store)
+    service.search_for_wechat("手机价格")
+
+    responses = service.search_many(["手机价格", "退货政策", "x", "天气"], search_type='wechat')
+    assert store.searches == 1 and store.batches == 1
+    assert [r['success'] for r in responses] == [True, True, False, True]
+    assert responses[1]['results'][0]['content'] == "退货政策 的答案"
+
+    service.search_for_wechat("天气")
+    assert store.searches == 1  # 批量搜索的结果已进入缓存
+    print("✓ 批量搜索正确")
+
+
+if __name__ == "__main__":
+    test_hits_skip_model_and_lru_eviction()
+    test_persistence_and_model_id()
+    test_concurrent_access()
+    test_search_results_invalidated_by_generation()
+    test_search_many_batches_cache_misses()
+    print("所有测试完成")
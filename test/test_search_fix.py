@@ -18,6 +18,7 @@ def test_search_functionality():
     try:
         # 导入向量存储
         from vector_store import FaissVectorStore
+        from columnar_store import vector_store_exists
         
         logger.info("=== 开始测试搜索功能 ===")
         
@@ -26,7 +27,7 @@ def test_search_functionality():
         
         # 尝试加载现有的向量存储
         vector_store_path = "knowledge_base/vector_store"
-        if os.path.exists(f"{vector_store_path}.index") and os.path.exists(f"{vector_store_path}.pkl"):
+        if vector_store_exists(vector_store_path):
             logger.info("加载现有向量存储...")
             vector_store.load(vector_store_path)
         
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试两阶段检索流水线
+"""
+
+import sys
+from pathlib import Path
+
+import numpy as np
+
+# 添加项目根目录到Python路径
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from search_pipeline import Candidate, Reranker, SearchPipeline, StageTimer
+
+
+class LengthReranker(Reranker):
+    """按文本长度打分、记录收到的候选数量的假重排器"""
+
+    name = 'length'
+
+    def __init__(self):
+        self.batches = []
+
+    def score_many(self, queries, candidate_lists):
+        self.batches.append([len(candidates) for candidates in candidate_lists])
+        return [np.array([len(c.text) for c in candidates], dtype=np.float32) for candidates in candidate_lists]
+
+
+class FailingReranker(Reranker):
+    name = 'failing'
+
+    def score(self, query, candidates):
+        raise RuntimeError("模型不可用")
+
+
+def _candidates(texts):
+    return [Candidate(row, 100 + row, text, 1.0 - row * 0.1, {'_debug_info': {}}) for row, text in enumerate(texts)]
+
+
+def test_rerank_only_within_budget():
+    """只重排前 N 个候选，所有查询一次打分，N 之后的候选保持原来的顺序"""
+    print("=== 测试重排预算 ===")
+    reranker = LengthReranker()
+    pipeline = SearchPipeline(reranker, rerank_budget=3)
+    assert pipeline.candidate_count(2) == 3 and pipeline.candidate_count(10) == 10
+    assert SearchPipeline(None, rerank_budget=3).candidate_count(2) == 2
+
+    first = _candidates(["a", "ccc", "bb", "dddd", "eeeee"])
+    second = _candidates(["xx", "y"])
+    timer = StageTimer()
+    reranked = pipeline.rerank(["问题一", "问题二"], [first, second], timer)
+    assert reranker.batches == [[3, 2]]
+    assert [c.text for c in reranked[0]] == ["ccc", "bb", "a", "dddd", "eeeee"]
+    assert [c.text for c in reranked[1]] == ["xx", "y"]
+    # 分数仍是第一阶段的分数，重排分数记录在调试信息中
+    assert reranked[0][0].score == first[1].score
+    assert reranked[0][0].metadata['_debug_info']['rerank_score'] == "3.0000"
+    assert 'rerank' in timer.timings
+    print("✓ 重排预算正确")
+
+
+def test_failure_keeps_first_stage_order():
+    """重排失败时保留第一阶段的顺序"""
+    print("=== 测试重排失败 ===")
+    pipeline = SearchPipeline(FailingReranker(), rerank_budget=5)
+    candidates = _candidates(["a", "bbb", "cc"])
+    reranked = pipeline.rerank(["问题"], [candidates], StageTimer())
+    assert [c.text for c in reranked[0]] == ["a", "bbb", "cc"]
+    print("✓ 重排失败处理正确")
+
+
+def test_stage_timings():
+    """累计各阶段的次数、平均和最大耗时"""
+    print("=== 测试阶段耗时统计 ===")
+    pipeline = SearchPipeline()
+    for _ in range(2):
+        timer = StageTimer()
+        with timer.stage('lexical'):
+            pass
+        with timer.stage('candidates'):
+            sum(range(1000))
+        pipeline.record(timer)
+    stats = pipeline.stats()
+    assert stats['runs'] == 2 and stats['reranker'] == 'none'
+    assert set(stats['stages']) == {'lexical', 'candidates'}
+    assert stats['stages']['candidates']['count'] == 2
+    assert stats['stages']['candidates']['max_ms'] >= stats['stages']['candidates']['avg_ms'] > 0
+    print("✓ 阶段耗时统计正确")
+
+
+if __name__ == "__main__":
+    test_rerank_only_within_budget()
+    test_failure_keeps_first_stage_order()
+    test_stage_timings()
+    print("所有测试完成")
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试查询服务按配置的阈值过滤搜索结果
+"""
+
+import hashlib
+import sys
+from pathlib import Path
+
+import numpy as np
+import torch
+
+# 添加项目根目录到Python路径
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from knowledge_query_service import KnowledgeQueryService
+from vector_store import FaissVectorStore
+
+
+class CharHashModel:
+    """按字符哈希计数生成向量的假模型（不需要下载 text2vec）"""
+
+    dim = 64
+
+    def get_sentence_embedding_dimension(self):
+        return self.dim
+
+    def to(self, device):
+        return self
+
+    def encode(self, texts, convert_to_tensor=False, batch_size=32, **kwargs):
+        vectors = np.full((len(texts), self.dim), 0.01, dtype=np.float32)
+        for i, text in enumerate(texts):
+            for ch in text:
+                vectors[i, int(hashlib.md5(ch.encode('utf-8')).hexdigest(), 16) % self.dim] += 1
+        return torch.from_numpy(vectors) if convert_to_tensor else vectors
+
+
+class HashVectorStore(FaissVectorStore):
+    """使用假模型、不读写磁盘向量缓存的向量存储"""
+
+    def initialize_model(self):
+        self.model = CharHashModel()
+        self.embedding_cache = None
+        self.ann_index = self._create_ann_index(self.model.get_sentence_embedding_dimension())
+
+
+def create_hash_store() -> HashVectorStore:
+    # FaissVectorStore 是单例，初始化标记记在基类上，创建完成后复位，不影响其他测试创建向量存储
+    FaissVectorStore._initialized = False
+    HashVectorStore._instance = None
+    store = HashVectorStore()
+    FaissVectorStore._initialized = False
+    return store
+
+
+def test_rrf_results_pass_configured_threshold():
+    """倒数排名融合只决定顺序，只被一个检索器召回的文本块按加权分数通过默认阈值"""
+    print("=== 测试搜索结果阈值 ===")
+    store = create_hash_store()
+    texts = ["手机退货政策：七天无理由退货", "手机退货需要保留包装和发票", "退货流程：联系客服申请手机退货",
+             "手机价格表", "退货运费由买家承担", "平板电脑退货政策", "手机保修一年",
+             "手机退货后退款三个工作日到账", "手机退货 手机退货 手机退货"]
+    texts += [f"第{i}条：手机退货" + "说明" * i for i in range(1, 12)]
+    store.add(texts, [{'source': 'faq.txt'} for _ in texts])
+    # 候选池等于返回数量，向量排名和 BM25 排名各自只有前 5 个，部分结果只出现在一个排名中
+    store.candidate_pool_size = 0
+    assert store.fusion_method == 'rrf'
+
+    results = store.search("手机退货", top_k=5)
+    assert len(results) == 5
+    debug_infos = [metadata['_debug_info'] for _, _, metadata in results]
+    assert [f"{score:.4f}" for _, score, _ in results] == [info['weighted_score'] for info in debug_infos]
+    assert min(float(info['rrf_score']) for info in debug_infos) < 0.5
+
+    service = KnowledgeQueryService(store)
+    _, min_score = service.search_config.get_default_config()
+    response = service.search_knowledge_base("手机退货", top_k=5)
+    assert response['success']
+    expected = [text for text, score, _ in results if score >= min_score]
+    assert [item['content'] for item in response['results']] == expected
+    assert "手机退货后退款三个工作日到账" in expected
+    print("✓ 搜索结果阈值正确")
+
+
+if __name__ == "__main__":
+    test_rrf_results_pass_configured_threshold()
+    print("所有测试完成")
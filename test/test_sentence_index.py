@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试句子向量索引
+"""
+
+import sys
+import tempfile
+from pathlib import Path
+
+import numpy as np
+
+# 添加项目根目录到Python路径
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+import segment_log
+from columnar_store import SegmentStore
+from sentence_index import (SentenceIndex, encode_sentences, encode_with_sentences, semantic_coherence,
+                            semantic_similarity, split_sentences)
+
+
+class CountingEncoder:
+    """按字符哈希生成向量、记录调用次数的假模型"""
+
+    def __init__(self):
+        self.calls = 0
+        self.encoded = 0
+
+    def __call__(self, texts):
+        self.calls += 1
+        self.encoded += len(texts)
+        vectors = np.zeros((len(texts), 16), dtype=np.float32)
+        for i, text in enumerate(texts):
+            for ch in text:
+                vectors[i, ord(ch) % 16] += 1
+        return vectors + 0.01
+
+
+def _cosine(a, b):
+    return float(np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b)))
+
+
+def test_batch_encoding():
+    """文本块和句子一次编码，相同的字符串只编码一次"""
+    print("=== 测试批量编码 ===")
+    assert split_sentences("第一句。 第二句。。第三句。第四句") == ["第一句", "第二句", "第三句"]
+
+    encoder = CountingEncoder()
+    texts = ["手机价格三千元。颜色有黑白两种", "退货政策", "退货政策"]
+    text_vectors, sentence_vectors = encode_with_sentences(encoder, texts)
+    assert encoder.calls == 1 and encoder.encoded == 4
+    assert np.allclose(text_vectors, encoder(texts))
+    assert [len(v) for v in sentence_vectors] == [2, 1, 1]
+    assert sentence_vectors[0].dtype == np.float16
+    assert np.allclose(np.linalg.norm(sentence_vectors[0].astype(np.float32), axis=1), 1.0, atol=1e-3)
+
+    assert [len(v) for v in encode_sentences(encoder, ["。。", "一句"])] == [0, 1]
+    print("✓ 批量编码正确")
+
+
+def test_scores_match_sentence_by_sentence():
+    """查表打分与逐句计算余弦相似度的结果一致"""
+    print("=== 测试语义打分 ===")
+    encoder = CountingEncoder()
+    text = "手机价格三千元。手机颜色有黑白两种。售后保修一年。第四句不参与打分"
+    sentences = split_sentences(text)
+    query = encoder(["手机价格"])[0]
+    raw = encoder(sentences)
+    vectors = encode_sentences(encoder, [text])[0]
+    q = query / np.linalg.norm(query)
+
+    query_sims = [_cosine(query, v) for v in raw]
+    coherence = [_cosine(raw[i], raw[i + 1]) for i in range(len(raw) - 1)]
+    expected = 0.7 * np.mean(query_sims) + 0.3 * np.mean(coherence) if np.mean(query_sims) >= 0.4 else 0.0
+    assert abs(semantic_similarity(q, vectors) - max(query_sims)) < 5e-3
+    assert abs(semantic_coherence(q, vectors) - expected) < 5e-3
+
+    single = encode_sentences(encoder, ["手机价格"])[0]
+    assert abs(semantic_coherence(q, single) - 1.0) < 5e-3
+    assert semantic_coherence(q, encode_sentences(encoder, ["退货"])[0]) == 0.0
+    assert semantic_similarity(q, np.empty((0, 16), dtype=np.float16)) == 0.0
+    print("✓ 语义打分正确")
+
+
+def test_copy_and_persistence():
+    """副本互不影响；句子向量随段和日志保存，落盘与合并后保持不变"""
+    print("=== 测试副本与持久化 ===")
+    encoder = CountingEncoder()
+    texts = ["手机价格。三千元", "退货政策", "天气"]
+    embeddings, sentences = encode_with_sentences(encoder, texts)
+
+    index = SentenceIndex(zip(range(3), sentences))
+    clone = index.copy()
+    clone.remove([0])
+    clone.set_many([5], sentences[:1])
+    assert 0 in index and 5 not in index and len(clone) == 3
+
+    with tempfile.TemporaryDirectory() as tmp:
+        store = SegmentStore(str(Path(tmp) / "vector_store"))
+        store.create([(text, {}) for text in texts], embeddings, ids=[0, 1, 2], sentence_vectors=sentences)
+        snapshot = store.open()
+        assert all(np.array_equal(a, b) for a, b in zip(snapshot.sentence_vectors, sentences))
+
+        new_embeddings, new_sentences = encode_with_sentences(encoder, ["新增。两句"])
+        store.append([
+            {'op': segment_log.OP_DELETE, 'ids': [1]},
+            {'op': segment_log.OP_ADD, 'ids': [3], 'documents': [("新增。两句", {})],
+             'embeddings': new_embeddings, 'sentence_vectors': new_sentences}
+        ])
+        expected = {0: sentences[0], 2: sentences[2], 3: new_sentences[0]}
+        for step in ('replay', 'flush', 'compact'):
+            if step == 'flush':
+                store.flush()
+            elif step == 'compact':
+                assert store.compact()
+            snapshot = store.open()
+            assert snapshot.ids == [0, 2, 3], step
+            for chunk_id, vectors in zip(snapshot.ids, snapshot.sentence_vectors):
+                assert np.array_equal(np.asarray(vectors), expected[chunk_id]), step
+    print("✓ 副本与持久化正确")
+
+
+if __name__ == "__main__":
+    test_batch_encoding()
+    test_scores_match_sentence_by_sentence()
+    test_copy_and_persistence()
+    print("所有测试完成")
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试分片路由索引与分片常驻缓存
+"""
+
+import sys
+import tempfile
+from pathlib import Path
+
+import numpy as np
+
+# 添加项目根目录到Python路径
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from shard_router import RouteStats, ShardCache, ShardRouter
+
+
+def _unit(*values):
+    vector = np.array(values, dtype=np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+def test_route_and_copy_on_write():
+    """查询路由到质心最接近的分片；修改副本不影响原索引，每次修改都分配新的版本号"""
+    print("=== 测试分片路由 ===")
+    router = ShardRouter()
+    router.reset([
+        ('a.txt', [0, 1], np.stack([_unit(1, 0, 0), _unit(1, 0.1, 0)])),
+        ('b.txt', [2], np.stack([_unit(0, 1, 0)])),
+        ('c.txt', [3], np.stack([_unit(0, 0, 1)])),
+        (None, [4], None),
+    ])
+    assert len(router) == 3 and router.loose_ids == {4}
+    assert router.route(_unit(0.1, 1, 0), 1) == ['b.txt']
+    assert router.route(_unit(1, 0, 0.5), 2) == ['a.txt', 'c.txt']
+    assert len(router.route(_unit(1, 1, 1), 10)) == 3
+
+    clone = router.copy()
+    version = router.version('a.txt')
+    clone.remove('a.txt', [0, 1], np.stack([_unit(1, 0, 0), _unit(1, 0.1, 0)]))
+    clone.add('c.txt', [5], np.stack([_unit(0, 1, 1)]))
+    clone.remove(None, [4], None)
+    assert clone.route(_unit(1, 0, 1), 5) == ['c.txt', 'b.txt']
+    assert clone.version('c.txt') != router.version('c.txt') and not clone.loose_ids
+    assert router.route(_unit(1, 0, 0), 1) == ['a.txt'] and router.version('a.txt') == version
+    assert router.loose_ids == {4}
+
+    router.touch_all()
+    assert router.version('a.txt') != version
+    print("✓ 分片路由正确")
+
+
+def test_cache_lru_budget():
+    """缓存不超过内存预算，淘汰最久未访问的分片，超过预算的分片不缓存"""
+    print("=== 测试分片缓存 ===")
+    block = (np.arange(16, dtype=np.int64), np.zeros((16, 64), dtype=np.float32))  # 4224 字节
+    size_mb = (block[0].nbytes + block[1].nbytes) / 2 ** 20
+    cache = ShardCache(budget_mb=size_mb * 2.5)
+    loads = []
+
+    def loader(name):
+        loads.append(name)
+        return block
+
+    for name in ['a', 'b', 'a', 'c', 'b']:
+        cache.get((name, 1), lambda name=name: loader(name))
+    # a、b 装入，访问 a 后 c 装入时淘汰 b，再访问 b 需要重新读取
+    assert loads == ['a', 'b', 'c', 'b']
+    stats = cache.stats()
+    assert stats['hits'] == 1 and stats['misses'] == 4 and stats['resident_shards'] == 2
+    assert stats['resident_mb'] <= stats['budget_mb']
+
+    tiny = ShardCache(budget_mb=0)
+    tiny.get(('a', 1), lambda: block)
+    assert len(tiny) == 0
+    print("✓ 分片缓存正确")
+
+
+def test_save_load_and_route_stats():
+    """保存的质心只在 key 一致时加载；路由统计累计打分比例"""
+    print("=== 测试质心保存与路由统计 ===")
+    router = ShardRouter()
+    router.reset([('a.txt', [0, 1], np.stack([_unit(1, 0), _unit(1, 1)])), (None, [2], None)])
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / 'router.npz'
+        assert router.save(path, 'wal-000001.log:128')
+        loaded = ShardRouter()
+        assert not loaded.load(path, 'wal-000001.log:256') and len(loaded) == 0
+        assert loaded.load(path, 'wal-000001.log:128')
+    assert loaded.counts() == {'a.txt': 2} and loaded.loose_ids == {2}
+    assert loaded.rank(_unit(1, 0), 1)[0][0] == 'a.txt'
+    assert np.isclose(loaded.rank(_unit(1, 0), 1)[0][1], router.rank(_unit(1, 0), 1)[0][1])
+
+    stats = RouteStats()
+    assert stats.record(True, 10, 100) == 0.1
+    stats.record(False, 50, 100)
+    result = stats.stats()
+    assert result['queries'] == 2 and result['routed'] == 1 and result['fallback'] == 1
+    assert np.isclose(result['avg_touched_ratio'], 0.3) and result['max_touched_ratio'] == 0.5
+    print("✓ 质心保存与路由统计正确")
+
+
+if __name__ == "__main__":
+    test_route_and_copy_on_write()
+    test_cache_lru_budget()
+    test_save_load_and_route_stats()
+    print("所有测试完成")
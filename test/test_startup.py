@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试后台预热
+"""
+
+import sys
+import threading
+from pathlib import Path
+
+# 添加项目根目录到Python路径
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from startup import BackgroundLoader, STATE_FAILED, STATE_PENDING, STATE_READY
+
+
+def test_background_load_runs_once():
+    """后台加载完成后调用回调，重复 start/run 不会再次执行"""
+    print("=== 测试后台加载 ===")
+    release = threading.Event()
+    calls = []
+    ready = []
+
+    def load():
+        calls.append(1)
+        release.wait(5)
+        return "知识库"
+
+    loader = BackgroundLoader('test', load, on_ready=ready.append)
+    assert loader.state == STATE_PENDING and not loader.running
+    loader.start()
+    assert loader.running and not loader.ready
+    assert loader.get(timeout=0.05) is None  # 还没有加载完成
+    release.set()
+    assert loader.get(timeout=5) == "知识库"
+    assert loader.ready and not loader.running and ready == ["知识库"]
+    loader.start()
+    assert loader.run() == "知识库" and calls == [1]
+    assert loader.status()["state"] == STATE_READY
+    print("✓ 后台加载正确")
+
+
+def test_failed_load_reports_error():
+    """加载失败时记录错误，run() 抛出原来的异常，不调用回调"""
+    print("=== 测试加载失败 ===")
+    ready = []
+
+    def load():
+        raise RuntimeError("模型不存在")
+
+    loader = BackgroundLoader('test', load, on_ready=ready.append)
+    try:
+        loader.run()
+        assert False, "应该抛出异常"
+    except RuntimeError as e:
+        assert str(e) == "模型不存在"
+    status = loader.status()
+    assert status["state"] == STATE_FAILED and status["error"] == "模型不存在"
+    assert not loader.running and ready == []
+    print("✓ 加载失败处理正确")
+
+
+if __name__ == "__main__":
+    test_background_load_runs_once()
+    test_failed_load_reports_error()
+    print("所有测试完成")
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试按长度分桶的流式入库编码
+"""
+
+import sys
+from pathlib import Path
+
+import numpy as np
+
+# 添加项目根目录到Python路径
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from sentence_index import encode_with_sentences
+from streaming_encoder import StreamingEncoder
+
+
+class RecordingEncoder:
+    """记录每批文本的假模型，向量由文本长度和首字决定"""
+
+    def __init__(self):
+        self.batches = []
+
+    def __call__(self, texts):
+        self.batches.append(list(texts))
+        if not texts:
+            return np.empty((0, 3), dtype=np.float32)
+        return np.array([[len(text), ord(text[0]), 1.0] for text in texts], dtype=np.float32)
+
+
+def test_length_buckets_respect_budget():
+    """批次内文本长度相近，条数和填充后的 token 数都不超过上限，结果保持原顺序"""
+    print("=== 测试长度分桶 ===")
+    rng = np.random.default_rng(0)
+    texts = ["文" * int(n) for n in rng.integers(1, 300, 200)] + ["超长" * 400]
+    model = RecordingEncoder()
+    encoder = StreamingEncoder(model, max_batch_size=16, max_batch_tokens=1024, max_length=512)
+
+    vectors = encoder.encode(texts)
+    assert np.array_equal(vectors, model(texts))
+    model.batches.pop()
+    assert sorted(text for batch in model.batches for text in batch) == sorted(texts)
+    for batch in model.batches:
+        lengths = [min(len(text), 512) for text in batch]
+        assert len(batch) <= 16 and (len(batch) == 1 or len(batch) * max(lengths) <= 1024)
+    # 批次按长度升序，相邻批次之间不交叉
+    assert all(len(a[-1]) <= len(b[0]) for a, b in zip(model.batches, model.batches[1:]))
+    stats = encoder.stats()
+    assert stats['texts'] == len(texts) and stats['batches'] == len(model.batches)
+    assert 0 <= stats['padding_ratio'] < 0.2
+    print("✓ 长度分桶正确")
+
+
+def test_windows_match_single_batch():
+    """逐窗口编码的文本块向量和句子向量与一次性编码相同，每次模型调用的文本数有上限"""
+    print("=== 测试逐窗口编码 ===")
+    texts = [f"第{i}行。内容{'长' * (i % 37)}。备注{i % 5}" for i in range(100)]
+    model = RecordingEncoder()
+    encoder = StreamingEncoder(model, max_batch_size=8, max_batch_tokens=4096, window_size=30)
+    embeddings, sentences = encoder.encode_chunks(texts)
+    expected_embeddings, expected_sentences = encode_with_sentences(RecordingEncoder(), texts)
+    assert embeddings.shape == (100, 3) and np.array_equal(embeddings, expected_embeddings)
+    assert len(sentences) == 100
+    assert all(np.array_equal(a, b) for a, b in zip(sentences, expected_sentences))
+    assert max(len(batch) for batch in model.batches) <= 8
+    assert len(encoder.encode_sentences(texts)) == 100
+    print("✓ 逐窗口编码正确")
+
+
+if __name__ == "__main__":
+    test_length_buckets_respect_budget()
+    test_windows_match_single_batch()
+    print("所有测试完成")
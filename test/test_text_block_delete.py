@@ -40,7 +40,7 @@ def test_vector_store_delete():
             
             # 测试删除第一个文本块
             original_count = len(vector_store.documents)
-            if vector_store.delete_text_blocks([0]):
+            if vector_store.delete_text_blocks(vector_store.live_chunk_ids()[:1]):
                 print(f"✓ 删除第一个文本块成功")
                 print(f"  删除前数量: {original_count}")
                 print(f"  删除后数量: {len(vector_store.documents)}")
@@ -146,7 +146,7 @@ def test_delete_functionality():
                 print(f"  当前文本块数量: {len(vector_store.documents)}")
                 
                 # 测试批量删除
-                test_indices = [0] if len(vector_store.documents) >= 1 else []
+                test_indices = vector_store.live_chunk_ids()[:1]
                 if test_indices:
                     original_count = len(vector_store.documents)
                     if vector_store.delete_text_blocks(test_indices):
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试文本块删除标记
+"""
+
+import sys
+from pathlib import Path
+
+import numpy as np
+
+# 添加项目根目录到Python路径
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from tombstones import LiveView, TombstoneBitmap
+
+
+def test_bitmap_marks_and_filters_rows():
+    """标记删除后有效行和过滤结果正确，重复标记不重复计数"""
+    print("=== 测试删除位图 ===")
+    bitmap = TombstoneBitmap(5)
+    assert bitmap.mark([1, 3]) == 2
+    assert bitmap.mark([3]) == 0
+    bitmap.extend(2)
+    assert len(bitmap) == 7 and bitmap.count == 2 and bitmap.live_count == 5
+    assert bitmap.live_rows().tolist() == [0, 2, 4, 5, 6]
+    assert bitmap.filter(np.array([0, 1, 3, 6])).tolist() == [0, 6]
+    clone = bitmap.copy()
+    clone.mark([0])
+    assert bitmap.count == 2 and clone.count == 3 and not bitmap.is_deleted(0)
+    bitmap.reset(5)
+    assert bitmap.count == 0 and bitmap.live_rows().tolist() == [0, 1, 2, 3, 4]
+    print("✓ 删除位图正确")
+
+
+def test_live_view_skips_deleted_rows():
+    """视图的长度、下标、切片和迭代都跳过已删除的行"""
+    print("=== 测试有效行视图 ===")
+    table = [("a", {}), ("b", {}), ("c", {}), ("d", {})]
+    bitmap = TombstoneBitmap(4)
+    view = LiveView(table, bitmap)
+    assert list(view) == table
+
+    bitmap.mark([0, 2])
+    assert len(view) == 2
+    assert view[0] == ("b", {}) and view[-1] == ("d", {})
+    assert view[:1] == [("b", {})]
+    assert [text for text, _ in view] == ["b", "d"]
+    print("✓ 有效行视图正确")
+
+
+if __name__ == "__main__":
+    test_bitmap_marks_and_filters_rows()
+    test_live_view_skips_deleted_rows()
+    print("所有测试完成")
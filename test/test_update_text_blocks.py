@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试批量更新文本块内容
+"""
+
+import sys
+from pathlib import Path
+
+import numpy as np
+
+# 添加项目根目录到Python路径
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+sys.path.insert(0, str(Path(__file__).parent))
+
+from embedding_matrix import normalize_rows
+from test_search_threshold import create_hash_store
+
+
+def test_updated_text_is_stripped():
+    """更新后的文本去掉首尾空白后再保存和编码，与新增文本块的处理一致"""
+    print("=== 测试更新文本块去除首尾空白 ===")
+    store = create_hash_store()
+    store.add(["手机退货政策", "平板电脑保修"], [{'source': 'faq.txt'}, {'source': 'faq.txt'}])
+    chunk_id = store.chunk_ids[0]
+
+    assert store.update_text_blocks({chunk_id: "  \n手机换货政策\t "})
+    text, metadata = store.get_text_block(chunk_id)
+    assert text == "手机换货政策" and metadata['source'] == 'faq.txt'
+    expected = normalize_rows(store.model.encode(["手机换货政策"]))[0]
+    assert np.allclose(store.embedding_matrix[[0]][0], expected)
+
+    assert not store.update_text_blocks({chunk_id: "   "})
+    assert store.get_text_block(chunk_id)[0] == "手机换货政策"
+    print("✓ 更新的文本已去除首尾空白")
+
+
+if __name__ == "__main__":
+    test_updated_text_is_stripped()
+    print("所有测试完成")
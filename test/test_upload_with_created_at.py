@@ -17,6 +17,7 @@ def test_upload_with_created_at():
     """测试上传文件后创建时间是否正确设置"""
     try:
         from vector_store import FaissVectorStore
+        from columnar_store import vector_store_exists
         from file_processors.processor_factory import ProcessorFactory
         
         logger.info("=== 测试上传文件后创建时间设置 ===")
@@ -26,7 +27,7 @@ def test_upload_with_created_at():
         
         # 尝试加载现有的向量存储
         vector_store_path = "knowledge_base/vector_store"
-        if os.path.exists(f"{vector_store_path}.index") and os.path.exists(f"{vector_store_path}.pkl"):
+        if vector_store_exists(vector_store_path):
             logger.info("加载现有向量存储...")
             vector_store.load(vector_store_path)
         
@@ -116,6 +117,7 @@ def test_text_blocks_api():
     """测试文本块查询API"""
     try:
         from vector_store import FaissVectorStore
+        from columnar_store import vector_store_exists
         
         logger.info("\n=== 测试文本块查询API ===")
         
@@ -124,7 +126,7 @@ def test_text_blocks_api():
         
         # 加载向量存储
         vector_store_path = "knowledge_base/vector_store"
-        if os.path.exists(f"{vector_store_path}.index") and os.path.exists(f"{vector_store_path}.pkl"):
+        if vector_store_exists(vector_store_path):
             vector_store.load(vector_store_path)
         
         # 模拟API调用
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+文本块删除标记（墓碑）
+删除文本块时只在位图中标记对应行，向量矩阵、关键词索引和文本块表的行号保持不变，
+搜索时跳过已标记的行；已删除比例超过阈值时再统一压缩（见 FaissVectorStore.compact_tombstones）。
+"""
+
+from collections.abc import Sequence
+from typing import Iterable, Optional
+
+import numpy as np
+
+
+class TombstoneBitmap:
+    """按行号记录文本块是否已删除的位图"""
+
+    def __init__(self, size: int = 0):
+        self._bits = np.zeros(size, dtype=bool)
+        self._count = 0
+        self._live_rows: Optional[np.ndarray] = None
+
+    def __len__(self) -> int:
+        return len(self._bits)
+
+    @property
+    def count(self) -> int:
+        """已删除的行数"""
+        return self._count
+
+    @property
+    def live_count(self) -> int:
+        return len(self._bits) - self._count
+
+    def reset(self, size: int = 0):
+        """清空位图，所有行都有效"""
+        self._bits = np.zeros(size, dtype=bool)
+        self._count = 0
+        self._live_rows = None
+
+    def copy(self) -> 'TombstoneBitmap':
+        """独立的副本（写入方修改副本，已发布的快照保持不变）"""
+        clone = TombstoneBitmap()
+        clone._bits = self._bits.copy()
+        clone._count = self._count
+        clone._live_rows = self._live_rows
+        return clone
+
+    def extend(self, count: int):
+        """在末尾追加 count 个有效行"""
+        if count <= 0:
+            return
+        self._bits = np.concatenate([self._bits, np.zeros(count, dtype=bool)])
+        self._live_rows = None
+
+    def mark(self, rows: Iterable[int]) -> int:
+        """标记删除
+
+        Returns:
+            int: 新标记的行数（已标记过的行不重复计数）
+        """
+        rows = np.fromiter(rows, dtype=np.int64)
+        if rows.size == 0:
+            return 0
+        rows = np.unique(rows)
+        added = int(np.count_nonzero(~self._bits[rows]))
+        self._bits[rows] = True
+        self._count += added
+        self._live_rows = None
+        return added
+
+    def is_deleted(self, row: int) -> bool:
+        return bool(self._bits[row])
+
+    def live_rows(self) -> np.ndarray:
+        """所有未删除的行号（升序）"""
+        if self._live_rows is None:
+            self._live_rows = np.flatnonzero(~self._bits)
+        return self._live_rows
+
+    def deleted_rows(self) -> np.ndarray:
+        return np.flatnonzero(self._bits)
+
+    def filter(self, rows: np.ndarray) -> np.ndarray:
+        """去掉 rows 中已删除的行"""
+        if self._count == 0 or len(rows) == 0:
+            return rows
+        rows = np.asarray(rows, dtype=np.int64)
+        return rows[~self._bits[rows]]
+
+
+class LiveView(Sequence):
+    """只包含未删除行的只读视图，按位置访问时跳过已标记删除的行"""
+
+    def __init__(self, table, tombstones: TombstoneBitmap):
+        """
+        Args:
+            table: 按行号存放全部文本块（含已删除行）的序列
+            tombstones: 与 table 行号对应的删除标记
+        """
+        self.table = table
+        self.tombstones = tombstones
+
+    def __len__(self) -> int:
+        return len(self.table) - self.tombstones.count
+
+    def __getitem__(self, index):
+        if self.tombstones.count == 0:
+            return self.table[index]
+        live_rows = self.tombstones.live_rows()
+        if isinstance(index, slice):
+            return [self.table[int(row)] for row in live_rows[index]]
+        return self.table[int(live_rows[index])]
+
+    def __iter__(self):
+        if self.tombstones.count == 0:
+            yield from self.table
+            return
+        for row in self.tombstones.live_rows():
+            yield self.table[int(row)]
+
+    def __repr__(self) -> str:
+        return f"LiveView({len(self)} of {len(self.table)} rows)"
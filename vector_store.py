@@ -1,5 +1,8 @@
+import atexit
+import itertools
 import os
 import logging
+import threading
 import numpy as np
 import faiss
 from typing import List, Tuple, Optional, Dict, Any
@@ -9,12 +12,32 @@ import traceback
 from pathlib import Path
 import pickle
 import jieba
-from sklearn.feature_extraction.text import TfidfVectorizer
 import time
 import requests
 from requests.exceptions import RequestException
 from tenacity import retry, stop_after_attempt, wait_exponential
 import functools
+from collections import Counter
+from contextlib import contextmanager
+from config_loader import config
+import columnar_store
+import segment_log
+from embedding_cache import EmbeddingCache
+from embedding_matrix import EmbeddingMatrix, normalize_rows, select_top_k
+from embedding_service import PRIORITY_INGEST, PRIORITY_QUERY, EmbeddingService
+from ann_index import AnnIndex, CODEC_FLAT
+from keyword_index import KeywordIndex, tokenize
+from metadata_index import MetadataIndex, normalize_filters
+from onnx_backend import BACKEND_TORCH, BACKENDS, load_onnx_encoder
+from parallel_search import ParallelScorer
+from query_cache import QueryEmbeddingCache
+from search_pipeline import (RERANK_CROSS_ENCODER, RERANK_NONE, RERANK_RELEVANCE, Candidate, CrossEncoderReranker,
+                             RelevanceReranker, SearchPipeline, StageTimer)
+from sentence_index import SentenceIndex, encode_sentences, semantic_coherence, semantic_similarity
+from shard_router import ROUTER_FILE, RouteStats, ShardCache, ShardRouter
+from streaming_encoder import StreamingEncoder
+from store_snapshot import KnowledgeSnapshot
+from tombstones import LiveView, TombstoneBitmap
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -55,23 +78,601 @@ class FaissVectorStore:
     def __init__(self):
         if not self._initialized:
             logger.info("初始化向量存储...")
-            self.documents = []
+            # 按行号存放全部文本块（含已标记删除的行），documents 属性只返回未删除的行
+            self.chunks = []
+            # 预归一化的文档向量矩阵，内存中可以用 float16 / int8 压缩保存，最终候选用精确向量重排
+            self.embedding_matrix = EmbeddingMatrix(
+                storage=config.get('vector_store', 'embedding_storage', fallback='float32'),
+                rerank_factor=config.getint('vector_store', 'embedding_rerank_factor', fallback=4)
+            )
             self.document_embeddings = None
-            self.index = None
+            self.ann_index = None  # FAISS 候选生成索引
+            # 关键词倒排索引（同时维护 BM25 统计）
+            self.keyword_index = KeywordIndex(
+                k1=config.getfloat('vector_store', 'bm25_k1', fallback=1.5),
+                b=config.getfloat('vector_store', 'bm25_b', fallback=0.75)
+            )
+            # 文本块 ID -> 前几个句子的向量，入库时批量编码，语义相关度和连贯性打分时直接查表
+            self.sentence_index = SentenceIndex()
             self.model = None
+            self.model_backend = BACKEND_TORCH
             self.similarity_threshold = 0.3  # 调高基础相似度阈值到0.3
             self.max_retries = 3  # 最大重试次数
             self.retry_delay = 1  # 初始重试延迟（秒）
+            # 进入关键词匹配阶段的向量候选数量
+            self.candidate_pool_size = config.getint('vector_store', 'candidate_pool_size', fallback=200)
+            # 关键词筛选后的文本块不超过该数量时直接精确打分，否则先由 FAISS 索引召回
+            self.lexical_exact_limit = config.getint('vector_store', 'lexical_exact_limit', fallback=20000)
+            # 排序方式：rrf 为向量排名与 BM25 排名的倒数排名融合，weighted 为原来的固定加权分数
+            self.fusion_method = config.get('vector_store', 'fusion_method', fallback='rrf')
+            self.rrf_k = config.getint('vector_store', 'rrf_k', fallback=60)
+            # 每个文本块的永久 ID，与 chunks 行号一一对应，同时作为 FAISS 索引中的向量 ID，
+            # 存储日志中的操作和 /api/text_blocks 接口都按 ID 访问文本块
+            self.chunk_ids: List[int] = []
+            self.next_chunk_id = 0
+            self._chunk_rows: Dict[int, int] = {}  # 未删除的文本块 ID -> 行号
+            # 源文件 -> 该文件未删除的文本块 ID（按加入顺序），增删时同步维护，统计和按文件删除不再扫描全部文本块
+            self.source_chunks: Dict[str, Dict[int, None]] = {}
+            # source、sheet、type 等元数据字段 -> 值 -> 文本块 ID，搜索时按过滤条件先缩小范围
+            self.metadata_index = MetadataIndex()
+            # 按源文件分片：shard_probe 大于 0 时关键词筛选后仍有大量文本块的查询按分片质心路由，
+            # 只对最接近的 shard_probe 个分片打分（代替 FAISS 召回）；分片向量在 shard_cache_mb 内按 LRU 常驻内存
+            self.shard_probe = config.getint('vector_store', 'shard_probe', fallback=0)
+            self.shard_cache = ShardCache(config.getfloat('vector_store', 'shard_cache_mb', fallback=512))
+            # 文档级粗路由：document_route_top 大于 0 时先按文档质心选出前 M 个文档，只对其中的文本块打分；
+            # 最接近的文档相似度低于 document_route_min_score，或第 M 和第 M+1 个文档的相似度相差不到
+            # document_route_margin 时认为路由把握不大，退回全量打分
+            self.document_route_top = config.getint('vector_store', 'document_route_top', fallback=0)
+            self.document_route_min_score = config.getfloat('vector_store', 'document_route_min_score',
+                                                            fallback=0.3)
+            self.document_route_margin = config.getfloat('vector_store', 'document_route_margin', fallback=0.02)
+            self.route_stats = RouteStats()
+            # 两种路由共用文档质心；只开启文档路由时不按分片生成候选（见 _generate_candidates）
+            self.shard_router = ShardRouter() if self.shard_probe > 0 or self.document_route_top > 0 else None
+            # search_workers 大于 0 时，关键词筛选后仍有大量文本块的查询由多个进程并行精确打分（代替 FAISS 召回）
+            search_workers = config.getint('vector_store', 'search_workers', fallback=0)
+            self.parallel_scorer = ParallelScorer(search_workers) if search_workers > 0 else None
+            if self.parallel_scorer is not None:
+                atexit.register(self.parallel_scorer.close)
+            # 删除只在位图中标记，已删除行超过该比例时才压缩向量矩阵、关键词索引和文本块表
+            self.tombstones = TombstoneBitmap()
+            self.tombstone_compact_ratio = config.getfloat('vector_store', 'tombstone_compact_ratio', fallback=0.2)
+            self.segment_store = None  # 当前加载或保存的列式存储
+            # 写入方当前的版本号，发布快照时随快照一起发布（见 generation）
+            self._generation = 0
+            self._pending_log = []     # 上次保存之后尚未写入存储日志的变更
+            # 单一写入方：增删改、加载和保存持有写锁，修改写时复制的副本后发布新的只读快照，
+            # 搜索只读取已发布的快照（见 store_snapshot）
+            self._write_lock = threading.RLock()
+            self._write_depth = 0
+            self._writer = None        # 正在写入的线程
+            self._write_state = None   # 写事务开始时的 (未写入日志的变更数, 列式存储)，出错时恢复
+            self._snapshot: Optional[KnowledgeSnapshot] = None
+            # 查询向量 LRU 缓存，相同的问题不再经过模型计算；配置了路径时退出前保存到磁盘
+            self.query_cache = QueryEmbeddingCache(
+                max_size=config.getint('vector_store', 'query_cache_size', fallback=10000),
+                path=config.get('vector_store', 'query_cache_path', fallback='') or None
+            )
+            # 入库向量的持久化缓存（按模型和文本内容寻址），重新上传或迁移存储时编码过的文本不再经过模型
+            embedding_cache_path = config.get('vector_store', 'embedding_cache_path', fallback='')
+            self.embedding_cache = EmbeddingCache(
+                embedding_cache_path,
+                max_mb=config.getfloat('vector_store', 'embedding_cache_mb', fallback=1024)
+            ) if embedding_cache_path else None
             self.initialize_model()
-            # 初始化TF-IDF计算器
-            self.tfidf_vectorizer = TfidfVectorizer(
-                tokenizer=lambda x: jieba.lcut_for_search(x),
-                token_pattern=None,
-                min_df=2,  # 至少出现在2个文档中
-                max_df=0.8  # 最多出现在80%的文档中
+            # 搜索、微信查询和上传的编码请求由一个服务线程合并成批量模型调用，查询优先于入库
+            self.embedding_service = EmbeddingService(
+                self._model_encode,
+                max_batch_size=config.getint('vector_store', 'embedding_batch_size', fallback=32),
+                max_wait_ms=config.getfloat('vector_store', 'embedding_batch_wait_ms', fallback=5.0)
+            )
+            # 上传的文本块按长度分桶、逐窗口编码，每一批作为入库请求提交给编码服务
+            self.ingest_encoder = StreamingEncoder(
+                self._encode_batch,
+                max_batch_size=config.getint('vector_store', 'embedding_batch_size', fallback=32),
+                max_batch_tokens=config.getint('vector_store', 'ingest_batch_tokens', fallback=8192),
+                window_size=config.getint('vector_store', 'ingest_window_size', fallback=2048),
+                max_length=getattr(self.model, 'max_seq_length', None) or 512,
+                cache=self.embedding_cache
             )
             self.keyword_importance = {}  # 存储关键词重要性
+            # 两阶段检索：召回 rerank_budget 个候选后按配置重排，并统计各阶段耗时
+            self.search_pipeline = self._create_search_pipeline()
+            self._publish()
             FaissVectorStore._initialized = True
+
+    @property
+    def documents(self) -> LiveView:
+        """未删除的文本块 (text, metadata) 序列"""
+        return self._view().documents
+
+    def live_chunk_ids(self) -> List[int]:
+        """未删除文本块的 ID，顺序与 documents 一致"""
+        return self._view().live_chunk_ids()
+
+    def get_text_block(self, chunk_id: int) -> Optional[Tuple[str, Dict]]:
+        """按 ID 获取文本块，不存在或已删除时返回 None"""
+        return self._view().get_text_block(chunk_id)
+
+    def snapshot(self) -> KnowledgeSnapshot:
+        """当前的只读快照（需要多次读取知识库并保证前后一致时，先取快照再从快照中读取）"""
+        return self._view()
+
+    def _view(self) -> KnowledgeSnapshot:
+        """写入线程读取正在修改的副本，其他线程读取已发布的快照"""
+        if self._writer == threading.get_ident():
+            return self._capture()
+        return self._snapshot
+
+    def _capture(self) -> KnowledgeSnapshot:
+        return KnowledgeSnapshot(
+            self.chunks, self.chunk_ids, self._chunk_rows, self.source_chunks, self.metadata_index, self.tombstones,
+            self.embedding_matrix, self.keyword_index, self.ann_index, self.sentence_index, self.shard_router,
+            self._generation
+        )
+
+    def _publish(self):
+        """发布新的只读快照（一次赋值，读取方要么看到旧快照，要么看到新快照）"""
+        self._snapshot = self._capture()
+
+    @contextmanager
+    def _writing(self):
+        """写事务
+
+        持有写锁，把会被原地修改的结构换成写时复制的副本；正常结束时发布新快照，
+        出错时丢弃副本、恢复为原来的快照。可以嵌套，只有最外层复制和发布。
+        """
+        with self._write_lock:
+            outermost = self._write_depth == 0
+            if outermost:
+                self._begin_write()
+            self._write_depth += 1
+            try:
+                yield
+            except BaseException:
+                if outermost:
+                    self._rollback()
+                raise
+            else:
+                if outermost:
+                    self._publish()
+            finally:
+                self._write_depth -= 1
+                if outermost:
+                    self._writer = None
+
+    def _begin_write(self):
+        """开始写事务：复制已发布快照中的结构（向量矩阵和倒排表只在真正修改时复制大块数据）"""
+        self._writer = threading.get_ident()
+        self._write_state = (len(self._pending_log), self.segment_store)
+        if isinstance(self.chunks, columnar_store.ChunkTable):
+            self.chunks = self.chunks.copy()
+        else:
+            self.chunks = list(self.chunks)
+        self.chunk_ids = list(self.chunk_ids)
+        self._chunk_rows = dict(self._chunk_rows)
+        self.source_chunks = {source: dict(ids) for source, ids in self.source_chunks.items()}
+        self.metadata_index = self.metadata_index.copy()
+        self.tombstones = self.tombstones.copy()
+        self.embedding_matrix = self.embedding_matrix.copy()
+        self.keyword_index = self.keyword_index.copy()
+        self.sentence_index = self.sentence_index.copy()
+        if self.shard_router is not None:
+            self.shard_router = self.shard_router.copy()
+
+    def _rollback(self):
+        """写事务出错：恢复为已发布的快照
+
+        FAISS 索引不做复制，其中已经加入的向量找不到对应的行，搜索时被跳过；
+        文本块 ID 不回退，这些向量的 ID 不会被重新分配。
+        """
+        snapshot = self._snapshot
+        self.chunks = snapshot.chunks
+        self.chunk_ids = snapshot.chunk_ids
+        self._chunk_rows = snapshot.chunk_rows
+        self.source_chunks = snapshot.source_chunks
+        self.metadata_index = snapshot.metadata_index
+        self.tombstones = snapshot.tombstones
+        self.embedding_matrix = snapshot.embedding_matrix
+        self.keyword_index = snapshot.keyword_index
+        self.ann_index = snapshot.ann_index
+        self.sentence_index = snapshot.sentence_index
+        self.shard_router = snapshot.shard_router
+        self._generation = snapshot.generation
+        pending_count, self.segment_store = self._write_state
+        del self._pending_log[pending_count:]
+        logger.warning("写入失败，知识库已恢复到修改前的状态")
+
+    def _reset_chunk_rows(self):
+        """按 chunk_ids 和删除标记重建 ID -> 行号映射"""
+        self._chunk_rows = {
+            chunk_id: row for row, chunk_id in enumerate(self.chunk_ids)
+            if not self.tombstones.count or not self.tombstones.is_deleted(row)
+        }
+
+    def _row_source(self, row: int) -> Optional[str]:
+        """指定行的源文件（列式存储中只读取 source，不解析整条元数据）"""
+        if isinstance(self.chunks, columnar_store.ChunkTable):
+            return self.chunks.source(row)
+        return self.chunks[row][1].get('source')
+
+    def _index_sources(self, rows):
+        """把指定行加入源文件 -> 文本块 ID 索引"""
+        for row in rows:
+            source = self._row_source(int(row))
+            if source is not None:
+                self.source_chunks.setdefault(source, {})[self.chunk_ids[int(row)]] = None
+
+    def _reset_source_chunks(self, store: Optional[columnar_store.SegmentStore] = None):
+        """按当前全部未删除的行重建源文件索引、元数据过滤索引和文档质心（加载时调用一次）"""
+        self.source_chunks = {}
+        self._index_sources(self._chunk_rows.values())
+        self.metadata_index.reset(
+            (chunk_id, self._row_metadata_fields(row)) for chunk_id, row in self._chunk_rows.items()
+        )
+        self._reset_shard_router(store)
+
+    def _reset_shard_router(self, store: Optional[columnar_store.SegmentStore] = None):
+        """按源文件索引重建分片路由（没有源文件的文本块不参与路由）
+
+        存储中保存的质心与存储内容一致、且各文档的文本块数量与源文件索引相同时直接使用，不读取向量。
+        """
+        if self.shard_router is None:
+            return
+        if store is not None:
+            key = self._router_key(store)
+            if key is not None and self.shard_router.load(store.root / ROUTER_FILE, key):
+                if self.shard_router.counts() == {source: len(ids) for source, ids in self.source_chunks.items()}:
+                    logger.info(f"已加载 {len(self.shard_router)} 个文档的路由质心")
+                    return
+                logger.info("路由质心与文档不一致，重新计算")
+        loose_ids = set(self._chunk_rows).difference(*self.source_chunks.values())
+        groups = [(None, list(loose_ids), None)]
+        for source, chunk_ids in self.source_chunks.items():
+            rows = [self._chunk_rows[chunk_id] for chunk_id in chunk_ids]
+            groups.append((source, list(chunk_ids), self.embedding_matrix[rows]))
+        self.shard_router.reset(groups)
+
+    @staticmethod
+    def _router_key(store: columnar_store.SegmentStore) -> Optional[str]:
+        """标识存储内容的键：当前日志文件名和长度（段合并不改变日志，落盘和完整写入会换新日志）"""
+        manifest = store.read_manifest()
+        if manifest is None or not manifest.get('wal'):
+            return None
+        return f"{manifest['wal']}:{store.wal_size}"
+
+    def _save_router(self, store: columnar_store.SegmentStore):
+        """把文档质心保存到存储目录"""
+        key = self._router_key(store) if self.shard_router is not None else None
+        if key is not None:
+            self.shard_router.save(store.root / ROUTER_FILE, key)
+
+    def _route_documents(self, view: KnowledgeSnapshot, query_vector: np.ndarray,
+                         lexical_rows: np.ndarray) -> np.ndarray:
+        """文档级粗路由：只保留质心最接近查询的 document_route_top 个文档（及没有源文件的文本块）中的幸存行
+
+        路由把握不大或路由后没有幸存行时返回原来的幸存行（全量打分）。每次查询记录打分的文本块比例。
+        """
+        router, top = view.shard_router, self.document_route_top
+        if top <= 0 or router is None:
+            return lexical_rows
+        total = view.tombstones.live_count
+        ranked = router.rank(query_vector, top + 1) if len(router) > top else []
+        confident = bool(ranked) and ranked[0][1] >= self.document_route_min_score and (
+            len(ranked) <= top or ranked[top - 1][1] - ranked[top][1] >= self.document_route_margin
+        )
+        if confident:
+            chunk_rows = view.chunk_rows
+            chunk_ids = itertools.chain(
+                router.loose_ids, *(view.source_chunks.get(source, ()) for source, _ in ranked[:top])
+            )
+            routed = np.fromiter((chunk_rows[i] for i in chunk_ids if i in chunk_rows), dtype=np.int64)
+            routed = np.intersect1d(lexical_rows, routed)
+            if routed.size:
+                ratio = self.route_stats.record(True, len(routed), total)
+                logger.info(f"文档路由: 选中 {top}/{len(router)} 个文档，"
+                            f"打分 {len(routed)}/{total} 个文本块（{ratio:.1%}）")
+                return routed
+        ratio = self.route_stats.record(False, len(lexical_rows), total)
+        logger.info(f"文档路由把握不大，全量打分 {len(lexical_rows)}/{total} 个文本块（{ratio:.1%}）")
+        return lexical_rows
+
+    def _update_shards(self, rows, remove: bool = False):
+        """把指定行的向量加入（或移出）所属源文件的分片，需要在修改向量矩阵之前移出"""
+        if self.shard_router is None or not len(rows):
+            return
+        groups: Dict[Optional[str], List[int]] = {}
+        for row in rows:
+            groups.setdefault(self._row_source(int(row)), []).append(int(row))
+        update = self.shard_router.remove if remove else self.shard_router.add
+        for source, group in groups.items():
+            update(source, [self.chunk_ids[row] for row in group], self.embedding_matrix[group])
+
+    def _load_shard(self, view: KnowledgeSnapshot, source: str) -> Tuple[np.ndarray, np.ndarray]:
+        """读取一个分片的 (行号, float32 向量)，放入分片缓存"""
+        rows = np.sort(np.fromiter(
+            (view.chunk_rows[i] for i in view.source_chunks.get(source, ()) if i in view.chunk_rows),
+            dtype=np.int64
+        ))
+        return rows, np.ascontiguousarray(view.embedding_matrix[rows])
+
+    def _shard_candidates(self, view: KnowledgeSnapshot, query_vector: np.ndarray, k: int,
+                          rows: Optional[np.ndarray], min_score: float) -> Tuple[np.ndarray, np.ndarray]:
+        """按分片路由生成候选：只对质心与查询最接近的 shard_probe 个分片和没有源文件的文本块精确打分
+
+        分片向量从 LRU 缓存读取，冷分片第一次被路由到时才从向量矩阵（mmap）读入。
+        """
+        router = view.shard_router
+        query = normalize_rows(query_vector)[0]
+        row_parts, score_parts = [], []
+        for source in router.route(query, self.shard_probe):
+            shard_rows, vectors = self.shard_cache.get(
+                (source, router.version(source)), lambda source=source: self._load_shard(view, source)
+            )
+            if rows is not None:
+                mask = np.isin(shard_rows, rows, assume_unique=True)
+                shard_rows, vectors = shard_rows[mask], vectors[mask]
+            row_parts.append(shard_rows)
+            score_parts.append(vectors @ query)
+        if router.loose_ids:
+            loose_rows = np.sort(np.fromiter(
+                (view.chunk_rows[i] for i in router.loose_ids if i in view.chunk_rows), dtype=np.int64
+            ))
+            if rows is not None:
+                loose_rows = np.intersect1d(loose_rows, rows, assume_unique=True)
+            row_parts.append(loose_rows)
+            score_parts.append(view.embedding_matrix.score(query, loose_rows))
+        if not row_parts:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        scores = np.clip(np.concatenate(score_parts), 0.0, 1.0)
+        return select_top_k(scores, np.concatenate(row_parts), k, min_score)
+
+    def _row_metadata_fields(self, row: int) -> Dict[str, Any]:
+        """指定行参与过滤的元数据字段"""
+        if isinstance(self.chunks, columnar_store.ChunkTable):
+            return self.chunks.metadata_fields(row, self.metadata_index.fields)
+        metadata = self.chunks[row][1]
+        return {key: metadata[key] for key in self.metadata_index.fields if key in metadata}
+
+    def _filter_rows(self, view: KnowledgeSnapshot, filters) -> Optional[np.ndarray]:
+        """满足过滤条件的未删除行号（升序），没有过滤条件时返回 None"""
+        if not filters:
+            return None
+        chunk_rows = view.chunk_rows
+        chunk_ids = view.metadata_index.match(filters)
+        return np.sort(np.fromiter((chunk_rows[i] for i in chunk_ids if i in chunk_rows), dtype=np.int64))
+
+    def chunk_ids_for_source(self, source: str) -> List[int]:
+        """指定源文件的全部未删除文本块 ID"""
+        return self._view().chunk_ids_for_source(source)
+
+    def _reset_sentence_index(self, sentence_vectors: Optional[List[Optional[np.ndarray]]] = None) -> int:
+        """按存储中的句子向量重建句子向量索引，缺少的文本块（旧格式的存储）一次批量补算
+
+        Returns:
+            int: 补算的文本块数量
+        """
+        if sentence_vectors is None:
+            sentence_vectors = [None] * len(self.chunk_ids)
+        self.sentence_index.reset(
+            (chunk_id, vectors) for chunk_id, vectors in zip(self.chunk_ids, sentence_vectors) if vectors is not None
+        )
+        missing = [row for row in self._chunk_rows.values() if self.chunk_ids[row] not in self.sentence_index]
+        if missing:
+            logger.info(f"存储中缺少 {len(missing)} 个文本块的句子向量，重新编码")
+            self.sentence_index.set_many(
+                [self.chunk_ids[row] for row in missing],
+                self._encode_sentences([self.chunks[row][0] for row in missing])
+            )
+        return len(missing)
+
+    def _live_sentence_vectors(self) -> Optional[List[np.ndarray]]:
+        """与 chunk_ids 一一对应的句子向量（完整写入存储前已压缩删除标记），有缺失时返回 None"""
+        vectors = [self.sentence_index.get(chunk_id) for chunk_id in self.chunk_ids]
+        return None if any(v is None for v in vectors) else vectors
+
+    @property
+    def document_embeddings(self) -> Optional[np.ndarray]:
+        """文档向量矩阵（已归一化，含已标记删除的行），行号与 chunks 对应"""
+        return self._view().embedding_matrix.vectors
+
+    @document_embeddings.setter
+    def document_embeddings(self, embeddings):
+        self.embedding_matrix.reset(embeddings)
+
+    @property
+    def generation(self) -> int:
+        """知识库版本号，每次增、删、改或重新加载都会递增，搜索结果缓存据此判断结果是否过期
+
+        返回已发布快照的版本号：写入完成之前搜索仍使用旧快照，版本号也不变。
+        """
+        return self._snapshot.generation if self._snapshot is not None else self._generation
+
+    def bump_generation(self) -> int:
+        """知识库内容发生变化，递增版本号（新快照发布后，之前缓存的搜索结果随之失效）"""
+        self._generation += 1
+        return self._generation
+
+    @property
+    def index(self):
+        """底层 FAISS 索引"""
+        return self.ann_index.index if self.ann_index else None
+
+    def _create_ann_index(self, dim: int) -> AnnIndex:
+        """按配置创建 FAISS 索引管理器"""
+        return AnnIndex(
+            dim,
+            flat_threshold=config.getint('vector_store', 'ann_flat_threshold', fallback=20000),
+            hnsw_threshold=config.getint('vector_store', 'ann_hnsw_threshold', fallback=500000),
+            nprobe=config.getint('vector_store', 'ann_nprobe', fallback=16),
+            retrain_growth=config.getfloat('vector_store', 'ann_retrain_growth', fallback=2.0),
+            compression=config.get('vector_store', 'ann_compression', fallback='flat'),
+            pq_m=config.getint('vector_store', 'ann_pq_m', fallback=64),
+            pq_min_train=config.getint('vector_store', 'ann_pq_min_train', fallback=10000)
+        )
+
+    def _create_search_pipeline(self) -> SearchPipeline:
+        """按配置创建两阶段检索流水线"""
+        method = config.get('vector_store', 'rerank_method', fallback=RERANK_NONE)
+        reranker = None
+        if method == RERANK_RELEVANCE:
+            reranker = RelevanceReranker(self)
+        elif method == RERANK_CROSS_ENCODER:
+            reranker = CrossEncoderReranker(
+                config.get('vector_store', 'rerank_model', fallback='')
+                or os.path.join(os.path.dirname(__file__), 'models', 'bge-reranker-base'),
+                batch_size=config.getint('vector_store', 'rerank_batch_size', fallback=32)
+            )
+        elif method != RERANK_NONE:
+            logger.warning(f"未知的重排方式: {method}，不做重排")
+        return SearchPipeline(reranker, rerank_budget=config.getint('vector_store', 'rerank_budget', fallback=50))
+
+    def _create_segment_store(self, path: str) -> columnar_store.SegmentStore:
+        """按配置创建列式存储管理器"""
+        return columnar_store.SegmentStore(
+            path,
+            wal_flush_bytes=config.getint('vector_store', 'wal_flush_mb', fallback=64) * 1024 * 1024,
+            max_segments=config.getint('vector_store', 'compaction_max_segments', fallback=8),
+            max_deleted_ratio=config.getfloat('vector_store', 'compaction_deleted_ratio', fallback=0.2)
+        )
+
+    def _record_change(self, op: str, rows, embeddings: Optional[np.ndarray] = None) -> None:
+        """记录一次变更，下次保存时追加到存储日志
+
+        删除操作需要在行被移除之前记录（日志中保存的是文本块 ID）。新增和更新操作传入
+        模型生成的原始向量，向量矩阵压缩保存时日志中仍然是精确的 float32 向量。
+        """
+        rows = list(rows)
+        record = {'op': op, 'ids': [self.chunk_ids[row] for row in rows]}
+        if op != segment_log.OP_DELETE:
+            if embeddings is None:
+                embeddings = self.embedding_matrix[rows]
+            record['documents'] = [self.chunks[row] for row in rows]
+            record['embeddings'] = np.asarray(embeddings, dtype=np.float32)
+            record['keyword_terms'] = [self.keyword_index.row_terms[row] for row in rows]
+            record['sentence_vectors'] = [self.sentence_index.get(chunk_id) for chunk_id in record['ids']]
+        self._pending_log.append(record)
+
+    def rebuild_index(self):
+        """根据当前全部未删除的向量重建 FAISS 索引（规模变化时自动切换索引类型）"""
+        with self._write_lock:
+            vectors = self.embedding_matrix if len(self.embedding_matrix) else None
+            ids = np.asarray(self.chunk_ids, dtype=np.int64)
+            if self.tombstones.count:
+                rows = self.tombstones.live_rows()
+                vectors = self.embedding_matrix.view(rows) if len(rows) else None
+                ids = ids[rows]
+            self.ann_index.reset_vectors(vectors, ids)
+
+    def _index_appended_rows(self, rows: range):
+        """将新追加的行同步到 FAISS 索引，规模跨越阈值时重新训练"""
+        if self.ann_index.should_rebuild(self.tombstones.live_count):
+            logger.info("知识库规模跨越索引阈值，重新构建 FAISS 索引")
+            self.rebuild_index()
+        else:
+            self.ann_index.add(self.embedding_matrix[rows.start:rows.stop],
+                               np.asarray(self.chunk_ids[rows.start:rows.stop], dtype=np.int64))
+
+    def _refresh_index_ids(self, chunk_ids):
+        """从 FAISS 索引中移除指定文本块，再把其中仍然存在的重新加入（用于重放存储日志后的同步）"""
+        chunk_ids = np.fromiter(chunk_ids, dtype=np.int64)
+        rows = np.array(sorted(self._chunk_rows[i] for i in chunk_ids.tolist() if i in self._chunk_rows),
+                        dtype=np.int64)
+        self.ann_index.remove(chunk_ids)
+        if self.ann_index.should_rebuild(self.tombstones.live_count):
+            self.rebuild_index()
+            return
+        if len(rows):
+            self.ann_index.add(self.embedding_matrix[rows],
+                               np.asarray(self.chunk_ids, dtype=np.int64)[rows])
+        self._rebuild_if_stale()
+
+    def _rebuild_if_stale(self):
+        """索引中失效的向量（HNSW 无法删除的旧向量）超过 tombstone_compact_ratio 时重建"""
+        if self.ann_index.stale_count > self.tombstone_compact_ratio * max(1, self.ann_index.ntotal):
+            logger.info(f"FAISS 索引中有 {self.ann_index.stale_count} 个失效向量，重新构建索引")
+            self.rebuild_index()
+
+    def _generate_candidates(self, view: KnowledgeSnapshot, query_vector: np.ndarray, k: int,
+                             rows: Optional[np.ndarray], min_score: float) -> Tuple[np.ndarray, np.ndarray]:
+        """向量候选生成
+
+        Args:
+            view: 本次搜索读取的快照
+            query_vector: 归一化的查询向量
+            k: 候选数量
+            rows: 关键词筛选后幸存的行号，为 None 时在全部文本块中选择
+            min_score: 最低向量相似度
+
+        幸存行数量不多时直接对这些行精确打分；启用了多进程打分时由工作进程并行精确打分；
+        启用了分片路由时只在路由到的分片中打分；否则由 FAISS 索引召回候选（索引返回文本块 ID，转换为行号，已删除的文本块不在映射中），
+        与幸存行取交集后再用精确余弦相似度重新打分。索引与向量矩阵不同步时退回到矩阵打分。
+        """
+        matrix, ann_index, chunk_rows = view.embedding_matrix, view.ann_index, view.chunk_rows
+        lexical_rows = rows
+        if rows is None and view.tombstones.count:
+            rows = view.tombstones.live_rows()
+        if rows is not None and len(rows) <= self.lexical_exact_limit:
+            return matrix.top_k(query_vector, k, min_score=min_score, rows=rows)
+        if self.parallel_scorer is not None:
+            result = self._parallel_top_k(view, query_vector, k, min_score, rows)
+            if result is not None:
+                return result
+        if self.shard_probe > 0 and view.shard_router is not None and len(view.shard_router):
+            # 分片中只有未删除的行，不需要再与删除标记取交集
+            return self._shard_candidates(view, query_vector, k, lexical_rows, min_score)
+
+        # HNSW 索引不支持删除，其中可能还留有已删除的向量
+        if ann_index is not None and ann_index.ntotal >= view.tombstones.live_count:
+            fetch = k
+            if ann_index.codec != CODEC_FLAT:
+                # 压缩编码的索引分数不精确，多召回一些候选交给下面的精确打分
+                fetch = min(k * matrix.rerank_factor, ann_index.ntotal)
+            if rows is not None:
+                # 召回数量按幸存比例放大，保证取交集后仍有足够的候选
+                fetch = max(fetch, k * ann_index.ntotal // max(1, len(rows)))
+                fetch = min(fetch, self.lexical_exact_limit, ann_index.ntotal)
+            ann_ids, _ = ann_index.search(query_vector, fetch)
+            # 索引可能已经包含快照之后加入的文本块，只保留快照中存在的
+            ann_rows = np.fromiter(
+                (chunk_rows[i] for i in ann_ids.tolist() if i in chunk_rows), dtype=np.int64
+            )
+            if rows is not None:
+                ann_rows = ann_rows[np.isin(ann_rows, rows)]
+            return matrix.top_k(query_vector, min(k, len(ann_rows)), min_score=min_score, rows=ann_rows)
+        return matrix.top_k(query_vector, k, min_score=min_score, rows=rows)
+
+    def _parallel_top_k(self, view: KnowledgeSnapshot, query_vector: np.ndarray, k: int, min_score: float,
+                        rows: Optional[np.ndarray]) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """由工作进程并行精确打分；工作进程还没有打开这个快照的向量矩阵或打分失败时返回 None"""
+        # 写入线程读到的是尚未发布的副本，不导出给工作进程
+        if self._writer == threading.get_ident() or not self.parallel_scorer.ready(view.embedding_matrix):
+            return None
+        try:
+            return self.parallel_scorer.top_k(view.embedding_matrix, query_vector, k, min_score, rows)
+        except Exception as e:
+            logger.error(f"多进程打分失败，改为在当前进程打分: {str(e)}")
+            logger.error(traceback.format_exc())
+            return None
+
+    def _reciprocal_rank_fusion(self, *rankings: List[int]) -> Dict[int, float]:
+        """倒数排名融合（RRF）
+
+        Args:
+            rankings: 多个按相关性降序排列的行号列表
+
+        Returns:
+            Dict[int, float]: 行号 -> 融合分数（按分数降序），除以理论最大值归一化到 [0, 1]；
+                              分数相同时按第一个排名中的先后，只出现在后面排名中的行排在后面
+        """
+        fused: Dict[int, float] = {}
+        for ranking in rankings:
+            for rank, row in enumerate(ranking, start=1):
+                fused[row] = fused.get(row, 0.0) + 1.0 / (self.rrf_k + rank)
+        max_score = len(rankings) / (self.rrf_k + 1)
+        # 稳定排序：分数相同时保持插入顺序（各排名本身的顺序是确定的，见 select_top_k）
+        ordered = sorted(fused.items(), key=lambda item: item[1], reverse=True)
+        return {row: score / max_score for row, score in ordered}
             
     @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=4, max=10))
     def initialize_model(self):
@@ -87,14 +688,43 @@ class FaissVectorStore:
             logger.info(f"使用设备: {device}")
             
             logger.info("正在初始化模型...")
-            self.model = SentenceTransformer(cache_dir)
-            self.model.to(device)
-            
-            # 初始化FAISS索引为L2距离
+            self.model = None
+            backend = config.get('vector_store', 'model_backend', fallback=BACKEND_TORCH)
+            if backend not in BACKENDS:
+                logger.warning(f"未知的模型后端 {backend}，使用 {BACKEND_TORCH}")
+                backend = BACKEND_TORCH
+            elif backend != BACKEND_TORCH and device != 'cpu':
+                logger.info(f"检测到 GPU，忽略 {backend} 后端，使用 {BACKEND_TORCH}")
+                backend = BACKEND_TORCH
+            if backend != BACKEND_TORCH:
+                # ONNX Runtime 后端：首次使用时导出并缓存，一致性检查不通过时退回 PyTorch
+                self.model = load_onnx_encoder(
+                    cache_dir, backend,
+                    threads=config.getint('vector_store', 'onnx_threads', fallback=0),
+                    min_cosine=config.getfloat('vector_store', 'onnx_min_cosine', fallback=0.99)
+                )
+                if self.model is None:
+                    backend = BACKEND_TORCH
+            if self.model is None:
+                self.model = SentenceTransformer(cache_dir)
+                self.model.to(device)
+            self.model_backend = backend
+            
+            # 初始化FAISS索引（内积，向量已归一化）
             dim = self.model.get_sentence_embedding_dimension()
-            self.index = faiss.IndexFlatL2(dim)  # 使用L2距离
+            self.ann_index = self._create_ann_index(dim)
             logger.info(f"FAISS 索引初始化成功，维度: {dim}")
             
+            # 缓存的查询向量只对同一个模型有效
+            self.query_cache.model_id = f"{os.path.basename(cache_dir)}:{dim}"
+            if backend != BACKEND_TORCH:
+                self.query_cache.model_id += f":{backend}"
+            if self.embedding_cache is not None:
+                self.embedding_cache.model_id = self.query_cache.model_id
+            if self.query_cache.path is not None:
+                self.query_cache.load()
+                atexit.register(self.query_cache.save)
+            
         except Exception as e:
             logger.error(f"初始化向量模型失败: {str(e)}")
             logger.error(traceback.format_exc())
@@ -141,11 +771,15 @@ class FaissVectorStore:
             return vector
         return vector / norm
 
+    def _extract_keywords(self, text: str) -> set:
+        """分词并过滤单字词，返回关键词集合"""
+        return set(tokenize(text))
+
     def calculate_keyword_match(self, query: str, text: str) -> float:
         """计算关键词匹配度"""
         # 分词并过滤停用词
-        query_words = set(w for w in jieba.lcut_for_search(query) if len(w) > 1)
-        text_words = set(w for w in jieba.lcut_for_search(text) if len(w) > 1)
+        query_words = self._extract_keywords(query)
+        text_words = self._extract_keywords(text)
         
         if not query_words or not text_words:
             return 0.0
@@ -237,79 +871,54 @@ class FaissVectorStore:
         # 综合考虑词频、位置和匹配率
         return (importance * 0.4 + sum(position_scores) * 0.3 + match_rate * 0.3)
 
-    def calculate_semantic_similarity(self, query: str, text: str) -> float:
+    def _model_encode(self, texts: List[str]) -> np.ndarray:
+        """直接调用模型批量编码（只在编码服务线程中调用）"""
+        return self.model.encode(texts, batch_size=max(1, len(texts)), convert_to_tensor=True).cpu().numpy()
+
+    def _encode_batch(self, texts: List[str], priority: int = PRIORITY_INGEST) -> np.ndarray:
+        return self.embedding_service.encode(texts, priority)
+
+    def _encode_chunks(self, texts: List[str]) -> Tuple[np.ndarray, List[np.ndarray]]:
+        """入库编码：文本块和它们的前几个句子按长度分桶流式编码，返回 (文本块向量, 每个文本块的句子向量)"""
+        return self.ingest_encoder.encode_chunks(texts)
+
+    def _encode_sentences(self, texts: List[str]) -> List[np.ndarray]:
+        """只编码文本块的前几个句子（补算存储中缺少的句子向量）"""
+        return self.ingest_encoder.encode_sentences(texts)
+
+    def _encode_query_sentences(self, texts: List[str]) -> List[np.ndarray]:
+        """搜索时现场编码句子向量（按查询优先级）"""
+        return encode_sentences(lambda batch: self._encode_batch(batch, PRIORITY_QUERY), texts)
+
+    def _sentence_vectors(self, text: str, chunk_id: Optional[int] = None) -> np.ndarray:
+        """文本块的句子向量：优先从句子向量索引中查找，不在知识库中的文本才现场编码"""
+        if chunk_id is not None:
+            vectors = self._view().sentence_index.get(chunk_id)
+            if vectors is not None:
+                return vectors
+        return self._encode_query_sentences([text])[0]
+
+    def calculate_semantic_similarity(self, query: str, text: str, chunk_id: Optional[int] = None,
+                                      query_vector: Optional[np.ndarray] = None) -> float:
         """计算语义相关度
         
-        使用更细粒度的语义分析来评估查询和文本的相关性
+        使用更细粒度的语义分析来评估查询和文本的相关性：返回查询与前3个句子相似度的最大值。
+        句子向量在入库时已经计算好，传入 chunk_id 时只做查表和点积。
         """
-        # 将长文本分成句子
-        text_sentences = [s.strip() for s in text.split('。') if s.strip()]
-        if not text_sentences:
-            return 0.0
-            
-        # 对每个句子计算与查询的相似度
-        sentence_scores = []
-        query_vector = self.model.encode([query], convert_to_tensor=True)[0]
-        
-        for sentence in text_sentences[:3]:  # 只取前3个句子，避免计算过多
-            try:
-                sentence_vector = self.model.encode([sentence], convert_to_tensor=True)[0]
-                similarity = self.cosine_similarity(query_vector.cpu().numpy(), sentence_vector.cpu().numpy())
-                sentence_scores.append(similarity)
-            except Exception as e:
-                logger.warning(f"计算句子相似度失败: {str(e)}")
-                continue
-                
-        # 如果没有有效的句子相似度，返回0
-        if not sentence_scores:
+        try:
+            if query_vector is None:
+                query_vector = self.encode_text(query)
+            return semantic_similarity(self.normalize_vector(query_vector), self._sentence_vectors(text, chunk_id))
+        except Exception as e:
+            logger.warning(f"计算句子相似度失败: {str(e)}")
             return 0.0
-            
-        # 返回最高的句子相似度
-        return max(sentence_scores)
 
-    def calculate_semantic_coherence(self, query: str, text: str) -> float:
-        """计算语义连贯性"""
-        # 将文本分成句子
-        sentences = [s.strip() for s in text.split('。') if s.strip()]
-        if not sentences:
-            return 0.0
-            
-        # 对查询和每个句子进行向量化
-        query_vector = self.model.encode([query], convert_to_tensor=True)[0]
-        sentence_vectors = self.model.encode(sentences[:3], convert_to_tensor=True)
-        
-        # 计算句子间的语义连贯性
-        coherence_scores = []
-        query_similarities = []
-        prev_vector = None
-        
-        for i, sent_vector in enumerate(sentence_vectors):
-            # 计算与查询的相似度
-            query_sim = float(self.cosine_similarity(query_vector.cpu().numpy(), sent_vector.cpu().numpy()))
-            query_similarities.append(query_sim)
-            
-            # 计算与前一个句子的连贯性
-            if prev_vector is not None:
-                coherence = float(self.cosine_similarity(prev_vector.cpu().numpy(), sent_vector.cpu().numpy()))
-                coherence_scores.append(coherence)
-                
-            prev_vector = sent_vector
-            
-        # 如果只有一个句子，检查与查询的相似度
-        if not coherence_scores:
-            avg_query_sim = sum(query_similarities) / len(query_similarities)
-            return avg_query_sim if avg_query_sim > 0.5 else 0.0
-            
-        # 计算平均查询相似度和连贯性
-        avg_query_sim = sum(query_similarities) / len(query_similarities)
-        avg_coherence = sum(coherence_scores) / len(coherence_scores)
-        
-        # 如果平均查询相似度过低，返回0
-        if avg_query_sim < 0.4:
-            return 0.0
-            
-        # 综合考虑查询相似度和语义连贯性
-        return 0.7 * avg_query_sim + 0.3 * avg_coherence
+    def calculate_semantic_coherence(self, query: str, text: str, chunk_id: Optional[int] = None,
+                                     query_vector: Optional[np.ndarray] = None) -> float:
+        """计算语义连贯性（查询与前3个句子的相似度，结合相邻句子之间的连贯性）"""
+        if query_vector is None:
+            query_vector = self.encode_text(query)
+        return semantic_coherence(self.normalize_vector(query_vector), self._sentence_vectors(text, chunk_id))
 
     def is_query_valid(self, query: str) -> bool:
         """检查查询是否有效"""
@@ -330,16 +939,24 @@ class FaissVectorStore:
         return True
 
     @network_error_handler
-    def encode_text(self, text: str) -> np.ndarray:
-        """对单个文本进行编码，带有错误处理"""
+    def encode_text(self, text: str, use_cache: bool = True) -> np.ndarray:
+        """对单个文本进行编码，带有错误处理
+
+        默认经过查询向量缓存，命中时直接返回归一化后的向量，不再调用模型。
+        """
         try:
             if not text or not text.strip():
                 raise ValueError("文本为空")
-            return self.model.encode([text.strip()], convert_to_tensor=True)[0].cpu().numpy()
+            if use_cache:
+                return self.query_cache.get_or_compute(text, self._encode_with_model)
+            return self._encode_with_model(text)
         except Exception as e:
             logger.error(f"文本编码失败: {str(e)}")
             raise
 
+    def _encode_with_model(self, text: str) -> np.ndarray:
+        return self._encode_batch([text.strip()], PRIORITY_QUERY)[0]
+
     def add(self, texts: List[str], metadata: Optional[List[Dict]] = None) -> bool:
         """添加文档到向量存储"""
         try:
@@ -358,8 +975,8 @@ class FaissVectorStore:
             # 生成向量嵌入
             logger.info("生成文档向量...")
             try:
-                # 使用模型批量编码文本
-                embeddings = self.model.encode(valid_texts, convert_to_tensor=True).cpu().numpy()
+                # 使用模型批量编码文本，句子向量在同一批中编码，打分时不再调用模型
+                embeddings, sentence_vectors = self._encode_chunks(valid_texts)
                 logger.info(f"生成了 {len(embeddings)} 个向量")
                 
             except Exception as e:
@@ -367,24 +984,37 @@ class FaissVectorStore:
                 logger.error(traceback.format_exc())
                 return False
             
-            # 添加到文档存储
-            try:
-                if self.document_embeddings is None:
-                    self.document_embeddings = embeddings
+            # 保存文档和元数据
+            if metadata is None:
+                metadata = [{}] * len(valid_texts)
+            elif len(metadata) != len(valid_texts):
+                # 如果元数据长度不匹配，调整元数据
+                if len(metadata) > len(valid_texts):
+                    metadata = metadata[:len(valid_texts)]
                 else:
-                    self.document_embeddings = np.vstack([self.document_embeddings, embeddings])
-                    
-                # 保存文档和元数据
-                if metadata is None:
-                    metadata = [{}] * len(valid_texts)
-                elif len(metadata) != len(valid_texts):
-                    # 如果元数据长度不匹配，调整元数据
-                    if len(metadata) > len(valid_texts):
-                        metadata = metadata[:len(valid_texts)]
-                    else:
-                        metadata.extend([{}] * (len(valid_texts) - len(metadata)))
-                        
-                self.documents.extend(list(zip(valid_texts, metadata)))
+                    metadata.extend([{}] * (len(valid_texts) - len(metadata)))
+            
+            # 添加到文档存储（模型编码在写锁之外完成，写入期间搜索继续使用旧快照）
+            try:
+                with self._writing():
+                    # 追加到预分配的向量矩阵，不再复制整个矩阵
+                    rows = self.embedding_matrix.append(embeddings)
+                    self.chunks.extend(list(zip(valid_texts, metadata)))
+                    # 入库时分词一次并写入倒排索引
+                    self.keyword_index.add_texts(valid_texts)
+                    new_ids = range(self.next_chunk_id, self.next_chunk_id + len(rows))
+                    self.next_chunk_id += len(rows)
+                    self.chunk_ids.extend(new_ids)
+                    self._chunk_rows.update(zip(new_ids, rows))
+                    self.sentence_index.set_many(new_ids, sentence_vectors)
+                    self.tombstones.extend(len(rows))
+                    self._index_sources(rows)
+                    self._update_shards(rows)
+                    for row, chunk_id in zip(rows, new_ids):
+                        self.metadata_index.add(chunk_id, self.chunks[row][1])
+                    self._index_appended_rows(rows)
+                    self._record_change(segment_log.OP_ADD, rows, embeddings)
+                    self.bump_generation()
                 logger.info(f"文档已保存，当前总数: {len(self.documents)}")
                 
                 return True
@@ -444,44 +1074,33 @@ class FaissVectorStore:
         if not query_words:
             return
             
-        # 构建文档集合
-        all_docs = [query] + relevant_docs
+        if not relevant_docs:
+            return
         
-        # 训练TF-IDF
+        # 词频取自相关文档，逆文档频率直接使用倒排索引增量维护的统计，不再每次重新拟合 TF-IDF
         try:
-            tfidf_matrix = self.tfidf_vectorizer.fit_transform(all_docs)
-            
-            # 获取特征名称（兼容不同版本的scikit-learn）
-            try:
-                feature_names = self.tfidf_vectorizer.get_feature_names_out()
-            except AttributeError:
-                try:
-                    feature_names = self.tfidf_vectorizer.get_feature_names()
-                except AttributeError:
-                    logger.error("无法获取TF-IDF特征名称，可能是scikit-learn版本不兼容")
-                    return
+            doc_terms = [Counter(tokenize(doc)) for doc in relevant_docs]
             
             # 更新关键词重要性
             for word in query_words:
-                if word in feature_names:
-                    idx = list(feature_names).index(word)
-                    # 获取该词在所有文档中的TF-IDF值
-                    importance = np.mean(tfidf_matrix[:, idx].toarray())
-                    # 更新重要性，使用指数移动平均
-                    self.keyword_importance[word] = (
-                        0.7 * self.keyword_importance.get(word, importance) +
-                        0.3 * importance
-                    )
+                tf = np.mean([terms[word] / max(1, sum(terms.values())) for terms in doc_terms])
+                importance = float(tf * self.keyword_index.normalized_idf(word))
+                # 更新重要性，使用指数移动平均
+                self.keyword_importance[word] = (
+                    0.7 * self.keyword_importance.get(word, importance) +
+                    0.3 * importance
+                )
         except Exception as e:
             logger.warning(f"更新关键词重要性失败: {str(e)}")
 
     def calculate_relevance_score(self, query_vector: np.ndarray, doc_vector: np.ndarray,
-                                query: str, text: str) -> Tuple[float, Dict[str, float]]:
-        """计算综合相关性得分"""
+                                query: str, text: str,
+                                chunk_id: Optional[int] = None) -> Tuple[float, Dict[str, float]]:
+        """计算综合相关性得分（传入 chunk_id 时语义连贯性直接使用入库时计算的句子向量）"""
         # 计算各个维度的相似度
         vector_similarity = float(self.cosine_similarity(query_vector, doc_vector))
         keyword_importance = self.calculate_keyword_importance(query, text)
-        semantic_coherence = self.calculate_semantic_coherence(query, text)
+        semantic_coherence = self.calculate_semantic_coherence(query, text, chunk_id, query_vector)
         
         # 严格的过滤规则
         if keyword_importance == 0.0:  # 如果关键词重要性为0，说明没有足够的关键词匹配
@@ -533,207 +1152,519 @@ class FaissVectorStore:
             
         return combined_score, scores
 
-    def search(self, query: str, top_k: int = 5) -> List[Tuple[str, float, Dict]]:
-        """搜索相似文档"""
+    def _check_query(self, view: KnowledgeSnapshot, query: str) -> bool:
+        """检查查询内容和知识库状态"""
+        if not self.is_query_valid(query):
+            logger.warning("查询内容无效")
+            return False
+        if not view.documents:
+            logger.warning("知识库为空")
+            return False
+        if len(query) < 2:
+            logger.warning("查询内容过短")
+            return False
+        return True
+
+    def _lexical_filter(self, view: KnowledgeSnapshot, query: str,
+                        filter_rows: Optional[np.ndarray] = None) -> Optional[Tuple[set, Dict[int, int], np.ndarray]]:
+        """第一阶段：合并查询关键词的倒排表，只保留关键词匹配率达到30%的文本块
+
+        Args:
+            filter_rows: 满足元数据过滤条件的行号（升序），为 None 时不过滤
+
+        Returns:
+            (查询关键词, 行号 -> 命中关键词数, 幸存行号)，没有幸存的文本块时返回 None
+        """
+        query_words = self._extract_keywords(query)
+        keyword_hits = view.keyword_index.match(query_words)
+        lexical_rows = view.tombstones.filter(np.sort(np.fromiter(
+            (row for row, hits in keyword_hits.items() if hits / len(query_words) >= 0.3),
+            dtype=np.int64
+        )))
+        if filter_rows is not None:
+            lexical_rows = np.intersect1d(lexical_rows, filter_rows, assume_unique=True)
+        logger.info(f"关键词筛选后剩余 {len(lexical_rows)} 个文本块")
+        if lexical_rows.size == 0:
+            logger.info("未找到相关文档")
+            return None
+        return query_words, keyword_hits, lexical_rows
+
+    def search(self, query: str, top_k: int = 5, min_score: Optional[float] = None,
+               filters: Optional[Dict[str, Any]] = None) -> List[Tuple[str, float, Dict]]:
+        """搜索相似文档
+
+        Args:
+            query: 查询文本
+            top_k: 返回数量
+            min_score: 本次搜索的最低向量相似度，为 None 时使用 similarity_threshold
+                       （需要不同阈值时按次传入，不要修改共享的 similarity_threshold）
+            filters: 元数据过滤条件，例如 {'source': 'a.xlsx', 'sheet': ['Sheet1', 'Sheet2']}，
+                     字段见 metadata_index.FILTER_FIELDS；在向量打分之前应用
+
+        Raises:
+            ValueError: 过滤条件中有不支持的字段
+        """
+        filters = normalize_filters(filters)
         try:
-            if not self.is_query_valid(query):
-                logger.warning("查询内容无效")
-                return []
-                
-            if not self.documents:
-                logger.warning("知识库为空")
-                return []
-                
-            if len(query) < 2:
-                logger.warning("查询内容过短")
+            # 整个搜索过程只读取这一份快照，不受并发写入的影响
+            view = self._view()
+            min_score = self.similarity_threshold if min_score is None else min_score
+            if not self._check_query(view, query):
                 return []
                 
             logger.info(f"\n{'='*50}")
             logger.info(f"开始搜索: {query}")
-            logger.info(f"当前知识库文档数量: {len(self.documents)}")
+            logger.info(f"当前知识库文档数量: {len(view.documents)}")
             logger.info(f"{'='*50}\n")
             
+            timer = StageTimer()
+            with timer.stage('lexical'):
+                lexical = self._lexical_filter(view, query, self._filter_rows(view, filters))
+            if lexical is None:
+                return []
+            query_words, keyword_hits, lexical_rows = lexical
+            
             # 生成查询向量
             try:
-                query_vector = self.encode_text(query)
-                # 标准化查询向量
-                query_vector = self.normalize_vector(query_vector)
+                with timer.stage('encode'):
+                    query_vector = self.encode_text(query)
+                    # 标准化查询向量
+                    query_vector = self.normalize_vector(query_vector)
             except Exception as e:
                 logger.error(f"查询向量生成失败: {str(e)}")
                 return []
-            
-            # 计算与所有文档的相似度
-            results = []
-            
-            for i, (text, metadata) in enumerate(self.documents):
-                try:
-                    if self.document_embeddings is not None and i < len(self.document_embeddings):
-                        # 获取文档向量并标准化
-                        doc_vector = self.document_embeddings[i]
-                        doc_vector = self.normalize_vector(doc_vector)
-                        
-                        # 计算向量相似度
-                        vector_similarity = self.cosine_similarity(query_vector, doc_vector)
-                        
-                        # 计算关键词匹配度
-                        keyword_match = self.calculate_keyword_match(query, text)
-                        
-                        # 使用严格的过滤规则
-                        if keyword_match == 0:  # 如果没有关键词匹配，直接跳过
-                            continue
-                            
-                        # 计算加权分数
-                        # 向量相似度权重降低，关键词匹配权重提高
-                        weighted_score = 0.4 * vector_similarity + 0.6 * keyword_match
-                        
-                        # 恢复原有严格阈值
-                        if (vector_similarity >= self.similarity_threshold and 
-                            keyword_match >= 0.3 and  # 关键词匹配阈值30%
-                            weighted_score >= 0.4):  # 最终分数阈值0.4
-                            
-                            results.append((
-                                text, 
-                                weighted_score,
-                                {
-                                    **metadata,
-                                    '_debug_info': {
-                                        'vector_similarity': f"{vector_similarity:.4f}",
-                                        'keyword_match': f"{keyword_match:.4f}",
-                                        'weighted_score': f"{weighted_score:.4f}"
-                                    }
-                                }
-                            ))
-                            
-                except Exception as e:
-                    logger.error(f"处理文档 {i} 时发生错误: {str(e)}")
-                    continue
-            
-            if not results:
-                logger.info("未找到相关文档")
-                return []
-            
-            # 按相似度排序
-            results.sort(key=lambda x: x[1], reverse=True)
-            
-            # 输出搜索结果详情
-            logger.info("\n搜索结果详情:")
-            logger.info(f"{'='*150}")
-            logger.info(f"{'序号':^6} | {'加权分数':^10} | {'向量相似度':^12} | {'关键词匹配':^10} | {'文本预览':<90}")
-            logger.info(f"{'-'*150}")
-            
-            for i, (text, score, metadata) in enumerate(results[:top_k]):
-                debug_info = metadata.get('_debug_info', {})
-                preview = text[:90] + "..." if len(text) > 90 else text
-                logger.info(
-                    f"{i+1:^6} | {score:^10.4f} | "
-                    f"{debug_info.get('vector_similarity', 'N/A'):^12} | "
-                    f"{debug_info.get('keyword_match', 'N/A'):^10} | "
-                    f"{preview:<90}"
+
+            with timer.stage('route'):
+                lexical_rows = self._route_documents(view, query_vector, lexical_rows)
+            
+            # 第二阶段：只对关键词筛选后的文本块做向量打分
+            pool_size = max(top_k, self.candidate_pool_size)
+            with timer.stage('candidates'):
+                candidate_rows, candidate_scores = self._generate_candidates(
+                    view, query_vector, pool_size, lexical_rows, min_score
                 )
-            
-            logger.info(f"{'='*150}")
-            logger.info(f"找到 {len(results)} 条匹配结果\n")
-            
-            return results[:top_k]
+            with timer.stage('fusion'):
+                candidates = self._fuse_and_rank(
+                    view, self.search_pipeline.candidate_count(top_k), min_score, query_words, keyword_hits,
+                    lexical_rows, candidate_rows, candidate_scores,
+                    lambda rows: view.embedding_matrix.score(query_vector, rows)
+                )
+            candidates = self._rerank(view, [query], [candidates], timer)[0]
+            self.search_pipeline.record(timer)
+            return self._finish(candidates, top_k)
             
         except Exception as e:
             logger.error(f"搜索失败: {str(e)}")
             logger.error(traceback.format_exc())
             return []
+
+    def encode_queries(self, queries: List[str]) -> np.ndarray:
+        """批量编码查询（未命中查询向量缓存的在一次模型调用中完成）
+
+        Returns:
+            np.ndarray: 归一化的查询向量矩阵，行与 queries 一一对应
+        """
+        vectors = [self.query_cache.get(query) for query in queries]
+        missing = list(dict.fromkeys(query.strip() for query, vector in zip(queries, vectors) if vector is None))
+        if missing:
+            encoded = dict(zip(missing, self._encode_batch(missing, PRIORITY_QUERY)))
+            for i, query in enumerate(queries):
+                if vectors[i] is None:
+                    vectors[i] = self.query_cache.put(query, encoded[query.strip()])
+        return np.stack(vectors)
+
+    def search_many(self, queries: List[str], top_k: int = 5, min_score: Optional[float] = None,
+                    filters: Optional[Dict[str, Any]] = None) -> List[List[Tuple[str, float, Dict]]]:
+        """批量搜索（向量矩阵压缩保存时，精确打分路径不再先粗排）
+
+        结果与 search 逐条搜索一致，只有一点例外：矩阵-矩阵乘法与 search 中的矩阵-向量乘法舍入不同，
+        相似度可能相差 float32 的舍入误差，分数只差这么一点的文本块先后顺序可能不同。
+        向量相似度完全相同时两者都按行号排序，融合分数相同时按向量排名排序。
+
+        全部查询在一次模型调用中编码；关键词筛选后幸存行不多的查询（走精确打分的路径）
+        合并幸存行，用一次矩阵-矩阵乘法算出全部相似度，其余查询由 FAISS 索引召回候选。
+        所有查询读取同一份快照。
+
+        Args:
+            min_score: 同 search
+            filters: 同 search，对全部查询生效
+
+        Returns:
+            List[List[Tuple[str, float, Dict]]]: 与 queries 一一对应的搜索结果
+        """
+        filters = normalize_filters(filters)
+        results: List[List[Tuple[str, float, Dict]]] = [[] for _ in queries]
+        try:
+            view = self._view()
+            min_score = self.similarity_threshold if min_score is None else min_score
+            timer = StageTimer()
+            with timer.stage('lexical'):
+                filter_rows = self._filter_rows(view, filters)
+            lexical = {}
+            for i, query in enumerate(queries):
+                if self._check_query(view, query):
+                    with timer.stage('lexical'):
+                        filtered = self._lexical_filter(view, query, filter_rows)
+                    if filtered is not None:
+                        lexical[i] = filtered
+            if not lexical:
+                return results
+            logger.info(f"批量搜索 {len(queries)} 个查询，其中 {len(lexical)} 个通过关键词筛选")
+
+            positions = list(lexical)
+            try:
+                with timer.stage('encode'):
+                    query_vectors = self.encode_queries([queries[i] for i in positions])
+            except Exception as e:
+                logger.error(f"查询向量生成失败: {str(e)}")
+                return results
+
+            with timer.stage('route'):
+                for n, i in enumerate(positions):
+                    query_words, keyword_hits, lexical_rows = lexical[i]
+                    lexical[i] = (query_words, keyword_hits, self._route_documents(view, query_vectors[n], lexical_rows))
+
+            # 精确打分路径的查询：所有幸存行合并后一次算出相似度矩阵（行 × 查询）
+            exact = [n for n, i in enumerate(positions) if len(lexical[i][2]) <= self.lexical_exact_limit]
+            with timer.stage('candidates'):
+                union_rows = np.unique(np.concatenate([lexical[positions[n]][2] for n in exact])) if exact else None
+                union_scores = (view.embedding_matrix.score_many(query_vectors[exact], union_rows)
+                                if exact else None)
+            exact_column = {n: column for column, n in enumerate(exact)}
+
+            pool_size = max(top_k, self.candidate_pool_size)
+            candidate_lists = []
+            for n, i in enumerate(positions):
+                query_words, keyword_hits, lexical_rows = lexical[i]
+                query_vector = query_vectors[n]
+                with timer.stage('candidates'):
+                    if n in exact_column:
+                        column = union_scores[:, exact_column[n]]
+
+                        def score_rows(rows, column=column):
+                            return column[np.searchsorted(union_rows, rows)]
+
+                        candidate_rows, candidate_scores = select_top_k(
+                            score_rows(lexical_rows), lexical_rows, pool_size, min_score=min_score
+                        )
+                    else:
+                        candidate_rows, candidate_scores = self._generate_candidates(
+                            view, query_vector, pool_size, lexical_rows, min_score
+                        )
+
+                        def score_rows(rows, query_vector=query_vector):
+                            return view.embedding_matrix.score(query_vector, rows)
+
+                with timer.stage('fusion'):
+                    candidate_lists.append(self._fuse_and_rank(
+                        view, self.search_pipeline.candidate_count(top_k), min_score, query_words, keyword_hits,
+                        lexical_rows, candidate_rows, candidate_scores, score_rows
+                    ))
+            # 所有查询的候选一起重排（交叉编码器一次批量推理）
+            candidate_lists = self._rerank(view, [queries[i] for i in positions], candidate_lists, timer)
+            self.search_pipeline.record(timer)
+            for i, candidates in zip(positions, candidate_lists):
+                results[i] = self._finish(candidates, top_k)
+            return results
+
+        except Exception as e:
+            logger.error(f"批量搜索失败: {str(e)}")
+            logger.error(traceback.format_exc())
+            return results
+
+    def _fuse_and_rank(self, view: KnowledgeSnapshot, limit: int, min_score: float, query_words: set,
+                       keyword_hits: Dict[int, int], lexical_rows: np.ndarray, candidate_rows: np.ndarray,
+                       candidate_scores: np.ndarray, score_rows) -> List[Candidate]:
+        """第三阶段：BM25 在关键词筛选结果中给出自己的排名，与向量排名做倒数排名融合
+
+        Args:
+            limit: 输出的候选数量（开启重排时为重排预算，见 SearchPipeline.candidate_count）
+            min_score: 最低向量相似度
+            score_rows: 计算指定行向量相似度的函数（补算只出现在 BM25 排名中的文本块）
+
+        Returns:
+            List[Candidate]: 排好序的候选（rrf 按融合分数排序，weighted 按加权分数排序）；
+                             候选的分数都是加权分数，调用方按它做阈值过滤
+        """
+        dense_ranking = candidate_rows.tolist()
+        vector_scores = dict(zip(dense_ranking, candidate_scores.tolist()))
+        bm25_ranking = view.keyword_index.bm25_top_n(query_words, max(limit, self.candidate_pool_size),
+                                                     rows=lexical_rows.tolist())
+        bm25_scores = dict(bm25_ranking)
+        
+        # 只出现在 BM25 排名中的文本块补算向量相似度
+        missing_rows = [row for row in bm25_scores if row not in vector_scores]
+        if missing_rows:
+            extra_scores = score_rows(np.array(missing_rows, dtype=np.int64))
+            vector_scores.update(zip(missing_rows, extra_scores.tolist()))
+        
+        fused_scores = self._reciprocal_rank_fusion(dense_ranking, [row for row, _ in bm25_ranking])
+        
+        results = []
+        
+        for i, fused_score in fused_scores.items():
+            try:
+                text, metadata = view.chunks[i]
+                vector_similarity = vector_scores[i]
+                
+                # 关键词匹配度直接由倒排表命中数得到
+                keyword_match = keyword_hits[i] / len(query_words)
+                    
+                # 计算加权分数
+                # 向量相似度权重降低，关键词匹配权重提高
+                weighted_score = 0.4 * vector_similarity + 0.6 * keyword_match
+                
+                # 恢复原有严格阈值
+                if (vector_similarity >= min_score and
+                    keyword_match >= 0.3 and  # 关键词匹配阈值30%
+                    weighted_score >= 0.4):  # 最终分数阈值0.4
+                    
+                    results.append(Candidate(
+                        i,
+                        view.chunk_ids[i],
+                        text, 
+                        weighted_score,
+                        {
+                            **metadata,
+                            '_debug_info': {
+                                'vector_similarity': f"{vector_similarity:.4f}",
+                                'keyword_match': f"{keyword_match:.4f}",
+                                'bm25_score': f"{bm25_scores.get(i, 0.0):.4f}",
+                                'weighted_score': f"{weighted_score:.4f}",
+                                'rrf_score': f"{fused_score:.4f}"
+                            }
+                        }
+                    ))
+                    
+            except Exception as e:
+                logger.error(f"处理文档 {i} 时发生错误: {str(e)}")
+                continue
+        
+        # fused_scores 已按融合分数降序排列；weighted 按加权分数排序
+        # （融合分数只反映排名，一个检索器没有召回的文本块最高只有约 0.5，不能和 similarity_threshold 比较）
+        if self.fusion_method != 'rrf':
+            results.sort(key=lambda c: c.score, reverse=True)
+        return results[:limit]
+
+    def _rerank(self, view: KnowledgeSnapshot, queries: List[str], candidate_lists: List[List[Candidate]],
+                timer: StageTimer) -> List[List[Candidate]]:
+        """第二阶段重排（只处理每个查询的前 rerank_budget 个候选）"""
+        pipeline = self.search_pipeline
+        if not pipeline.reranks:
+            return candidate_lists
+        if pipeline.reranker.needs_vectors:
+            heads = [c for candidates in candidate_lists for c in candidates[:pipeline.rerank_budget]]
+            if heads:
+                vectors = view.embedding_matrix[[c.row for c in heads]]
+                for c, vector in zip(heads, vectors):
+                    c.vector = vector
+        return pipeline.rerank(queries, candidate_lists, timer)
+
+    def _finish(self, candidates: List[Candidate], top_k: int) -> List[Tuple[str, float, Dict]]:
+        """取前 top_k 个候选作为搜索结果并输出详情"""
+        results = [c.result() for c in candidates[:top_k]]
+        if not results:
+            logger.info("未找到相关文档")
+            return []
+        
+        # 输出搜索结果详情
+        logger.info("\n搜索结果详情:")
+        logger.info(f"{'='*150}")
+        logger.info(f"{'序号':^6} | {'综合分数':^10} | {'向量相似度':^12} | {'关键词匹配':^10} | {'BM25':^8} | {'文本预览':<90}")
+        logger.info(f"{'-'*150}")
+        
+        for i, (text, score, metadata) in enumerate(results):
+            debug_info = metadata.get('_debug_info', {})
+            preview = text[:90] + "..." if len(text) > 90 else text
+            logger.info(
+                f"{i+1:^6} | {score:^10.4f} | "
+                f"{debug_info.get('vector_similarity', 'N/A'):^12} | "
+                f"{debug_info.get('keyword_match', 'N/A'):^10} | "
+                f"{debug_info.get('bm25_score', 'N/A'):^8} | "
+                f"{preview:<90}"
+            )
+        
+        logger.info(f"{'='*150}")
+        logger.info(f"找到 {len(candidates)} 条匹配结果\n")
+        
+        return results
             
     def save(self, path: str) -> None:
-        """保存向量存储到文件"""
+        """保存向量存储（列式存储格式，见 columnar_store）
+        
+        已从同一路径加载或保存过时，只把上次保存之后的变更追加到存储日志；
+        日志过大时落盘为新段，段过多时在后台合并。其他情况写入完整的新存储。
+        """
         try:
-            save_dir = Path(path).parent
-            save_dir.mkdir(parents=True, exist_ok=True)
-            
-            # 保存索引
-            index_path = str(Path(path).with_suffix('.index'))
-            faiss.write_index(self.index, index_path)
-            logger.info(f"索引已保存到: {index_path}")
-            
-            # 保存文档和元数据
-            data = {
-                'documents': self.documents,
-                'document_embeddings': self.document_embeddings
-            }
-            data_path = str(Path(path).with_suffix('.pkl'))
-            with open(data_path, 'wb') as f:
-                pickle.dump(data, f)
-            logger.info(f"数据已保存到: {data_path}")
+            # 与写入方互斥（保存期间不会有新的修改），搜索不受影响
+            with self._write_lock:
+                store = self.segment_store
+                if (store is not None and store.path == Path(path)
+                        and store.read_manifest() is not None and store.wal_path is not None):
+                    store.append(self._pending_log)
+                    logger.info(f"已追加 {len(self._pending_log)} 条变更到存储日志: {store.wal_path}")
+                    if store.wal_size >= store.wal_flush_bytes:
+                        store.flush(self.index)
+                    store.compact_in_background()
+                else:
+                    # 完整写入前先压缩删除标记，存储中只保留未删除的文本块
+                    self.compact_tombstones()
+                    Path(path).parent.mkdir(parents=True, exist_ok=True)
+                    store = self._create_segment_store(path)
+                    manifest = store.create(
+                        self.chunks,
+                        self.embedding_matrix.vectors,
+                        keyword_terms=self.keyword_index.row_terms,
+                        ids=self.chunk_ids,
+                        index=self.index,
+                        next_id=self.next_chunk_id,
+                        dim=self.model.get_sentence_embedding_dimension() if self.model else None,
+                        sentence_vectors=self._live_sentence_vectors()
+                    )
+                    self.segment_store = store
+                    logger.info(f"向量存储已保存到: {store.root / manifest}")
+                self._save_router(store)
+                self._pending_log = []
             
         except Exception as e:
             logger.error(f"保存向量存储失败: {str(e)}")
             logger.error(traceback.format_exc())
             
     def load(self, path: str) -> None:
-        """从文件加载向量存储"""
+        """从文件加载向量存储
+        
+        优先打开列式存储（向量、文本和元数据均按需 mmap 读取，并重放存储日志），
+        不存在时回退到旧的 .index + .pkl 格式（可用 migrate_vector_store.py 一次性迁移）。
+        加载完成后一次性发布新的快照，加载失败时保留原来的内容。
+        """
         try:
-            # 加载索引
-            index_path = str(Path(path).with_suffix('.index'))
-            if os.path.exists(index_path):
-                try:
-                    self.index = faiss.read_index(index_path)
-                    logger.info(f"索引已加载: {index_path}")
-                except Exception as e:
-                    logger.warning(f"索引文件损坏或维度不匹配，重新创建索引: {e}")
-                    # 重新创建索引
-                    dim = self.model.get_sentence_embedding_dimension()
-                    self.index = faiss.IndexFlatL2(dim)
-            else:
-                logger.warning(f"索引文件不存在: {index_path}")
-                return
+            # 加载在写事务中完成：加载期间搜索继续使用旧快照，加载失败时保留原来的知识库
+            with self._writing():
+                self.bump_generation()
+                store = self._create_segment_store(path)
+                snapshot = store.open()
+                if snapshot is None:
+                    self._load_legacy(path)
+                    return
             
-            # 加载文档和元数据
-            data_path = str(Path(path).with_suffix('.pkl'))
-            if os.path.exists(data_path):
-                with open(data_path, 'rb') as f:
-                    data = pickle.load(f)
-                
-                # 兼容旧的文件格式
-                if 'documents' in data and 'document_embeddings' in data:
-                    # 新格式
-                    self.documents = data['documents']
-                    self.document_embeddings = data['document_embeddings']
-                    logger.info(f"使用新格式加载数据: {data_path}")
-                elif 'texts' in data and 'metadata' in data:
-                    # 旧格式，转换为新格式
-                    texts = data['texts']
-                    metadata_list = data['metadata']
-                    
-                    # 重新生成文档向量
-                    self.documents = []
-                    self.document_embeddings = []
-                    
-                    for i, (text, metadata) in enumerate(zip(texts, metadata_list)):
-                        try:
-                            # 生成文本向量
-                            text_vector = self.encode_text(text)
-                            self.document_embeddings.append(text_vector)
-                            self.documents.append((text, metadata))
-                        except Exception as e:
-                            logger.error(f"处理文档 {i} 时发生错误: {str(e)}")
-                            continue
-                    
-                    # 更新FAISS索引
-                    if self.document_embeddings:
-                        vectors = np.array(self.document_embeddings)
-                        self.index.reset()
-                        self.index.add(vectors.astype('float32'))
-                    
-                    logger.info(f"从旧格式转换并加载数据: {data_path}")
-                    logger.info(f"加载了 {len(self.documents)} 个文档")
+                self.ann_index = self._create_ann_index(self.model.get_sentence_embedding_dimension())
+                self.chunks = snapshot.documents
+                if snapshot.embeddings is not None:
+                    self.embedding_matrix.attach(snapshot.embeddings)
                 else:
-                    logger.error(f"不支持的数据格式: {data_path}")
-                    return
-                    
-            else:
-                logger.warning(f"数据文件不存在: {data_path}")
+                    self.embedding_matrix.reset()
+                self.chunk_ids = snapshot.ids
+                self.next_chunk_id = snapshot.next_id
+                self.tombstones.reset(len(self.chunk_ids))
+                self._reset_chunk_rows()
+                self._reset_source_chunks(store)
+            
+                if snapshot.keyword_terms is not None:
+                    self.keyword_index.reset(row_terms=snapshot.keyword_terms)
+                else:
+                    logger.info("存储中没有分词结果，重新构建关键词索引")
+                    self.keyword_index.reset(texts=(self.chunks.text(i) for i in range(len(self.chunks))))
+                backfilled = self._reset_sentence_index(snapshot.sentence_vectors)
+                logger.info(f"已加载列式存储 {store.root}，文本块数量: {len(self.chunks)}")
+            
+                # 索引与段的内容一致，按文本块 ID 同步日志中新增、更新和删除过的文本块
+                if snapshot.index is None or not self.ann_index.adopt(snapshot.index):
+                    logger.info("索引不存在或格式不兼容，重新构建 FAISS 索引")
+                    self.rebuild_index()
+                else:
+                    self.ann_index.stale_count = max(0, self.ann_index.ntotal - len(self.chunks))
+                    if snapshot.stale_ids:
+                        self._refresh_index_ids(snapshot.stale_ids)
+                    if self.ann_index.ntotal < len(self.chunks):
+                        logger.info("索引与文档数据不一致，重新构建 FAISS 索引")
+                        self.rebuild_index()
+                    elif self.ann_index.should_rebuild(self.tombstones.live_count):
+                        logger.info("索引类型或向量编码与配置不一致，重新构建 FAISS 索引")
+                        self.rebuild_index()
+            
+                # 补算了句子向量时下次保存写入完整的新存储，之后加载不再重新编码
+                self.segment_store = store if not backfilled else None
+                self._pending_log = []
                 
         except Exception as e:
             logger.error(f"加载向量存储失败: {str(e)}")
             logger.error(traceback.format_exc())
             
+    def _load_legacy(self, path: str) -> None:
+        """从旧的 .index + .pkl 文件加载向量存储"""
+        # 加载索引
+        index_path = str(Path(path).with_suffix('.index'))
+        loaded_index = None
+        if os.path.exists(index_path):
+            try:
+                loaded_index = faiss.read_index(index_path)
+                logger.info(f"索引已加载: {index_path}")
+            except Exception as e:
+                logger.warning(f"索引文件损坏或维度不匹配，重新创建索引: {e}")
+        else:
+            logger.warning(f"索引文件不存在: {index_path}")
+            return
+        self.ann_index = self._create_ann_index(self.model.get_sentence_embedding_dimension())
+        
+        # 加载文档和元数据
+        data_path = str(Path(path).with_suffix('.pkl'))
+        if os.path.exists(data_path):
+            with open(data_path, 'rb') as f:
+                data = pickle.load(f)
+            
+            # 兼容旧的文件格式
+            if 'documents' in data and 'document_embeddings' in data:
+                # 新格式
+                self.chunks = data['documents']
+                self.document_embeddings = data['document_embeddings']
+                keyword_terms = data.get('keyword_terms')
+                if keyword_terms is not None and len(keyword_terms) == len(self.chunks):
+                    self.keyword_index.reset(row_terms=keyword_terms)
+                else:
+                    logger.info("数据中没有分词结果，重新构建关键词索引")
+                    self.keyword_index.reset(texts=[text for text, _ in self.chunks])
+                logger.info(f"使用新格式加载数据: {data_path}")
+            elif 'texts' in data and 'metadata' in data:
+                # 旧格式，转换为新格式
+                texts = data['texts']
+                metadata_list = data['metadata']
+                
+                # 重新生成文档向量：按长度分桶批量编码，持久化向量缓存中已有的文本不再经过模型
+                self.chunks = []
+                for i, (text, metadata) in enumerate(zip(texts, metadata_list)):
+                    if not text or not text.strip():
+                        logger.error(f"处理文档 {i} 时发生错误: 文本为空")
+                        continue
+                    self.chunks.append((text, metadata))
+                
+                self.document_embeddings = (self.ingest_encoder.encode([text.strip() for text, _ in self.chunks])
+                                            if self.chunks else None)
+                self.keyword_index.reset(texts=[text for text, _ in self.chunks])
+                logger.info(f"从旧格式转换并加载数据: {data_path}")
+                logger.info(f"加载了 {len(self.chunks)} 个文档")
+            else:
+                logger.error(f"不支持的数据格式: {data_path}")
+                return
+                
+        else:
+            logger.warning(f"数据文件不存在: {data_path}")
+        
+        # 旧的 IndexFlatL2 或与文档数量不一致的索引需要重建
+        if (loaded_index is None or not self.ann_index.adopt(loaded_index)
+                or self.ann_index.ntotal != len(self.embedding_matrix)):
+            logger.info("索引与文档数据不一致，重新构建 FAISS 索引")
+            self.ann_index.build(self.embedding_matrix if len(self.embedding_matrix) else None)
+        
+        # 旧格式没有文本块 ID，按行号分配（与索引中的向量 ID 一致）；下次保存时写入完整的列式存储
+        self.chunk_ids = list(range(len(self.chunks)))
+        self.next_chunk_id = len(self.chunks)
+        self.tombstones.reset(len(self.chunks))
+        self._reset_chunk_rows()
+        self._reset_source_chunks()
+        self._reset_sentence_index()
+        self.segment_store = None
+        self._pending_log = []
+            
     def get_document_stats(self, file_path: str) -> Dict[str, Any]:
         """获取指定文档的统计信息
         
@@ -744,14 +1675,8 @@ class FaissVectorStore:
             Dict[str, Any]: 文档统计信息
         """
         try:
-            # 统计该文档的文本块数量
-            chunks = 0
-            for _, metadata in self.documents:
-                if metadata.get('source') == str(file_path):
-                    chunks += 1
-                    
             return {
-                'chunks': chunks
+                'chunks': len(self._view().source_chunks.get(str(file_path), ()))
             }
         except Exception as e:
             logger.error(f"获取文档统计信息失败 {file_path}: {str(e)}")
@@ -762,32 +1687,32 @@ class FaissVectorStore:
     def get_statistics(self) -> Dict[str, Any]:
         """获取向量存储的统计信息"""
         try:
-            # 获取所有文档的源文件路径
-            unique_sources = set()
-            for _, metadata in self.documents:
-                if 'source' in metadata:
-                    unique_sources.add(metadata['source'])
-            
+            view = self._view()
             stats = {
-                "total_documents": len(unique_sources),  # 使用唯一源文件数作为文档总数
-                "total_chunks": len(self.documents),     # 文本块总数
+                "total_documents": len(view.source_chunks),  # 使用唯一源文件数作为文档总数
+                "total_chunks": len(view.documents),     # 文本块总数
                 "vector_dimension": self.model.get_sentence_embedding_dimension() if self.model else 0,
-                "index_size": self.index.ntotal if self.index else 0,
+                "model_backend": self.model_backend,  # torch / onnx / onnx_int8
+                "index_size": view.ann_index.ntotal if view.ann_index else 0,
+                "index_type": view.ann_index.index_type if view.ann_index else None,
+                "deleted_chunks": view.tombstones.count,  # 已标记删除、尚未压缩的文本块
+                "query_cache": self.query_cache.stats(),  # 查询向量缓存命中统计
+                "search_pipeline": self.search_pipeline.stats(),  # 检索各阶段耗时
+                "shards": (dict(self.shard_cache.stats(), total_shards=len(view.shard_router))
+                           if self.shard_probe > 0 and view.shard_router is not None else None),  # 分片数量和常驻缓存
+                "parallel_search": self.parallel_scorer.stats() if self.parallel_scorer is not None else None,
+                "document_route": self.route_stats.stats() if self.document_route_top > 0 else None,
+                "embedding_service": self.embedding_service.stats(),  # 微批量编码
+                "ingest_encoder": self.ingest_encoder.stats(),  # 入库分桶编码与填充比例
+                "embedding_cache": self.embedding_cache.stats() if self.embedding_cache is not None else None,
                 "documents": []  # 文档列表
             }
             
-            # 统计每个文档的文本块数量
-            doc_chunks = {}
-            for _, metadata in self.documents:
-                if 'source' in metadata:
-                    source = metadata['source']
-                    doc_chunks[source] = doc_chunks.get(source, 0) + 1
-            
-            # 构建文档列表
-            for source in unique_sources:
+            # 构建文档列表（每个文档的文本块数量直接取自源文件索引）
+            for source, chunk_ids in view.source_chunks.items():
                 stats["documents"].append({
                     "path": source,
-                    "chunk_count": doc_chunks.get(source, 0)
+                    "chunk_count": len(chunk_ids)
                 })
             
             return stats
@@ -802,6 +1727,69 @@ class FaissVectorStore:
                 "documents": []
             }
 
+    def _delete_rows(self, rows: List[int]):
+        """标记删除指定行
+
+        行号保持不变：只在删除位图中标记，并从关键词索引和 FAISS 索引中移除，
+        已删除比例超过 tombstone_compact_ratio 时再统一压缩。
+        """
+        if not rows:
+            return
+        self._record_change(segment_log.OP_DELETE, rows)
+        self.bump_generation()
+        self.tombstones.mark(rows)
+        self.keyword_index.clear_rows(rows)
+        chunk_ids = [self.chunk_ids[row] for row in rows]
+        self.sentence_index.remove(chunk_ids)
+        for row, chunk_id in zip(rows, chunk_ids):
+            self._chunk_rows.pop(chunk_id, None)
+            self.metadata_index.remove(chunk_id, self._row_metadata_fields(row))
+            source = self._row_source(row)
+            source_ids = self.source_chunks.get(source)
+            if source_ids is not None:
+                source_ids.pop(chunk_id, None)
+                if not source_ids:
+                    del self.source_chunks[source]
+        self._update_shards(rows, remove=True)
+        # HNSW 索引不支持删除，向量留在索引中，搜索时因找不到对应的行而被跳过，压缩时再重建
+        self.ann_index.remove(chunk_ids)
+        if self.tombstones.count > self.tombstone_compact_ratio * len(self.tombstones):
+            self.compact_tombstones()
+        else:
+            self._rebuild_if_stale()
+
+    def compact_tombstones(self) -> bool:
+        """压缩已标记删除的行：从文本块表、向量矩阵和关键词索引中真正移除，之后的行号前移
+
+        FAISS 索引以文本块 ID 为向量 ID，压缩后不需要重建（HNSW 索引或规模跨越阈值时除外）。
+
+        Returns:
+            bool: 是否有行被压缩
+        """
+        with self._write_lock:
+            if self.tombstones.count == 0:
+                return False
+            with self._writing():
+                deleted_rows = self.tombstones.deleted_rows().tolist()
+                live_rows = self.tombstones.live_rows()
+                if isinstance(self.chunks, columnar_store.ChunkTable):
+                    # 保留未修改行的段引用，不把整张表读入内存
+                    self.chunks = self.chunks.take(live_rows)
+                else:
+                    self.chunks = [self.chunks[row] for row in live_rows]
+                self.chunk_ids = [self.chunk_ids[row] for row in live_rows]
+                self.embedding_matrix.delete_rows(deleted_rows)
+                self.keyword_index.delete_rows(deleted_rows)
+                self.tombstones.reset(len(self.chunk_ids))
+                self._reset_chunk_rows()
+                if self.shard_router is not None:
+                    # 行号前移，已缓存的分片行号失效
+                    self.shard_router.touch_all()
+                if not self.ann_index.supports_remove or self.ann_index.should_rebuild(len(self.chunk_ids)):
+                    self.rebuild_index()
+            logger.info(f"已压缩 {len(deleted_rows)} 个已删除的文本块，当前文本块数量: {len(self.chunk_ids)}")
+            return True
+
     def delete_document(self, file_path: str) -> bool:
         """删除指定的文档
         
@@ -812,29 +1800,13 @@ class FaissVectorStore:
             bool: 删除是否成功
         """
         try:
-            # 找到所有属于该文档的文本块
-            new_documents = []
-            new_embeddings = []
-            
-            # 遍历所有文本块，保留不属于被删除文档的块
-            for i, (text, metadata) in enumerate(self.documents):
-                if metadata.get('source') != str(file_path):
-                    new_documents.append((text, metadata))
-                    if self.document_embeddings is not None:
-                        new_embeddings.append(self.document_embeddings[i])
-            
-            # 更新文档列表和向量
-            self.documents = new_documents
-            if new_embeddings:
-                self.document_embeddings = np.array(new_embeddings)
-                
-                # 重建索引
-                self.index.reset()
-                if len(new_embeddings) > 0:
-                    self.index.add(self.document_embeddings)
+            with self._writing():
+                # 由源文件索引直接找到该文档的文本块
+                removed_rows = [self._chunk_rows[chunk_id] for chunk_id in self.chunk_ids_for_source(file_path)]
+                self._delete_rows(removed_rows)
                     
-            logger.info(f"文档删除成功，路径: {file_path}")
-            logger.info(f"删除后的统计信息: {self.get_statistics()}")
+            logger.info(f"文档删除成功，路径: {file_path}，删除文本块: {len(removed_rows)} 个")
+            logger.info(f"当前文本块数量: {len(self.documents)}，待压缩的已删除文本块: {self.tombstones.count}")
             return True
             
         except Exception as e:
@@ -842,52 +1814,32 @@ class FaissVectorStore:
             logger.error(traceback.format_exc())
             return False
 
-    def delete_text_blocks(self, indices: List[int]) -> bool:
-        """删除指定索引的文本块
+    def delete_text_blocks(self, chunk_ids: List[int]) -> bool:
+        """删除指定 ID 的文本块
         
         Args:
-            indices: 要删除的文本块索引列表（从0开始）
+            chunk_ids: 要删除的文本块 ID 列表（见 live_chunk_ids，删除其他文本块后不会变化）
             
         Returns:
             bool: 删除是否成功
         """
         try:
-            if not indices:
-                logger.warning("没有指定要删除的文本块索引")
+            if not chunk_ids:
+                logger.warning("没有指定要删除的文本块ID")
                 return True
             
-            # 验证索引范围
-            max_index = len(self.documents) - 1
-            invalid_indices = [idx for idx in indices if idx < 0 or idx > max_index]
-            if invalid_indices:
-                logger.error(f"无效的索引: {invalid_indices}")
-                return False
-            
-            # 按降序排序索引，避免删除时索引变化
-            sorted_indices = sorted(indices, reverse=True)
-            
-            # 删除指定索引的文本块
-            new_documents = []
-            new_embeddings = []
-            
-            for i, (text, metadata) in enumerate(self.documents):
-                if i not in indices:
-                    new_documents.append((text, metadata))
-                    if self.document_embeddings is not None:
-                        new_embeddings.append(self.document_embeddings[i])
-            
-            # 更新文档列表和向量
-            self.documents = new_documents
-            if new_embeddings:
-                self.document_embeddings = np.array(new_embeddings)
+            with self._writing():
+                # 验证文本块是否存在
+                invalid_ids = [chunk_id for chunk_id in chunk_ids if chunk_id not in self._chunk_rows]
+                if invalid_ids:
+                    logger.error(f"文本块不存在: {invalid_ids}")
+                    return False
                 
-                # 重建索引
-                self.index.reset()
-                if len(new_embeddings) > 0:
-                    self.index.add(self.document_embeddings)
+                unique_ids = list(dict.fromkeys(chunk_ids))
+                self._delete_rows([self._chunk_rows[chunk_id] for chunk_id in unique_ids])
                     
-            logger.info(f"成功删除 {len(indices)} 个文本块，索引: {indices}")
-            logger.info(f"删除后的统计信息: {self.get_statistics()}")
+            logger.info(f"成功删除 {len(unique_ids)} 个文本块，ID: {unique_ids}")
+            logger.info(f"当前文本块数量: {len(self.documents)}，待压缩的已删除文本块: {self.tombstones.count}")
             return True
             
         except Exception as e:
@@ -895,32 +1847,69 @@ class FaissVectorStore:
             logger.error(traceback.format_exc())
             return False
 
-    def update_text_block(self, index: int, new_text: str) -> bool:
+    def update_text_block(self, chunk_id: int, new_text: str) -> bool:
         """
-        更新指定索引的文本块内容，并同步更新向量。
+        更新指定 ID 的文本块内容，并同步更新向量。
         Args:
-            index: 文本块索引（从0开始）
+            chunk_id: 文本块 ID
             new_text: 新的文本内容
         Returns:
             bool: 是否更新成功
         """
+        return self.update_text_blocks({chunk_id: new_text})
+
+    def update_text_blocks(self, updates: Dict[int, str]) -> bool:
+        """
+        批量更新文本块内容：所有新文本一次批量编码，FAISS 索引中只替换这些文本块的向量。
+        Args:
+            updates: 文本块 ID -> 新的文本内容
+        Returns:
+            bool: 是否更新成功（任一文本块不存在或文本为空时不做任何修改）
+        """
         try:
-            if index < 0 or index >= len(self.documents):
-                logger.error(f"文本块索引超出范围: {index}")
+            if not updates:
+                logger.warning("没有指定要更新的文本块")
+                return True
+            invalid_ids = [chunk_id for chunk_id in updates if chunk_id not in self._chunk_rows]
+            if invalid_ids:
+                logger.error(f"文本块不存在: {invalid_ids}")
                 return False
-            # 更新文本内容
-            old_text, metadata = self.documents[index]
-            self.documents[index] = (new_text, metadata)
-            # 重新生成向量
-            embedding = self.model.encode([new_text], convert_to_tensor=True).cpu().numpy()[0]
-            self.document_embeddings[index] = embedding
-            # 重建FAISS索引
-            self.index.reset()
-            if len(self.document_embeddings) > 0:
-                self.index.add(self.document_embeddings)
-            logger.info(f"成功更新文本块索引 {index} 的内容和向量")
+            empty_ids = [chunk_id for chunk_id, text in updates.items() if not text or not text.strip()]
+            if empty_ids:
+                logger.error(f"文本块内容为空: {empty_ids}")
+                return False
+
+            chunk_ids = list(updates.keys())
+            texts = [updates[chunk_id].strip() for chunk_id in chunk_ids]
+            # 重新生成向量（一次批量编码，在写锁之外完成）
+            embeddings, sentence_vectors = self._encode_chunks(texts)
+
+            with self._writing():
+                # 编码期间文本块可能已被其他请求删除
+                invalid_ids = [chunk_id for chunk_id in chunk_ids if chunk_id not in self._chunk_rows]
+                if invalid_ids:
+                    logger.error(f"文本块不存在: {invalid_ids}")
+                    return False
+                rows = [self._chunk_rows[chunk_id] for chunk_id in chunk_ids]
+
+                # 更新文本内容、向量和关键词索引
+                for row, text in zip(rows, texts):
+                    _, metadata = self.chunks[row]
+                    self.chunks[row] = (text, metadata)
+                    self.keyword_index.update_row(row, text)
+                self._update_shards(rows, remove=True)
+                self.embedding_matrix.set_rows(rows, embeddings)
+                self._update_shards(rows)
+                self.sentence_index.set_many(chunk_ids, sentence_vectors)
+                self._record_change(segment_log.OP_UPDATE, rows, embeddings)
+                self.bump_generation()
+
+                # 同步FAISS索引（向量 ID 即文本块 ID），只替换这些向量
+                self.ann_index.replace(normalize_rows(embeddings), np.asarray(chunk_ids, dtype=np.int64))
+                self._rebuild_if_stale()
+            logger.info(f"成功更新 {len(chunk_ids)} 个文本块的内容和向量，ID: {chunk_ids}")
             return True
         except Exception as e:
             logger.error(f"更新文本块失败: {str(e)}")
             logger.error(traceback.format_exc())
-            return False 
\ No newline at end of file
+            return False
@@ -13,6 +13,7 @@ from pathlib import Path
 import logging
 from config_loader import config
 from knowledge_query_service import get_knowledge_query_service
+from columnar_store import vector_store_exists, store_mtime
 from prompt_manager import get_prompt_manager
 import threading
 
@@ -34,7 +35,7 @@ def init_vector_store():
     from vector_store import FaissVectorStore
     vector_store = FaissVectorStore()
     vector_store_path = "knowledge_base/vector_store"
-    if os.path.exists(f"{vector_store_path}.index") and os.path.exists(f"{vector_store_path}.pkl"):
+    if vector_store_exists(vector_store_path):
         vector_store.load(vector_store_path)
         logger.info("知识库加载成功")
     else:
@@ -171,6 +172,7 @@ class WeChatBot:
         self.max_history_length = 10    # 每个用户最多保存10轮对话
         
         self.vector_store_path = "knowledge_base/vector_store"
+        self._last_store_mtime = None
         self._last_index_mtime = None
         self._last_pkl_mtime = None
         self._start_vector_store_watcher()
@@ -254,7 +256,7 @@ class WeChatBot:
             self.vector_store = FaissVectorStore()
             # 尝试加载现有向量存储
             vector_store_path = "knowledge_base/vector_store"
-            if os.path.exists(f"{vector_store_path}.index") and os.path.exists(f"{vector_store_path}.pkl"):
+            if vector_store_exists(vector_store_path):
                 self.vector_store.load(vector_store_path)
                 logger.info("知识库加载成功")
             else:
@@ -568,6 +570,7 @@ class WeChatBot:
                     messages = self.wx.GetAllMessage()
                     if not messages or not isinstance(messages, list):
                         continue
+                    pending = []
                     for msg in reversed(messages):
                         try:
                             msg_str = str(msg)
@@ -611,6 +614,25 @@ class WeChatBot:
                                 logger.info("跳过已回复的消息")
                                 processed_hashes.add(msg_hash)
                                 continue
+                            pending.append((msg_str, msg_hash, sender, msg_time))
+                        except Exception as e:
+                            logger.error(f"处理消息时出错: {str(e)}")
+                            logger.error(traceback.format_exc())
+                            continue
+                    
+                    # 同一轮拉取到多条待处理消息时先批量检索一次（一次模型调用、一次矩阵乘法），
+                    # 结果进入搜索结果缓存，下面逐条处理时直接命中；含指代词的消息按上下文改写后仍单独检索
+                    if len(pending) > 1:
+                        try:
+                            knowledge_query_service.search_many(
+                                [msg_str.split('@auto', 1)[1].strip() for msg_str, _, _, _ in pending],
+                                search_type='wechat'
+                            )
+                        except Exception as e:
+                            logger.warning(f"批量检索知识库失败: {e}")
+                    
+                    for msg_str, msg_hash, sender, msg_time in pending:
+                        try:
                             logger.info(f"\n收到新消息: {msg_str}")
                             logger.info(f"- 消息时间: {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(msg_time))}")
                             actual_message = msg_str.split('@auto', 1)[1].strip()
@@ -721,19 +743,25 @@ class WeChatBot:
             watch_interval = interval or self.wechat_vector_store_watch_interval
             while True:
                 try:
+                    # 列式存储每次保存都会追加日志或切换清单；旧格式仍检查 .index 和 .pkl
                     index_file = f"{self.vector_store_path}.index"
                     pkl_file = f"{self.vector_store_path}.pkl"
+                    current_store_mtime = store_mtime(self.vector_store_path)
                     index_mtime = os.path.getmtime(index_file) if os.path.exists(index_file) else None
                     pkl_mtime = os.path.getmtime(pkl_file) if os.path.exists(pkl_file) else None
                     changed = []
+                    if current_store_mtime != self._last_store_mtime:
+                        changed.append(f"存储: {self._last_store_mtime} -> {current_store_mtime}")
                     if index_mtime != self._last_index_mtime:
                         changed.append(f"index文件: {self._last_index_mtime} -> {index_mtime}")
                     if pkl_mtime != self._last_pkl_mtime:
                         changed.append(f"pkl文件: {self._last_pkl_mtime} -> {pkl_mtime}")
                     if changed:
                         logger.info("检测到知识库文件变更，自动重新加载向量库... 变动详情: " + "; ".join(changed))
+                        # load 会递增知识库版本号，之前缓存的搜索结果随之失效
                         self.vector_store.load(self.vector_store_path)
                         knowledge_query_service.set_vector_store(self.vector_store)
+                        self._last_store_mtime = current_store_mtime
                         self._last_index_mtime = index_mtime
                         self._last_pkl_mtime = pkl_mtime
                         logger.info("微信端知识库已自动热加载最新内容。")